@@ -1,98 +1,81 @@
 import pandas as pd
 import numpy as np
 import os
-import glob
 from train import settings
+from train import profiling
+from train import window_features
+from train import results_db
+from app import history_snapshot
 
 class HistoryLoader:
+    """
+    推論用の過去走。load() は CSV から作った履歴を history_snapshot (馬ごとの列の .npy) に書き出し、
+    次からはそれを mmap で開くだけにする。df は互換用で、使われたときに DataFrame にする。
+    """
     def __init__(self):
-        self.df = None
+        self._df = None
+        self.snapshot = None
         self.is_loaded = False
         
-    def load(self):
+    @property
+    def df(self):
+        if self._df is None and self.snapshot is not None:
+            self._df = self.snapshot.frame()
+        return self._df
+    
+    def __len__(self):
+        return 0 if self.snapshot is None else len(self.snapshot)
+    
+    @profiling.profiled('history.load', rows=None)
+    def load(self, use_snapshot=True):
         if self.is_loaded: return
         
-        print("Loading historical data for inference...")
-        files = glob.glob(os.path.join(settings.RAW_DATA_DIR, "*.csv"))
-        dfs = []
-        for f in files:
-            try:
-                # results_*.csv のみ対象
-                if not os.path.basename(f).startswith('results_'):
-                    continue
-                    
-                # 新フォーマット: year, month, day カラム
-                # レガシー: date カラム
-                df = pd.read_csv(f, dtype={'race_id': str, 'horse_id': str})
-                
-                # 必要カラム（speed_index計算のため course_type, distance, time を追加）
-                needed = ['horse_id', 'rank', 'time', 'race_id', 'last_3f',
-                          'course_type', 'distance']
-                date_cols = []
-                if 'year' in df.columns and 'month' in df.columns and 'day' in df.columns:
-                    date_cols = ['year', 'month', 'day']
-                elif 'date' in df.columns:
-                    date_cols = ['date']
-                
-                keep_cols = [c for c in needed + date_cols if c in df.columns]
-                df = df[keep_cols]
-                dfs.append(df)
-            except Exception as e:
-                pass
-                
-        if dfs:
-            self.df = pd.concat(dfs, ignore_index=True)
-            
-            # 日付の構築
-            if 'year' in self.df.columns and 'month' in self.df.columns and 'day' in self.df.columns:
-                # 新フォーマット: year, month, day から datetime を構築
-                self.df['date'] = pd.to_datetime(self.df[['year', 'month', 'day']], errors='coerce')
-                self.df = self.df.dropna(subset=['date'])
-                self.df = self.df.sort_values('date')
-            elif 'date' in self.df.columns:
-                # レガシーフォールバック
-                if self.df['date'].dtype == 'int64' or self.df['date'].dtype == 'int32':
-                    print("⚠️  Warning: Date column is integer type. Sorting by race_id.")
-                    self.df = self.df.sort_values('race_id')
-                    def extract_date_from_race_id(rid):
-                        try:
-                            rid_str = str(rid)
-                            if len(rid_str) >= 12:
-                                year = rid_str[0:4]
-                                month = rid_str[6:8]
-                                day = rid_str[8:10]
-                                return pd.to_datetime(f"{year}-{month}-{day}", errors='coerce')
-                            return pd.NaT
-                        except:
-                            return pd.NaT
-                    self.df['date'] = self.df['race_id'].apply(extract_date_from_race_id)
-                    self.df = self.df.dropna(subset=['date'])
-                else:
-                    self.df['date'] = pd.to_datetime(self.df['date'], format='%Y年%m月%d日', errors='coerce')
-                    self.df = self.df.dropna(subset=['date'])
-                    self.df = self.df.sort_values('date')
-            else:
-                self.df = self.df.sort_values('race_id')
-                self.df['date'] = pd.NaT
-            
-            # Parse last_3f to numeric
-            self.df['last_3f'] = pd.to_numeric(self.df['last_3f'], errors='coerce').fillna(0)
-            
-            # --- Speed Index の計算 ---
-            self._calculate_speed_index()
- 
+        # results_*.csv の内容 (results_db に取り込み済みの sha1) で決まるスナップショット
+        digests = results_db.digests()
+        path = os.path.join(history_snapshot.SNAPSHOT_DIR, history_snapshot.snapshot_key(digests))
+        if use_snapshot and os.path.exists(os.path.join(path, 'meta.json')):
+            print(f"Opening history snapshot {path}")
+            self.snapshot = history_snapshot.HistorySnapshot.open(path)
         else:
-            self.df = pd.DataFrame(columns=['horse_id', 'date', 'rank'])
+            print("Loading historical data for inference...")
+            self._read_results()
+            self.snapshot = history_snapshot.HistorySnapshot.from_frame(self._df)
+            if use_snapshot and len(self.snapshot) > 0:
+                try:
+                    self.snapshot = self.snapshot.write(path)
+                    print(f"History snapshot saved: {path}")
+                except OSError as e:
+                    print(f"⚠️  Could not save history snapshot: {e}")
+            self._df = None # 必要なら snapshot から作り直す
             
         self.is_loaded = True
-        print(f"History loaded: {len(self.df)} records.")
+        print(f"History loaded: {len(self)} records.")
         
         # Warning if no historical data
-        if len(self.df) == 0:
+        if len(self) == 0:
             print("⚠️  WARNING: No historical data found!")
             print("⚠️  Predictions will use default values, resulting in lower accuracy.")
             print(f"⚠️  Expected data location: {settings.RAW_DATA_DIR}")
 
+    def _read_results(self):
+        """results_db (results_*.csv を取り込んだ SQLite、日付は取り込み時に正規化) から self._df (日付順、speed_index 付き) を作る"""
+        self._df = results_db.history_frame()
+        if self._df.empty:
+            self._df = pd.DataFrame(columns=['horse_id', 'date', 'rank'])
+            return
+        
+        # Parse last_3f to numeric
+        self._df['last_3f'] = pd.to_numeric(self._df['last_3f'], errors='coerce').fillna(0)
+        
+        # --- Speed Index の計算 ---
+        self._calculate_speed_index()
+        
+        # 学習時と同じく、着順が数値の出走 (完走) のみを過去走として扱う
+        self._df['rank'] = pd.to_numeric(self._df['rank'], errors='coerce')
+        self._df = self._df.dropna(subset=['rank']).reset_index(drop=True)
+        self._df['horse_id'] = self._df['horse_id'].astype(str)
+        self._df['last_3f_time'] = self._df['last_3f']
+
     def _calculate_speed_index(self):
         """
         履歴データから speed_index を計算する。
@@ -111,12 +94,12 @@ class HistoryLoader:
             except:
                 return np.nan
         
-        self.df['time_sec'] = self.df['time'].apply(parse_time)
+        self._df['time_sec'] = self._df['time'].apply(parse_time)
         
         # コース × 距離 ごとの統計を計算
-        if 'course_type' in self.df.columns and 'distance' in self.df.columns:
-            self.df['distance'] = pd.to_numeric(self.df['distance'], errors='coerce')
-            valid_times = self.df[self.df['time_sec'] > 0]
+        if 'course_type' in self._df.columns and 'distance' in self._df.columns:
+            self._df['distance'] = pd.to_numeric(self._df['distance'], errors='coerce')
+            valid_times = self._df[self._df['time_sec'] > 0]
             
             if not valid_times.empty:
                 course_stats = valid_times.groupby(
@@ -125,76 +108,71 @@ class HistoryLoader:
                 course_stats.columns = ['course_type', 'distance', 'course_mean', 'course_std']
                 
                 # マージして speed_index を計算
-                self.df = self.df.merge(course_stats, on=['course_type', 'distance'], how='left')
-                self.df['speed_index'] = (
-                    (self.df['course_mean'] - self.df['time_sec']) / 
-                    self.df['course_std'].replace(0, 1)
+                self._df = self._df.merge(course_stats, on=['course_type', 'distance'], how='left')
+                self._df['speed_index'] = (
+                    (self._df['course_mean'] - self._df['time_sec']) / 
+                    self._df['course_std'].replace(0, 1)
                 )
-                self.df['speed_index'] = self.df['speed_index'].fillna(0)
+                self._df['speed_index'] = self._df['speed_index'].fillna(0)
                 
                 # 一時カラムの削除
-                self.df = self.df.drop(columns=['course_mean', 'course_std'], errors='ignore')
+                self._df = self._df.drop(columns=['course_mean', 'course_std'], errors='ignore')
                 
-                print(f"Speed index calculated: mean={self.df['speed_index'].mean():.3f}, "
-                      f"std={self.df['speed_index'].std():.3f}")
+                print(f"Speed index calculated: mean={self._df['speed_index'].mean():.3f}, "
+                      f"std={self._df['speed_index'].std():.3f}")
             else:
-                self.df['speed_index'] = 0
+                self._df['speed_index'] = 0
         else:
-            self.df['speed_index'] = 0
+            self._df['speed_index'] = 0
+
+    def reload(self):
+        """CSV を読み直す (常駐サーバーで新しい結果を取り込むとき。CSV が変わっていれば新しいスナップショットを作る)"""
+        self._df = None
+        self.snapshot = None
+        self.is_loaded = False
+        self.load()
+
+    def history(self, horse_ids, current_date_str=None):
+        """
+        horse_ids の過去走 (current_date_str より前、馬ごとに直近 window_features.depth() 走) の DataFrame。
+        スナップショットの馬ごとの行範囲から切り出すので、全履歴を走査しない。
+        """
+        curr_date = pd.to_datetime(current_date_str) if current_date_str and pd.notna(current_date_str) else pd.NaT
+        if self.snapshot is None or len(self.snapshot) == 0:
+            return pd.DataFrame(columns=['horse_id', 'date'])
+        before = curr_date.to_datetime64() if pd.notna(curr_date) else None
+        return self.snapshot.frame(self.snapshot.rows(horse_ids, before, window_features.depth()))
+
+    def get_window_features(self, horse_ids, current_date_str=None):
+        """
+        出走馬ごとのウィンドウ特徴量 (lag1..5, interval, 直近5走の mean/min/std) を返す。
+        学習時と同じ window_features.compute を「過去走 + 今回の行」に適用し、
+        今回の行の結果を horse_ids と同じ順の DataFrame で返す。
+        """
+        horse_ids = pd.Series(horse_ids).astype(str).reset_index(drop=True)
+        curr_date = pd.to_datetime(current_date_str) if current_date_str and pd.notna(current_date_str) else pd.NaT
+        
+        history = self.history(horse_ids, current_date_str)
+        query = pd.DataFrame({'horse_id': horse_ids, 'date': curr_date})
+        combined = pd.concat([history, query], ignore_index=True)
+        return window_features.compute(combined).iloc[len(history):].reset_index(drop=True)
 
     def get_last_race(self, horse_id, current_date_str=None):
         """
         Returns dict of last race stats: {lag1_rank, interval, lag1_speed_index, lag1_last_3f}
+        過去走が無い場合は None
         """
-        if self.df is None or self.df.empty:
-             return None
-             
-        # Filter by horse
-        # horse_id in scraper is string
-        history = self.df[self.df['horse_id'].astype(str) == str(horse_id)]
-        
-        if history.empty:
-            return None
-            
-        # Filter before current date if provided
-        if current_date_str:
-             curr_date = pd.to_datetime(current_date_str)
-             history = history[history['date'] < curr_date]
-             
-        if history.empty:
+        # Filter by horse (before current date if provided)
+        if self.history([str(horse_id)], current_date_str).empty:
             return None
-            
-        last_race = history.iloc[-1]
         
-        # Calculate Interval
-        interval = 365
-        if current_date_str:
-            curr_date = pd.to_datetime(current_date_str)
-            interval = (curr_date - last_race['date']).days
-            
-        # Parse Rank
-        try:
-            rank = int(last_race['rank'])
-        except:
-            rank = 99
-            
-        # Parse last_3f
-        try:
-            last_3f = float(last_race.get('last_3f', 0))
-        except:
-            last_3f = 0.0
+        stats = self.get_window_features([horse_id], current_date_str).iloc[0]
         
-        # Speed Index（計算済みの値を使用）
-        try:
-            speed_index = float(last_race.get('speed_index', 0))
-        except:
-            speed_index = 0.0
-            
         return {
-            "lag1_rank": rank,
-            "interval": interval,
-            "lag1_speed_index": speed_index,
-            "lag1_last_3f": last_3f
+            "lag1_rank": int(stats['lag1_rank']),
+            "interval": int(stats['interval']),
+            "lag1_speed_index": float(stats['lag1_speed_index']),
+            "lag1_last_3f": float(stats['lag1_last_3f'])
         }
 
 # Global instance
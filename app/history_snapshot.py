@@ -0,0 +1,130 @@
+"""
+推論用の履歴 (過去走) の読み取り専用スナップショット。
+
+HistoryLoader が results_*.csv から作った履歴 (speed_index 計算済み) を、馬ごと・日付順に並べた
+列の .npy に書き出しておき、次からは np.load(mmap_mode='r') で開くだけにする。CSV の読み込みと
+speed_index の計算は1回だけで、開くのはほぼ一瞬。ページキャッシュを共有するので、同じ
+スナップショットを開く複数のプロセス (サーバーのワーカー、並列のレポート生成) でもメモリは1つ分。
+
+    CACHE_DIR/history_snapshot/<key>/
+        horse_ids.npy   ユニークな horse_id (ソート済み、固定長の文字列)
+        offsets.npy     馬 i の行は offsets[i]:offsets[i+1] (len = 馬の数 + 1)
+        date.npy, rank.npy, speed_index.npy, last_3f_time.npy   行ごとの列 (馬の中は日付順)
+        meta.json
+
+key は results_*.csv のファイル名と内容の sha1 (results_db が取り込み時に記録したもの) と、履歴を
+作るコード (history_loader.py, history_snapshot.py, train/results_db.py) のハッシュ。CSV かコードが
+変われば別のスナップショットを作る。更新時刻は使わないので、checkout 後やキャッシュから復元しても開ける。
+書き込みは一時ディレクトリに書いてから os.replace するので、途中のものを開くことは無い。
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from train import settings
+
+SNAPSHOT_DIR = os.path.join(settings.CACHE_DIR, 'history_snapshot')
+VALUE_COLUMNS = ['rank', 'speed_index', 'last_3f_time'] # float64
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCES = [os.path.join(_APP_DIR, 'history_snapshot.py'), os.path.join(_APP_DIR, 'history_loader.py'),
+           os.path.join(os.path.dirname(_APP_DIR), 'train', 'results_db.py')]
+
+def snapshot_key(digests, sources=SOURCES):
+    """digests ({results_*.csv のファイル名: 内容の sha1}) とコードのハッシュ"""
+    h = hashlib.sha1()
+    for name in sorted(digests):
+        h.update(json.dumps([name, digests[name]]).encode('utf-8'))
+    for path in sources:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+class HistorySnapshot:
+    """馬ごとに連続した行の列 (numpy 配列、ファイルから開いたときは読み取り専用の memmap)"""
+    def __init__(self, arrays, path=None):
+        self.path = path
+        self.horse_ids = arrays['horse_ids']
+        self.offsets = arrays['offsets']
+        self.date = arrays['date']
+        self.columns = {col: arrays[col] for col in VALUE_COLUMNS}
+
+    @classmethod
+    def open(cls, path):
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+                  for name in ['horse_ids', 'offsets', 'date'] + VALUE_COLUMNS}
+        return cls(arrays, path)
+
+    @classmethod
+    def from_frame(cls, df):
+        """HistoryLoader の DataFrame (horse_id, date, rank, speed_index, last_3f_time) から作る (メモリ上)"""
+        horse_ids, codes = np.unique(df['horse_id'].astype(str).to_numpy(dtype=str), return_inverse=True)
+        # 馬ごとにまとめる。馬の中は df の並び (日付順) のまま
+        order = np.argsort(codes, kind='stable')
+        offsets = np.zeros(len(horse_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(horse_ids)), out=offsets[1:])
+        arrays = {
+            'horse_ids': horse_ids,
+            'offsets': offsets,
+            'date': pd.to_datetime(df['date']).to_numpy(dtype='datetime64[ns]')[order]
+        }
+        for col in VALUE_COLUMNS:
+            values = df[col] if col in df.columns else pd.Series(np.nan, index=df.index)
+            arrays[col] = pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64)[order]
+        return cls(arrays)
+
+    def __len__(self):
+        return len(self.date)
+
+    def write(self, path):
+        """path に書き出す (一時ディレクトリ → os.replace)。書いたものを開き直して返す"""
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        arrays = dict(self.columns, horse_ids=self.horse_ids, offsets=self.offsets, date=self.date)
+        for name, values in arrays.items():
+            np.save(os.path.join(tmp_path, f'{name}.npy'), np.asarray(values))
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'n_rows': len(self), 'n_horses': len(self.horse_ids)}, f)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # 別のプロセスが先に同じスナップショットを書いた
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.exists(os.path.join(path, 'meta.json')):
+                raise
+        return HistorySnapshot.open(path)
+
+    def rows(self, horse_ids, before=None, depth=None):
+        """
+        horse_ids の行番号 (馬ごとに日付順、馬は horse_ids の順で重複なし)。
+        before (datetime64) があればその日より前の行だけ、depth があれば馬ごとに直近 depth 行だけ。
+        """
+        ids = np.asarray(pd.unique(np.asarray(horse_ids, dtype=str)), dtype=str)
+        if len(self.horse_ids) == 0 or len(ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        pos = np.searchsorted(self.horse_ids, ids)
+        found = pos < len(self.horse_ids)
+        found[found] = self.horse_ids[pos[found]] == ids[found]
+        parts = []
+        for p in pos[found]:
+            start, stop = int(self.offsets[p]), int(self.offsets[p + 1])
+            if before is not None:
+                # NaT は searchsorted で末尾扱いなので、日付の無い行は before より前にならない
+                stop = start + int(np.searchsorted(self.date[start:stop], before, side='left'))
+            if depth is not None:
+                start = max(start, stop - depth)
+            parts.append(np.arange(start, stop))
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def frame(self, rows=None):
+        """rows (行番号、None なら全行) の DataFrame (horse_id, date, rank, speed_index, last_3f_time)"""
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.int64)
+        codes = np.searchsorted(self.offsets, rows, side='right') - 1
+        df = pd.DataFrame({'horse_id': np.asarray(self.horse_ids)[codes].astype(object),
+                           'date': np.asarray(self.date)[rows]})
+        for col in VALUE_COLUMNS:
+            df[col] = np.asarray(self.columns[col][rows])
+        return df
@@ -0,0 +1,201 @@
+"""
+週末 (任意の日付の範囲) の予測パイプライン。run_weekend と predict_html_generator の共通部分。
+
+    discover : 日付ごとに scraper.search_races でレースを探す
+    fetch    : 出馬表・オッズ (scraper.fetch_race_data) を FETCH_WORKERS 本のスレッドで並行に取る。
+               netkeiba へのリクエストは RateLimiter (scraper.limiter) で RATE 回/秒 までに抑える
+               (キャッシュで済んだレースは待たない)
+    predict  : BATCH_SIZE レースずつ predictor.predict_batch でまとめて予測する
+               (モデル・encoders の読み込みと推論がバッチ1回ずつ)
+    sink     : 予測したレースから順に sink.add(race, df) へ流す (レポートのシャードなど)
+
+出馬表は発見した順に先読みし、結果も発見した順 (日付 → レース一覧の順) に受け取るので、
+並行に取っても sink へ渡る順は毎回同じになる。段ごとの件数・スループット・レイテンシ (p50/p95) は PipelineStats。
+
+    stats = pipeline.run(dates, [reporting.ShardReport('public/index.html')])
+    print(stats.summary())
+"""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import scraper, predictor
+from train import profiling
+
+FETCH_WORKERS = 4
+RATE = 3.0 # netkeiba へのリクエスト 回/秒
+BATCH_SIZE = 12
+STAGES = ['discover', 'fetch', 'predict', 'sink']
+
+class RateLimiter:
+    """rate 回/秒 を超えないように wait() で待つ (スレッド間で共有)"""
+    def __init__(self, rate=RATE):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_at = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+class PipelineStats:
+    """段ごとの (1回の処理時間, 件数) を記録する (スレッドから呼んでよい)"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.started = time.perf_counter()
+
+    def record(self, stage, seconds, items=1):
+        with self.lock:
+            self.samples.setdefault(stage, []).append((seconds, items))
+
+    def stage(self, name):
+        """with stats.stage('fetch') as s: ...; s['items'] = n"""
+        return _Timer(self, name)
+
+    def table(self):
+        """段ごとの {calls, items, busy_s, items_per_s, p50_ms, p95_ms}。items_per_s は実行全体の経過時間あたり"""
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        out = {}
+        with self.lock:
+            samples = {k: list(v) for k, v in self.samples.items()}
+        for stage in STAGES + sorted(set(samples) - set(STAGES)):
+            if stage not in samples:
+                continue
+            seconds = np.array([s for s, _ in samples[stage]])
+            items = sum(n for _, n in samples[stage])
+            out[stage] = {
+                'calls': len(seconds),
+                'items': items,
+                'busy_s': float(seconds.sum()),
+                'items_per_s': items / elapsed,
+                'p50_ms': float(np.percentile(seconds, 50) * 1000),
+                'p95_ms': float(np.percentile(seconds, 95) * 1000)
+            }
+        return out
+
+    def summary(self):
+        lines = [f"Pipeline: {time.perf_counter() - self.started:.1f}s"]
+        for stage, s in self.table().items():
+            lines.append(f"  {stage:<8} {s['items']:>5} items in {s['calls']:>4} calls  "
+                         f"{s['items_per_s']:7.2f}/s  p50 {s['p50_ms']:8.1f}ms  p95 {s['p95_ms']:8.1f}ms")
+        return "\n".join(lines)
+
+class _Timer:
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.info = {'items': 1}
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self.info
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stats.record(self.name, time.perf_counter() - self.t0, self.info['items'])
+        return False
+
+def discover(dates, stats=None, workers=FETCH_WORKERS):
+    """日付ごとのレース一覧 (scraper.search_races の dict に date と place (競馬場コード) を足したもの) を日付順に返す"""
+    stats = stats or PipelineStats()
+
+    def search(date_str):
+        with stats.stage('discover') as s:
+            try:
+                races = scraper.search_races(date_str) or []
+            except Exception as e:
+                print(f"Error searching races for {date_str}: {e}")
+                races = []
+            s['items'] = len(races)
+        print(f"Found {len(races)} races for {date_str}.")
+        # race['id'] = YYYYPP... (12 digits), PP (4:6) が競馬場コード
+        return [dict(r, date=date_str, place=r['id'][4:6]) for r in races]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(dates)))) as pool:
+        return [race for races in pool.map(search, dates) for race in races]
+
+def fetch_all(races, stats=None, workers=FETCH_WORKERS):
+    """(race, race_data) を races の順に返すジェネレータ。出馬表は workers 本のスレッドで先に取っておく"""
+    stats = stats or PipelineStats()
+
+    def fetch(race):
+        with stats.stage('fetch'):
+            try:
+                return scraper.fetch_race_data(race['url'], race_date=race['date'])
+            except Exception as e:
+                print(f"Error fetching {race['id']}: {e}")
+                return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        yield from zip(races, pool.map(fetch, races))
+
+def run(dates, sinks, power=None, cache=None, fetch_workers=FETCH_WORKERS, rate=RATE, batch_size=BATCH_SIZE,
+        stats=None):
+    """
+    dates のレースを探して予測し、sinks の各 sink.add(race, df) へ流す。PipelineStats を返す。
+    cache (任意) は cache.lookup(race, race_data) -> df or None と cache.store(race, race_data, df) を持つもの。
+    lookup で df が返ったレースは予測せずにそのまま sink へ渡す。sink を閉じるのは呼び出し側。
+    cache に discovered(races) があれば、出馬表を取る前に発見した全レースを渡す (取れなかったレースも含む)。
+    """
+    stats = stats or PipelineStats()
+    scraper.limiter = RateLimiter(rate)
+    try:
+        return _run(dates, sinks, power, cache, fetch_workers, batch_size, stats)
+    finally:
+        scraper.limiter = None
+
+def _run(dates, sinks, power, cache, fetch_workers, batch_size, stats):
+    races = discover(dates, stats, fetch_workers)
+    print(f"Pipeline: {len(races)} races on {len(dates)} dates")
+    if getattr(cache, 'discovered', None) is not None:
+        cache.discovered(races)
+
+    def emit(race, df):
+        with stats.stage('sink'):
+            for sink in sinks:
+                try:
+                    sink.add(race, df)
+                except Exception as e:
+                    print(f"Error writing {race['id']}: {e}")
+                    import traceback
+                    traceback.print_exc()
+
+    def flush(batch):
+        if not batch:
+            return
+        with stats.stage('predict') as s:
+            s['items'] = len(batch)
+            results = predictor.predict_batch([race_data for _, race_data in batch], power=power)
+        for (race, race_data), df in zip(batch, results):
+            if isinstance(df, str): # Error message
+                print(f"Prediction failed for {race['id']}: {df}")
+                continue
+            if cache is not None:
+                cache.store(race, race_data, df)
+            emit(race, df)
+        batch.clear()
+
+    batch = []
+    with profiling.stage('pipeline', rows=len(races)):
+        for race, race_data in fetch_all(races, stats, fetch_workers):
+            if not race_data:
+                continue
+            df = cache.lookup(race, race_data) if cache is not None else None
+            if df is not None:
+                emit(race, df)
+                continue
+            print(f"Predicting {race['id']} ({race['title']})...")
+            batch.append((race, race_data))
+            if len(batch) >= batch_size:
+                flush(batch)
+        flush(batch)
+    return stats
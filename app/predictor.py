@@ -1,38 +1,110 @@
-import joblib
-import pandas as pd
 import os
 import sys
+import time
 
-# Add project root to path to import train.settings if needed
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# numpy / pandas と特徴量のモジュール (train.preprocess など) は予測するときに読み込む
+# (サーバーやスケジューラーの起動、予測しないコマンドの import を軽くする)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 try:
     from train import settings
 except ImportError:
     class settings:
-        MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'train', 'data', 'model')
+        MODEL_DIR = os.path.join(PROJECT_ROOT, 'train', 'data', 'model')
         MODEL_PATH = os.path.join(MODEL_DIR, 'model_lgb.pkl')
+from train import profiling
 
+# 読み込んだモデルと encoders (ファイルの更新時刻が変わったら読み直す)。常駐サーバー (app/server.py) や
+# パイプラインのバッチごとに unpickle し直さないようにプロセス内で使い回す
+_loaded = {}
+
+def load_artifacts(reload=False):
+    """(model, artifacts) を返す。モデルか encoders のファイルが更新されていれば (または reload=True なら) 読み直す"""
+    if PROJECT_ROOT not in sys.path:
+        sys.path.append(PROJECT_ROOT) # encoders.pkl の unpickle に train のモジュールが要る
+    import joblib
+    encoder_path = os.path.join(settings.MODEL_DIR, 'encoders.pkl')
+    key = (settings.MODEL_PATH, os.path.getmtime(settings.MODEL_PATH), encoder_path, os.path.getmtime(encoder_path))
+    if reload or _loaded.get('key') != key:
+        with profiling.stage('predict.load_artifacts'):
+            _loaded['model'] = joblib.load(settings.MODEL_PATH)
+            _loaded['artifacts'] = joblib.load(encoder_path)
+        _loaded['key'] = key
+        _loaded['loaded_at'] = time.time()
+    return _loaded['model'], _loaded['artifacts']
+
+def artifacts_info():
+    """読み込み済みのモデルのパス・更新時刻・読み込んだ時刻 (まだなら None)"""
+    if 'key' not in _loaded:
+        return None
+    model_path, model_mtime, encoder_path, encoder_mtime = _loaded['key']
+    return {'model_path': model_path, 'model_mtime': model_mtime, 'encoder_path': encoder_path,
+            'encoder_mtime': encoder_mtime, 'loaded_at': _loaded['loaded_at']}
+
+@profiling.profiled('predict', rows=None)
 def predict(race_data, return_df=False, power=None):
     """
     Takes race data (list of dicts) and returns predictions using the trained model.
     If return_df is True, returns the pandas DataFrame with scores.
     power: exponent for score calculation (P^power * Odds), defaults to settings.POWER_EXPONENT
     """
-    if not race_data:
-        return "No data to predict."
+    df = predict_batch([race_data], power=power)[0]
+    if return_df or isinstance(df, str):
+        return df
+    return format_ranking(df, race_data, power)
+
+def _window_features(loader, df):
+    import numpy as np
+    import pandas as pd
+    # 日付ごとに過去走ウィンドウ特徴量を引く (同じ馬が別の日のレースにいても混ざらないように)
+    dates = df['date'].where(df['date'].notna(), '').astype(str) if 'date' in df.columns else pd.Series('', index=df.index)
+    horse_ids = df['horse_id'].astype(str)
+    parts = []
+    for date in dates.unique():
+        rows = np.flatnonzero((dates == date).to_numpy())
+        ids = horse_ids.iloc[rows]
+        uniq = pd.unique(ids)
+        windows = loader.get_window_features(uniq, current_date_str=date or None)
+        windows.index = uniq
+        part = windows.loc[ids.to_numpy()]
+        part.index = df.index[rows]
+        parts.append(part)
+    return pd.concat(parts).loc[df.index]
+
+@profiling.profiled('predict.batch', rows=None)
+def predict_batch(races, power=None):
+    """
+    複数レース (race_data のリスト) をまとめて予測する。モデル・encoders の読み込み、過去走の特徴量、
+    勝率、推論はバッチ全体で1回ずつ。戻り値はレースごとの DataFrame (predict(..., return_df=True) と同じ)
+    またはエラーメッセージのリスト。
+    """
+    results = ["No data to predict."] * len(races)
+    valid = [i for i, race_data in enumerate(races) if race_data]
+    if not valid:
+        return results
+
+    if PROJECT_ROOT not in sys.path:
+        sys.path.append(PROJECT_ROOT)
+    import numpy as np
+    import pandas as pd
+    from train import window_features
+    from train import preprocess
+    from train import asof_stats
+    from train import staking
 
     # Check if model exists
     encoder_path = os.path.join(settings.MODEL_DIR, 'encoders.pkl')
     if not os.path.exists(settings.MODEL_PATH) or not os.path.exists(encoder_path):
-        return "Error: Model or encoders not found. Please train the model first."
+        return ["Error: Model or encoders not found. Please train the model first." if race_data else results[i]
+                for i, race_data in enumerate(races)]
 
     try:
-        # Load Artifacts
-        model = joblib.load(settings.MODEL_PATH)
-        artifacts = joblib.load(encoder_path)
+        # Load Artifacts (読み込み済みで更新されていなければ使い回す)
+        model, artifacts = load_artifacts()
 
-        # DataFrame
-        df = pd.DataFrame(race_data)
+        # DataFrame (全レースの行。race_codes はバッチ内のレース番号、index はレース内の行番号)
+        frames = [pd.DataFrame(races[i]) for i in valid]
+        race_codes = np.repeat(np.arange(len(frames)), [len(f) for f in frames])
+        df = pd.concat(frames, ignore_index=True)
 
         # --- Feature Engineering for Inference ---
 
@@ -45,109 +117,107 @@ def predict(race_data, return_df=False, power=None):
         try:
             loader.load() # Load CSVs once
 
-            # Enrich race_data with history
-            for i, row in df.iterrows():
-                # Current Race Date provided by metadata?
-                # Scraper puts "date" in input race_data! string "2024年..."
-                current_date = row.get('date', None)
-
-                last_stats = loader.get_last_race(row['horse_id'], current_date_str=current_date)
-
-                if last_stats:
-                    df.at[i, 'lag1_rank'] = last_stats['lag1_rank']
-                    df.at[i, 'lag1_speed_index'] = last_stats['lag1_speed_index']
-                    df.at[i, 'lag1_last_3f'] = last_stats['lag1_last_3f']
-                    df.at[i, 'interval'] = last_stats['interval']
-                else:
-                    df.at[i, 'lag1_rank'] = 99
-                    df.at[i, 'lag1_speed_index'] = 0
-                    df.at[i, 'lag1_last_3f'] = 0
-                    df.at[i, 'interval'] = 365
+            # Enrich race_data with history (lag1..5, interval, 直近5走の統計を全頭まとめて計算)
+            # race_data に "date" (2024年... の文字列) があればその日より前の過去走だけを使う
+            windows = _window_features(loader, df)
         except Exception as e:
             print(f"⚠️  History load failed: {e}")
             print("⚠️  Using default feature values - prediction accuracy will be reduced.")
-            df['lag1_rank'] = 99
-            df['lag1_speed_index'] = 0
-            df['lag1_last_3f'] = 0
-            df['interval'] = 365
-
-        # 2. Jockey Win Rate
-        jockey_map = artifacts.get('jockey_win_rate', {})
-        def get_rate(jid):
-            # Try exact match, then string match, then 0
-            if jid in jockey_map: return jockey_map[jid]
-            try:
-                if int(jid) in jockey_map: return jockey_map[int(jid)]
-            except: pass
-            try:
-                if str(jid) in jockey_map: return jockey_map[str(jid)]
-            except: pass
-            return 0.0
-
-        df['jockey_win_rate'] = df['jockey_id'].apply(get_rate)
-
-        # 2b. Trainer Win Rate
-        trainer_map = artifacts.get('trainer_win_rate', {})
-        def get_trainer_rate(tid):
-            if tid in trainer_map: return trainer_map[tid]
-            try:
-                if int(tid) in trainer_map: return trainer_map[int(tid)]
-            except: pass
-            try:
-                if str(tid) in trainer_map: return trainer_map[str(tid)]
-            except: pass
-            return 0.0
-            
-        df['trainer_win_rate'] = df['trainer_id'].apply(get_trainer_rate)
+            # 過去走なしとして計算 (lag 99/0, interval 365)
+            windows = window_features.compute(pd.DataFrame({'horse_id': df['horse_id'].astype(str)}))
+        for col in windows.columns:
+            df[col] = windows[col].to_numpy()
 
         # 3. Categorical Encoding (Label Encoder)
         cat_cols = ['horse_id', 'jockey_id', 'trainer_id', 'course_type', 'weather', 'condition', 'sire_id', 'damsire_id', 'running_style']
         
-        # 2c. Sire/DamSire Win Rate
-        for col in ['sire_win_rate', 'damsire_win_rate']:
-            base_col = col.replace('_win_rate', '_id') # sire_id
-            map_data = artifacts.get(col, {})
-            def get_pedigree_rate(pid):
-                if pid in map_data: return map_data[pid]
-                if str(pid) in map_data: return map_data[str(pid)]
+        asof = artifacts.get('asof_stats')
+        if asof is not None:
+            # 2. 騎手・調教師・血統・適性の勝率 (時点別インデックスでレース当日より前の成績を一括で引く)
+            if 'distance' in df.columns:
+                df['dist_cat'] = df['distance'].apply(preprocess._get_dist_cat)
+            # 日付不明 (NaT) なら最終時点の勝率
+            race_dates = pd.Series(pd.NaT, index=df.index)
+            if 'date' in df.columns:
+                race_dates = pd.to_datetime(df['date'], format='%Y年%m月%d日', errors='coerce')
+            rates = asof_stats.lookup(asof, df, race_dates)
+            for col in rates.columns:
+                df[col] = rates[col]
+        else:
+            # 2. Jockey Win Rate
+            jockey_map = artifacts.get('jockey_win_rate', {})
+            def get_rate(jid):
+                # Try exact match, then string match, then 0
+                if jid in jockey_map: return jockey_map[jid]
+                try:
+                    if int(jid) in jockey_map: return jockey_map[int(jid)]
+                except: pass
+                try:
+                    if str(jid) in jockey_map: return jockey_map[str(jid)]
+                except: pass
                 return 0.0
-            # Ensure base col exists first (handled in loop below? No, must exist for apply)
-            if base_col not in df.columns: df[base_col] = 'unknown'
-            df[col] = df[base_col].apply(get_pedigree_rate)
-
-        # 2d. Aptitude Features (Turf/Dirt, Distance)
-        # Turf/Dirt
-        apt_type_map = artifacts.get('aptitude_type', {})
-        def get_type_aptitude(row):
-            hid = str(row['horse_id'])
-            ctype = row.get('course_type', 'unknown')
-            if hid in apt_type_map and ctype in apt_type_map[hid]:
-                return apt_type_map[hid][ctype]
-            return 0.0
-        df['course_type_win_rate'] = df.apply(get_type_aptitude, axis=1)
-
-        # Distance
-        apt_dist_map = artifacts.get('aptitude_dist', {})
-        def get_dist_cat(d):
-            try:
-                d = int(d)
-                if d < 1400: return 'sprint'
-                if d < 1900: return 'mile'
-                if d < 2500: return 'intermediate'
-                return 'long'
-            except:
-                return 'unknown'
+
+            df['jockey_win_rate'] = df['jockey_id'].apply(get_rate)
+
+            # 2b. Trainer Win Rate
+            trainer_map = artifacts.get('trainer_win_rate', {})
+            def get_trainer_rate(tid):
+                if tid in trainer_map: return trainer_map[tid]
+                try:
+                    if int(tid) in trainer_map: return trainer_map[int(tid)]
+                except: pass
+                try:
+                    if str(tid) in trainer_map: return trainer_map[str(tid)]
+                except: pass
+                return 0.0
+            
+            df['trainer_win_rate'] = df['trainer_id'].apply(get_trainer_rate)
+
+            # 2c. Sire/DamSire Win Rate
+            for col in ['sire_win_rate', 'damsire_win_rate']:
+                base_col = col.replace('_win_rate', '_id') # sire_id
+                map_data = artifacts.get(col, {})
+                def get_pedigree_rate(pid):
+                    if pid in map_data: return map_data[pid]
+                    if str(pid) in map_data: return map_data[str(pid)]
+                    return 0.0
+                # Ensure base col exists first (handled in loop below? No, must exist for apply)
+                if base_col not in df.columns: df[base_col] = 'unknown'
+                df[col] = df[base_col].apply(get_pedigree_rate)
+
+            # 2d. Aptitude Features (Turf/Dirt, Distance)
+            # Turf/Dirt
+            apt_type_map = artifacts.get('aptitude_type', {})
+            def get_type_aptitude(row):
+                hid = str(row['horse_id'])
+                ctype = row.get('course_type', 'unknown')
+                if hid in apt_type_map and ctype in apt_type_map[hid]:
+                    return apt_type_map[hid][ctype]
+                return 0.0
+            df['course_type_win_rate'] = df.apply(get_type_aptitude, axis=1)
+
+            # Distance
+            apt_dist_map = artifacts.get('aptitude_dist', {})
+            def get_dist_cat(d):
+                try:
+                    d = int(d)
+                    if d < 1400: return 'sprint'
+                    if d < 1900: return 'mile'
+                    if d < 2500: return 'intermediate'
+                    return 'long'
+                except:
+                    return 'unknown'
         
-        # Create temp dist_cat if needed
-        df['dist_cat_temp'] = df['distance'].apply(get_dist_cat)
+            # Create temp dist_cat if needed
+            df['dist_cat_temp'] = df['distance'].apply(get_dist_cat)
         
-        def get_dist_aptitude(row):
-            hid = str(row['horse_id'])
-            cat = row.get('dist_cat_temp', 'unknown')
-            if hid in apt_dist_map and cat in apt_dist_map[hid]:
-                return apt_dist_map[hid][cat]
-            return 0.0
-        df['dist_cat_win_rate'] = df.apply(get_dist_aptitude, axis=1)
+            def get_dist_aptitude(row):
+                hid = str(row['horse_id'])
+                cat = row.get('dist_cat_temp', 'unknown')
+                if hid in apt_dist_map and cat in apt_dist_map[hid]:
+                    return apt_dist_map[hid][cat]
+                return 0.0
+            df['dist_cat_win_rate'] = df.apply(get_dist_aptitude, axis=1)
 
 
         for col in cat_cols:
@@ -189,29 +259,16 @@ def predict(race_data, return_df=False, power=None):
             df['pace_ratio'] = 0  # Unknown
 
         # 5. Predict
-        features = [
-            'jockey_win_rate', 'trainer_win_rate', 'horse_id', 'jockey_id', 'trainer_id',
-            'waku', 'umaban', 'course_type', 'distance', 'weather', 'condition',
-            'lag1_rank', 'lag1_speed_index', 'lag1_last_3f', 'interval', 'weight_diff',
-            'sire_id', 'damsire_id', 'running_style',
-            'sire_win_rate', 'damsire_win_rate',
-            'course_type_win_rate', 'dist_cat_win_rate',
-            'front_runner_count', 'pace_ratio'
-        ]
+        # 学習時の特徴量リストを優先 (特徴量追加前に学習したモデルとの互換)
+        features = model.feature_name() if hasattr(model, 'feature_name') else settings.FEATURES
 
         # LambdaRank returns 1D score array (N,) - higher is better
-        pred_scores = model.predict(df[features])
+        with profiling.stage('predict.model', rows=len(df)):
+            pred_scores = model.predict(df[features])
         
-        # Convert LambdaRank scores to probabilities using softmax
+        # Convert LambdaRank scores to probabilities using softmax (レースごと)
         # This prevents the top horse from always being 100% and creates a realistic probability distribution
-        import numpy as np
-        
-        if len(pred_scores) > 0:
-            # Softmax transformation for numerical stability
-            exp_scores = np.exp(pred_scores - pred_scores.max())
-            df['win_prob'] = exp_scores / exp_scores.sum()
-        else:
-            df['win_prob'] = 0.0
+        df['win_prob'] = staking.softmax_by_race(race_codes, pred_scores)
 
         # Clean Odds for calculation
         def parse_odds(o):
@@ -221,6 +278,9 @@ def predict(race_data, return_df=False, power=None):
                 return 0.0
         df['odds_val'] = df['odds'].apply(parse_odds)
 
+        # 分数 Kelly の賭け金 (資金に対する割合、1レースの上限付き: train/staking.py)
+        df['kelly'] = staking.stake_fractions(race_codes, df['win_prob'].to_numpy(), df['odds_val'].to_numpy())
+
         # Calculate Score: (Win Prob)^4 * Odds
         # If odds are missing (0.0), score becomes 0.
         # Fallback to win_prob if odds are missing? 
@@ -229,10 +289,7 @@ def predict(race_data, return_df=False, power=None):
         
         # Hybrid Score: Use Expectation if odds exist, else raw prob
         use_power = power if power is not None else settings.POWER_EXPONENT
-        df['score'] = df.apply(
-            lambda x: (x['win_prob'] ** use_power) * x['odds_val'] if x['odds_val'] > 0 else x['win_prob'], 
-            axis=1
-        )
+        df['score'] = np.where(df['odds_val'] > 0, df['win_prob'] ** use_power * df['odds_val'], df['win_prob'])
 
         # Normalize scores to 0-1 range for better readability
         # Note: Expectation scores can be widely distributed
@@ -240,39 +297,45 @@ def predict(race_data, return_df=False, power=None):
         # normalization removed
         pass
 
-        # Rank by Score (Descending)
-        df = df.sort_values('score', ascending=False)
-        
-        if return_df:
-            return df
-
-        # 6. Format Output
-        # Get context from original race_data to avoid showing encoded integers
-        context_weather = race_data[0].get('weather', 'Unknown')
-        context_distance = race_data[0].get('distance', 'Unknown')
-
-        result_lines = [f"Prediction Ranking (Score = Prob^{use_power} * Odds):"]
-        result_lines.append(f"Context: {context_weather} / {context_distance}m")
-        result_lines.append("-" * 40)
-
-        for i, (_, row) in enumerate(df.iterrows()):
-            symbol = "  "
-            if i == 0: symbol = "◎ "
-            elif i == 1: symbol = "○ "
-            elif i == 2: symbol = "▲ "
-            elif i == 3: symbol = "△ "
-
-            # Show odds if available, else ---
-            odds_str = str(row.get('odds', '---.-'))
-            
-            # Show Probability as well for transparency
-            prob_pct = row['win_prob'] * 100
-            
-            line = f"{symbol} {i+1}. {row['name']} (Odds: {odds_str}, Win%: {prob_pct:.1f}%, Score: {row['score']:.4f})"
-            result_lines.append(line)
-
-        return "\n".join(result_lines)
+        # Rank by Score (Descending) (レースごとに分けて、index はレース内の行番号に戻す)
+        df.index = np.concatenate([np.arange(len(f)) for f in frames])
+        for code, i in enumerate(valid):
+            results[i] = df[race_codes == code].sort_values('score', ascending=False)
+        return results
 
     except Exception as e:
         import traceback
-        return f"Prediction Error: {e}\n{traceback.format_exc()}"
\ No newline at end of file
+        return [f"Prediction Error: {e}\n{traceback.format_exc()}" if race_data else results[i]
+                for i, race_data in enumerate(races)]
+
+def format_ranking(df, race_data, power=None):
+    """predict_batch のレースの DataFrame を表示用のランキングの文字列にする"""
+    use_power = power if power is not None else settings.POWER_EXPONENT
+    # 6. Format Output
+    # Get context from original race_data to avoid showing encoded integers
+    context_weather = race_data[0].get('weather', 'Unknown')
+    context_distance = race_data[0].get('distance', 'Unknown')
+
+    result_lines = [f"Prediction Ranking (Score = Prob^{use_power} * Odds):"]
+    result_lines.append(f"Context: {context_weather} / {context_distance}m")
+    result_lines.append("-" * 40)
+
+    for i, (_, row) in enumerate(df.iterrows()):
+        symbol = "  "
+        if i == 0: symbol = "◎ "
+        elif i == 1: symbol = "○ "
+        elif i == 2: symbol = "▲ "
+        elif i == 3: symbol = "△ "
+
+        # Show odds if available, else ---
+        odds_str = str(row.get('odds', '---.-'))
+        
+        # Show Probability as well for transparency
+        prob_pct = row['win_prob'] * 100
+        
+        line = f"{symbol} {i+1}. {row['name']} (Odds: {odds_str}, Win%: {prob_pct:.1f}%, Score: {row['score']:.4f})"
+        if row['kelly'] > 0:
+            line += f" Kelly: {row['kelly'] * 100:.1f}%"
+        result_lines.append(line)
+
+    return "\n".join(result_lines)
\ No newline at end of file
@@ -0,0 +1,179 @@
+"""
+出馬表 (shutuba) の2段キャッシュ。
+
+出走馬・枠番・馬番・騎手・調教師などの出馬表の内容はほとんど変わらないので長い TTL (ENTRY_TTL) で保存し、
+オッズだけを短い TTL (ODDS_TTL) でオッズ API から取り直す。3時間ごとの実行では前日までのレースは
+オッズ API を1回呼ぶだけになる。次のどれかで出馬表のページを取り直す:
+    - ENTRY_TTL が過ぎた
+    - レース当日 (race_date が今日以前) で DAY_OF_TTL が過ぎた (天候・馬場状態・当日の騎手変更)
+    - オッズ API の馬番の集合が保存した出走馬と違う (除外・追加)
+    - オッズが付かなくなった馬番 (取消) の集合が出馬表を取ったときと違う
+
+オッズ API からは騎手変更・天候・馬場状態の変化は分からない。前日までの騎手変更は ENTRY_TTL の間
+(最大6時間) 反映されないことがある。race_date を渡さない呼び出し (予測サーバー) は ENTRY_TTL だけで判断する。
+
+    entries, odds = cards.get(race_id, url, fetch_entries, fetch_odds)
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from train import settings
+
+CARD_DIR = os.path.join(settings.CACHE_DIR, 'race_cards')
+ENTRY_TTL = 6 * 3600
+DAY_OF_TTL = 15 * 60 # レース当日の出馬表 (スケジューラーの 10・3 分前のチェックポイントで取り直す間隔)
+ODDS_TTL = 5 * 60
+MAX_AGE = 7 * 24 * 3600 # prune() で消す古さ
+JST = timezone(timedelta(hours=9)) # race_date は日本時間の日付
+
+# 出馬表の中身の比較に使う項目 (オッズ・人気は除く)
+ENTRY_FIELDS = ['umaban', 'waku', 'name', 'horse_id', 'jockey', 'jockey_id', 'trainer', 'trainer_id',
+                'course_type', 'distance', 'weather', 'condition', 'post_time']
+
+def umaban_key(umaban):
+    """オッズ API の馬番 (ゼロ埋め2桁の文字列) に合わせる"""
+    u = str(umaban or '').strip()
+    return u.zfill(2) if u.isdigit() else u
+
+def entry_hash(entries):
+    rows = sorted(json.dumps([e.get(k) for k in ENTRY_FIELDS], ensure_ascii=False, default=str) for e in entries)
+    return hashlib.sha1('\n'.join(rows).encode('utf-8')).hexdigest()[:16]
+
+def _has_odds(value):
+    try:
+        return float(value) > 0
+    except (TypeError, ValueError):
+        return False
+
+def field_signature(odds):
+    """オッズ API の結果の [馬番のリスト, オッズが付いていない (取消など) 馬番のリスト]"""
+    return [sorted(odds), sorted(u for u, v in odds.items() if not _has_odds(v))]
+
+class RaceCardCache:
+    """race_id ごとの出馬表とオッズ。1レース1ファイル (JSON)"""
+    def __init__(self, root=None, entry_ttl=ENTRY_TTL, odds_ttl=ODDS_TTL, day_of_ttl=DAY_OF_TTL):
+        self.root = root or CARD_DIR
+        self.entry_ttl = entry_ttl
+        self.odds_ttl = odds_ttl
+        self.day_of_ttl = day_of_ttl
+        self.stats = {'cached': 0, 'odds_only': 0, 'entries': 0, 'invalidated': 0}
+
+    def _path(self, race_id):
+        return os.path.join(self.root, f"{race_id}.json")
+
+    def load(self, race_id):
+        path = self._path(race_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable race card for {race_id}: {e}")
+            return None
+
+    def save(self, race_id, card):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self._path(race_id) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(card, f, ensure_ascii=False, default=str)
+        os.replace(tmp, self._path(race_id))
+
+    def _entries_fresh(self, card, race_date, now):
+        """保存した出馬表が TTL 内か。race_date (YYYYMMDD) が今日以前なら DAY_OF_TTL で判断する"""
+        if card is None:
+            return False
+        ttl = self.entry_ttl
+        if race_date and str(race_date) <= datetime.fromtimestamp(now, JST).strftime('%Y%m%d'):
+            ttl = min(ttl, self.day_of_ttl)
+        return now - card['entries_at'] < ttl
+
+    def _field_changed(self, card, odds):
+        if card.get('field') is not None:
+            return field_signature(odds) != card['field']
+        # 出馬表を取ったときにオッズが無かった場合は出走馬の馬番と比べる
+        return sorted(odds) != sorted(umaban_key(e.get('umaban')) for e in card['entries'])
+
+    def get(self, race_id, url, fetch_entries, fetch_odds, now=None, race_date=None):
+        """
+        (出走馬のリスト, {馬番: 単勝オッズ}) を返す。必要なときだけ fetch_entries(url) / fetch_odds(race_id) を呼ぶ。
+        出馬表が取れなかったときは ([], {})。race_date (YYYYMMDD) があれば当日は出馬表を DAY_OF_TTL で取り直す。
+        """
+        now = time.time() if now is None else now
+        card = self.load(race_id)
+        fresh = self._entries_fresh(card, race_date, now)
+        if fresh and now - card.get('odds_at', 0) < self.odds_ttl:
+            self.stats['cached'] += 1
+            return card['entries'], card.get('odds', {})
+
+        odds = None
+        if fresh:
+            odds = fetch_odds(race_id)
+            if odds and self._field_changed(card, odds):
+                print(f"Entries changed for {race_id} (scratch or addition), re-fetching the race card.")
+                self.stats['invalidated'] += 1
+                fresh = False
+
+        if fresh:
+            self.stats['odds_only'] += 1
+        else:
+            entries = fetch_entries(url)
+            if not entries:
+                return [], {}
+            if odds is None:
+                odds = fetch_odds(race_id)
+            if card is not None and card.get('entry_hash') != entry_hash(entries):
+                print(f"Race card for {race_id} updated.")
+            card = {
+                'entries': entries,
+                'entries_at': now,
+                'entry_hash': entry_hash(entries),
+                'field': field_signature(odds) if odds else None
+            }
+            self.stats['entries'] += 1
+
+        # オッズが取れなかったとき (発売前・API の失敗) は前回のオッズを残し、次の実行で取り直す
+        if odds:
+            card['odds'] = odds
+            card['odds_at'] = now
+        self.save(race_id, card)
+        return card['entries'], card.get('odds', {})
+
+    def entries(self, race_id, url, fetch_entries, now=None, race_date=None):
+        """出馬表だけ (オッズ API は呼ばない)。TTL 内なら保存した出走馬、切れていれば取り直して保存する"""
+        now = time.time() if now is None else now
+        card = self.load(race_id)
+        if self._entries_fresh(card, race_date, now):
+            return card['entries']
+        entries = fetch_entries(url)
+        if not entries:
+            return []
+        # オッズは次の get() で取る (odds_at が無いので TTL 切れ扱い)
+        self.save(race_id, {'entries': entries, 'entries_at': now, 'entry_hash': entry_hash(entries), 'field': None})
+        self.stats['entries'] += 1
+        return entries
+
+    def prune(self, max_age=MAX_AGE, now=None):
+        """max_age 秒以上取り直していないレース (終わったレース) を消す。消した数を返す"""
+        now = time.time() if now is None else now
+        removed = 0
+        if not os.path.isdir(self.root):
+            return 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith('.json') and now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def summary(self):
+        s = self.stats
+        return (f"Race cards: {s['cached']} fully cached, {s['odds_only']} odds-only refreshes, "
+                f"{s['entries']} race card downloads ({s['invalidated']} invalidated by entry changes)")
+
+cards = RaceCardCache()
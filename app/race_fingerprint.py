@@ -0,0 +1,70 @@
+"""
+予測実行の差分検出。
+
+スクレイプした race_data (出走馬・馬体重・オッズ・馬場状態など全項目) からレースごとの指紋を作り、
+採点結果 (DataFrame など) と一緒に保存しておく。次の実行で指紋 (モデル指紋を含む) が同じレースは
+再予測せずに前回の結果を使う。
+
+    store = ScoredRaces()
+    fp = race_fingerprint(race_data, model_key)
+    df = store.get(race_id, fp)
+    if df is None:
+        df = predictor.predict(race_data, return_df=True)
+        store.put(race_id, fp, df)
+"""
+import glob
+import hashlib
+import json
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from train import settings
+
+STATE_DIR = os.path.join(settings.CACHE_DIR, 'predict_runs')
+
+def race_fingerprint(race_data, model_key=''):
+    """race_data の全項目 (馬の並び順は無視) と model_key の指紋"""
+    h = hashlib.sha1(str(model_key).encode('utf-8'))
+    for row in sorted(json.dumps(horse, sort_keys=True, ensure_ascii=False, default=str) for horse in race_data):
+        h.update(row.encode('utf-8'))
+        h.update(b'\n')
+    return h.hexdigest()[:20]
+
+class ScoredRaces:
+    """race_id ごとの (指紋, 採点結果)。1レース1ファイル (pickle)"""
+    def __init__(self, root=None):
+        self.root = root or STATE_DIR
+
+    def _path(self, race_id):
+        return os.path.join(self.root, f"{race_id}.pkl")
+
+    def get(self, race_id, fingerprint):
+        """指紋が一致すれば前回の採点結果、そうでなければ None"""
+        path = self._path(race_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            saved = pd.read_pickle(path)
+        except Exception as e:
+            print(f"Ignoring unreadable state for {race_id}: {e}")
+            return None
+        return saved['result'] if saved.get('fingerprint') == fingerprint else None
+
+    def put(self, race_id, fingerprint, result):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self._path(race_id) + '.tmp'
+        pd.to_pickle({'fingerprint': fingerprint, 'result': result}, tmp)
+        os.replace(tmp, self._path(race_id))
+
+    def prune(self, keep):
+        """keep に無いレース (対象期間から外れたもの) の状態を消す。消した数を返す"""
+        keep = {str(r) for r in keep}
+        removed = 0
+        for path in glob.glob(os.path.join(self.root, '*.pkl')):
+            if os.path.basename(path)[:-4] not in keep:
+                os.remove(path)
+                removed += 1
+        return removed
@@ -2,13 +2,18 @@ import os
 import sys
 import pandas as pd
 from datetime import datetime, timedelta
-from collections import defaultdict
 
 # Add project root
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from app import scraper, predictor, history_loader
+from app import history_loader, pipeline
+from app import race_fingerprint
+from app import report_shards
+from app import race_card_cache
 from train import settings
+from train import profiling
+from train import prediction_cache
+from train import html_render
 
 SEX_MAP = {
     '牡': 'Male',
@@ -29,356 +34,389 @@ PLACE_MAP = {
     '10': 'Kokura'
 }
 
-def generate_prediction_report(output_file="predict.html", power_min=None, power_max=None):
-    print("Generating Prediction Report (Tabbed View)...")
-    
-    # Load historical data to check availability
-    history_loader.loader.load()
-    has_historical_data = len(history_loader.loader.df) > 0
-    print(f"Historical data available: {has_historical_data} ({len(history_loader.loader.df)} records)")
-    
-    # Defaults
-    # User requested fixed default power 4, but let's keep args support just in case,
-    # but strictly prioritize showing the single power score primarily.
-    default_p = 4
-    p_min = int(power_min) if power_min is not None else default_p
-    p_max = int(power_max) if power_max is not None else p_min
-    power_values = list(range(p_min, p_max + 1))
-    
-    # 1. Determine Target Dates (Today + 6 days)
-    # The user requested to include all races for the week, not just weekends.
-    today = datetime.now()
-    target_dates = []
-    
-    for i in range(7):
-        d = today + timedelta(days=i)
-        target_dates.append(d.strftime('%Y%m%d'))
+# レースの表はシャードを読み込んだときにブラウザで組み立てる (列は _shard_race の columns)
+RENDER_JS = """
+var SYMBOLS = ['🥇', '🥈', '🥉', '△', '☆'];
+function raceCard(race) {
+    var c = race.columns, rows = '';
+    for (var i = 0; i < c.name.length; i++) {
+        rows += '<tr class="' + (i === 0 ? 'top-pick-row' : '') + '">' +
+            '<td><span class="symbol">' + (SYMBOLS[i] || '') + '</span></td>' +
+            '<td>' + esc(c.umaban[i]) + '</td><td>' + esc(c.name[i]) + '</td><td>' + esc(c.jockey[i]) + '</td>' +
+            '<td>' + esc(c.odds[i] === null ? '---' : c.odds[i]) + '</td><td>' + fmt(c.win_prob[i], 1, 100) + '%</td>' +
+            '<td><strong>' + fmt(c.score[i], 4) + '</strong></td></tr>';
+    }
+    return '<div class="card"><div class="card-header">' +
+        '<span class="race-title-text">' + esc(race.title) + '</span>' +
+        '<span class="race-meta">' + esc(race.meta) + ' | ID: ' + esc(race.id) + '</span></div>' +
+        '<div class="card-body p-0"><table class="table table-hover table-sm mb-0"><thead><tr>' +
+        '<th>Mark</th><th>#</th><th>Horse</th><th>Jockey</th><th>Odds</th><th>Win%</th><th>Score (P=' + SCORE_POWER + ')</th>' +
+        '</tr></thead><tbody>' + rows + '</tbody></table></div></div>';
+}
+function renderShard(pane, races) {
+    var tabs = '', panes = '';
+    races.forEach(function (race, i) {
+        var rid = esc(race.id);
+        tabs += '<li class="nav-item"><a class="nav-link ' + (i === 0 ? 'active' : '') + '" id="tab-' + rid +
+            '" data-toggle="tab" href="#content-' + rid + '" role="tab">' + esc(race.race_no) + 'R</a></li>';
+        panes += '<div class="tab-pane fade ' + (i === 0 ? 'show active' : '') + '" id="content-' + rid +
+            '" role="tabpanel">' + raceCard(race) + '</div>';
+    });
+    pane.innerHTML = '<ul class="nav nav-tabs race-tabs" role="tablist" style="margin-top: 10px;">' + tabs + '</ul>' +
+        '<div class="tab-content">' + panes + '</div>';
+}
+"""
 
-    print(f"Target Dates: {target_dates}")
-    
-    # 2. Search & Predict
-    # Structure: data[date][venue_code] = list of race_results
-    grouped_data = defaultdict(lambda: defaultdict(list))
-    venue_names = {} # code -> name map for this run
+def _shard_race(entry, default_p):
+    """シャードに書くレース (表示する上位12頭の列だけ)"""
+    score_col = f'Score(P={default_p})'
+    cols = report_shards.columns(entry['df'], ['umaban', 'name', 'jockey', 'odds', 'win_prob', score_col], limit=12)
+    cols['score'] = cols.pop(score_col)
+    return {'id': entry['id'], 'title': entry['title'], 'race_no': entry['race_no'], 'meta': entry['meta'], 'columns': cols}
 
-    for date_str in target_dates:
-        # Search all races
-        races = scraper.search_races(date_str)
-        print(f"Found {len(races)} races for {date_str}.")
-        
-        for race in races:
-            try:
-                # race['id'] = YYYYPP... (12 digits)
-                # PP is 4:6
-                race_id = race['id']
-                place_code = race_id[4:6]
-                venue_name = PLACE_MAP.get(place_code, f"Place {place_code}")
-                venue_names[place_code] = venue_names.get(place_code, venue_name)
-                
-                print(f"Predicting {race_id} ({race['title']})...")
-                # Scrape
-                race_data = scraper.fetch_race_data(race['url'])
-                if not race_data: continue
-                
-                # Predict
-                df_pred = predictor.predict(race_data, return_df=True, power=p_min) # Start with min
-                
-                if isinstance(df_pred, str): # Error message
-                    print(df_pred)
-                    continue
-                
-                # Calculate scores
-                def parse_odds(o):
-                    try: return float(o)
-                    except: return 0.0
-                
-                if 'odds_val' not in df_pred.columns:
-                     df_pred['odds_val'] = df_pred['odds'].apply(parse_odds)
-                     
-                for p in power_values:
-                    col_name = f'Score(P={p})'
-                    df_pred[col_name] = (df_pred['win_prob'] ** p) * df_pred['odds_val']
-                
-                # Sort by default_p if present, else max
-                sort_p = default_p if default_p in power_values else power_values[-1]
-                df_pred = df_pred.sort_values(f'Score(P={sort_p})', ascending=False)
-                
-                # Meta
-                weather = "?"
-                dist = "?"
-                course = "?"
-                if not df_pred.empty and 'weather' in df_pred.columns:
-                    weather = df_pred.iloc[0]['weather']
-                    dist = df_pred.iloc[0]['distance']
-                    course = df_pred.iloc[0]['course_type']
+# ページ本体のタブと、single_file で埋め込むレースの表 (train/html_render.py のコンパイル済みテンプレート)
+DATE_TAB = html_render.Template("""
+            <li class="nav-item">
+                <a class="nav-link {active}" id="tab-{date}" data-toggle="tab" href="#content-{date}" role="tab" data-shard="{shard}">{date}</a>
+            </li>""")
+VENUE_TAB = html_render.Template("""
+                <li class="nav-item">
+                    <a class="nav-link {active}" id="tab-{date}-{venue}" data-toggle="tab" href="#content-{date}-{venue}" role="tab" data-shard="{shard}">{name}</a>
+                </li>""")
+VENUE_PANE = html_render.Template('<div class="tab-pane fade {active}" id="content-{date}-{venue}" role="tabpanel">')
+RACE_TAB = html_render.Template('<li class="nav-item"><a class="nav-link {active}" id="tab-{id}" data-toggle="tab" '
+                                'href="#content-{id}" role="tab">{race_no}R</a></li>')
+RACE_HEAD = html_render.Template("""
+<div class="tab-pane fade {active}" id="content-{id}" role="tabpanel">
+    <div class="card">
+        <div class="card-header">
+            <span class="race-title-text">{title}</span>
+            <span class="race-meta">{meta} | ID: {id}</span>
+        </div>
+        <div class="card-body p-0">
+            <table class="table table-hover table-sm mb-0">
+                <thead>
+                    <tr><th>Mark</th><th>#</th><th>Horse</th><th>Jockey</th><th>Odds</th><th>Win%</th><th>Score (P={power})</th></tr>
+                </thead>
+                <tbody>
+""")
+RACE_ROW = html_render.Template('<tr class="{row_class}"><td><span class="symbol">{symbol}</span></td><td>{umaban}</td>'
+                                '<td>{name}</td><td>{jockey}</td><td>{odds}</td><td>{win_prob:.1%}</td>'
+                                '<td><strong>{score:.4f}</strong></td></tr>\n')
+RACE_TAIL = '</tbody></table></div></div></div>\n'
+SYMBOLS = ['🥇', '🥈', '🥉', '△', '☆']
 
-                grouped_data[date_str][place_code].append({
-                    'id': race_id,
-                    'title': race['title'],
-                    'race_no': race['race_no'],
-                    'df': df_pred,
-                    'meta': f"{course} {dist}m {weather}"
-                })
-                
-            except Exception as e:
-                print(f"Error processing {race['id']}: {e}")
-                import traceback
-                traceback.print_exc()
+def _write_races(f, races, default_p):
+    """1つの競馬場のレース (シャードの列の配列) をタブと表にして f へ直接書く"""
+    races = sorted(races, key=lambda r: int(r['race_no']))
+    f.write('<ul class="nav nav-tabs race-tabs" role="tablist" style="margin-top: 10px;">')
+    RACE_TAB.write_rows(f, {'active': html_render.first_only(len(races), 'active'),
+                            'id': [r['id'] for r in races], 'race_no': [r['race_no'] for r in races]})
+    f.write('</ul>\n<div class="tab-content">')
+    for i, race in enumerate(races):
+        c = race['columns']
+        n = len(c['name'])
+        RACE_HEAD.write(f, active="show active" if i == 0 else "", id=race['id'], title=race['title'], meta=race['meta'],
+                        power=default_p)
+        RACE_ROW.write_rows(f, {**c, 'row_class': html_render.first_only(n, 'top-pick-row'),
+                                'symbol': (SYMBOLS + [''] * n)[:n],
+                                'odds': ['---' if o is None else o for o in c['odds']]}, n)
+        f.write(RACE_TAIL)
+    f.write('</div>\n')
 
-    # 3. Generate HTML
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="ja">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1, shrink-to-fit=no">
-        <title>Keiba Prediction Report</title>
-        <!-- Bootstrap 4 CSS -->
-        <link rel="stylesheet" href="https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/css/bootstrap.min.css">
-        <style>
-            body {{ padding: 20px; background-color: #f4f7f6; font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif; }}
-            .card {{ margin-top: 20px; border: none; box-shadow: 0 2px 4px rgba(0,0,0,0.1); border-radius: 8px; overflow: hidden; }}
+def _write_shell(f, output_file, manifest, venue_names, history_rows, default_p, single_file=False):
+    """
+    日付・競馬場のタブと、シャードを読み込むスクリプトだけのページを書く。
+    single_file なら各競馬場のタブにシャードから表を書き込み、スクリプトは付けない。
+    """
+    f.write(f"""<!DOCTYPE html>
+<html lang="ja">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1, shrink-to-fit=no">
+    <title>Keiba Prediction Report</title>
+    <!-- Bootstrap 4 CSS -->
+    <link rel="stylesheet" href="https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/css/bootstrap.min.css">
+    """)
+    f.write('''<style>
+            body { padding: 20px; background-color: #f4f7f6; font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif; }
+            .card { margin-top: 20px; border: none; box-shadow: 0 2px 4px rgba(0,0,0,0.1); border-radius: 8px; overflow: hidden; }
             
             /* Card Header: Black background, White text */
-            .card-header {{ 
+            .card-header { 
                 background-color: #212529; 
                 color: white; 
                 border-bottom: none; 
                 padding: 10px 15px;
-            }}
-            .race-title-text {{ font-size: 1.1em; font-weight: bold; }}
-            .race-meta {{ font-size: 0.9em; color: #ced4da; float: right; }}
+            }
+            .race-title-text { font-size: 1.1em; font-weight: bold; }
+            .race-meta { font-size: 0.9em; color: #ced4da; float: right; }
             
             /* Tabs */
-            .nav-tabs {{ border-bottom: 2px solid #dee2e6; }}
-            .nav-link {{ border: none; color: #495057; }}
+            .nav-tabs { border-bottom: 2px solid #dee2e6; }
+            .nav-link { border: none; color: #495057; }
             
             /* Level 1: Date (Standard Tabs) */
-            #dateTabs .nav-link.active {{ 
+            #dateTabs .nav-link.active { 
                 border-bottom: 3px solid #007bff; 
                 color: #007bff; 
                 font-weight: bold; 
                 background: transparent;
-            }}
+            }
             
             /* Level 2: Venue (Blue Pills/Tabs) */
-            .venue-tabs .nav-link {{
+            .venue-tabs .nav-link {
                 background-color: transparent;
                 margin-right: 5px;
                 border-radius: 4px;
                 padding: 8px 15px;
-            }}
-            .venue-tabs .nav-link.active {{ 
+            }
+            .venue-tabs .nav-link.active { 
                 background-color: #007bff; 
                 color: white !important; 
-            }}
+            }
             
             /* Level 3: Race (Light Pills) */
-            .race-tabs .nav-link {{
+            .race-tabs .nav-link {
                 padding: 5px 15px;
                 margin-right: 5px;
                 border: 1px solid transparent;
-            }}
-            .race-tabs .nav-link.active {{ 
+            }
+            .race-tabs .nav-link.active { 
                 background-color: white; 
                 color: #212529 !important; 
                 font-weight: bold; 
                 border: 1px solid #dee2e6;
                 border-bottom: none;
                 box-shadow: 0 -2px 5px rgba(0,0,0,0.05);
-            }}
+            }
             
-            .table th {{ background-color: #f8f9fa; border-top: none; font-weight: 600; }}
-            .symbol {{ font-size: 1.2em; }}
+            .table th { background-color: #f8f9fa; border-top: none; font-weight: 600; }
+            .symbol { font-size: 1.2em; }
             
             /* Top Pick: Yellow Highlight */
-            .top-pick-row {{ background-color: #fff3cd !important; }}
+            .top-pick-row { background-color: #fff3cd !important; }
             
-            h1 {{ margin-bottom: 10px; text-align: center; color: #333; font-weight: 700; }}
-            .header-icon {{ font-size: 1.5em; margin-right: 10px; }}
-        </style>
-    </head>
-    <body>
-        <div class="container-fluid" style="max-width: 800px; margin: 0 auto;">
-            <h1><span class="header-icon">🏇</span>Keiba AI Predictions</h1>
-            <p class="text-center text-muted" style="margin-bottom: 10px;">Generated at: {datetime.now().strftime('%Y-%m-%d %H:%M')}</p>
-    """
-    
+            h1 { margin-bottom: 10px; text-align: center; color: #333; font-weight: 700; }
+            .header-icon { font-size: 1.5em; margin-right: 10px; }
+        </style>''')
+    f.write(f"""
+</head>
+<body>
+    <div class="container-fluid" style="max-width: 800px; margin: 0 auto;">
+        <h1><span class="header-icon">🏇</span>Keiba AI Predictions</h1>
+        <p class="text-center text-muted" style="margin-bottom: 10px;">Generated at: {datetime.now().strftime('%Y-%m-%d %H:%M')}</p>
+""")
     # Conditionally add warning banner if historical data is not available
-    if not has_historical_data:
-        html_content += """
-            <!-- Warning Banner for Missing Historical Data -->
-            <div class="alert alert-warning" role="alert" style="margin-bottom: 20px;">
-                <strong>⚠️  Note:</strong> Historical race data is not available in the CI/CD environment. 
-                Predictions are using default feature values, which may result in lower accuracy. 
-                For better predictions, historical data should be provided in <code>train/data/raw</code>.
-            </div>
-        """
+    if not history_rows:
+        f.write("""
+        <!-- Warning Banner for Missing Historical Data -->
+        <div class="alert alert-warning" role="alert" style="margin-bottom: 20px;">
+            <strong>⚠️  Note:</strong> Historical race data is not available in the CI/CD environment. 
+            Predictions are using default feature values, which may result in lower accuracy. 
+            For better predictions, historical data should be provided in <code>train/data/raw</code>.
+        </div>
+""")
     else:
-        html_content += f"""
-            <!-- Historical Data Status -->
-            <div class="alert alert-info" role="alert" style="margin-bottom: 20px;">
-                <strong>✓ Info:</strong> Using historical race data ({len(history_loader.loader.df):,} records) for enhanced predictions.
-            </div>
-        """
-    
-    html_content += """
-    """
-    
-    if not grouped_data:
-        html_content += "<div class='alert alert-warning'>No race data found.</div>"
+        f.write(f"""
+        <!-- Historical Data Status -->
+        <div class="alert alert-info" role="alert" style="margin-bottom: 20px;">
+            <strong>✓ Info:</strong> Using historical race data ({history_rows:,} records) for enhanced predictions.
+        </div>
+""")
+
+    if not manifest:
+        f.write("<div class='alert alert-warning'>No race data found.</div>")
     else:
-        # --- Level 1: Date Tabs ---
-        html_content += '<ul class="nav nav-tabs" id="dateTabs" role="tablist">'
-        sorted_dates = sorted(grouped_data.keys())
-        for idx, d in enumerate(sorted_dates):
-            active = "active" if idx == 0 else ""
-            html_content += f"""
-            <li class="nav-item">
-                <a class="nav-link {active}" id="tab-{d}" data-toggle="tab" href="#content-{d}" role="tab">{d}</a>
-            </li>
-            """
-        html_content += '</ul>'
-        
-        # Date Content
-        html_content += '<div class="tab-content" id="dateTabsContent">'
-        
-        for idx, d in enumerate(sorted_dates):
-            active = "show active" if idx == 0 else ""
-            html_content += f'<div class="tab-pane fade {active}" id="content-{d}" role="tabpanel">'
-            
+        dates = [d for d, _ in manifest]
+        # --- Level 1: Date Tabs (開いたら最初の競馬場のシャードを読み込む) ---
+        f.write('<ul class="nav nav-tabs" id="dateTabs" role="tablist">')
+        DATE_TAB.write_rows(f, {'active': html_render.first_only(len(dates), 'active'), 'date': dates,
+                                'shard': [report_shards.shard_name(d, venues[0]) for d, venues in manifest]})
+        f.write('</ul>\n<div class="tab-content" id="dateTabsContent">')
+
+        for idx, (d, venues) in enumerate(manifest):
+            f.write(f'<div class="tab-pane fade {"show active" if idx == 0 else ""}" id="content-{d}" role="tabpanel">')
             # --- Level 2: Venue Tabs ---
-            venues = grouped_data[d]
-            sorted_venues = sorted(venues.keys())
-            
-            html_content += f'<ul class="nav nav-tabs venue-tabs" id="venueTabs-{d}" role="tablist" style="margin-top: 10px;">'
-            for v_idx, v_code in enumerate(sorted_venues):
-                v_active = "active" if v_idx == 0 else ""
-                v_name = venue_names.get(v_code, v_code)
-                html_content += f"""
-                <li class="nav-item">
-                    <a class="nav-link {v_active}" id="tab-{d}-{v_code}" data-toggle="tab" href="#content-{d}-{v_code}" role="tab">{v_name}</a>
-                </li>
-                """
-            html_content += '</ul>'
-            
-            # Venue Content
-            html_content += f'<div class="tab-content" id="venueTabsContent-{d}">'
-            for v_idx, v_code in enumerate(sorted_venues):
-                v_active = "show active" if v_idx == 0 else ""
-                races = sorted(venues[v_code], key=lambda x: x['race_no'])
-                
-                html_content += f'<div class="tab-pane fade {v_active}" id="content-{d}-{v_code}" role="tabpanel">'
-                
-                # --- Level 3: Race Tabs ---
-                html_content += f'<ul class="nav nav-tabs race-tabs" id="raceTabs-{d}-{v_code}" role="tablist" style="margin-top: 10px;">'
-                for r_idx, race in enumerate(races):
-                    r_active = "active" if r_idx == 0 else ""
-                    rid = race['id']
-                    html_content += f"""
-                    <li class="nav-item">
-                        <a class="nav-link {r_active}" id="tab-{rid}" data-toggle="tab" href="#content-{rid}" role="tab">{race['race_no']}R</a>
-                    </li>
-                    """
-                html_content += '</ul>'
-                
-                # Race Content
-                html_content += f'<div class="tab-content" id="raceTabsContent-{d}-{v_code}">'
-                
-                for r_idx, race in enumerate(races):
-                    r_active = "show active" if r_idx == 0 else ""
-                    rid = race['id']
-                    df = race['df']
-                    meta = race['meta']
-                    
-                    html_content += f"""
-                    <div class="tab-pane fade {r_active}" id="content-{rid}" role="tabpanel">
-                        <div class="card">
-                            <div class="card-header">
-                                <span class="race-title-text">{race['title']}</span>
-                                <span class="race-meta">{meta} | ID: {rid}</span>
-                            </div>
-                            <div class="card-body p-0">
-                                <table class="table table-hover table-sm mb-0">
-                                    <thead>
-                                        <tr>
-                                            <th>Mark</th>
-                                            <th>#</th>
-                                            <th>Horse</th>
-                                            <th>Jockey</th>
-                                            <th>Odds</th>
-                                            <th>Win%</th>
-                                            <th>Score (P={default_p})</th>
-                                        </tr>
-                                    </thead>
-                                    <tbody>
-                    """
-                    
-                    for i, (_, row) in enumerate(df.head(12).iterrows()): # Show top 12
-                        symbol = ""
-                        row_class = ""
-                        if i == 0: 
-                            symbol = "🥇" # Gold Medal
-                            row_class = "top-pick-row"
-                        elif i == 1: symbol = "🥈" # Silver
-                        elif i == 2: symbol = "🥉" # Bronze
-                        elif i == 3: symbol = "△"
-                        elif i == 4: symbol = "☆"
-                        
-                        odds = row.get('odds', '---')
-                        win_prob = row.get('win_prob', 0) * 100
-                        score = row.get(f'Score(P={default_p})', 0)
-                        
-                        html_content += f"""
-                                        <tr class="{row_class}">
-                                            <td><span class="symbol">{symbol}</span></td>
-                                            <td>{row.get('umaban', '')}</td>
-                                            <td>{row.get('name', '')}</td>
-                                            <td>{row.get('jockey', '')}</td>
-                                            <td>{odds}</td>
-                                            <td>{win_prob:.1f}%</td>
-                                            <td><strong>{score:.4f}</strong></td>
-                                        </tr>
-                        """
-                        
-                    html_content += """
-                                    </tbody>
-                                </table>
-                            </div>
-                        </div>
-                    </div>
-                    """
-                
-                html_content += '</div>' # End Race Content
-                html_content += '</div>' # End Venue Pane
-            
-            html_content += '</div>' # End Venue Tabs Content
-            html_content += '</div>' # End Date Pane
-            
-        html_content += '</div>' # End Date Tabs Content
+            f.write(f'<ul class="nav nav-tabs venue-tabs" id="venueTabs-{d}" role="tablist" style="margin-top: 10px;">')
+            VENUE_TAB.write_rows(f, {'active': html_render.first_only(len(venues), 'active'), 'date': d, 'venue': venues,
+                                     'shard': [report_shards.shard_name(d, v) for v in venues],
+                                     'name': [venue_names.get(v, v) for v in venues]})
+            f.write(f'</ul>\n<div class="tab-content" id="venueTabsContent-{d}">')
+            # --- Level 3: Races (シャードから描画。single_file ならここに表を書く) ---
+            for v_idx, v_code in enumerate(venues):
+                VENUE_PANE.write(f, active="show active" if v_idx == 0 else "", date=d, venue=v_code)
+                if single_file:
+                    _write_races(f, report_shards.read_shard(output_file, d, v_code), default_p)
+                else:
+                    f.write(f'<div id="shard-{report_shards.shard_name(d, v_code)}" class="text-muted p-3">Loading...</div>')
+                f.write('</div>\n')
+            f.write('</div>\n</div>\n') # End Venue Tabs Content / Date Pane
+        f.write('</div>\n') # End Date Tabs Content
 
-    html_content += """
-        </div>
-        <!-- Bootstrap JS and dependencies -->
-        <script src="https://code.jquery.com/jquery-3.5.1.slim.min.js"></script>
-        <script src="https://cdn.jsdelivr.net/npm/@popperjs/core@2.5.4/dist/umd/popper.min.js"></script>
-        <script src="https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/js/bootstrap.min.js"></script>
-    </body>
-    </html>
+    f.write("""
+    </div>
+    <!-- Bootstrap JS and dependencies -->
+    <script src="https://code.jquery.com/jquery-3.5.1.slim.min.js"></script>
+    <script src="https://cdn.jsdelivr.net/npm/@popperjs/core@2.5.4/dist/umd/popper.min.js"></script>
+    <script src="https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/js/bootstrap.min.js"></script>
+""")
+    if not single_file:
+        f.write(f"<script>var SCORE_POWER = {int(default_p)};</script>\n")
+        report_shards.write_loader(f, output_file, RENDER_JS)
+    f.write("</body>\n</html>\n")
+
+def parse_odds(o):
+    try: return float(o)
+    except: return 0.0
+
+class _ScoredCache:
+    """
+    pipeline.run の cache。race_data の指紋が前回と同じレースは前回の DataFrame を返す。
+    seen_ids は発見した全レース (出馬表を取れなかったレースも含む。prune で前回の採点結果を消さないように)。
+    """
+    def __init__(self, scored, model_key, incremental=True):
+        self.scored = scored
+        self.model_key = model_key
+        self.incremental = incremental
+        self.seen_ids = []
+        self.fetched = 0
+        self.skipped = 0
+
+    def discovered(self, races):
+        self.seen_ids.extend(race['id'] for race in races)
+
+    def lookup(self, race, race_data):
+        self.fetched += 1
+        if not self.incremental:
+            return None
+        df = self.scored.get(race['id'], race_fingerprint.race_fingerprint(race_data, self.model_key))
+        if df is not None:
+            print(f"Unchanged since last run, reusing scores for {race['id']}.")
+            self.skipped += 1
+        return df
+
+    def store(self, race, race_data, df):
+        self.scored.put(race['id'], race_fingerprint.race_fingerprint(race_data, self.model_key), df)
+
+class _ReportSink:
+    """pipeline.run の sink。power ごとの Score 列を足して並べ替え、シャードへ書く"""
+    def __init__(self, shards, power_values, default_p):
+        self.shards = shards
+        self.power_values = power_values
+        self.default_p = default_p
+        self.venue_names = {} # code -> name map for this run
+
+    def add(self, race, df_pred):
+        place_code = race['place']
+        self.venue_names.setdefault(place_code, PLACE_MAP.get(place_code, f"Place {place_code}"))
+        df_pred = df_pred.copy()
+
+        # Calculate scores
+        if 'odds_val' not in df_pred.columns:
+            df_pred['odds_val'] = df_pred['odds'].apply(parse_odds)
+        for p in self.power_values:
+            df_pred[f'Score(P={p})'] = (df_pred['win_prob'] ** p) * df_pred['odds_val']
+
+        # Sort by default_p if present, else max
+        sort_p = self.default_p if self.default_p in self.power_values else self.power_values[-1]
+        df_pred = df_pred.sort_values(f'Score(P={sort_p})', ascending=False)
+
+        # Meta
+        weather = "?"
+        dist = "?"
+        course = "?"
+        if not df_pred.empty and 'weather' in df_pred.columns:
+            weather = df_pred.iloc[0]['weather']
+            dist = df_pred.iloc[0]['distance']
+            course = df_pred.iloc[0]['course_type']
+
+        entry = {
+            'id': race['id'],
+            'title': race['title'],
+            'race_no': race['race_no'],
+            'df': df_pred,
+            'meta': f"{course} {dist}m {weather}"
+        }
+        self.shards.add(race['date'], place_code, _shard_race(entry, self.default_p))
+
+def generate_prediction_report(output_file="predict.html", power_min=None, power_max=None, incremental=True,
+                               single_file=False):
+    """
+    incremental=True なら race_data の指紋が前回の実行と同じレースは再予測せず、前回の採点結果を使う
+    (app/race_fingerprint.py)。single_file=True ならシャードに分けず全レースの表を1つのページに書く
+    (ローカルで file:// のまま開く用)。
     """
+    print("Generating Prediction Report (Tabbed View)...")
+    
+    # Load historical data to check availability
+    history_loader.loader.load()
+    has_historical_data = len(history_loader.loader) > 0
+    print(f"Historical data available: {has_historical_data} ({len(history_loader.loader)} records)")
+    
+    # Defaults
+    # User requested fixed default power 4, but let's keep args support just in case,
+    # but strictly prioritize showing the single power score primarily.
+    default_p = 4
+    p_min = int(power_min) if power_min is not None else default_p
+    p_max = int(power_max) if power_max is not None else p_min
+    power_values = list(range(p_min, p_max + 1))
+    
+    # 1. Determine Target Dates (Today + 6 days)
+    # The user requested to include all races for the week, not just weekends.
+    today = datetime.now()
+    target_dates = []
     
-    with open(output_file, "w", encoding='utf-8') as f:
-        f.write(html_content)
+    for i in range(7):
+        d = today + timedelta(days=i)
+        target_dates.append(d.strftime('%Y%m%d'))
+
+    print(f"Target Dates: {target_dates}")
     
-    print(f"Saved {output_file}")
+    # 前回の実行から変わっていないレースは再予測しない
+    # (モデル・特徴量のコード・履歴の CSV・power が変われば全レース再予測)
+    cache = _ScoredCache(race_fingerprint.ScoredRaces(), prediction_cache.model_fingerprint(context={
+        'history_rows': len(history_loader.loader),
+        'powers': power_values,
+        'state': 'df' # 保存するのは predict_batch の DataFrame
+    }, sources=[os.path.join(os.path.dirname(history_loader.__file__), 'predictor.py'), history_loader.__file__]), incremental)
+    
+    # 2. Search & Predict (app/pipeline.py: 出馬表の並行取得とバッチ予測)
+    # レースは採点した順に 日付×競馬場 のシャード (JSON) へ書き出し、ページ本体にはタブだけを置く
+    with report_shards.ShardWriter(output_file) as shards:
+        sink = _ReportSink(shards, power_values, default_p)
+        stats = pipeline.run(target_dates, [sink], power=p_min, cache=cache)
+    venue_names = sink.venue_names
+    seen_ids, fetched, skipped, scored = cache.seen_ids, cache.fetched, cache.skipped, cache.scored
+
+    # 対象期間のレース一覧に無いものだけ消す (出馬表の取得に失敗したレースの採点結果は残す)
+    pruned = scored.prune(seen_ids)
+    print(f"Incremental run: {skipped}/{fetched} races unchanged and skipped, "
+          f"{fetched - skipped} re-scored, {len(seen_ids) - fetched} not fetched ({pruned} stale entries removed)")
+    race_card_cache.cards.prune()
+    print(race_card_cache.cards.summary())
+    print(stats.summary())
+    
+    # 3. Generate HTML (shell)
+    with profiling.stage('report.render', rows=shards.races()), open(output_file, "w", encoding='utf-8') as f:
+        _write_shell(f, output_file, shards.manifest(), venue_names, len(history_loader.loader), default_p, single_file)
+    
+    if single_file:
+        report_shards.remove(output_file)
+        print(f"Saved {output_file} ({shards.races()} races)")
+    else:
+        print(f"Saved {output_file} ({shards.races()} races in {report_shards.shard_dir(output_file)}/)")
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--power_min", type=int, default=None, help="Min Power")
     parser.add_argument("--power_max", type=int, default=None, help="Max Power")
+    parser.add_argument("--full", action="store_true", help="Re-score every race even if its entries and odds are unchanged")
+    parser.add_argument("--single_file", action="store_true", help="Inline every race table instead of writing JSON shards")
     args = parser.parse_args()
 
     # Ensure output dir
     os.makedirs("app/report", exist_ok=True)
-    generate_prediction_report("predict.html", power_min=args.power_min, power_max=args.power_max)
+    generate_prediction_report("predict.html", power_min=args.power_min, power_max=args.power_max, incremental=not args.full,
+                               single_file=args.single_file)
@@ -34,8 +34,8 @@ def verify_html_generation():
         'course_type': ['Turf', 'Turf', 'Turf']
     })
     
-    # Predictor returns DF directly
-    predictor.predict = MagicMock(return_value=mock_df)
+    # Predictor returns one DF per race (app/pipeline.py predicts in batches)
+    predictor.predict_batch = MagicMock(side_effect=lambda races, power=None: [mock_df.copy() for _ in races])
     
     # Run Generator
     output_file = "predict_test.html"
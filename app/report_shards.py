@@ -0,0 +1,141 @@
+"""
+予測レポートの分割出力。
+
+ページ本体 (シェル) には日付・競馬場のタブだけを置き、レースの表は 日付×競馬場 ごとの JSON (シャード) に
+書き出す。シャードはタブを開いたときにブラウザが fetch して描画する。レースは採点した順にシャードの
+ファイルへ追記するので、レポート全体をメモリに持たない。
+
+    with ShardWriter("predict.html") as shards:
+        shards.add(date, venue, {'id': ..., 'race_no': ..., 'columns': columns(df, [...])})
+    shards.manifest()  # [(date, [venue, ...]), ...]
+
+出力は predict.html と predict_shards/<date>_<venue>.json。シャードは fetch で読むので
+file:// で直接開くのではなく HTTP (GitHub Pages, python -m http.server など) で配信する。
+1ファイルにまとめる場合 (single_file) は、シェルを書くときにシャードを1つずつ読み戻して表を埋め込み、
+シャードは消す。
+"""
+import json
+import os
+import re
+import shutil
+
+def shard_dir(output_file):
+    """output_file (シェル) と同じ場所のシャードのディレクトリ (predict.html -> predict_shards)"""
+    stem = os.path.splitext(output_file)[0]
+    return stem + '_shards'
+
+def shard_name(date, venue):
+    return re.sub(r'[^0-9A-Za-z_-]', '_', f"{date}_{venue}")
+
+def _json_default(value):
+    # numpy のスカラーは Python の値に、それ以外 (日付など) は文字列に
+    return value.item() if hasattr(value, 'item') else str(value)
+
+def columns(df, names, limit=None):
+    """df の列を JSON にできる値のリストの dict にする (欠損は None、無い列は None の列)"""
+    head = df if limit is None else df.iloc[:limit]
+    out = {}
+    for name in names:
+        if name in head.columns:
+            values = head[name].astype(object)
+            out[name] = values.where(values.notna(), None).tolist()
+        else:
+            out[name] = [None] * len(head)
+    return out
+
+def read_shard(output_file, date, venue):
+    """書き出したシャードのレースのリスト"""
+    with open(os.path.join(shard_dir(output_file), shard_name(date, venue) + '.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+def remove(output_file):
+    shutil.rmtree(shard_dir(output_file), ignore_errors=True)
+
+class ShardWriter:
+    """日付×競馬場ごとの JSON 配列ファイルにレースを追記する。close() で配列を閉じる"""
+    def __init__(self, output_file):
+        self.root = shard_dir(output_file)
+        self.files = {}
+        self.counts = {}
+        # 前回の実行のシャードが残らないように作り直す
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+        os.makedirs(self.root)
+
+    def add(self, date, venue, race):
+        key = (str(date), str(venue))
+        f = self.files.get(key)
+        if f is None:
+            f = open(os.path.join(self.root, shard_name(*key) + '.json'), 'w', encoding='utf-8')
+            f.write('[\n')
+            self.files[key] = f
+            self.counts[key] = 0
+        elif self.counts[key]:
+            f.write(',\n')
+        f.write(json.dumps(race, ensure_ascii=False, default=_json_default))
+        self.counts[key] += 1
+
+    def manifest(self):
+        """[(date, [venue, ...]), ...] (どちらも昇順)"""
+        dates = {}
+        for date, venue in self.counts:
+            dates.setdefault(date, []).append(venue)
+        return [(d, sorted(dates[d])) for d in sorted(dates)]
+
+    def races(self):
+        return sum(self.counts.values())
+
+    def close(self):
+        for f in self.files.values():
+            f.write('\n]\n')
+            f.close()
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# タブのクリックでシャードを読み込む (Bootstrap 4/5 共通。描画はページごとの renderShard(pane, races))
+LOADER_JS = """
+function esc(v) {
+    return String(v === null || v === undefined ? '' : v).replace(/[&<>"']/g, function (c) {
+        return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c];
+    });
+}
+function fmt(v, digits, scale) {
+    return (v === null || v === undefined || isNaN(v)) ? '-' : (Number(v) * (scale || 1)).toFixed(digits);
+}
+function loadShard(name) {
+    var pane = document.getElementById('shard-' + name);
+    if (!pane || pane.getAttribute('data-loaded')) return;
+    pane.setAttribute('data-loaded', '1');
+    fetch(SHARD_DIR + '/' + name + '.json').then(function (r) {
+        if (!r.ok) throw new Error(r.status);
+        return r.json();
+    }).then(function (races) {
+        races.sort(function (a, b) { return Number(a.race_no) - Number(b.race_no); });
+        renderShard(pane, races);
+    }).catch(function (err) {
+        pane.removeAttribute('data-loaded');
+        pane.textContent = 'Failed to load ' + name + ': ' + err;
+    });
+}
+document.addEventListener('click', function (e) {
+    var tab = e.target.closest ? e.target.closest('[data-shard]') : null;
+    if (tab) loadShard(tab.getAttribute('data-shard'));
+});
+document.addEventListener('DOMContentLoaded', function () {
+    var first = document.querySelector('[data-shard]');
+    if (first) loadShard(first.getAttribute('data-shard'));
+});
+"""
+
+def write_loader(f, output_file, render_js):
+    """シェルの <script> (シャードのパス・読み込み・ページごとの描画関数) を書く"""
+    f.write('<script>\n')
+    f.write(f"var SHARD_DIR = {json.dumps(os.path.basename(shard_dir(output_file)))};\n")
+    f.write(LOADER_JS)
+    f.write(render_js)
+    f.write('</script>\n')
@@ -1,6 +1,9 @@
 import pandas as pd
 import datetime
 import os
+from train import profiling
+from app import report_shards
+from train import html_render
 
 PLACE_MAP = {
     "01": "札幌 (Sapporo)", "02": "函館 (Hakodate)", "03": "福島 (Fukushima)", "04": "新潟 (Niigata)",
@@ -8,26 +11,105 @@ PLACE_MAP = {
     "09": "阪神 (Hanshin)", "10": "小倉 (Kokura)"
 }
 
-def generate_html_report(predictions_list, output_path="index.html"):
+# レースの表はシャードを読み込んだときにブラウザで組み立てる
+RENDER_JS = """
+var BADGES = ['🥇 ', '🥈 ', '🥉 '];
+function raceCard(race) {
+    var c = race.columns, rows = '';
+    for (var i = 0; i < c.name.length; i++) {
+        rows += '<tr class="' + (i === 0 ? 'table-warning' : '') + '"><td>' + (BADGES[i] || '') + (i + 1) + '</td>' +
+            '<td>' + esc(c.name[i]) + '</td><td>' + esc(c.jockey[i]) + '</td>' +
+            '<td>' + esc(c.odds[i] === null ? '---.-' : c.odds[i]) + '</td><td>' + fmt(c.win_prob[i], 1, 100) + '%</td>' +
+            '<td class="score-high">' + fmt(c.score[i], 4) + '</td></tr>';
+    }
+    return '<div class="card race-card"><div class="card-header bg-dark text-white d-flex justify-content-between align-items-center">' +
+        '<h5 class="mb-0">' + esc(race.title) + '</h5>' +
+        '<span class="badge bg-secondary">' + esc(race.weather) + ' / ' + esc(race.distance) + 'm</span></div>' +
+        '<div class="card-body p-0"><div class="table-responsive"><table class="table table-hover mb-0">' +
+        '<thead class="table-light"><tr><th>#</th><th>Name</th><th>Jockey</th><th>Odds</th><th>Win%</th><th>Score</th></tr></thead>' +
+        '<tbody>' + rows + '</tbody></table></div></div></div>';
+}
+function renderShard(pane, races) {
+    var tabs = '', panes = '';
+    races.forEach(function (race, i) {
+        var rid = esc(race.id);
+        tabs += '<li class="nav-item" role="presentation"><button class="nav-link ' + (i === 0 ? 'active' : '') +
+            '" data-bs-toggle="tab" data-bs-target="#race-' + rid + '" type="button" role="tab">' + esc(race.race_no) + 'R</button></li>';
+        panes += '<div class="tab-pane fade ' + (i === 0 ? 'show active' : '') + '" id="race-' + rid + '" role="tabpanel">' +
+            raceCard(race) + '</div>';
+    });
+    pane.innerHTML = '<ul class="nav nav-tabs mb-3" role="tablist">' + tabs + '</ul><div class="tab-content">' + panes + '</div>';
+}
+"""
+
+def shard_race(item):
+    """predictions_list の1レースをシャードに書く dict にする"""
+    df = item['df']
+    return {
+        'id': f"{item['date']}-{item['place']}-{item['race_no']}",
+        'title': item['title'],
+        'race_no': item['race_no'],
+        'weather': df['weather'].iloc[0] if 'weather' in df.columns and len(df) else 'Unknown',
+        'distance': df['distance'].iloc[0] if 'distance' in df.columns and len(df) else 'Unknown',
+        'columns': report_shards.columns(df, ['name', 'jockey', 'odds', 'win_prob', 'score'])
+    }
+
+# ページ本体のタブと、single_file で埋め込むレースの表 (train/html_render.py のコンパイル済みテンプレート)
+DATE_TAB = html_render.Template("""
+                <li class="nav-item" role="presentation">
+                    <button class="nav-link {active}" id="tab-{date}" data-bs-toggle="tab" data-bs-target="#content-{date}" type="button" role="tab" data-shard="{shard}">{date}</button>
+                </li>""")
+PLACE_TAB = html_render.Template("""
+                    <li class="nav-item" role="presentation">
+                        <button class="nav-link {active}" id="tab-{date}-{place}" data-bs-toggle="pill" data-bs-target="#content-{date}-{place}" type="button" role="tab" data-shard="{shard}">{name}</button>
+                    </li>""")
+PLACE_PANE = html_render.Template('<div class="tab-pane fade {active}" id="content-{date}-{place}" role="tabpanel">')
+RACE_TAB = html_render.Template('<li class="nav-item" role="presentation"><button class="nav-link {active}" data-bs-toggle="tab" '
+                                'data-bs-target="#race-{id}" type="button" role="tab">{race_no}R</button></li>')
+RACE_HEAD = html_render.Template("""
+<div class="tab-pane fade {active}" id="race-{id}" role="tabpanel">
+    <div class="card race-card">
+        <div class="card-header bg-dark text-white d-flex justify-content-between align-items-center">
+            <h5 class="mb-0">{title}</h5>
+            <span class="badge bg-secondary">{weather} / {distance}m</span>
+        </div>
+        <div class="card-body p-0">
+            <div class="table-responsive">
+                <table class="table table-hover mb-0">
+                    <thead class="table-light">
+                        <tr><th>#</th><th>Name</th><th>Jockey</th><th>Odds</th><th>Win%</th><th>Score</th></tr>
+                    </thead>
+                    <tbody>
+""")
+RACE_ROW = html_render.Template('<tr class="{row_class}"><td>{badge}{pos}</td><td>{name}</td><td>{jockey}</td><td>{odds}</td>'
+                                '<td>{win_prob:.1%}</td><td class="score-high">{score:.4f}</td></tr>\n')
+RACE_TAIL = '</tbody></table></div></div></div></div>\n'
+BADGES = ['🥇 ', '🥈 ', '🥉 ']
+
+def write_races(f, races):
+    """1つの競馬場のレース (シャードの列の配列) をタブと表にして f へ直接書く"""
+    races = sorted(races, key=lambda r: int(r['race_no']))
+    f.write('<ul class="nav nav-tabs mb-3" role="tablist">')
+    RACE_TAB.write_rows(f, {'active': html_render.first_only(len(races), 'active'),
+                            'id': [r['id'] for r in races], 'race_no': [r['race_no'] for r in races]})
+    f.write('</ul>\n<div class="tab-content">')
+    for i, race in enumerate(races):
+        c = race['columns']
+        n = len(c['name'])
+        RACE_HEAD.write(f, active="show active" if i == 0 else "", id=race['id'], title=race['title'],
+                        weather=race['weather'], distance=race['distance'])
+        RACE_ROW.write_rows(f, {**c, 'row_class': html_render.first_only(n, 'table-warning'),
+                                'badge': (BADGES + [''] * n)[:n], 'pos': list(range(1, n + 1)),
+                                'odds': ['---.-' if o is None else o for o in c['odds']]}, n)
+        f.write(RACE_TAIL)
+    f.write('</div>\n')
+
+def write_shell(f, output_path, manifest, single_file=False):
     """
-    Generates a Tabbed HTML report from a list of prediction dicts.
-    predictions_list: [ { "date":..., "place":..., "race_no":..., "df":... }, ... ]
+    日付・競馬場のタブと、シャードを読み込むスクリプトだけのページを書く。
+    single_file なら各競馬場のタブにシャードから表を書き込み、スクリプトは付けない。
     """
-    
-    # 1. Structure Data: Date -> Place -> Races
-    data_tree = {}
-    for item in predictions_list:
-        d = item['date']
-        p = item['place']
-        if d not in data_tree: data_tree[d] = {}
-        if p not in data_tree[d]: data_tree[d][p] = []
-        data_tree[d][p].append(item)
-    
-    # Sort keys
-    sorted_dates = sorted(data_tree.keys())
-    
-    html_content = ["""
-<!DOCTYPE html>
+    f.write("""<!DOCTYPE html>
 <html lang="ja">
 <head>
     <meta charset="UTF-8">
@@ -50,150 +132,95 @@ def generate_html_report(predictions_list, output_path="index.html"):
             <h1>🏇 Keiba AI Predictions</h1>
             <p class="text-muted">Generated at: """ + datetime.datetime.now().strftime("%Y-%m-%d %H:%M") + """</p>
         </div>
-"""]
+""")
 
-    if not predictions_list:
-        html_content.append("""
+    if not manifest:
+        f.write("""
         <div class="alert alert-warning" role="alert">
             No races found.
         </div>
-        """)
+""")
     else:
-        # --- Level 1: Date Tabs ---
-        html_content.append('<ul class="nav nav-tabs mb-3" id="dateTabs" role="tablist">')
-        for i, date_str in enumerate(sorted_dates):
-            active = "active" if i == 0 else ""
-            html_content.append(f"""
-                <li class="nav-item" role="presentation">
-                    <button class="nav-link {active}" id="tab-{date_str}" data-bs-toggle="tab" data-bs-target="#content-{date_str}" type="button" role="tab">{date_str}</button>
-                </li>
-            """)
-        html_content.append('</ul>')
-        
-        # --- Level 1 Content ---
-        html_content.append('<div class="tab-content" id="dateTabsContent">')
-        
-        for i, date_str in enumerate(sorted_dates):
-            active = "show active" if i == 0 else ""
-            html_content.append(f'<div class="tab-pane fade {active}" id="content-{date_str}" role="tabpanel">')
-            
-            places = sorted(data_tree[date_str].keys())
-            
+        dates = [d for d, _ in manifest]
+        # --- Level 1: Date Tabs (開いたら最初の競馬場のシャードを読み込む) ---
+        f.write('<ul class="nav nav-tabs mb-3" id="dateTabs" role="tablist">')
+        DATE_TAB.write_rows(f, {'active': html_render.first_only(len(dates), 'active'), 'date': dates,
+                                'shard': [report_shards.shard_name(d, places[0]) for d, places in manifest]})
+        f.write('</ul>\n<div class="tab-content" id="dateTabsContent">')
+
+        for i, (date_str, places) in enumerate(manifest):
+            f.write(f'<div class="tab-pane fade {"show active" if i == 0 else ""}" id="content-{date_str}" role="tabpanel">')
             # --- Level 2: Place Pills ---
-            html_content.append(f'<ul class="nav nav-pills mb-3" id="placeTabs-{date_str}" role="tablist">')
+            f.write(f'<ul class="nav nav-pills mb-3" id="placeTabs-{date_str}" role="tablist">')
+            PLACE_TAB.write_rows(f, {'active': html_render.first_only(len(places), 'active'), 'date': date_str, 'place': places,
+                                     'shard': [report_shards.shard_name(date_str, p) for p in places],
+                                     'name': [PLACE_MAP.get(p, f"Place {p}") for p in places]})
+            f.write(f'</ul>\n<div class="tab-content" id="placeTabsContent-{date_str}">')
+            # --- Level 3: Races (シャードから描画。single_file ならここに表を書く) ---
             for j, p_code in enumerate(places):
-                p_name = PLACE_MAP.get(p_code, f"Place {p_code}")
-                active_p = "active" if j == 0 else ""
-                html_content.append(f"""
-                    <li class="nav-item" role="presentation">
-                        <button class="nav-link {active_p}" id="tab-{date_str}-{p_code}" data-bs-toggle="pill" data-bs-target="#content-{date_str}-{p_code}" type="button" role="tab">{p_name}</button>
-                    </li>
-                """)
-            html_content.append('</ul>')
-            
-            # --- Level 2 Content ---
-            html_content.append(f'<div class="tab-content" id="placeTabsContent-{date_str}">')
-            
-            for j, p_code in enumerate(places):
-                active_p = "show active" if j == 0 else ""
-                html_content.append(f'<div class="tab-pane fade {active_p}" id="content-{date_str}-{p_code}" role="tabpanel">')
-                
-                # Races in this place
-                races = sorted(data_tree[date_str][p_code], key=lambda x: x['race_no'])
-                
-                # --- Level 3: Race Tabs (Nav Tabs/Pills) ---
-                html_content.append(f'<ul class="nav nav-tabs mb-3" id="raceTabs-{date_str}-{p_code}" role="tablist">')
-                for k, item in enumerate(races):
-                    r_no = item['race_no']
-                    active_r = "active" if k == 0 else ""
-                    html_content.append(f"""
-                        <li class="nav-item" role="presentation">
-                            <button class="nav-link {active_r}" id="tab-{date_str}-{p_code}-{r_no}" data-bs-toggle="tab" data-bs-target="#race-{date_str}-{p_code}-{r_no}" type="button" role="tab">{r_no}R</button>
-                        </li>
-                    """)
-                html_content.append('</ul>')
-
-                # --- Level 3 Content (Race Cards) ---
-                html_content.append(f'<div class="tab-content" id="raceTabsContent-{date_str}-{p_code}">')
-
-                for k, item in enumerate(races):
-                    r_no = item['race_no']
-                    df = item['df']
-                    title = item['title']
-                    active_r = "show active" if k == 0 else ""
-                    
-                    # Formatting matching previous style
-                    weather = df['weather'].iloc[0] if 'weather' in df.columns else 'Unknown'
-                    distance = df['distance'].iloc[0] if 'distance' in df.columns else 'Unknown'
-
-                    html_content.append(f"""
-                    <div class="tab-pane fade {active_r}" id="race-{date_str}-{p_code}-{r_no}" role="tabpanel">
-                        <div class="card race-card">
-                            <div class="card-header bg-dark text-white d-flex justify-content-between align-items-center">
-                                <h5 class="mb-0">{title}</h5>
-                                <span class="badge bg-secondary">{weather} / {distance}m</span>
-                            </div>
-                            <div class="card-body p-0">
-                                <div class="table-responsive">
-                                    <table class="table table-hover mb-0">
-                                        <thead class="table-light">
-                                            <tr>
-                                                <th>#</th>
-                                                <th>Name</th>
-                                                <th>Jockey</th>
-                                                <th>Odds</th>
-                                                <th>Win%</th>
-                                                <th>Score</th>
-                                            </tr>
-                                        </thead>
-                                        <tbody>
-                    """)
-                    
-                    for row_idx, (_, row) in enumerate(df.iterrows()):
-                        row_class = ""
-                        badge = ""
-                        if row_idx == 0: 
-                            row_class = "table-warning"
-                            badge = "🥇 "
-                        elif row_idx == 1: badge = "🥈 "
-                        elif row_idx == 2: badge = "🥉 "
-                        
-                        odds = row.get('odds', '---.-')
-                        win_prob = row.get('win_prob', 0) * 100
-                        score = row.get('score', 0)
-                        
-                        html_content.append(f"""
-                                        <tr class="{row_class}">
-                                            <td>{badge}{row_idx+1}</td>
-                                            <td>{row['name']}</td>
-                                            <td>{row['jockey']}</td>
-                                            <td>{odds}</td>
-                                            <td>{win_prob:.1f}%</td>
-                                            <td class="score-high">{score:.4f}</td>
-                                        </tr>
-                        """)
-                    html_content.append("</tbody></table></div></div></div>")
-                    html_content.append("</div>") # End Tab Pane
-                
-                html_content.append('</div>') # End Level 3 Content
-                
-                html_content.append('</div>') # End Level 2 Content (Place Pane)
-            
-            html_content.append('</div>') # End Level 2 Tabs Content
-            html_content.append('</div>') # End Level 1 Content (Date Pane)
-
-        html_content.append('</div>') # End Level 1 Tabs Content
-
-    html_content.append("""
+                PLACE_PANE.write(f, active="show active" if j == 0 else "", date=date_str, place=p_code)
+                if single_file:
+                    write_races(f, report_shards.read_shard(output_path, date_str, p_code))
+                else:
+                    f.write(f'<div id="shard-{report_shards.shard_name(date_str, p_code)}" class="text-muted p-3">Loading...</div>')
+                f.write('</div>\n')
+            f.write('</div>\n</div>\n') # End Level 2 Tabs Content / Level 1 Content (Date Pane)
+        f.write('</div>\n') # End Level 1 Tabs Content
+
+    f.write("""
         <footer class="text-center text-muted mt-5">
             <small>Powered by Keiba AI | LightGBM Ranker</small>
         </footer>
     </div>
-</body>
-</html>
 """)
+    if not single_file:
+        report_shards.write_loader(f, output_path, RENDER_JS)
+    f.write("</body>\n</html>\n")
+
+@profiling.profiled('report.render', rows=None)
+def generate_html_report(predictions_list, output_path="index.html", single_file=False):
+    """
+    Generates a Tabbed HTML report from a list of prediction dicts.
+    predictions_list: [ { "date":..., "place":..., "race_no":..., "df":... }, ... ]
+    ページ本体 (output_path) にはタブだけを置き、レースの表は 日付×競馬場 ごとの JSON シャード
+    (<output_path の拡張子なし>_shards/) に1レースずつ書き出す (app/report_shards.py)。
+    single_file=True ならシャードに分けず全レースの表を1つのページに書く。
+    """
+    with ShardReport(output_path, single_file) as report:
+        for item in predictions_list:
+            report.add_item(item)
+
+class ShardReport:
+    """
+    予測したレースから順にシャードへ書き、close() でページ本体を書く (app/pipeline.py の sink)。
+    add(race, df) の race は pipeline のレースの dict (date, place, race_no, title)。
+    """
+    def __init__(self, output_path="index.html", single_file=False):
+        self.output_path = output_path
+        self.single_file = single_file
+        self.shards = report_shards.ShardWriter(output_path)
+
+    def add_item(self, item):
+        self.shards.add(item['date'], item['place'], shard_race(item))
+
+    def add(self, race, df):
+        self.add_item({'date': race['date'], 'place': race['place'], 'race_no': race['race_no'],
+                       'title': f"{race['date']} {race['title']}", 'df': df})
+
+    def close(self):
+        shards = self.shards
+        shards.close()
+        with open(self.output_path, "w", encoding="utf-8") as f:
+            write_shell(f, self.output_path, shards.manifest(), self.single_file)
+
+        if self.single_file:
+            report_shards.remove(self.output_path)
+            print(f"Report generated: {self.output_path} ({shards.races()} races)")
+        else:
+            print(f"Report generated: {self.output_path} ({shards.races()} races in {report_shards.shard_dir(self.output_path)}/)")
+
+    def __enter__(self):
+        return self
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(html_content))
-    
-    print(f"Report generated: {output_path}")
+    def __exit__(self, *exc):
+        self.close()
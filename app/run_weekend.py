@@ -1,6 +1,6 @@
 import datetime
-from . import scraper
-from . import predictor
+import os
+from . import pipeline
 from . import reporting
 import sys
 
@@ -35,53 +35,12 @@ def get_weekend_dates():
 def main():
     dates = get_weekend_dates()
     print(f"Targeting Weekend: {dates}")
-    
-    all_predictions = []
-    
-    for date_str in dates:
-        print(f"\nSearching races for {date_str}...")
-        try:
-            races = scraper.search_races(date_str)
-            if not races:
-                print(f"No races found for {date_str}.")
-                continue
-                
-            print(f"Found {len(races)} races.")
-            for r in races:
-                title = f"{date_str} {r['title']}"
-                print(f"Predicting: {title}")
-                
-                race_data = scraper.fetch_race_data(r['url'])
-                if race_data:
-                    # Use return_df=True to get DataFrame
-                    df = predictor.predict(race_data, return_df=True)
-                    if isinstance(df, str): # Error message
-                        print(f"Prediction failed: {df}")
-                    else:
-                        # r dict contains: 'id', 'url', 'title', 'race_no'
-                        # id is like 202606010802 -> YYYYPP...
-                        # Extract Place Code
-                        rid = r['id']
-                        p_code = rid[4:6]
-                        
-                        all_predictions.append({
-                            "date": date_str,
-                            "place": p_code,
-                            "race_no": r['race_no'],
-                            "title": title,
-                            "df": df
-                        })
-                        
-        except Exception as e:
-            print(f"Error processing {date_str}: {e}")
-            import traceback
-            traceback.print_exc()
 
-    # Generate Report
-    print(f"\nGenerating Report for {len(all_predictions)} races...")
-    import os
+    # 探索・出馬表の並行取得・バッチ予測・シャードへの書き出し (app/pipeline.py)
     os.makedirs("public", exist_ok=True)
-    reporting.generate_html_report(all_predictions, output_path="public/index.html")
+    with reporting.ShardReport(output_path="public/index.html") as report:
+        stats = pipeline.run(dates, [report])
+    print(stats.summary())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,178 @@
+"""
+発走時刻に合わせたオッズの取り直しと再予測のスケジューラー。
+
+3時間ごとの固定実行ではなく、出馬表の RaceData01 の発走時刻 ("14:20発走") からレースごとに
+発走 REFRESH_OFFSETS 分前 (60, 30, 10, 3 分前) のチェックポイントを作り、発走が近づくほど
+間隔が短くなる取り直しの計画にする。チェックポイントが来たレースだけオッズ API を呼び
+(出馬表は race_cards のキャッシュ)、出走馬・オッズが変わったレースだけ predictor で再予測する。
+
+    python -m app.scheduler --plan            # 今日のチェックポイントを表示するだけ
+    python -m app.scheduler --output latest.json
+
+近いチェックポイント (GRACE 秒以内) はまとめて1回で処理し、再予測は1バッチにする。
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import scraper, predictor, pipeline, race_card_cache, race_fingerprint, server
+
+JST = timezone(timedelta(hours=9))
+REFRESH_OFFSETS = [60, 30, 10, 3] # 発走の何分前に取り直すか
+GRACE = 60 # この秒数以内に来るチェックポイントはまとめて処理する
+ODDS_TTL = 60 # チェックポイントではオッズを必ず取り直す (直前のチェックポイントとの間隔より短く)
+
+def post_timestamp(date_str, post_time):
+    """'20260124', '14:20' (JST) -> UNIX 時刻。発走時刻が無ければ None"""
+    if not post_time:
+        return None
+    hour, minute = post_time.split(':')
+    d = datetime.strptime(date_str, '%Y%m%d')
+    return datetime(d.year, d.month, d.day, int(hour), int(minute), tzinfo=JST).timestamp()
+
+def build_plan(races, offsets=REFRESH_OFFSETS, now=None):
+    """
+    races (date, id, post_at を持つ dict) のチェックポイント [(時刻, 何分前, race)] を時刻順に返す。
+    発走済みのレースと過ぎたチェックポイントは入れないが、発走前で直前のチェックポイントを
+    過ぎている場合 (途中から起動したとき) は、今すぐのチェックポイントを1つ入れる。
+    """
+    now = time.time() if now is None else now
+    plan = []
+    for race in races:
+        post_at = race.get('post_at')
+        if post_at is None or post_at <= now:
+            continue
+        points = [(post_at - m * 60, m) for m in sorted(offsets, reverse=True)]
+        upcoming = [(at, m) for at, m in points if at > now]
+        if len(upcoming) < len(points):
+            upcoming.insert(0, (now, int((post_at - now) // 60)))
+        plan.extend((at, m, race) for at, m in upcoming)
+    plan.sort(key=lambda p: (p[0], p[2]['id']))
+    return plan
+
+def format_plan(plan):
+    lines = [f"Refresh plan: {len(plan)} checkpoints for {len({r['id'] for _, _, r in plan})} races"]
+    for at, m, race in plan:
+        t = datetime.fromtimestamp(at, JST).strftime('%m/%d %H:%M')
+        lines.append(f"  {t}  T-{m:<3} {race['id']} {race['title']} (post {race['post_time']})")
+    return "\n".join(lines)
+
+class JsonSink:
+    """再予測したレースのランキングを1つの JSON ({race_id: {...}}) にまとめて書く"""
+    def __init__(self, path, top=None):
+        self.path = path
+        self.top = top
+        self.races = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.races = json.load(f)
+
+    def add(self, race, df):
+        self.races[race['id']] = {'title': race['title'], 'date': race['date'], 'post_time': race['post_time'],
+                                  'scored_at': datetime.now(JST).isoformat(timespec='seconds'),
+                                  'ranking': server.ranking(df, self.top)}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.races, f, ensure_ascii=False, default=str)
+        os.replace(tmp, self.path)
+
+class Scheduler:
+    """
+    races のチェックポイントを時刻順に処理する。tick(now) は今処理すべきレースのオッズを取り直して
+    変わったレースだけ再予測し、sinks に渡す。run() は次のチェックポイントまで待って tick を繰り返す。
+    """
+    def __init__(self, races, sinks, offsets=REFRESH_OFFSETS, power=None, cards=None, now=None):
+        self.races = races
+        self.sinks = sinks
+        self.power = power
+        self.cards = cards or race_card_cache.RaceCardCache(odds_ttl=ODDS_TTL)
+        self.plan = build_plan(races, offsets, now)
+        self.fingerprints = {} # race_id -> 前回予測したときの race_data の指紋
+        self.stats = {'ticks': 0, 'refreshed': 0, 'rescored': 0, 'unchanged': 0}
+
+    def pending(self):
+        return len(self.plan)
+
+    def next_at(self):
+        return self.plan[0][0] if self.plan else None
+
+    def tick(self, now=None):
+        """now + GRACE までのチェックポイントを処理して、再予測したレースの数を返す"""
+        now = time.time() if now is None else now
+        due = {}
+        while self.plan and self.plan[0][0] <= now + GRACE:
+            _, m, race = self.plan.pop(0)
+            due.setdefault(race['id'], (m, race)) # 同じレースのチェックポイントが重なったら1回だけ
+        if not due:
+            return 0
+        self.stats['ticks'] += 1
+
+        batch = []
+        for m, race in due.values():
+            entries, odds = self.cards.get(race['id'], race['url'], scraper.fetch_entries, scraper.fetch_odds, now=now,
+                                           race_date=race['date'])
+            self.stats['refreshed'] += 1
+            race_data = scraper.merge_odds(entries, odds)
+            fingerprint = race_fingerprint.race_fingerprint(race_data)
+            if not race_data or self.fingerprints.get(race['id']) == fingerprint:
+                self.stats['unchanged'] += 1
+                continue
+            batch.append((race, race_data, fingerprint))
+            print(f"T-{m}: re-scoring {race['id']} ({race['title']})")
+
+        if batch:
+            results = predictor.predict_batch([race_data for _, race_data, _ in batch], power=self.power)
+            for (race, _, fingerprint), df in zip(batch, results):
+                if isinstance(df, str): # Error message
+                    print(f"Prediction failed for {race['id']}: {df}")
+                    continue
+                self.fingerprints[race['id']] = fingerprint
+                self.stats['rescored'] += 1
+                for sink in self.sinks:
+                    sink.add(race, df)
+        print(f"Refreshed odds for {len(due)} races, re-scored {len(batch)} ({self.pending()} checkpoints left)")
+        return len(batch)
+
+    def run(self, clock=time.time, sleep=time.sleep):
+        """チェックポイントが無くなるまで、次のチェックポイントの時刻まで待って tick する"""
+        while self.plan:
+            wait = self.next_at() - clock()
+            if wait > 0:
+                print(f"Next checkpoint in {wait / 60:.1f} min")
+                sleep(wait)
+            self.tick(clock())
+        print(f"Scheduler done: {self.stats}")
+
+def load_races(dates, cards=None, now=None):
+    """dates のレースを探し、出馬表 (キャッシュ) から発走時刻を付ける (オッズ API は呼ばない)"""
+    cards = cards or race_card_cache.RaceCardCache(odds_ttl=ODDS_TTL)
+    races = []
+    for race in pipeline.discover(dates):
+        entries = cards.entries(race['id'], race['url'], scraper.fetch_entries, now=now, race_date=race['date'])
+        post_time = entries[0].get('post_time') if entries else None
+        if post_time is None:
+            print(f"No post time for {race['id']}, skipping.")
+            continue
+        races.append(dict(race, post_time=post_time, post_at=post_timestamp(race['date'], post_time)))
+    return races
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Refresh odds and re-score races on a post-time-aware schedule")
+    parser.add_argument("--date", default=None, help="YYYYMMDD (default: today in JST)")
+    parser.add_argument("--offsets", default=",".join(map(str, REFRESH_OFFSETS)), help="Minutes before post time")
+    parser.add_argument("--plan", action="store_true", help="Print the refresh plan and exit")
+    parser.add_argument("--output", default="scheduled_predictions.json", help="JSON file with the latest rankings")
+    parser.add_argument("--power", type=int, default=None)
+    args = parser.parse_args()
+
+    date = args.date or datetime.now(JST).strftime('%Y%m%d')
+    offsets = [int(m) for m in args.offsets.split(',') if m]
+    races = load_races([date])
+    scheduler = Scheduler(races, [JsonSink(args.output)], offsets=offsets, power=args.power)
+    print(format_plan(scheduler.plan))
+    if not args.plan:
+        scheduler.run()
@@ -1,10 +1,57 @@
-import requests
-from bs4 import BeautifulSoup
+import re
+from train import profiling
+from app import race_card_cache
 
-def fetch_race_data(url):
+# netkeiba へのリクエストの間隔 (app/pipeline.py が並行に取得するときに RateLimiter を入れる。None なら待たない)
+limiter = None
+
+def http_get(url, headers):
+    import requests # 取得するときだけ読み込む (予測サーバー・レポートの import を軽くする)
+    if limiter is not None:
+        limiter.wait()
+    return requests.get(url, headers=headers)
+
+def parse_post_time(text):
+    """RaceData01 の "14:20発走" から "14:20" (無ければ None)"""
+    m = re.search(r'(\d{1,2}):(\d{2})\s*発走', text or '')
+    return f"{int(m.group(1)):02d}:{m.group(2)}" if m else None
+
+def shutuba_url(race_id):
+    """race_id の出馬表のページ"""
+    return f"https://race.netkeiba.com/race/shutuba.html?race_id={race_id}&rf=race_list"
+
+def fetch_race_data(url, use_cache=True, race_date=None):
     """
     Fetches race data from the given netkeiba URL.
     Returns a list of dictionaries containing horse information.
+    use_cache=True なら出馬表は長い TTL で使い回し、オッズだけを API で取り直す (app/race_card_cache.py)。
+    race_date (YYYYMMDD) を渡すと、レース当日は出馬表も短い TTL で取り直す (天候・馬場状態・騎手変更)。
+    """
+    rid_match = re.search(r'race_id=(\d+)', url)
+    if not rid_match:
+        return fetch_entries(url)
+    rid = rid_match.group(1)
+    if use_cache:
+        race_data, odds_map = race_card_cache.cards.get(rid, url, fetch_entries, fetch_odds, race_date=race_date)
+    else:
+        race_data = fetch_entries(url)
+        odds_map = fetch_odds(rid) if race_data else {}
+    return merge_odds(race_data, odds_map)
+
+def merge_odds(race_data, odds_map):
+    """出馬表の各馬にオッズ API の単勝オッズを付けたコピー (API に無い馬は出馬表のオッズのまま)"""
+    merged = [dict(horse) for horse in race_data]
+    if odds_map:
+        print(f"Merged {len(odds_map)} odds records.")
+        for horse in merged:
+            u = race_card_cache.umaban_key(horse.get("umaban"))
+            if u and u in odds_map:
+                horse["odds"] = odds_map[u]
+    return merged
+
+def fetch_entries(url):
+    """
+    出馬表のページを取得して出走馬のリストを返す (オッズはページに載っている値。取れなければ [])。
     """
     print(f"Fetching data from: {url}")
     headers = {
@@ -12,9 +59,11 @@ def fetch_race_data(url):
     }
     
     try:
-        response = requests.get(url, headers=headers)
+        with profiling.stage('http.shutuba'):
+            response = http_get(url, headers)
         response.encoding = response.apparent_encoding  # Handle Japanese encoding
         
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(response.text, "lxml")
         
         # Parse Race Metadata (Shutuba Page)
@@ -22,20 +71,21 @@ def fetch_race_data(url):
             "course_type": "unknown",
             "distance": 0,
             "weather": "cloudy", # Default
-            "condition": "good"  # Default
+            "condition": "good", # Default
+            "post_time": None    # 発走時刻 "HH:MM" (app/scheduler.py)
         }
         
         try:
             data01 = soup.select_one("div.RaceData01")
             if data01:
                 text = data01.get_text(strip=True) # e.g. "14:20発走 / 芝1800m (右 C)"
+                metadata["post_time"] = parse_post_time(text)
                 
                 # Course / Dist
                 if "芝" in text: metadata["course_type"] = "turb"
                 elif "ダ" in text: metadata["course_type"] = "dirt"
                 elif "障" in text: metadata["course_type"] = "steeple"
                 
-                import re
                 dist_match = re.search(r'\d{4}', text) # e.g. 1800
                 if dist_match:
                     metadata["distance"] = int(dist_match.group())
@@ -102,31 +152,10 @@ def fetch_race_data(url):
                 race_data.append(horse)
                 
         print(f"Parsed {len(race_data)} horses.")
-        
-        # --- Fetch Real-time Odds via API ---
-        # Extract race_id from URL
-        import re
-        rid_match = re.search(r'race_id=(\d+)', url)
-        if rid_match:
-            rid = rid_match.group(1)
-            odds_map = fetch_odds(rid)
-            if odds_map:
-                print(f"Merged {len(odds_map)} odds records.")
-                for horse in race_data:
-                    u = horse.get("umaban")
-                    if u:
-                        u = u.strip()
-                        # API uses zero-padded strings (e.g. "01")
-                        if len(u) == 1 and u.isdigit():
-                            u = u.zfill(2)
-                    
-                    if u and u in odds_map:
-                        horse["odds"] = odds_map[u]
-        
         return race_data
 
     except Exception as e:
-        print(f"Error in fetch_race_data: {e}")
+        print(f"Error in fetch_entries: {e}")
         return []
 
 def fetch_odds(race_id):
@@ -143,7 +172,8 @@ def fetch_odds(race_id):
     }
     
     try:
-        res = requests.get(api_url, headers=headers)
+        with profiling.stage('http.odds'):
+            res = http_get(api_url, headers)
         data = res.json()
         
         # 'middle' status also contains valid odds (interim)
@@ -189,10 +219,12 @@ def search_races(date_str, place_code=None, race_no=None):
     }
     
     try:
-        response = requests.get(url, headers=headers)
+        with profiling.stage('http.race_list'):
+            response = http_get(url, headers)
         # race_list_sub is UTF-8, unlike main race pages
         response.encoding = 'utf-8' 
              
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(response.text, "lxml")
         
         found_races = []
@@ -242,8 +274,7 @@ def search_races(date_str, place_code=None, race_no=None):
                         continue
                         
                     # Construct full URL
-                    # Usually "https://race.netkeiba.com/race/shutuba.html?race_id={rid}"
-                    full_url = f"https://race.netkeiba.com/race/shutuba.html?race_id={rid}&rf=race_list"
+                    full_url = shutuba_url(rid)
                     
                     # Get title/metadata from text if available
                     title = a.get_text(strip=True)
@@ -0,0 +1,189 @@
+"""
+常駐の予測サーバー (ローカルの HTTP または Unix ソケット)。
+
+CLI の1回の実行ごとに払っていた pandas / lightgbm の import、encoders.pkl の unpickle、
+HistoryLoader.load() による CSV の読み込みを起動時に1回だけ行い、モデル・encoders・履歴
+(mmap したスナップショット) をメモリに置いたままリクエストに答える。
+
+    python -m app.server --port 8765
+    python -m app.server --socket /tmp/keiba.sock
+    curl -s localhost:8765/predict -d '{"race_ids": ["202606010811"]}'
+
+エンドポイント (JSON)
+    POST /predict  {"race_ids": [...]} (出馬表・オッズを取得して予測) または {"races": [race_data, ...]}
+                   任意で "power" (スコアの指数)、"top" (返す頭数)
+    POST /reload   モデル・encoders を読み直す ({"history": true} なら履歴の CSV も)。
+                   モデルのファイルが更新されていれば /predict でも自動で読み直す
+    GET  /health   読み込み済みのモデル・履歴の件数・起動からの秒数
+    GET  /metrics  エンドポイントごとの件数・スループット・レイテンシ (p50/p95)
+"""
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import scraper, predictor, history_loader, pipeline, report_shards
+from train import settings
+
+PORT = 8765
+RANKING_COLUMNS = ['umaban', 'name', 'jockey', 'odds', 'win_prob', 'score', 'kelly']
+
+def _json_default(value):
+    return value.item() if hasattr(value, 'item') else str(value)
+
+def ranking(df, top=None):
+    """predict_batch のレースの DataFrame を [{rank, umaban, name, ...}] にする (スコア順)"""
+    cols = report_shards.columns(df, RANKING_COLUMNS, limit=top)
+    return [dict(zip(RANKING_COLUMNS, values), rank=i + 1) for i, values in enumerate(zip(*cols.values()))]
+
+class PredictionService:
+    """モデル・encoders・履歴を読み込んだまま予測する (HTTP を通さずにも使える)"""
+    def __init__(self, power=None):
+        self.power = power
+        self.lock = threading.Lock() # 予測と読み直しは1つずつ
+        self.stats = pipeline.PipelineStats()
+        self.started = time.time()
+
+    def warm(self):
+        """履歴とモデルを読み込んでおく (モデルが無ければ最初の /predict でエラーを返す)"""
+        with self.lock:
+            history_loader.loader.load()
+            try:
+                predictor.load_artifacts()
+            except OSError as e:
+                print(f"⚠️  Model not loaded: {e}")
+
+    def predict(self, payload):
+        """payload は /predict の JSON。{'results': [{'race_id', 'ranking'} または {'race_id', 'error'}]} を返す"""
+        power = payload.get('power', self.power)
+        top = payload.get('top')
+        if payload.get('race_ids') is not None:
+            race_ids = [str(r) for r in payload['race_ids']]
+            with self.stats.stage('fetch') as s:
+                races = [scraper.fetch_race_data(scraper.shutuba_url(rid)) for rid in race_ids]
+                s['items'] = len(races)
+        elif payload.get('races') is not None:
+            races = payload['races']
+            race_ids = [str(r[0].get('race_id', i)) if r else str(i) for i, r in enumerate(races)]
+        else:
+            raise ValueError("payload needs 'race_ids' or 'races'")
+
+        with self.stats.stage('predict') as s, self.lock:
+            s['items'] = len(races)
+            dfs = predictor.predict_batch(races, power=power)
+        results = []
+        for race_id, df in zip(race_ids, dfs):
+            if isinstance(df, str): # Error message
+                results.append({'race_id': race_id, 'error': df.splitlines()[0]})
+            else:
+                results.append({'race_id': race_id, 'ranking': ranking(df, top)})
+        return {'results': results}
+
+    def reload(self, history=False):
+        """モデル・encoders (と history=True なら履歴) を読み直す"""
+        with self.lock:
+            predictor.load_artifacts(reload=True)
+            if history:
+                history_loader.loader.reload()
+        return self.health()
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'model': predictor.artifacts_info(),
+            'history_rows': len(history_loader.loader),
+            'uptime_s': time.time() - self.started
+        }
+
+    def metrics(self):
+        return self.stats.table()
+
+class Handler(BaseHTTPRequestHandler):
+    service = None # make_server で設定する
+
+    def _send(self, code, body, elapsed):
+        data = json.dumps(body, ensure_ascii=False, default=_json_default).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-Elapsed-Ms', f"{elapsed * 1000:.1f}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _payload(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+    def _handle(self, routes):
+        t0 = time.perf_counter()
+        path = self.path.split('?')[0]
+        route = routes.get(path)
+        try:
+            if route is None:
+                code, body = 404, {'error': f"not found: {path}"}
+            else:
+                code, body = 200, route()
+        except ValueError as e: # 不正な JSON・payload
+            code, body = 400, {'error': str(e)}
+        except Exception as e:
+            code, body = 500, {'error': f"{type(e).__name__}: {e}"}
+        elapsed = time.perf_counter() - t0
+        if path == '/predict' and code == 200:
+            body['elapsed_ms'] = elapsed * 1000
+        self._send(code, body, elapsed)
+        self.service.stats.record(f"{self.command} {path}", elapsed)
+        print(f"{self.command} {path} {code} {elapsed * 1000:.1f}ms")
+
+    def do_GET(self):
+        self._handle({'/health': self.service.health, '/metrics': self.service.metrics})
+
+    def do_POST(self):
+        self._handle({
+            '/predict': lambda: self.service.predict(self._payload()),
+            '/reload': lambda: self.service.reload(history=bool(self._payload().get('history')))
+        })
+
+    def log_message(self, format, *args):
+        pass # _handle で1行ずつ出す
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def make_server(service, host='127.0.0.1', port=PORT, socket_path=None):
+    """service に答えるサーバー (socket_path を渡すと Unix ソケット)。serve_forever() は呼び出し側"""
+    handler = type('BoundHandler', (Handler,), {'service': service})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return UnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+def serve(host='127.0.0.1', port=PORT, socket_path=None, power=None):
+    service = PredictionService(power)
+    t0 = time.perf_counter()
+    service.warm()
+    print(f"Warm-up done in {time.perf_counter() - t0:.1f}s (model: {settings.MODEL_PATH})")
+    server = make_server(service, host, port, socket_path)
+    print(f"Serving predictions on {socket_path or f'http://{host}:{port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Resident prediction server (warm model and history)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--socket", default=None, help="Listen on a Unix socket instead of TCP")
+    parser.add_argument("--power", type=int, default=None, help="Score exponent (default: settings.POWER_EXPONENT)")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.socket, args.power)
@@ -0,0 +1,111 @@
+"""
+train.backtest (ベクトル化バックテスト) のテスト
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import os
+import sys
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestBacktest:
+    """従来のレースごとのループと同じ成績になること"""
+
+    def _assert_same(self, df, min_score):
+        from train import backtest
+
+        fast = backtest.backtest(df, min_score=min_score)
+        for bt in backtest.BETTING_TYPES:
+            slow = backtest.simulate_loop(df, bt, min_score)
+            for key, value in slow.items():
+                if key == 'betting_type':
+                    assert fast[bt][key] == value
+                else:
+                    assert fast[bt][key] == pytest.approx(value), (bt, key)
+
+    def test_matches_loop_on_synthetic_data(self):
+        from train import backtest
+
+        df = backtest.synthetic_races(years=1, races_per_year=300, seed=1)
+        for min_score in [0.0, 0.4, 2.0]:
+            self._assert_same(df, min_score)
+
+    def test_edge_cases(self):
+        """同点スコア・少頭数・1着不在・スコア欠損・race_id 欠損"""
+        df = pd.DataFrame({
+            'race_id': ['A', 'A', 'A', 'B', 'B', 'C', 'C', 'C', 'D', 'E', 'E', 'E', None],
+            'rank':    [2, 1, 3, 1, 2, 2, 3, 4, 1, 3, 1, 2, 1],
+            'odds':    [3.0, 5.0, 9.0, 2.0, 4.0, 1.5, 3.0, 8.0, 6.0, 2.0, 7.0, 3.0, 2.0],
+            'score':   [1.0, 1.0, 0.5, 0.8, np.nan, 2.0, 1.0, 0.1, 0.6, np.nan, 0.9, 0.9, 5.0]
+        })
+        self._assert_same(df, 0.0)
+        self._assert_same(df, 0.7)
+
+    def test_metrics(self):
+        from train import backtest
+
+        df = pd.DataFrame({
+            'race_id': ['A', 'A', 'A', 'B', 'B', 'B'],
+            'rank':    [1, 2, 3, 3, 1, 2],
+            'odds':    [4.0, 2.0, 9.0, 2.0, 5.0, 3.0],
+            'score':   [0.9, 0.5, 0.1, 0.9, 0.5, 0.1]
+        })
+        result = backtest.backtest(df)
+        assert result['win']['bet_races'] == 2
+        assert result['win']['hits'] == 1
+        assert result['win']['total_return'] == 400
+        assert result['win']['roi'] == 200
+        assert result['place']['hits'] == 2
+        assert result['trifecta']['hits'] == 1
+        assert result['box_trifecta']['total_bet'] == 1200
+        assert result['box_trifecta']['hits'] == 2
+        assert result['uma_ren']['hits'] == 1
+
+    def test_unknown_betting_type(self):
+        from train import backtest
+
+        df = backtest.synthetic_races(years=1, races_per_year=5)
+        with pytest.raises(ValueError):
+            backtest.backtest(df, ['exacta'])
+
+
+class TestThresholdSweep:
+    """閾値 × 競馬場ごとに上位1頭を取り直す従来の集計と一致すること"""
+
+    def _naive(self, df, thresholds):
+        rows = []
+        for t in thresholds:
+            for p_code in sorted(df['place_code'].unique()):
+                place_df = df[df['place_code'] == p_code]
+                top1 = place_df.sort_values(['race_id', 'score'], ascending=[True, False]).groupby('race_id').head(1)
+                bet_df = top1[top1['score'] >= t]
+                hits_df = bet_df[bet_df['rank'] == 1]
+                rows.append({
+                    'group': p_code, 'min_score': t, 'bets': len(bet_df), 'hits': len(hits_df),
+                    'hits_top3': int((bet_df['rank'] <= 3).sum()),
+                    'return': (hits_df['odds'] * 100).sum(), 'cost': len(bet_df) * 100
+                })
+        return pd.DataFrame(rows)
+
+    def test_matches_naive(self):
+        from train import backtest
+
+        df = backtest.synthetic_races(years=1, races_per_year=400, seed=2)
+        # race_id の 5-6 桁目を競馬場コードとして振る
+        df['race_id'] = df['race_id'].str[:4] + (df['race_id'].str[-3:].astype(int) % 5 + 1).map('{:02d}'.format) + df['race_id'].str[6:]
+        df['place_code'] = df['race_id'].str[4:6]
+        df.loc[df.index[::37], 'score'] = np.nan
+        thresholds = np.round(np.arange(0, 1.005, 0.01), 6)
+
+        top = backtest.top_k(df, k=1)
+        fast = backtest.threshold_sweep(top, thresholds, groups=pd.Series(top['race_id']).str[4:6])
+        fast = fast.sort_values(['min_score', 'group'], kind='mergesort').reset_index(drop=True)
+        slow = self._naive(df, thresholds)
+
+        for col in ['bets', 'hits', 'hits_top3', 'cost']:
+            np.testing.assert_array_equal(fast[col].to_numpy(), slow[col].to_numpy())
+        np.testing.assert_allclose(fast['return'].to_numpy(), slow['return'].to_numpy())
+        assert list(fast['group']) == list(slow['group'])
@@ -0,0 +1,104 @@
+"""
+train.bootstrap (閾値スイープのブートストラップ信頼区間) のテスト
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import os
+import sys
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _make_top(n_races=150, seed=0):
+    from train import backtest
+
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(5, 15, n_races)
+    race_ids = np.repeat([2025050101 * 100 + i for i in range(n_races)], sizes)
+    odds = np.round(rng.lognormal(2.0, 0.8, len(race_ids)), 1)
+    df = pd.DataFrame({
+        'race_id': race_ids,
+        'rank': np.concatenate([rng.permutation(s) + 1 for s in sizes]).astype(float),
+        'odds': odds,
+        'score': rng.random(len(race_ids)) * odds / 10
+    })
+    return backtest.top_k(df)
+
+
+class TestBootstrap:
+    """ブートストラップ区間の計算"""
+
+    def test_resample_counts(self):
+        from train import bootstrap
+
+        w = bootstrap.resample_counts(np.random.default_rng(0), 7, 50)
+        assert w.shape == (50, 7)
+        assert (w.sum(axis=1) == 7).all()
+
+    def test_matches_loop(self):
+        """同じインデックス行列でリサンプルごとに集計した結果と一致する"""
+        from train import backtest, bootstrap
+
+        top = _make_top()
+        thresholds = [0.0, 0.5, 1.0, 2.0]
+        n_boot = 200
+        ci = bootstrap.sweep_intervals(top, thresholds, n_boot=n_boot, seed=3)
+
+        _, _, score, out = backtest.sweep_order(top)
+        rng = np.random.default_rng(3)
+        idx = rng.integers(0, len(score), size=(n_boot, len(score)))
+        roi = np.full((n_boot, len(thresholds)), np.nan)
+        hit_rate = np.full((n_boot, len(thresholds)), np.nan)
+        for b in range(n_boot):
+            s = score[idx[b]]
+            for j, t in enumerate(thresholds):
+                sel = idx[b][s >= t]
+                if len(sel):
+                    roi[b, j] = out['return'][sel].sum() / out['cost'][sel].sum() * 100
+                    hit_rate[b, j] = out['hit'][sel].mean() * 100
+        np.testing.assert_allclose(ci['roi_lo'], np.nanquantile(roi, 0.025, axis=0))
+        np.testing.assert_allclose(ci['roi_hi'], np.nanquantile(roi, 0.975, axis=0))
+        np.testing.assert_allclose(ci['hit_rate_lo'], np.nanquantile(hit_rate, 0.025, axis=0))
+        np.testing.assert_allclose(ci['hit_rate_hi'], np.nanquantile(hit_rate, 0.975, axis=0))
+
+    def test_no_bets(self):
+        """賭けの無いリサンプルは区間に含めない (全リサンプルで賭けが無ければ NaN)"""
+        from train import backtest, bootstrap
+
+        top = _make_top()
+        _, _, score, out = backtest.sweep_order(top)
+        # 最上位のレースだけに賭ける閾値: 約 37% のリサンプルは賭けが無い
+        best = score[-1]
+        ci = bootstrap.sweep_intervals(top, [best, best + 1], n_boot=200)
+        roi = out['return'][-1] / out['cost'][-1] * 100
+        np.testing.assert_allclose(ci.loc[0, ['roi_lo', 'roi_hi']].astype(float), [roi, roi])
+        assert ci.loc[1, bootstrap.CI_COLUMNS].isna().all()
+
+    def test_chunks(self, monkeypatch):
+        """重み行列を分割して作っても同じ区間になる"""
+        from train import bootstrap
+
+        top = _make_top()
+        full = bootstrap.sweep_intervals(top, [0.0, 1.0], n_boot=100)
+        monkeypatch.setattr(bootstrap, 'CHUNK_ELEMENTS', 1000)
+        chunked = bootstrap.sweep_intervals(top, [0.0, 1.0], n_boot=100)
+        pd.testing.assert_frame_equal(full, chunked)
+
+    def test_grid_columns(self):
+        """グリッドの各セルに信頼区間が付き、点推定を含む"""
+        from train import grid, bootstrap
+
+        top = _make_top()
+        arrays = {
+            'race_id': top['race_id'],
+            'win_prob': np.nan_to_num(top['score'][:, 0]),
+            'rank': top['rank'][:, 0],
+            'odds': top['odds'][:, 0]
+        }
+        res = grid.evaluate_cell(arrays, 1, 0, 99, ['win'], [0.0, 0.5], n_boot=300)
+        assert all(c in res.columns for c in bootstrap.CI_COLUMNS)
+        ok = res['bets'] > 0
+        assert (res.loc[ok, 'roi_lo'] <= res.loc[ok, 'roi'] + 1e-9).all()
+        assert (res.loc[ok, 'roi'] <= res.loc[ok, 'roi_hi'] + 1e-9).all()
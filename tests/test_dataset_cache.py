@@ -0,0 +1,74 @@
+"""
+train.dataset_cache (LightGBM バイナリ Dataset キャッシュ) のテスト
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import os
+import sys
+import tempfile
+import shutil
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _make_frame(n_races=20, field=8, seed=0):
+    rng = np.random.default_rng(seed)
+    n = n_races * field
+    return pd.DataFrame({
+        'race_id': np.repeat([f"2024050101{i:02d}" for i in range(n_races)], field),
+        'f1': rng.random(n),
+        'f2': rng.integers(0, 10, n),
+        'rank': np.tile(np.arange(1, field + 1), n_races)
+    })
+
+
+class TestDatasetCache:
+    """build_datasets のキャッシュ動作テスト"""
+
+    def setup_method(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_key_changes_with_data_and_params(self):
+        """特徴量・パラメータが変わるとキーが変わること"""
+        from train.dataset_cache import dataset_key, DATASET_PARAMS
+
+        df = _make_frame()
+        base = dataset_key([df], ['f1', 'f2'], 'rank')
+        assert base == dataset_key([df.copy()], ['f1', 'f2'], 'rank')
+
+        changed = df.copy()
+        changed.loc[0, 'f1'] += 1.0
+        assert base != dataset_key([changed], ['f1', 'f2'], 'rank')
+        assert base != dataset_key([df], ['f1'], 'rank')
+        assert base != dataset_key([df], ['f1', 'f2'], 'rank', {**DATASET_PARAMS, 'max_bin': 63})
+
+    def test_second_build_reuses_binary_files(self, capsys):
+        """2回目の構築でバイナリファイルが再利用され、同じ内容になること"""
+        from train.dataset_cache import build_datasets
+
+        train = _make_frame(seed=1)
+        valid = _make_frame(n_races=5, seed=2)
+        groups_t = train.groupby('race_id').size().to_list()
+        groups_v = valid.groupby('race_id').size().to_list()
+        features = ['f1', 'f2']
+
+        d1, v1 = build_datasets(train, valid, features, 'rank', groups_t, groups_v, cache_dir=self.tmp_dir)
+        keys = os.listdir(self.tmp_dir)
+        assert len(keys) == 1
+        assert os.path.exists(os.path.join(self.tmp_dir, keys[0], 'train.bin'))
+
+        capsys.readouterr()
+        d2, v2 = build_datasets(train, valid, features, 'rank', groups_t, groups_v, cache_dir=self.tmp_dir)
+        assert "Loading cached binary Datasets" in capsys.readouterr().out, "キャッシュ済みファイルから読み込まれていません"
+        assert d2.num_data() == len(train)
+        assert v2.num_data() == len(valid)
+        np.testing.assert_array_equal(d2.get_label(), d1.get_label())
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,74 @@
+"""
+train.evaluate のテスト (小さな合成データで学習 → 評価を通しで実行)
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import os
+import sys
+import tempfile
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _write_year(raw_dir, year, rng, n_days=8, races_per_day=4, size=8, n_horses=60):
+    rows = []
+    for d in range(n_days):
+        month, day = 1 + d // 4, 1 + (d % 4) * 7
+        for r in range(races_per_day):
+            race_id = f"{year}05{month:02d}{day:02d}{r + 1:02d}"
+            horses = rng.choice(n_horses, size, replace=False)
+            ranks = rng.permutation(size) + 1
+            for i, (h, rank) in enumerate(zip(horses, ranks)):
+                rows.append({
+                    'race_id': race_id, 'course_type': 'turf' if r % 2 else 'dirt', 'distance': 1200 + 400 * (r % 3),
+                    'weather': 'sunny', 'condition': 'good', 'year': year, 'month': month, 'day': day,
+                    'rank': rank, 'waku': i // 2 + 1, 'umaban': i + 1, 'horse_name': f"H{h}", 'horse_id': f"2019{h:06d}",
+                    'jockey': f"J{h % 7}", 'jockey_id': f"0{h % 7:04d}", 'trainer': f"T{h % 5}", 'trainer_id': f"0{h % 5:04d}",
+                    'horse_weight': 480, 'weight_diff': 0, 'time': f"1:{30 + rank}.0", 'passing': f"{rank}-{rank}",
+                    'last_3f': 34 + rank / 10, 'odds': float(rank * 2), 'popularity': rank
+                })
+    pd.DataFrame(rows).to_csv(os.path.join(raw_dir, f'results_{year}.csv'), index=False)
+
+
+@pytest.fixture
+def trained(monkeypatch):
+    """合成データ (2024 年で学習、2025 年で評価) と horse_profiles.csv を置いて学習したモデル"""
+    pytest.importorskip('lightgbm')
+    from train import settings
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_dir = os.path.join(tmp, 'raw')
+        model_dir = os.path.join(tmp, 'model')
+        os.makedirs(raw_dir)
+        monkeypatch.setattr(settings, 'RAW_DATA_DIR', raw_dir)
+        monkeypatch.setattr(settings, 'CACHE_DIR', os.path.join(tmp, 'cache'))
+        monkeypatch.setattr(settings, 'MODEL_DIR', model_dir)
+        monkeypatch.setattr(settings, 'MODEL_PATH', os.path.join(model_dir, 'model.pkl'))
+        rng = np.random.default_rng(0)
+        for year in (2024, 2025):
+            _write_year(raw_dir, year, rng)
+        pd.DataFrame({'horse_id': [f"2019{h:06d}" for h in range(60)],
+                      'sire_id': [f"s{h % 4}" for h in range(60)],
+                      'damsire_id': [f"d{h % 3}" for h in range(60)]}).to_csv(
+            os.path.join(raw_dir, 'horse_profiles.csv'), index=False)
+
+        from train import train
+        train.train_model(2024, 2024)
+        yield tmp
+
+
+class TestEvaluate:
+    """学習時に使った血統 (sire_id, damsire_id) を評価でも horse_profiles.csv から付ける"""
+
+    def test_end_to_end(self, trained):
+        import joblib
+        from train import evaluate, settings
+
+        features = joblib.load(settings.MODEL_PATH).feature_name()
+        assert 'sire_id' in features and 'damsire_id' in features
+
+        metrics = evaluate.evaluate(2025, 2025, use_cache=False)
+        assert metrics['total_races'] == 32
+        assert 0 <= metrics['hit_rate'] <= 1
@@ -0,0 +1,38 @@
+"""
+train.feature_store のキャッシュキーのテスト
+"""
+import pytest
+import os
+import sys
+import tempfile
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestStoreKey:
+    """キーは生データの内容と特徴量のコードで決まり、更新時刻には依存しない"""
+
+    def test_content_not_mtime(self, monkeypatch):
+        from train import feature_store, settings
+
+        with tempfile.TemporaryDirectory() as tmp:
+            monkeypatch.setattr(settings, 'RAW_DATA_DIR', tmp)
+            path = os.path.join(tmp, 'results_2025.csv')
+            with open(path, 'w') as f:
+                f.write("race_id,rank\n202505010101,1\n")
+            key = feature_store.store_key(2025, 2025)
+
+            os.utime(path, (1e9, 1e9)) # checkout で更新時刻だけ変わる
+            assert feature_store.store_key(2025, 2025) == key
+
+            with open(path, 'w') as f:
+                f.write("race_id,rank\n202505010101,2\n")
+            os.utime(path, (1e9, 1e9))
+            assert feature_store.store_key(2025, 2025) != key
+
+    def test_feature_sources(self):
+        from train import feature_store
+
+        names = [os.path.basename(p) for p in feature_store.FEATURE_SOURCES]
+        assert names == ['preprocess.py', 'window_features.py', 'asof_stats.py']
@@ -0,0 +1,130 @@
+"""
+train.grid (共有メモリ + プロセスプールの戦略グリッド) のテスト
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import itertools
+import os
+import sys
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _make_predictions(n_races=300, seed=0):
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(8, 17, n_races)
+    # YYYY PP KK DD RR
+    race_ids = [f"2025{rng.integers(1, 11):02d}0101{i % 12 + 1:02d}" for i in range(n_races)]
+    race_ids = [rid[:8] + f"{i // 12:02d}" + rid[10:] for i, rid in enumerate(race_ids)]
+    rows = np.repeat(race_ids, sizes)
+    return pd.DataFrame({
+        'race_id': rows,
+        'win_prob': rng.random(len(rows)),
+        'rank': np.concatenate([rng.permutation(s) + 1 for s in sizes]).astype(float),
+        'odds': np.round(rng.lognormal(2.5, 1.0, len(rows)), 1),
+        'umaban': np.concatenate([np.arange(s) + 1 for s in sizes])
+    })
+
+
+def _make_payouts(df, seed=0):
+    """着順から作った払戻テーブル (単勝・複勝・馬連・ワイド)"""
+    from train import payouts
+
+    rng = np.random.default_rng(seed)
+    rows = []
+    for rid, g in df.sort_values('rank').groupby('race_id'):
+        u = g['umaban'].tolist()[:3]
+        hits = [('win', u[:1]), ('uma_ren', u[:2])] + [('place', [x]) for x in u]
+        hits += [('wide', c) for c in itertools.combinations(u, 2)]
+        for bet_type, nums in hits:
+            rows.append({'race_id': rid, 'bet_type': bet_type, 'combination': payouts.combination_str(nums, bet_type),
+                         'payout': int(rng.integers(110, 5000)), 'popularity': 1})
+    return pd.DataFrame(rows)
+
+
+class TestSharedArrays:
+    """共有メモリ経由で同じ配列が見えること"""
+
+    def test_attach(self):
+        from train import grid
+
+        arrays = grid.to_arrays(_make_predictions(20))
+        with grid.SharedArrays(arrays) as shared:
+            attached, blocks = grid.attach(shared.spec())
+            for name, values in arrays.items():
+                np.testing.assert_array_equal(attached[name], values)
+            del attached
+            for shm in blocks:
+                shm.close()
+
+
+class TestGrid:
+    """グリッドの各セルが backtest の集計と一致し、並列でも同じ結果になること"""
+
+    def test_cell_matches_sweep(self):
+        from train import grid, backtest, payouts, payout_backtest
+
+        df = _make_predictions()
+        index = payouts.PayoutIndex(_make_payouts(df))
+        thresholds = np.round(np.arange(0, 1.05, 0.1), 6)
+        cell = grid.evaluate_cell(grid.to_arrays(df), 3, 9, 12, ['win', 'wide'], thresholds, payout_index=index)
+
+        sub = df[df['race_id'].str[-2:].astype(int) >= 9].copy()
+        sub['score'] = sub['win_prob'] ** 3 * sub['odds']
+        top = backtest.top_k(sub)
+        for bt in ['win', 'wide']:
+            expected = backtest.threshold_sweep(top, thresholds, groups=pd.Series(top['race_id']).str[4:6], betting_type=bt,
+                                                payout_index=index)
+            got = cell[(cell['betting_type'] == bt) & (cell['place_code'] != 'all')]
+            got = got.sort_values(['place_code', 'min_score'], kind='mergesort')
+            np.testing.assert_array_equal(got['bets'].to_numpy(), expected['bets'].to_numpy())
+            np.testing.assert_array_equal(got['hits'].to_numpy(), expected['hits'].to_numpy())
+            np.testing.assert_allclose(got['return'].to_numpy(), expected['return'].to_numpy())
+
+            # 'all' は競馬場別の合計
+            total = cell[(cell['betting_type'] == bt) & (cell['place_code'] == 'all')].set_index('min_score')
+            by_place = got.groupby('min_score')[['bets', 'hits', 'cost']].sum()
+            np.testing.assert_array_equal(total[['bets', 'hits', 'cost']].to_numpy(), by_place.to_numpy())
+
+        # 単勝以外の払戻は払戻テーブルから (閾値 0 の全体は payout_backtest と同じ)
+        wide = cell[(cell['betting_type'] == 'wide') & (cell['place_code'] == 'all') & (cell['min_score'] == 0)].iloc[0]
+        strategy = payout_backtest.evaluate_strategies(top, index, {'wide': payout_backtest.STRATEGIES['wide']}).iloc[0]
+        assert wide['return'] > 0 and wide['roi'] > 0
+        assert (wide['bets'], wide['hits']) == (strategy['bet_races'], strategy['hits'])
+        assert wide['return'] == pytest.approx(strategy['return']) and wide['cost'] == strategy['cost']
+
+    def test_skip_without_payouts(self):
+        """払戻テーブルが無ければ単勝以外の賭け式は ROI 0 の行を出さずに除く"""
+        from train import grid
+
+        df = _make_predictions(50)
+        with pytest.raises(ValueError):
+            grid.evaluate_cell(grid.to_arrays(df), 3, 1, 12, ['place'], [0.0])
+        results = grid.run_grid(df, [3], betting_types=['win', 'place'], workers=1)
+        assert set(results['betting_type']) == {'win'}
+
+    def test_parallel_matches_serial(self):
+        import shutil
+        import tempfile
+        from train import grid
+
+        df = _make_predictions()
+        kwargs = dict(race_windows=[(1, 12), (9, 12)], betting_types=['win', 'place'], payout_table=_make_payouts(df))
+        tmp_dir = tempfile.mkdtemp()
+        output = os.path.join(tmp_dir, 'grid_results.csv')
+        try:
+            parallel = grid.run_grid(df, [2, 4], workers=2, output=output, **kwargs)
+            serial = grid.run_grid(df, [2, 4], workers=1, **kwargs)
+            pd.testing.assert_frame_equal(parallel, serial)
+            assert serial.loc[serial['betting_type'] == 'place', 'return'].sum() > 0
+            # 全タスクの結果が1つの CSV に書き出されていること
+            assert len(pd.read_csv(output)) == len(serial)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def test_parse_windows(self):
+        from train import grid
+
+        assert grid.parse_windows("1-12, 9-12,5") == [(1, 12), (9, 12), (5, 5)]
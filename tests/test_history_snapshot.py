@@ -0,0 +1,95 @@
+"""
+app.history_snapshot (履歴の mmap スナップショット) と HistoryLoader のテスト
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import os
+import sys
+import tempfile
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _write_results(raw_dir, year, rows):
+    df = pd.DataFrame(rows, columns=['race_id', 'horse_id', 'rank', 'time', 'last_3f', 'course_type', 'distance',
+                                     'year', 'month', 'day'])
+    df.to_csv(os.path.join(raw_dir, f'results_{year}.csv'), index=False)
+
+
+@pytest.fixture
+def dirs(monkeypatch):
+    from app import history_snapshot
+    from train import settings
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_dir = os.path.join(tmp, 'raw')
+        os.makedirs(raw_dir)
+        monkeypatch.setattr(settings, 'RAW_DATA_DIR', raw_dir)
+        monkeypatch.setattr(settings, 'CACHE_DIR', os.path.join(tmp, 'cache'))
+        monkeypatch.setattr(history_snapshot, 'SNAPSHOT_DIR', os.path.join(tmp, 'snapshot'))
+        _write_results(raw_dir, 2025, [
+            ['202505010101', 'h1', '1', '1:35.0', '34.0', '芝', 1600, 2025, 1, 5],
+            ['202505010101', 'h2', '2', '1:35.5', '34.5', '芝', 1600, 2025, 1, 5],
+            ['202505010201', 'h1', '中止', '', '', '芝', 1600, 2025, 2, 1],
+            ['202505010301', 'h1', '3', '1:36.0', '35.0', '芝', 1600, 2025, 3, 1],
+            ['202505010301', 'h3', '1', '1:34.0', '33.5', '芝', 1600, 2025, 3, 1],
+            ['202505010401', 'h1', '2', '1:35.2', '34.2', '芝', 1600, 2025, 4, 6]
+        ])
+        yield raw_dir, history_snapshot.SNAPSHOT_DIR
+
+
+class TestHistorySnapshot:
+    """スナップショットは初回に CSV から作り、次からは mmap で開く"""
+
+    def test_build_and_open(self, dirs):
+        from app.history_loader import HistoryLoader
+
+        _, snapshot_dir = dirs
+        built = HistoryLoader()
+        built.load()
+        assert len(built) == 5 # 着順が数値でない行は除く
+        assert len(os.listdir(snapshot_dir)) == 1
+
+        raw_dir, _ = dirs
+        os.utime(os.path.join(raw_dir, 'results_2025.csv'), (1e9, 1e9)) # 更新時刻だけ変わっても同じスナップショット
+        opened = HistoryLoader()
+        opened.load()
+        assert len(os.listdir(snapshot_dir)) == 1
+        assert isinstance(opened.snapshot.date, np.memmap)
+        assert list(opened.snapshot.horse_ids) == ['h1', 'h2', 'h3']
+        assert list(opened.snapshot.offsets) == [0, 3, 4, 5]
+
+        # 馬の中は日付順、日付より前の直近の過去走だけを使う
+        wf = opened.get_window_features(['h1', 'h4', 'h3'], '2025-04-06')
+        assert list(wf['lag1_rank']) == [3.0, 99.0, 1.0]
+        assert list(wf['lag2_rank']) == [1.0, 99.0, 99.0]
+        assert wf['interval'].iloc[0] == (pd.Timestamp('2025-04-06') - pd.Timestamp('2025-03-01')).days
+        pd.testing.assert_frame_equal(wf, built.get_window_features(['h1', 'h4', 'h3'], '2025-04-06'))
+
+        assert opened.get_last_race('h3', '2025-03-01') is None
+        assert opened.get_last_race('h1')['lag1_rank'] == 2
+        assert list(opened.df.columns[:2]) == ['horse_id', 'date'] and len(opened.df) == 5
+
+    def test_rebuild_on_change(self, dirs):
+        from app.history_loader import HistoryLoader
+
+        raw_dir, snapshot_dir = dirs
+        loader = HistoryLoader()
+        loader.load()
+        _write_results(raw_dir, 2026, [['202605010101', 'h2', '1', '1:35.0', '34.0', '芝', 1600, 2026, 1, 4]])
+        loader.reload()
+        assert len(loader) == 6 and len(os.listdir(snapshot_dir)) == 2
+        assert loader.get_last_race('h2')['lag1_rank'] == 1
+
+    def test_empty(self, dirs):
+        from app.history_loader import HistoryLoader
+
+        raw_dir, snapshot_dir = dirs
+        for name in os.listdir(raw_dir):
+            os.remove(os.path.join(raw_dir, name))
+        loader = HistoryLoader()
+        loader.load()
+        assert len(loader) == 0 and not os.path.exists(snapshot_dir)
+        assert list(loader.get_window_features(['h1'])['lag1_rank']) == [99.0]
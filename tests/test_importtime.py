@@ -0,0 +1,45 @@
+"""
+train.importtime (エントリーポイントの import 時間の予算) のテスト
+"""
+import pytest
+import os
+import sys
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SAMPLE = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 | site
+import time:       300 |        300 |     numpy.core
+import time:      2000 |       2300 |   numpy
+import time:      5000 |       5000 |   requests
+import time:       400 |       7700 | app.scraper
+"""
+
+
+class TestImportTime:
+    """-X importtime の解析と、エントリーポイントが重いモジュールを読み込まないこと"""
+
+    def test_parse(self):
+        from train import importtime
+
+        rows = importtime.parse(SAMPLE)
+        assert rows[0] == ('site', 120, 120, 0)
+        assert [(name, depth) for name, _, _, depth in rows[1:]] == [('numpy.core', 2), ('numpy', 1), ('requests', 1),
+                                                                      ('app.scraper', 0)]
+
+    @pytest.mark.parametrize('module', sorted(__import__('train.importtime').importtime.BUDGETS_MS))
+    def test_no_heavy_imports(self, module):
+        """lightgbm / sklearn / matplotlib / requests / bs4 / joblib は使う関数の中でだけ読み込む"""
+        from train import importtime
+
+        result = importtime.measure(module, runs=1)
+        assert result['heavy'] == []
+        assert result['ms'] > 0 and result['top']
+
+    def test_predictor_without_pandas(self):
+        """app.predictor は numpy / pandas も予測するときにだけ読み込む"""
+        from train import importtime
+
+        loaded = [name for name, _ in importtime.measure('app.predictor', runs=1)['top']]
+        assert 'numpy' not in loaded and 'pandas' not in loaded
@@ -0,0 +1,157 @@
+"""
+train.payouts (払戻テーブル) と train.payout_backtest (全賭け式バックテスト) のテスト
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import itertools
+import os
+import sys
+import tempfile
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PAY_HTML = """
+<table class="pay_table_01">
+<tr><th class="tan">単勝</th><td>5</td><td class="txt_r">1,230</td><td class="txt_r">4</td></tr>
+<tr><th class="fuku">複勝</th><td>5<br/>10<br/>3</td><td class="txt_r">310<br/>150<br/>420</td><td class="txt_r">4<br/>1<br/>6</td></tr>
+<tr><th class="uren">馬連</th><td>5 - 10</td><td class="txt_r">2,540</td><td class="txt_r">8</td></tr>
+</table>
+<table class="pay_table_01">
+<tr><th class="wide">ワイド</th><td>5 - 10<br/>3 - 5<br/>3 - 10</td><td class="txt_r">820<br/>1,640<br/>700</td><td class="txt_r">9<br/>20<br/>7</td></tr>
+<tr><th class="utan">馬単</th><td>5 → 10</td><td class="txt_r">5,010</td><td class="txt_r">17</td></tr>
+<tr><th class="sanfuku">三連複</th><td>3 - 5 - 10</td><td class="txt_r">6,930</td><td class="txt_r">22</td></tr>
+<tr><th class="santan">三連単</th><td>5 → 10 → 3</td><td class="txt_r">41,270</td><td class="txt_r">130</td></tr>
+</table>
+"""
+
+
+def _make_races(n_races=200, seed=0):
+    """着順・馬番・スコア付きの疑似レースと、着順から作った払戻テーブル"""
+    from train import payouts
+
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(3, 17, n_races)
+    race_ids = np.repeat([202505010101 + i for i in range(n_races)], sizes)
+    df = pd.DataFrame({
+        'race_id': race_ids,
+        'umaban': np.concatenate([rng.permutation(s) + 1 for s in sizes]),
+        'rank': np.concatenate([rng.permutation(s) + 1 for s in sizes]).astype(float),
+        'odds': np.round(rng.lognormal(2.5, 1.0, len(race_ids)), 1),
+        'score': rng.random(len(race_ids))
+    })
+    rows = []
+    for rid, g in df.sort_values('rank').groupby('race_id'):
+        u = g['umaban'].tolist()[:3]
+        hits = [('win', u[:1]), ('uma_ren', u[:2]), ('uma_tan', u[:2]), ('trio', u), ('trifecta', u)]
+        hits += [('place', [x]) for x in u] + [('wide', c) for c in itertools.combinations(u, 2)]
+        for bet_type, nums in hits:
+            rows.append({'race_id': rid, 'bet_type': bet_type, 'combination': payouts.combination_str(nums, bet_type),
+                         'payout': int(rng.integers(110, 50000)), 'popularity': 1})
+    return df, pd.DataFrame(rows)
+
+
+class TestPayTable:
+    """払戻テーブルの解析と参照"""
+
+    def test_parse(self):
+        from bs4 import BeautifulSoup
+        from train import payouts
+
+        rows = payouts.parse_pay_table(BeautifulSoup(PAY_HTML, "html.parser"), '202505010101')
+        df = pd.DataFrame(rows)
+        assert len(df) == 11
+        assert df.loc[df['bet_type'] == 'win', 'payout'].tolist() == [1230]
+        assert df.loc[df['bet_type'] == 'place', 'combination'].tolist() == ['5', '10', '3']
+        assert df.loc[df['bet_type'] == 'wide', 'combination'].tolist() == ['5-10', '3-5', '3-10']
+        assert df.loc[df['bet_type'] == 'trifecta', 'combination'].tolist() == ['5>10>3']
+        assert df.loc[df['bet_type'] == 'trio', 'popularity'].tolist() == [22]
+
+    def test_lookup(self):
+        from bs4 import BeautifulSoup
+        from train import payouts
+
+        rows = payouts.parse_pay_table(BeautifulSoup(PAY_HTML, "html.parser"), '202505010101')
+        index = payouts.PayoutIndex(pd.DataFrame(rows))
+        rid = [202505010101]
+        np.testing.assert_array_equal(index.lookup('uma_ren', rid, [[[10, 5], [5, 3]]]), [[2540, 0]])
+        np.testing.assert_array_equal(index.lookup('uma_tan', rid, [[[10, 5], [5, 10]]]), [[0, 5010]])
+        np.testing.assert_array_equal(index.lookup('trio', rid, [[[10, 3, 5], [np.nan, 3, 5]]]), [[6930, 0]])
+        assert index.has_race([202505010101, 202505010102]).tolist() == [True, False]
+
+
+class TestPayoutBacktest:
+    """全賭け式のバックテストがレースごとのループと一致すること"""
+
+    def test_tickets(self):
+        from train import payout_backtest
+
+        assert len(payout_backtest.tickets('trifecta', [[0, 1, 2]])) == 6
+        assert len(payout_backtest.tickets('trio', [[0, 1, 2, 3, 4]])) == 10
+        assert len(payout_backtest.tickets('trio', [[0], [1, 2], [1, 2, 3, 4]])) == 5
+        assert len(payout_backtest.tickets('trifecta', [[0], [1, 2], [1, 2, 3, 4]])) == 6
+        assert payout_backtest.parse_strategy('trifecta:1/23/2345') == ('trifecta', [[0], [1, 2], [1, 2, 3, 4]])
+
+    def test_matches_backtest_hits(self):
+        from train import backtest, payouts, payout_backtest
+
+        df, table = _make_races()
+        top = backtest.top_k(df, payout_backtest.positions_needed(payout_backtest.STRATEGIES))
+        results = payout_backtest.evaluate_strategies(top, payouts.PayoutIndex(table)).set_index('strategy')
+        for bt in backtest.BETTING_TYPES:
+            expected = backtest.simulate(top, bt)
+            assert results.loc[bt, 'hits'] == expected['hits'], bt
+        assert np.isclose(results.loc['win', 'cost'], backtest.simulate(top, 'win')['total_bet'])
+
+    def test_matches_loop(self):
+        from train import backtest, payouts, payout_backtest
+
+        df, table = _make_races(seed=1)
+        pay = {(r.race_id, r.bet_type, r.combination): r.payout for r in table.itertuples()}
+        top = backtest.top_k(df, 5)
+        for name in ['box_trifecta', 'trio_box5', 'trio_1_23_2345', 'uma_tan_1_23', 'wide_box3']:
+            bet_type, legs = payout_backtest.STRATEGIES[name]
+            cost, ret = payout_backtest.race_returns(top, payouts.PayoutIndex(table), bet_type, legs)
+
+            exp_cost, exp_ret = 0, 0
+            for rid, g in df.groupby('race_id'):
+                horses = g.sort_values('score', ascending=False, kind='mergesort')['umaban'].tolist()
+                for combo in payout_backtest.tickets(bet_type, legs):
+                    if max(combo) >= len(horses):
+                        continue
+                    exp_cost += 100
+                    exp_ret += pay.get((rid, bet_type, payouts.combination_str([horses[i] for i in combo], bet_type)), 0)
+            assert cost.sum() == exp_cost, name
+            assert np.isclose(ret.sum(), exp_ret), name
+
+
+class TestBulkPayouts:
+    """scraper_bulk の払戻の取り直し"""
+
+    def test_backfill_and_marker(self, monkeypatch):
+        """払戻の取り直しは backfill_payouts のときだけ。払戻テーブルの無いレースは印を残して取り直さない"""
+        from train import settings, payouts, scraper_bulk, results_db
+
+        with tempfile.TemporaryDirectory() as tmp:
+            monkeypatch.setattr(settings, 'RAW_DATA_DIR', tmp)
+            open(os.path.join(tmp, 'results_2025.csv'), 'w').close()
+            pages = {'202505010101': PAY_HTML, '202505010102': '<html><body></body></html>'}
+            fetched = []
+            monkeypatch.setattr(results_db, 'race_ids', lambda year: set(pages))
+            monkeypatch.setattr(scraper_bulk, 'get_race_ids', lambda year, month: list(pages))
+            monkeypatch.setattr(scraper_bulk, 'fetch_html', lambda url: fetched.append(url) or pages[url.split('/')[-2]])
+
+            scraper_bulk.bulk_scrape(2025, 2025, 1, 1)
+            assert fetched == []
+
+            scraper_bulk.bulk_scrape(2025, 2025, 1, 1, backfill_payouts=True)
+            assert len(fetched) == 2
+            raw = pd.read_csv(payouts.payout_path(2025), dtype=str)
+            assert raw.loc[raw['bet_type'] == payouts.NO_PAYOUT, 'race_id'].tolist() == ['202505010102']
+
+            scraper_bulk.bulk_scrape(2025, 2025, 1, 1, backfill_payouts=True)
+            assert len(fetched) == 2 # 印のあるレースも取り直さない
+            table = payouts.load_payouts(2025, 2025)
+            assert len(table) == 11 and set(table['race_id'].astype(str)) == {'202505010101'}
+            assert payouts.PayoutIndex(table).has_race([202505010101, 202505010102]).tolist() == [True, False]
@@ -0,0 +1,153 @@
+"""
+app.pipeline (探索・並行取得・バッチ予測・sink の週末パイプライン) のテスト
+"""
+import pytest
+import pandas as pd
+import json
+import os
+import sys
+import tempfile
+import time
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeScraper:
+    """2日分のレース一覧と出馬表 (1R ごとに遅延を変えて、取得の完了順をばらばらにする)"""
+    def __init__(self):
+        self.fetched = []
+
+    def search_races(self, date_str):
+        return [{'id': f"2026{place}0101{no:02d}", 'url': f"u?race_id=2026{place}0101{no:02d}&d={date_str}",
+                 'title': f"{no}R", 'race_no': no} for place in ['05', '09'] for no in (1, 2, 3)]
+
+    def fetch_race_data(self, url, race_date=None):
+        rid = url.split('race_id=')[1].split('&')[0]
+        time.sleep(0.01 * (4 - int(rid[-2:])))
+        self.fetched.append(rid)
+        if rid.endswith('03') and rid[4:6] == '09':
+            return [] # 出馬表が取れないレース
+        return [{'name': f"{rid}-{i}", 'odds': str(2.0 + i), 'umaban': str(i + 1)} for i in range(3)]
+
+
+def fake_predict_batch(calls):
+    def predict_batch(races, power=None):
+        calls.append(len(races))
+        return [pd.DataFrame({'name': [h['name'] for h in rd], 'jockey': 'J', 'odds': [h['odds'] for h in rd],
+                              'win_prob': [0.5, 0.3, 0.2], 'score': [0.5, 0.3, 0.2]}) for rd in races]
+    return predict_batch
+
+
+class ListSink:
+    def __init__(self):
+        self.items = []
+
+    def add(self, race, df):
+        self.items.append((race['date'], race['place'], race['id'], len(df)))
+
+
+class TestRateLimiter:
+    """RateLimiter はスレッド間で共有して rate 回/秒 に抑える"""
+
+    def test_wait(self):
+        from app import pipeline
+        from concurrent.futures import ThreadPoolExecutor
+
+        limiter = pipeline.RateLimiter(50)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(lambda _: limiter.wait(), range(6)))
+        assert time.perf_counter() - t0 >= 5 / 50 * 0.9
+
+
+class TestPipeline:
+    """run() の順序・バッチ・キャッシュ・統計"""
+
+    def test_run(self, monkeypatch):
+        from app import pipeline, scraper, predictor
+
+        site = FakeScraper()
+        calls = []
+        monkeypatch.setattr(scraper, 'search_races', site.search_races)
+        monkeypatch.setattr(scraper, 'fetch_race_data', site.fetch_race_data)
+        monkeypatch.setattr(predictor, 'predict_batch', fake_predict_batch(calls))
+
+        class Cache:
+            def __init__(self):
+                self.stored = []
+                self.seen = []
+
+            def discovered(self, races):
+                self.seen.extend(race['id'] for race in races)
+
+            def lookup(self, race, race_data):
+                if race['id'] == '202605010102' and race['date'] == '20260104':
+                    return pd.DataFrame({'name': ['cached']})
+                return None
+
+            def store(self, race, race_data, df):
+                self.stored.append(race['id'])
+
+        sink, cache = ListSink(), Cache()
+        stats = pipeline.run(['20260104', '20260105'], [sink], cache=cache, fetch_workers=3, rate=0, batch_size=4)
+        assert scraper.limiter is None
+
+        # 発見した順 (日付 → レース一覧の順)。取れなかったレースは飛ばし、キャッシュのレースはすぐ流す
+        expected = [(d, p, f"2026{p}0101{n:02d}") for d in ['20260104', '20260105'] for p in ['05', '09'] for n in (1, 2, 3)
+                    if not (p == '09' and n == 3)]
+        assert sorted(item[:3] for item in sink.items) == sorted(expected)
+        assert sink.items[0] == ('20260104', '05', '202605010102', 1)
+        assert [item[:3] for item in sink.items[1:]] == [e for e in expected if e != expected[1]]
+        assert calls == [4, 4, 1]
+        assert len(cache.stored) == 9
+        # 出馬表を取れなかったレースも発見したレースとして渡す
+        assert len(cache.seen) == 12 and '202609010103' in cache.seen
+
+        table = stats.table()
+        assert table['discover']['items'] == 12 and table['fetch']['calls'] == 12
+        assert table['predict']['items'] == 9 and table['predict']['calls'] == 3
+        assert table['sink']['calls'] == 10
+        assert 'p95' in stats.summary()
+
+    def test_scored_cache_keeps_unfetched(self, monkeypatch):
+        """出馬表の取得に失敗したレースの前回の採点結果は prune で消さない"""
+        from app import pipeline, scraper, predictor, race_fingerprint
+        from app.report import predict_html_generator
+
+        site = FakeScraper()
+        monkeypatch.setattr(scraper, 'search_races', site.search_races)
+        monkeypatch.setattr(scraper, 'fetch_race_data', site.fetch_race_data)
+        monkeypatch.setattr(predictor, 'predict_batch', fake_predict_batch([]))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            scored = race_fingerprint.ScoredRaces(tmp)
+            scored.put('202609010103', 'fp', pd.DataFrame({'name': ['saved']})) # 今回は取得に失敗する
+            scored.put('202501010101', 'fp', pd.DataFrame({'name': ['old']})) # 対象期間外
+            cache = predict_html_generator._ScoredCache(scored, 'model')
+            pipeline.run(['20260104'], [ListSink()], cache=cache, rate=0)
+
+            assert (cache.fetched, len(cache.seen_ids)) == (5, 6)
+            assert scored.prune(cache.seen_ids) == 1
+            assert scored.get('202609010103', 'fp') is not None
+            assert scored.get('202501010101', 'fp') is None
+
+    def test_shard_report(self, monkeypatch):
+        """reporting.ShardReport を sink にすると日付×競馬場のシャードとページ本体ができる"""
+        from app import pipeline, scraper, predictor, reporting, report_shards
+
+        site = FakeScraper()
+        monkeypatch.setattr(scraper, 'search_races', site.search_races)
+        monkeypatch.setattr(scraper, 'fetch_race_data', site.fetch_race_data)
+        monkeypatch.setattr(predictor, 'predict_batch', fake_predict_batch([]))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, 'index.html')
+            with reporting.ShardReport(out) as report:
+                pipeline.run(['20260104'], [report], rate=0)
+            assert sorted(os.listdir(report_shards.shard_dir(out))) == ['20260104_05.json', '20260104_09.json']
+            with open(os.path.join(report_shards.shard_dir(out), '20260104_09.json'), encoding='utf-8') as f:
+                races = json.load(f)
+            assert [r['title'] for r in races] == ['20260104 1R', '20260104 2R']
+            with open(out, encoding='utf-8') as f:
+                assert 'data-shard="20260104_05"' in f.read()
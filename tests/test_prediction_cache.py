@@ -0,0 +1,124 @@
+"""
+train.prediction_cache (モデル指紋 + race_id/horse_id の予測キャッシュ) のテスト
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import os
+import sys
+import tempfile
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _make_raw(n_races=6, size=5):
+    race_ids = np.repeat([f"2025050101{i + 1:02d}" for i in range(n_races)], size)
+    return pd.DataFrame({
+        'race_id': race_ids,
+        'horse_id': [f"h{i}" for i in range(len(race_ids))],
+        'x': np.arange(len(race_ids), dtype=float)
+    })
+
+
+class _Model:
+    """特徴量 x をそのまま返すモデル (呼ばれた行数を記録)"""
+    def __init__(self):
+        self.rows = []
+
+    def predict(self, X):
+        self.rows.append(len(X))
+        return X['x'].to_numpy() / 100
+
+
+def _fake_transform(df, artifacts):
+    # transform() と同様に行を並べ替える (index は元の行位置のまま)
+    return df.iloc[::-1]
+
+
+class TestPredictionCache:
+    """part ファイルへの追記・参照・まとめ直し"""
+
+    def test_append_lookup(self):
+        from train import prediction_cache
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = prediction_cache.PredictionCache('k', root=tmp)
+            cache.append(['202505010101', '202505010101'], ['a', 'b'], [0.1, 0.2])
+            cache.append([202505010102], ['a'], [0.3])
+            got = prediction_cache.PredictionCache('k', root=tmp).lookup(
+                ['202505010102', '202505010101', '202505010103'], ['a', 'b', 'a'])
+            np.testing.assert_allclose(got[:2], [0.3, 0.2])
+            assert np.isnan(got[2])
+
+    def test_compact(self, monkeypatch):
+        from train import prediction_cache
+
+        monkeypatch.setattr(prediction_cache, 'MAX_PARTS', 3)
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = prediction_cache.PredictionCache('k', root=tmp)
+            for i in range(5):
+                cache.append([i], ['a'], [i / 10])
+            assert len(cache._parts()) < 3
+            np.testing.assert_allclose(cache.lookup(range(5), ['a'] * 5), np.arange(5) / 10)
+
+
+class TestPredictCached:
+    """キャッシュに無いレースだけ推論され、結果が raw_df の行順に揃うこと"""
+
+    def test_only_missing_races(self, monkeypatch):
+        from train import prediction_cache, preprocess, settings
+
+        monkeypatch.setattr(preprocess, 'transform', _fake_transform)
+        with tempfile.TemporaryDirectory() as tmp:
+            monkeypatch.setattr(settings, 'CACHE_DIR', tmp)
+            raw = _make_raw()
+            model = _Model()
+            kwargs = dict(context={'first_race': 'x'}, model_path=os.path.join(tmp, 'none'))
+
+            first = prediction_cache.predict_cached(model, raw.iloc[:20], None, ['x'], **kwargs)
+            np.testing.assert_allclose(first, raw['x'].to_numpy()[:20] / 100)
+
+            second = prediction_cache.predict_cached(model, raw, None, ['x'], **kwargs)
+            np.testing.assert_allclose(second, raw['x'].to_numpy() / 100)
+            assert model.rows == [20, 10] # 2回目は残り2レースだけ
+
+            prediction_cache.predict_cached(model, raw, None, ['x'], **kwargs)
+            assert model.rows == [20, 10] # 全レースキャッシュ済み
+
+            # context が変わると別のキャッシュ
+            prediction_cache.predict_cached(model, raw, None, ['x'], context={'first_race': 'y'}, model_path=kwargs['model_path'])
+            assert model.rows == [20, 10, 30]
+
+    def test_raw_data_and_code_in_key(self, monkeypatch):
+        """評価する年の生データや特徴量のコードが変わると別のキャッシュになる"""
+        from train import prediction_cache, preprocess, feature_store, settings
+
+        monkeypatch.setattr(preprocess, 'transform', _fake_transform)
+        with tempfile.TemporaryDirectory() as tmp:
+            monkeypatch.setattr(settings, 'CACHE_DIR', tmp)
+            monkeypatch.setattr(settings, 'RAW_DATA_DIR', tmp)
+            for year in (2025, 2026):
+                with open(os.path.join(tmp, f'results_{year}.csv'), 'w') as f:
+                    f.write("race_id,rank\n")
+            raw = _make_raw()
+            model = _Model()
+            kwargs = dict(context={'first_race': 'x'}, model_path=os.path.join(tmp, 'none'))
+
+            prediction_cache.predict_cached(model, raw, None, ['x'], **kwargs)
+            with open(os.path.join(tmp, 'results_2026.csv'), 'a') as f:
+                f.write("202605010101,1\n") # 評価していない年
+            prediction_cache.predict_cached(model, raw, None, ['x'], **kwargs)
+            assert model.rows == [30]
+
+            with open(os.path.join(tmp, 'results_2025.csv'), 'a') as f:
+                f.write("202505010101,1\n") # 取り直した結果
+            prediction_cache.predict_cached(model, raw, None, ['x'], **kwargs)
+            assert model.rows == [30, 30]
+
+            code = os.path.join(tmp, 'window_features.py')
+            with open(code, 'w') as f:
+                f.write("# changed\n")
+            monkeypatch.setattr(feature_store, 'FEATURE_SOURCES', feature_store.FEATURE_SOURCES[:1] + [code])
+            prediction_cache.predict_cached(model, raw, None, ['x'], **kwargs)
+            assert model.rows == [30, 30, 30]
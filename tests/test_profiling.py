@@ -0,0 +1,99 @@
+"""
+train.profiling (ステージ計測) のテスト
+"""
+import pytest
+import json
+import csv
+import os
+import sys
+import tempfile
+import shutil
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestProfiling:
+    """ステージの記録とレポート出力のテスト"""
+
+    def setup_method(self):
+        from train import profiling
+        self.tmp_dir = tempfile.mkdtemp()
+        profiling.reset()
+
+    def teardown_method(self):
+        from train import profiling
+        profiling.disable()
+        profiling.reset()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_disabled_records_nothing(self):
+        """無効時は何も記録せず、デコレータも元の戻り値を返すこと"""
+        from train import profiling
+
+        @profiling.profiled('noop')
+        def f(x):
+            return [x] * 3
+
+        with profiling.stage('outer', rows=10):
+            assert f(1) == [1, 1, 1]
+        assert profiling.records() == []
+
+    def test_nested_stages_and_rows(self):
+        """入れ子のステージに親・深さ・行数・ピークメモリが記録されること"""
+        from train import profiling
+        profiling.enable(self.tmp_dir, memory=True)
+
+        @profiling.profiled('inner')
+        def make_rows(n):
+            return list(range(n))
+
+        with profiling.stage('outer') as st:
+            rows = make_rows(1000)
+            st.rows = len(rows)
+        render = profiling.start('render')
+        render.stop()
+
+        recs = {r['stage']: r for r in profiling.records()}
+        assert recs['inner']['parent'] == 'outer'
+        assert recs['inner']['depth'] == 1
+        assert recs['inner']['rows'] == 1000
+        assert recs['outer']['rows'] == 1000
+        assert recs['render']['parent'] is None
+        # 親のピークは子のピーク以上
+        assert recs['outer']['peak_mb'] >= recs['inner']['peak_mb'] > 0
+        assert recs['outer']['wall_s'] >= recs['inner']['wall_s']
+
+    def test_error_is_recorded(self):
+        """例外で抜けたステージも記録されること"""
+        from train import profiling
+        profiling.enable(self.tmp_dir, memory=False)
+
+        with pytest.raises(ValueError):
+            with profiling.stage('broken'):
+                raise ValueError("boom")
+        assert profiling.records()[0]['error'] == 'ValueError'
+
+    def test_write_report_and_compare(self):
+        """JSON / CSV が書き出され、比較で遅くなったステージが検出されること"""
+        from train import profiling
+        profiling.enable(self.tmp_dir, memory=False)
+
+        with profiling.stage('load_data', rows=5):
+            pass
+        base = profiling.write_report(run_name='test')
+
+        with open(base + '.json', encoding='utf-8') as f:
+            report = json.load(f)
+        assert report['summary']['load_data']['calls'] == 1
+        assert report['summary']['load_data']['rows'] == 5
+        with open(base + '.csv', encoding='utf-8') as f:
+            assert [r['stage'] for r in csv.DictReader(f)] == ['load_data']
+
+        slower = dict(report)
+        slower['summary'] = {'load_data': dict(report['summary']['load_data'], wall_s=report['summary']['load_data']['wall_s'] * 2 + 1)}
+        slower_path = os.path.join(self.tmp_dir, 'slower.json')
+        with open(slower_path, 'w', encoding='utf-8') as f:
+            json.dump(slower, f)
+        assert profiling.compare(base + '.json', slower_path) == ['load_data']
+        assert profiling.compare(slower_path, base + '.json') == []
@@ -0,0 +1,114 @@
+"""
+app.race_card_cache (出馬表とオッズの2段キャッシュ) のテスト
+"""
+import pytest
+import os
+import sys
+import tempfile
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeSite:
+    """呼び出し回数を数える出馬表・オッズ API"""
+    def __init__(self):
+        self.entries = [{'umaban': '1', 'horse_id': '2021100001', 'jockey_id': '01', 'odds': '---'},
+                        {'umaban': '2', 'horse_id': '2021100002', 'jockey_id': '02', 'odds': '---'}]
+        self.odds = {'01': '3.4', '02': '12.0'}
+        self.calls = {'entries': 0, 'odds': 0}
+
+    def fetch_entries(self, url):
+        self.calls['entries'] += 1
+        return [dict(e) for e in self.entries]
+
+    def fetch_odds(self, race_id):
+        self.calls['odds'] += 1
+        return dict(self.odds)
+
+
+class TestRaceCardCache:
+    """TTL と出走馬の変化による取り直し"""
+
+    def test_ttl(self):
+        from app import race_card_cache
+
+        site = FakeSite()
+        with tempfile.TemporaryDirectory() as tmp:
+            cards = race_card_cache.RaceCardCache(tmp, entry_ttl=3600, odds_ttl=300)
+
+            def get(now):
+                return cards.get('202605010101', 'u', site.fetch_entries, site.fetch_odds, now=now)
+
+            entries, odds = get(0)
+            assert site.calls == {'entries': 1, 'odds': 1} and odds == {'01': '3.4', '02': '12.0'}
+            get(100) # どちらも TTL 内
+            assert site.calls == {'entries': 1, 'odds': 1}
+
+            site.odds['01'] = '2.8'
+            entries, odds = get(1000) # オッズだけ取り直す
+            assert site.calls == {'entries': 1, 'odds': 2} and odds['01'] == '2.8'
+
+            site.entries[1]['jockey_id'] = '09'
+            entries, odds = get(4000) # 出馬表の TTL 切れ
+            assert site.calls == {'entries': 2, 'odds': 3} and entries[1]['jockey_id'] == '09'
+            assert cards.stats == {'cached': 1, 'odds_only': 1, 'entries': 2, 'invalidated': 0}
+
+    def test_scratch(self):
+        """オッズが付かなくなった馬がいたら TTL 内でも出馬表を取り直す"""
+        from app import race_card_cache
+
+        site = FakeSite()
+        with tempfile.TemporaryDirectory() as tmp:
+            cards = race_card_cache.RaceCardCache(tmp, entry_ttl=3600, odds_ttl=300)
+            cards.get('202605010101', 'u', site.fetch_entries, site.fetch_odds, now=0)
+
+            site.odds['02'] = '取消'
+            cards.get('202605010101', 'u', site.fetch_entries, site.fetch_odds, now=600)
+            assert site.calls == {'entries': 2, 'odds': 2}
+            assert cards.stats['invalidated'] == 1
+
+            # 取消を反映した出馬表を取った後は、オッズだけの取り直しに戻る
+            cards.get('202605010101', 'u', site.fetch_entries, site.fetch_odds, now=1200)
+            assert site.calls == {'entries': 2, 'odds': 3}
+
+    def test_day_of_ttl(self):
+        """レース当日 (JST) は天候・馬場・騎手変更を拾うため DAY_OF_TTL で出馬表を取り直す"""
+        from app import race_card_cache
+
+        site = FakeSite()
+        with tempfile.TemporaryDirectory() as tmp:
+            cards = race_card_cache.RaceCardCache(tmp, entry_ttl=3600, odds_ttl=300, day_of_ttl=900)
+            now = 1769216400 # 2026-01-24 10:00 JST
+
+            def get(now, race_date):
+                return cards.get('202605010101', 'u', site.fetch_entries, site.fetch_odds, now=now, race_date=race_date)
+
+            get(now, '20260131')
+            get(now + 1200, '20260131') # 先の開催日は ENTRY_TTL のまま
+            assert site.calls['entries'] == 1
+
+            get(now + 1200, '20260124') # 当日は DAY_OF_TTL 切れ
+            assert site.calls['entries'] == 2
+            get(now + 1500, '20260124')
+            assert site.calls['entries'] == 2
+
+    def test_fetch_race_data(self, monkeypatch):
+        """scraper.fetch_race_data がキャッシュの出走馬にオッズを付けて返す"""
+        from app import scraper, race_card_cache
+
+        site = FakeSite()
+        with tempfile.TemporaryDirectory() as tmp:
+            monkeypatch.setattr(race_card_cache, 'cards', race_card_cache.RaceCardCache(tmp))
+            monkeypatch.setattr(scraper, 'fetch_entries', site.fetch_entries)
+            monkeypatch.setattr(scraper, 'fetch_odds', site.fetch_odds)
+
+            url = 'https://race.netkeiba.com/race/shutuba.html?race_id=202605010101&rf=race_list'
+            data = scraper.fetch_race_data(url)
+            assert [h['odds'] for h in data] == ['3.4', '12.0']
+            data[0]['odds'] = 'modified'
+            assert [h['odds'] for h in scraper.fetch_race_data(url)] == ['3.4', '12.0']
+            assert site.calls == {'entries': 1, 'odds': 1}
+
+            scraper.fetch_race_data(url, use_cache=False)
+            assert site.calls == {'entries': 2, 'odds': 2}
@@ -0,0 +1,50 @@
+"""
+app.race_fingerprint (予測実行の差分検出) のテスト
+"""
+import pytest
+import pandas as pd
+import os
+import sys
+import tempfile
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _race_data():
+    return [
+        {'umaban': '1', 'horse_id': '2021100001', 'odds': '3.4', 'condition': 'good', 'weight': '480(+2)'},
+        {'umaban': '2', 'horse_id': '2021100002', 'odds': '12.0', 'condition': 'good', 'weight': '452(-4)'}
+    ]
+
+
+class TestRaceFingerprint:
+    """レースの指紋と採点結果の保存"""
+
+    def test_fingerprint(self):
+        from app import race_fingerprint
+
+        fp = race_fingerprint.race_fingerprint(_race_data(), 'model')
+        assert fp == race_fingerprint.race_fingerprint(_race_data()[::-1], 'model')
+        assert fp != race_fingerprint.race_fingerprint(_race_data(), 'other-model')
+        for key, value in [('odds', '3.6'), ('weight', '482(+4)'), ('condition', 'heavy')]:
+            changed = _race_data()
+            changed[0][key] = value
+            assert fp != race_fingerprint.race_fingerprint(changed, 'model'), key
+
+    def test_store(self):
+        from app import race_fingerprint
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = race_fingerprint.ScoredRaces(tmp)
+            df = pd.DataFrame({'umaban': [1, 2], 'score': [0.5, 0.1]})
+            store.put('202605010101', 'fp1', {'id': '202605010101', 'df': df})
+            store.put('202605010102', 'fp2', {'id': '202605010102', 'df': df})
+
+            pd.testing.assert_frame_equal(store.get('202605010101', 'fp1')['df'], df)
+            assert store.get('202605010101', 'changed') is None
+            assert store.get('202605010103', 'fp1') is None
+
+            assert store.prune(['202605010101']) == 1
+            assert store.get('202605010102', 'fp2') is None
+            assert store.get('202605010101', 'fp1') is not None
@@ -0,0 +1,68 @@
+"""
+train.ranking_metrics (レース単位の NDCG / MRR / Hit@k) のテスト
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import os
+import sys
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _make_races(n_races=400, seed=0):
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(2, 18, n_races)
+    race_ids = np.repeat(rng.permutation(n_races) + 202500000000, sizes)
+    ranks = np.concatenate([rng.permutation(s) + 1 for s in sizes]).astype(float)
+    scores = np.round(rng.normal(size=len(ranks)), 1) # 同点スコアを含む
+    return race_ids, scores, ranks
+
+
+class TestRankingMetrics:
+    """レースごとのループ (sklearn.metrics.ndcg_score) と一致すること"""
+
+    def test_matches_per_race_loop(self):
+        from sklearn.metrics import ndcg_score
+        from train import ranking_metrics
+
+        race_ids, scores, ranks = _make_races()
+        per_race = ranking_metrics.race_metrics(race_ids, scores, ranks).set_index('race_id')
+        df = pd.DataFrame({'race_id': race_ids, 'score': scores, 'rank': ranks})
+
+        for rid, group in df.groupby('race_id'):
+            group = group.sort_values('score', ascending=False, kind='mergesort')
+            relevance = (group['rank'].max() - group['rank'] + 1).values
+            row = per_race.loc[rid]
+            for k in ranking_metrics.DEFAULT_KS:
+                assert row[f'ndcg@{k}'] == pytest.approx(ndcg_score([relevance], [group['score'].values], k=k))
+            winner_pos = np.flatnonzero(group['rank'].values == 1)[0]
+            assert row['mrr'] == pytest.approx(1.0 / (winner_pos + 1))
+            assert row['hit@3'] == (winner_pos < 3)
+            assert row['acc@3'] == (group['rank'].iloc[0] <= 3)
+
+    def test_missing_winner_and_rank(self):
+        from train import ranking_metrics
+
+        per_race = ranking_metrics.race_metrics(
+            ['A', 'A', 'A', 'B', 'B', None],
+            [0.9, 0.5, 0.1, 0.2, 0.8, 1.0],
+            [2, np.nan, 3, 1, 2, 1]
+        ).set_index('race_id')
+        assert list(per_race.index) == ['A', 'B']
+        assert per_race.loc['A', 'mrr'] == 0 # 1着馬なし
+        assert not per_race.loc['A', 'hit@5']
+        assert per_race.loc['A', 'acc@3']
+        assert per_race.loc['B', 'mrr'] == 0.5
+        assert per_race.loc['B', 'ndcg@1'] == pytest.approx(1 / 2)
+
+    def test_summary(self):
+        from train import ranking_metrics
+
+        race_ids, scores, ranks = _make_races(50)
+        summary = ranking_metrics.ranking_metrics(race_ids, scores, ranks)
+        per_race = ranking_metrics.race_metrics(race_ids, scores, ranks)
+        assert summary['races'] == 50
+        assert summary['mrr'] == pytest.approx(per_race['mrr'].mean())
+        assert 'NDCG@1=' in ranking_metrics.format_metrics(summary)
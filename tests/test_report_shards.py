@@ -0,0 +1,89 @@
+"""
+app.report_shards (予測レポートのシェル + 日付×競馬場ごとの JSON シャード) のテスト
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import io
+import json
+import os
+import sys
+import tempfile
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _predictions():
+    items = []
+    for date, place, race_no in [('20260104', '06', 2), ('20260104', '06', 1), ('20260104', '08', 1), ('20260105', '06', 11)]:
+        items.append({
+            'date': date, 'place': place, 'race_no': race_no, 'title': f"{date} {place} {race_no}R",
+            'df': pd.DataFrame({
+                'name': [f'Horse{race_no}A', 'Horse<B>'], 'jockey': ['J1', 'J2'], 'odds': [2.5, np.nan],
+                'win_prob': [0.6, 0.4], 'score': [1.5, 0.1], 'weather': ['晴', '晴'], 'distance': [1600, 1600]
+            })
+        })
+    return items
+
+
+class TestShardWriter:
+    """シャードの書き出し"""
+
+    def test_shards(self):
+        from app import report_shards
+
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, 'predict.html')
+            os.makedirs(report_shards.shard_dir(out))
+            open(os.path.join(report_shards.shard_dir(out), 'stale.json'), 'w').close()
+
+            with report_shards.ShardWriter(out) as shards:
+                for item in _predictions():
+                    shards.add(item['date'], item['place'], {'race_no': item['race_no'],
+                                                             'columns': report_shards.columns(item['df'], ['name', 'odds', 'missing'])})
+            assert shards.manifest() == [('20260104', ['06', '08']), ('20260105', ['06'])]
+            assert shards.races() == 4
+            assert sorted(os.listdir(report_shards.shard_dir(out))) == ['20260104_06.json', '20260104_08.json', '20260105_06.json']
+
+            with open(os.path.join(report_shards.shard_dir(out), '20260104_06.json'), encoding='utf-8') as f:
+                races = json.load(f)
+            assert [r['race_no'] for r in races] == [2, 1] # 書いた順 (並べ替えはブラウザ側)
+            assert races[0]['columns'] == {'name': ['Horse2A', 'Horse<B>'], 'odds': [2.5, None], 'missing': [None, None]}
+
+    def test_generate_html_report(self):
+        """reporting のページ本体にはタブだけが入り、レースはシャードに入る"""
+        from app import reporting, report_shards
+
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, 'index.html')
+            reporting.generate_html_report(_predictions(), output_path=out)
+            with open(out, encoding='utf-8') as f:
+                shell = f.read()
+            assert 'data-shard="20260104_08"' in shell
+            assert 'var SHARD_DIR = "index_shards";' in shell
+            assert 'Horse1A' not in shell
+
+            with open(os.path.join(report_shards.shard_dir(out), '20260105_06.json'), encoding='utf-8') as f:
+                races = json.load(f)
+            assert races[0]['title'] == '20260105 06 11R'
+            assert races[0]['distance'] == 1600
+            assert races[0]['columns']['win_prob'] == [0.6, 0.4]
+
+    def test_single_file(self):
+        """single_file ならシャードを残さず全レースの表をページに書く"""
+        from app import reporting, report_shards
+
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, 'index.html')
+            reporting.generate_html_report(_predictions(), output_path=out, single_file=True)
+            assert not os.path.exists(report_shards.shard_dir(out))
+            with open(out, encoding='utf-8') as f:
+                page = f.read()
+            assert 'fetch(' not in page
+            tables = pd.read_html(io.StringIO(page))
+            assert len(tables) == 4
+            # レース番号順 (06 の 1R が先)
+            assert tables[0]['Name'].tolist() == ['Horse1A', 'Horse<B>']
+            assert tables[0]['Odds'].tolist() == ['2.5', '---.-']
+            assert tables[0]['Win%'].tolist() == ['60.0%', '40.0%']
@@ -0,0 +1,108 @@
+"""
+train.results_db (結果・プロフィールの SQLite) のテスト
+"""
+import pytest
+import pandas as pd
+import os
+import sys
+import tempfile
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COLUMNS = ['race_id', 'course_type', 'distance', 'year', 'month', 'day', 'rank', 'horse_name', 'horse_id',
+           'jockey', 'jockey_id', 'trainer', 'trainer_id', 'time', 'last_3f', 'odds']
+
+
+def _write(path, rows, columns=COLUMNS):
+    pd.DataFrame(rows, columns=columns).to_csv(path, index=False)
+
+
+@pytest.fixture
+def raw_dir(monkeypatch):
+    from train import settings
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = os.path.join(tmp, 'raw')
+        os.makedirs(raw)
+        monkeypatch.setattr(settings, 'RAW_DATA_DIR', raw)
+        monkeypatch.setattr(settings, 'CACHE_DIR', os.path.join(tmp, 'cache'))
+        _write(os.path.join(raw, 'results_2023.csv'), [
+            ['202305010101', 'turf', 1600, 2023, 5, 1, '1', 'A', '2019100001', 'J1', '01170', 'T1', '01001', '1:35.0', 34.0, '2.5'],
+            ['202305010101', 'turf', 1600, 2023, 5, 1, '中止', 'B', '2019100002', 'J2', '05676', 'T1', '01001', '', '', '---'],
+            ['202305010201', 'dirt', 1200, 2023, 6, 3, '2', 'A', '2019100001', 'J1', '01170', 'T2', '01002', '1:11.0', 36.0, '4.0']
+        ])
+        _write(os.path.join(raw, 'results_2024.csv'), [
+            ['202405010101', 'turf', 1600, 2024, 1, 6, '3', 'A', '2019100001', 'J2', '05676', 'T1', '01001', '1:34.8', 33.9, '3.1']
+        ])
+        # レガシー: date 列 (2022年12月4日)
+        _write(os.path.join(raw, 'results_2022.csv'), [['202205010101', 'turf', 1600, '2022年12月4日', '1', '2019100001']],
+               ['race_id', 'course_type', 'distance', 'date', 'rank', 'horse_id'])
+        pd.DataFrame({'horse_id': ['2019100001', '2019100003.0'], 'sire_id': ['s1', 's2']}).to_csv(
+            os.path.join(raw, 'horse_profiles.csv'), index=False)
+        yield raw
+
+
+class TestResultsDB:
+    """CSV の取り込みと問い合わせ"""
+
+    def test_sync_and_load(self, raw_dir):
+        from train import results_db
+
+        conn = results_db.connect()
+        assert results_db.sync(conn) == 4
+        assert results_db.sync(conn) == 0 # 変わっていないファイルは取り込まない
+        os.utime(os.path.join(raw_dir, 'results_2023.csv'), (1e9, 1e9)) # checkout で更新時刻だけ変わる
+        assert results_db.sync(conn) == 0
+        assert results_db.years(conn) == {2022, 2023, 2024}
+
+        # results_YYYY.csv を年順に read_csv したのと同じ (ID は文字列、数値にならない値を含む列は文字列)
+        df = results_db.load_results(2023, 2024, conn)
+        expected = pd.concat([pd.read_csv(os.path.join(raw_dir, f'results_{y}.csv'),
+                                          dtype={c: str for c in results_db.ID_COLUMNS}) for y in (2023, 2024)],
+                             ignore_index=True)
+        assert list(df.columns) == list(expected.columns)
+        assert list(df['jockey_id']) == ['01170', '05676', '01170', '05676']
+        assert list(df['rank']) == ['1', '中止', '2', '3']
+        assert list(pd.to_numeric(df['odds'], errors='coerce').fillna(0)) == [2.5, 0, 4.0, 3.1]
+        pd.testing.assert_series_equal(df['distance'], expected['distance'])
+        assert 'date' in results_db.load_results(2022, 2022, conn).columns
+
+        # CSV が変わったファイルだけ取り込み直し、消えたファイルの行は消す
+        _write(os.path.join(raw_dir, 'results_2024.csv'), [
+            ['202405010101', 'turf', 1600, 2024, 1, 6, '3', 'A', '2019100001', 'J2', '05676', 'T1', '01001', '1:34.8', 33.9, '3.1'],
+            ['202405010102', 'turf', 1600, 2024, 1, 6, '1', 'C', '2019100003', 'J1', '01170', 'T1', '01001', '1:34.0', 33.0, '5.0']
+        ])
+        os.remove(os.path.join(raw_dir, 'results_2022.csv'))
+        os.utime(os.path.join(raw_dir, 'results_2024.csv'), (1e9, 2e9))
+        assert results_db.sync(conn) == 1
+        assert results_db.race_ids(2024, conn) == {'202405010101', '202405010102'}
+        assert results_db.years(conn) == {2023, 2024}
+
+    def test_queries(self, raw_dir):
+        from train import results_db
+
+        conn = results_db.open_synced()
+        runs = results_db.runs(horse_id='2019100001', limit=2, conn=conn)
+        assert list(runs['race_date']) == ['2024-01-06', '2023-06-03'] # 新しい順
+        assert list(results_db.runs(horse_id='2019100001', conn=conn)['race_date'])[-1] == '2022-12-04'
+        jockey = results_db.runs(jockey_id='01170', start='2023-01-01', end='2023-12-31', conn=conn)
+        assert list(jockey['race_id']) == ['202305010201', '202305010101']
+        assert len(results_db.runs(course_type='turf', distance=1600, conn=conn)) == 4
+        assert results_db.horse_ids(conn) == {'2019100001', '2019100002'}
+        assert results_db.profile_ids(conn) == {'2019100001', '2019100003'}
+
+        for sql, index in [("SELECT * FROM results WHERE jockey_id = '01170' AND race_date >= '2023-01-01'", 'results_jockey'),
+                           ("SELECT * FROM results WHERE course_type = 'turf' AND distance = 1600", 'results_course')]:
+            plan = ' '.join(str(row) for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+            assert index in plan
+
+    def test_scraper_existing_ids(self, raw_dir, monkeypatch):
+        """scraper_horse は結果DB の馬IDとプロフィールの差分だけ取りに行く"""
+        from train import scraper_horse
+
+        fetched = []
+        monkeypatch.setattr(scraper_horse, 'scrape_horse_profile',
+                            lambda hid: fetched.append(hid) or {'horse_id': hid, 'sire_id': 'x'})
+        scraper_horse.scrape_missing_horses(output_path=os.path.join(raw_dir, 'new_profiles.csv'))
+        assert fetched == ['2019100002']
@@ -0,0 +1,119 @@
+"""
+app.scheduler (発走時刻に合わせたオッズの取り直しと再予測) のテスト
+"""
+import pytest
+import pandas as pd
+import os
+import sys
+import tempfile
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeSite:
+    """2レース (14:20 / 15:40 発走) の出馬表とオッズ API"""
+    def __init__(self):
+        self.odds = {'202605010111': {'01': '3.4', '02': '5.0'}, '202605010112': {'01': '2.0', '02': '9.0'}}
+        self.calls = {'entries': 0, 'odds': 0}
+
+    def search_races(self, date_str):
+        return [{'id': rid, 'url': f"u?race_id={rid}", 'title': f"{rid[-2:]}R", 'race_no': int(rid[-2:])}
+                for rid in self.odds]
+
+    def fetch_entries(self, url):
+        self.calls['entries'] += 1
+        post = '14:20' if url.endswith('11') else '15:40'
+        return [{'umaban': str(i), 'name': f"H{i}", 'horse_id': str(i), 'odds': '---', 'post_time': post} for i in (1, 2)]
+
+    def fetch_odds(self, race_id):
+        self.calls['odds'] += 1
+        return dict(self.odds[race_id])
+
+
+def _at(hhmm):
+    from app import scheduler
+    return scheduler.post_timestamp('20260124', hhmm)
+
+
+class TestPlan:
+    """発走時刻の読み取りとチェックポイント"""
+
+    def test_parse_post_time(self):
+        from app import scraper
+
+        assert scraper.parse_post_time("14:20発走 / 芝1800m (右 C)") == '14:20'
+        assert scraper.parse_post_time("9:50 発走 / ダ1200m") == '09:50'
+        assert scraper.parse_post_time("芝1800m") is None
+
+    def test_build_plan(self):
+        from app import scheduler
+
+        race = {'id': '202605010111', 'date': '20260124', 'post_at': _at('14:20')}
+        plan = scheduler.build_plan([race], now=_at('12:00'))
+        assert [(at, m) for at, m, _ in plan] == [(_at('13:20'), 60), (_at('13:50'), 30), (_at('14:10'), 10), (_at('14:17'), 3)]
+
+        # 途中から起動したら今すぐ1回、その後は残りのチェックポイント
+        plan = scheduler.build_plan([race], now=_at('14:00'))
+        assert [(at, m) for at, m, _ in plan] == [(_at('14:00'), 20), (_at('14:10'), 10), (_at('14:17'), 3)]
+        assert scheduler.build_plan([race], now=_at('14:30')) == []
+
+
+class TestScheduler:
+    """チェックポイントのレースだけオッズを取り直し、変わったレースだけ再予測する"""
+
+    def test_run(self, monkeypatch):
+        from app import scheduler, scraper, predictor, race_card_cache
+
+        site = FakeSite()
+        monkeypatch.setattr(scraper, 'search_races', site.search_races)
+        predicted = []
+
+        def predict_batch(races, power=None):
+            predicted.append(len(races))
+            return [pd.DataFrame({'name': [h['name'] for h in rd], 'odds': [h['odds'] for h in rd],
+                                  'win_prob': [0.5, 0.5], 'score': [1.0, 0.5]}) for rd in races]
+        monkeypatch.setattr(predictor, 'predict_batch', predict_batch)
+        monkeypatch.setattr(scraper, 'fetch_entries', site.fetch_entries)
+        monkeypatch.setattr(scraper, 'fetch_odds', site.fetch_odds)
+
+        class Sink:
+            def __init__(self):
+                self.added = []
+
+            def add(self, race, df):
+                self.added.append((race['id'], df['odds'].tolist()))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cards = race_card_cache.RaceCardCache(tmp, odds_ttl=scheduler.ODDS_TTL)
+            races = scheduler.load_races(['20260124'], cards=cards, now=_at('12:00'))
+            assert [r['post_time'] for r in races] == ['14:20', '15:40']
+            assert site.calls == {'entries': 2, 'odds': 0}
+
+            sink = Sink()
+            sched = scheduler.Scheduler(races, [sink], offsets=[30, 10], cards=cards, now=_at('12:00'))
+            assert sched.pending() == 4
+
+            sched.tick(_at('13:50')) # 11R の T-30
+            site.odds['202605010111']['01'] = '2.9'
+            sched.tick(_at('14:10')) # 11R の T-10 (オッズが変わった)
+            sched.tick(_at('15:10')) # 12R の T-30
+            sched.tick(_at('15:30')) # 12R の T-10 (変わらない)
+            assert sched.pending() == 0
+            # レース当日なので、チェックポイントごとに出馬表も取り直す (DAY_OF_TTL 切れ: 天候・馬場・騎手変更)
+            assert site.calls == {'entries': 6, 'odds': 4}
+            assert sink.added == [('202605010111', ['3.4', '5.0']), ('202605010111', ['2.9', '5.0']),
+                                  ('202605010112', ['2.0', '9.0'])]
+            assert sched.stats == {'ticks': 4, 'refreshed': 4, 'rescored': 3, 'unchanged': 1}
+
+    def test_run_waits(self, monkeypatch):
+        """run() は次のチェックポイントまで sleep し、近いチェックポイントはまとめて処理する"""
+        from app import scheduler
+
+        races = [{'id': f"20260501011{i}", 'date': '20260124', 'post_at': _at('14:20') + i * 30} for i in range(3)]
+        sched = scheduler.Scheduler(races, [], offsets=[10], now=_at('12:00'))
+        ticks = []
+        monkeypatch.setattr(sched, 'tick', lambda now: ticks.append(now) or sched.plan.clear())
+        clock = [_at('14:00')]
+        sched.run(clock=lambda: clock[0], sleep=lambda s: clock.__setitem__(0, clock[0] + s))
+        assert ticks == [_at('14:10')]
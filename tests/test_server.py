@@ -0,0 +1,136 @@
+"""
+app.server (常駐の予測サーバー) のテスト
+"""
+import pytest
+import pandas as pd
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def fake_predict_batch(races, power=None):
+    out = []
+    for race_data in races:
+        if not race_data:
+            out.append("No data to predict.")
+            continue
+        n = len(race_data)
+        out.append(pd.DataFrame({
+            'umaban': [h['umaban'] for h in race_data], 'name': [h['name'] for h in race_data], 'jockey': 'J',
+            'odds': [h['odds'] for h in race_data], 'win_prob': [1.0 / n] * n, 'score': [float(power or 4)] * n,
+            'kelly': [0.0] * n
+        }))
+    return out
+
+
+def _race(race_id, n=3):
+    return [{'race_id': race_id, 'umaban': i + 1, 'name': f"H{i}", 'odds': '2.0'} for i in range(n)]
+
+
+@pytest.fixture
+def running(monkeypatch):
+    """予測をモックしたサーバーをスレッドで起動して (service, base_url) を返す"""
+    from app import server, predictor
+
+    monkeypatch.setattr(predictor, 'predict_batch', fake_predict_batch)
+    monkeypatch.setattr(predictor, 'load_artifacts', lambda reload=False: (None, None))
+    service = server.PredictionService()
+    srv = server.make_server(service, port=0)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield service, f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+    srv.server_close()
+
+
+def _post(url, body):
+    req = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'), method='POST')
+    with urllib.request.urlopen(req) as res:
+        return json.loads(res.read())
+
+
+class TestLoadArtifacts:
+    """モデル・encoders はファイルが更新されたときだけ読み直す"""
+
+    def test_reload_on_change(self, monkeypatch):
+        import joblib
+        from app import predictor
+        from train import settings
+
+        with tempfile.TemporaryDirectory() as tmp:
+            model_path = os.path.join(tmp, 'model.pkl')
+            joblib.dump({'v': 1}, model_path)
+            joblib.dump({'enc': 1}, os.path.join(tmp, 'encoders.pkl'))
+            monkeypatch.setattr(settings, 'MODEL_DIR', tmp)
+            monkeypatch.setattr(settings, 'MODEL_PATH', model_path)
+            monkeypatch.setattr(predictor, '_loaded', {})
+
+            model, artifacts = predictor.load_artifacts()
+            assert predictor.load_artifacts()[0] is model
+
+            joblib.dump({'v': 2}, model_path)
+            os.utime(model_path, (1e9, 2e9))
+            model = predictor.load_artifacts()[0]
+            assert model == {'v': 2}
+            assert predictor.load_artifacts(reload=True)[0] is not model # reload=True は必ず読み直す
+            assert predictor.artifacts_info()['model_mtime'] == 2e9
+
+
+class TestServer:
+    """HTTP のエンドポイント"""
+
+    def test_predict(self, running):
+        service, base = running
+        res = _post(base + '/predict', {'races': [_race('202605010101'), [], _race('202605010102', 5)], 'top': 2,
+                                        'power': 3})
+        first, empty, last = res['results']
+        assert first['race_id'] == '202605010101' and [h['rank'] for h in first['ranking']] == [1, 2]
+        assert first['ranking'][0] == {'rank': 1, 'umaban': 1, 'name': 'H0', 'jockey': 'J', 'odds': '2.0',
+                                       'win_prob': pytest.approx(1 / 3), 'score': 3.0, 'kelly': 0.0}
+        assert empty == {'race_id': '1', 'error': 'No data to predict.'}
+        assert len(last['ranking']) == 2 and res['elapsed_ms'] >= 0
+
+        with pytest.raises(urllib.error.HTTPError) as e:
+            _post(base + '/predict', {})
+        assert e.value.code == 400
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(base + '/nope')
+        assert e.value.code == 404
+
+        assert _post(base + '/reload', {})['status'] == 'ok'
+        with urllib.request.urlopen(base + '/metrics') as r:
+            metrics = json.loads(r.read())
+        assert metrics['POST /predict']['calls'] == 2
+        assert metrics['predict']['items'] == 3
+        assert set(metrics['POST /predict']) >= {'p50_ms', 'p95_ms', 'items_per_s'}
+
+    @pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="Unix sockets only")
+    def test_unix_socket(self, monkeypatch):
+        from app import server, predictor
+
+        monkeypatch.setattr(predictor, 'predict_batch', fake_predict_batch)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'keiba.sock')
+            srv = server.make_server(server.PredictionService(), socket_path=path)
+            threading.Thread(target=srv.serve_forever, daemon=True).start()
+            try:
+                body = json.dumps({'races': [_race('202605010101')]}).encode('utf-8')
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                    s.connect(path)
+                    s.sendall(b"POST /predict HTTP/1.0\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+                    data = b''
+                    while chunk := s.recv(65536):
+                        data += chunk
+                head, _, payload = data.partition(b'\r\n\r\n')
+                assert head.startswith(b'HTTP/1.0 200')
+                assert json.loads(payload)['results'][0]['ranking'][0]['name'] == 'H0'
+            finally:
+                srv.shutdown()
+                srv.server_close()
@@ -0,0 +1,123 @@
+"""
+train.staking (分数 Kelly 配分と資金推移シミュレーション) のテスト
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import os
+import sys
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _make_races(n_races=300, seed=0):
+    """日付・softmax 確率・オッズ付きの疑似レース (1日12レース)"""
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(5, 17, n_races)
+    codes = np.repeat(np.arange(n_races), sizes)
+    df = pd.DataFrame({
+        'race_id': np.repeat([202505010101 + i for i in range(n_races)], sizes),
+        'date': pd.Timestamp('2025-01-05') + pd.to_timedelta(codes // 12, unit='D'),
+        'win_prob': rng.normal(size=len(codes)),
+        'rank': np.concatenate([rng.permutation(s) + 1 for s in sizes]).astype(float),
+        'odds': np.round(rng.lognormal(2.0, 0.9, len(codes)), 1) + 1.0
+    })
+    return df, codes
+
+
+def _kelly_loop(p, o):
+    """1レースの同時 Kelly 配分 (期待値の高い順に集合へ足していく素朴な実装)"""
+    order = sorted(range(len(p)), key=lambda i: -p[i] * o[i])
+    chosen, r = [], 1.0
+    for i in order:
+        if p[i] * o[i] <= r:
+            break
+        chosen.append(i)
+        sp = sum(p[j] for j in chosen)
+        si = sum(1 / o[j] for j in chosen)
+        if si >= 1:
+            chosen.pop()
+            break
+        r = (1 - sp) / (1 - si)
+    f = np.zeros(len(p))
+    for i in chosen:
+        f[i] = max(p[i] - r / o[i], 0.0)
+    return f
+
+
+class TestKelly:
+    """Kelly 配分"""
+
+    def test_matches_loop(self):
+        from train import staking
+
+        df, codes = _make_races()
+        prob = staking.softmax_by_race(codes, df['win_prob'].to_numpy())
+        odds = df['odds'].to_numpy()
+        stakes = staking.kelly_stakes(codes, prob, odds)
+        assert (stakes > 0).any()
+        for c in range(codes.max() + 1):
+            rows = codes == c
+            np.testing.assert_allclose(stakes[rows], _kelly_loop(prob[rows], odds[rows]), atol=1e-12)
+
+    def test_optimal_growth(self):
+        """配分を少しずらすと期待対数成長率が下がる"""
+        from train import staking
+
+        p = np.array([0.4, 0.3, 0.2, 0.1])
+        o = np.array([2.0, 4.0, 6.0, 8.0])
+        f = staking.kelly_stakes(np.zeros(4, dtype=np.int64), p, o)
+        assert (f > 0).sum() == 2
+
+        def growth(f):
+            return (p * np.log(1 - f.sum() + f * o)).sum()
+
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            g = np.maximum(f + rng.normal(0, 0.01, 4), 0)
+            assert growth(g) <= growth(f) + 1e-12
+
+
+class TestBankroll:
+    """資金推移"""
+
+    def test_matches_daily_loop(self):
+        """1日ずつ資金を更新するループと一致する (レース・1日の上限を含む)"""
+        from train import staking
+
+        df, codes = _make_races(seed=1)
+        prob = staking.softmax_by_race(codes, df['win_prob'].to_numpy())
+        day = df['date'].to_numpy().astype('datetime64[D]').astype(np.int64)
+        table = staking.race_table(df['race_id'].to_numpy(), day, prob, df['odds'].to_numpy(), df['rank'].to_numpy(),
+                                   fraction=0.5, race_cap=0.08)
+        result = staking.simulate(table, day_cap=0.15, bankroll=1000)
+
+        bankroll, cost, ret = 1000.0, 0.0, 0.0
+        for d in np.unique(table['day']):
+            rows = (table['day'] == d) & table['has_winner']
+            stake = table['stake'][rows].sum()
+            scale = min(1.0, 0.15 / stake) if stake > 0 else 1.0
+            spent = bankroll * scale * stake
+            won = bankroll * scale * table['payout'][rows].sum()
+            cost, ret = cost + spent, ret + won
+            bankroll += won - spent
+        assert np.isclose(result['final_bankroll'], bankroll)
+        assert np.isclose(result['cost'], cost)
+        assert np.isclose(result['return'], ret)
+        assert (table['stake'] <= 0.08 + 1e-12).all()
+
+    def test_grid_kelly_rows(self):
+        """戦略グリッドの賭け式 'kelly' の行が閾値ごとのシミュレーションと一致する"""
+        from train import grid, staking, backtest
+
+        df, codes = _make_races(seed=2)
+        arrays = grid.to_arrays(df)
+        res = grid.evaluate_cell(arrays, 1, 0, 99, ['win', 'kelly'], [0.0, 1.0])
+        kelly = res[(res['betting_type'] == 'kelly') & (res['place_code'] == 'all')].set_index('min_score')
+        assert all(c in res.columns for c in grid.KELLY_COLUMNS)
+
+        df['score'] = df['win_prob'] * df['odds']
+        expected = staking.kelly_backtest(df, min_score=1.0)
+        assert kelly.loc[1.0, 'bets'] == expected['bets']
+        assert np.isclose(kelly.loc[1.0, 'final_bankroll'], expected['final_bankroll'])
@@ -0,0 +1,155 @@
+"""
+train.preprocess のチャンク処理 (preprocess_stream) のテスト
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import os
+import sys
+import tempfile
+import shutil
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _make_results(year, n_days=4, races_per_day=3, field=6, seed=0):
+    """同じ馬・騎手・調教師が年を跨いで出走する小さな results_YYYY.csv"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for d in range(n_days):
+        month, day = 1 + d * 3, 5 + d
+        for r in range(races_per_day):
+            race_id = f"{year}0501{d + 1:02d}{r + 1:02d}"
+            course_type = 'turf' if r % 2 == 0 else 'dirt'
+            distance = [1200, 1600, 2000][r]
+            horses = rng.choice(20, field, replace=False)
+            ranks = rng.permutation(field) + 1
+            for i, (h, rank) in enumerate(zip(horses, ranks)):
+                rows.append({
+                    'race_id': race_id, 'course_type': course_type, 'distance': distance,
+                    'weather': 'sunny', 'condition': 'good',
+                    'year': year, 'month': month, 'day': day,
+                    'rank': rank if rank != field or r != 1 else '取消',
+                    'waku': i // 2 + 1, 'umaban': i + 1,
+                    'horse_id': f"2019{h:06d}",
+                    'jockey_id': f"{rng.integers(0, 5):05d}",
+                    'trainer_id': f"{rng.integers(0, 4):05d}",
+                    'weight_diff': int(rng.integers(-6, 7)),
+                    'time': f"1:{30 + distance // 200 + rng.random() * 3:.1f}",
+                    'passing': f"{rng.integers(1, 12)}-{rng.integers(1, 12)}",
+                    'last_3f': round(34 + rng.random() * 3, 1),
+                    'odds': round(1.5 + rng.random() * 30, 1)
+                })
+    return pd.DataFrame(rows)
+
+
+class TestStreamingPreprocess:
+    """チャンク処理の結果が一括処理と一致すること"""
+
+    def setup_method(self):
+        from train import settings
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orig_raw_dir = settings.RAW_DATA_DIR
+        settings.RAW_DATA_DIR = self.tmp_dir
+        for i, year in enumerate([2023, 2024, 2025]):
+            _make_results(year, seed=i).to_csv(os.path.join(self.tmp_dir, f"results_{year}.csv"), index=False)
+        profiles = pd.DataFrame({
+            'horse_id': [f"2019{h:06d}" for h in range(20)],
+            'sire_id': [f"s{h % 4}" for h in range(20)],
+            'damsire_id': [f"d{h % 3}" for h in range(20)]
+        })
+        profiles.to_csv(os.path.join(self.tmp_dir, "horse_profiles.csv"), index=False)
+
+    def teardown_method(self):
+        from train import settings
+        settings.RAW_DATA_DIR = self.orig_raw_dir
+        shutil.rmtree(self.tmp_dir)
+
+    @pytest.mark.parametrize('freq', ['year', 'month'])
+    def test_stream_matches_in_memory(self, freq):
+        """年・月単位のチャンク処理が preprocess(load_data()) と同じ行・値・成果物になること"""
+        from train import preprocess, settings
+
+        expected, expected_artifacts = preprocess.preprocess(preprocess.load_data(2023, 2025))
+
+        state = preprocess.PreprocessState()
+        chunks = list(preprocess.preprocess_stream(2023, 2025, freq=freq, state=state))
+        assert len(chunks) > 1
+        actual = pd.concat(chunks, ignore_index=True)[expected.columns]
+
+        pd.testing.assert_frame_equal(actual, expected.reset_index(drop=True), check_dtype=False)
+
+        artifacts = state.artifacts()
+        for key in ['jockey_win_rate', 'trainer_win_rate', 'sire_win_rate', 'aptitude_type', 'aptitude_dist']:
+            assert artifacts[key] == expected_artifacts[key]
+        for col in settings.CATEGORY_COLS:
+            assert list(artifacts[col].classes_) == list(expected_artifacts[col].classes_)
+
+    def test_expanding_rates_use_only_past_races(self):
+        """累積勝率・前走特徴量が過去のレースのみから計算されること"""
+        from train import preprocess
+
+        df, _ = preprocess.preprocess(preprocess.load_data(2023, 2025))
+        raw = df[['date', 'race_id', 'jockey_id', 'is_win', 'jockey_win_rate']]
+
+        # 騎手ごとに、それ以前の行の勝率と一致する
+        for _, g in raw.groupby('jockey_id'):
+            wins = g['is_win'].cumsum() - g['is_win']
+            counts = np.arange(len(g))
+            expected = np.where(counts > 0, wins / np.maximum(counts, 1), 0)
+            np.testing.assert_allclose(g['jockey_win_rate'].to_numpy(), expected)
+        assert df['date'].is_monotonic_increasing
+
+
+class TestAsOfStats:
+    """時点別の勝率インデックス (train.asof_stats)"""
+
+    def setup_method(self):
+        TestStreamingPreprocess.setup_method(self)
+
+    def teardown_method(self):
+        TestStreamingPreprocess.teardown_method(self)
+
+    def test_transform_matches_training(self):
+        """学習期間内の行を transform すると学習時と同じ累積勝率になること"""
+        from train import preprocess
+
+        expected, artifacts = preprocess.preprocess(preprocess.load_data(2023, 2025))
+        actual = preprocess.transform(preprocess.load_data(2023, 2025), artifacts)
+
+        cols = [c for c, _ in preprocess.EXPANDING_RATES]
+        key = ['race_id', 'horse_id']
+        expected = expected.assign(race_id=expected['race_id'].astype(str))
+        merged = expected[key + ['date'] + cols].merge(
+            actual[key + cols].assign(race_id=actual['race_id'].astype(str)),
+            on=key, suffixes=('', '_asof'))
+        assert len(merged) == len(expected)
+        for col in cols:
+            np.testing.assert_allclose(merged[col + '_asof'], merged[col], err_msg=col)
+
+    def test_after_training_matches_final_maps(self):
+        """学習期間より後の時点では最終時点の勝率マップと同じ値になること"""
+        from train import preprocess, asof_stats
+
+        _, artifacts = preprocess.preprocess(preprocess.load_data(2023, 2025))
+        index = artifacts['asof_stats']
+        jockeys = sorted(artifacts['jockey_win_rate'].keys()) + ['99999']
+        race_key = asof_stats.race_keys(['2026-01-05'] * len(jockeys), ['202605010101'] * len(jockeys))
+        horse_key = asof_stats.horse_keys(['2019000001'] * len(jockeys))
+        rates = asof_stats.rates(index, 'jockey_win_rate', np.array(jockeys), race_key, horse_key)
+        np.testing.assert_allclose(rates, [artifacts['jockey_win_rate'].get(j, 0.0) for j in jockeys])
+
+    def test_stream_matches_in_memory(self):
+        """月単位のチャンク処理でも同じインデックスになること"""
+        from train import preprocess
+
+        _, expected = preprocess.preprocess(preprocess.load_data(2023, 2025))
+        state = preprocess.PreprocessState()
+        list(preprocess.preprocess_stream(2023, 2025, freq='month', state=state))
+        actual = state.artifacts()['asof_stats']
+        np.testing.assert_array_equal(actual['races'], expected['asof_stats']['races'])
+        np.testing.assert_array_equal(actual['times'], expected['asof_stats']['times'])
+        for name, table in expected['asof_stats']['tables'].items():
+            for field in ['keys', 'offsets', 'composite', 'wins']:
+                np.testing.assert_array_equal(actual['tables'][name][field], table[field])
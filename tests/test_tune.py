@@ -0,0 +1,68 @@
+"""
+train.tune (Walk-forward CV / ハイパーパラメータ探索) のテスト
+"""
+import pytest
+import numpy as np
+import os
+import sys
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _FakeStore:
+    """FeatureStore と同じく race_id 順に並んだ配列だけを持つダミー"""
+    def __init__(self, race_ids):
+        self.race_id = np.array(race_ids, dtype=np.int64)
+
+    @property
+    def year(self):
+        return self.race_id // 10**8
+
+    def year_slice(self, first_year, last_year):
+        years = self.year
+        return slice(int(np.searchsorted(years, first_year, 'left')), int(np.searchsorted(years, last_year, 'right')))
+
+
+class TestWalkForwardFolds:
+    """make_folds が年 <= Y 学習 / Y+1 検証 の連続スライスを返すこと"""
+
+    def test_folds_are_contiguous_year_slices(self):
+        from train.tune import make_folds
+
+        race_ids = [202201010101] * 3 + [202301010101] * 2 + [202401010101] * 4
+        folds = make_folds(_FakeStore(race_ids))
+
+        assert [f[4] for f in folds] == [2023, 2024]
+        assert folds[0][:4] == (0, 3, 3, 5)
+        assert folds[1][:4] == (0, 5, 5, 9)
+
+        assert [f[4] for f in make_folds(_FakeStore(race_ids), n_folds=1)] == [2024]
+
+
+class TestTop1WinStats:
+    """top1_win_stats がレースごとのスコア1位だけを単勝で評価すること"""
+
+    def test_matches_manual_calculation(self):
+        from train.tune import top1_win_stats
+
+        race_ids = np.array([1, 1, 1, 2, 2, 3, 3])
+        scores = np.array([0.1, 0.9, 0.5, 0.3, 0.2, 0.4, 0.8])
+        ranks = np.array([2, 1, 3, 2, 1, 1, 2])
+        odds = np.array([5.0, 2.5, 8.0, 3.0, 4.0, 6.0, 1.5])
+
+        bets, hits, ret = top1_win_stats(race_ids, scores, ranks, odds)
+        # race1: 2.5倍的中, race2: 外れ, race3: 外れ
+        assert (bets, hits, ret) == (3, 1, 250.0)
+
+    def test_sample_configs_starts_with_baseline(self):
+        from train.tune import sample_configs
+
+        configs = sample_configs(10)
+        assert configs[0] == {}
+        assert len(configs) == 10
+        assert len({str(sorted(c.items())) for c in configs}) == 10
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,64 @@
+"""
+train.walk_forward (週ごとの walk-forward シミュレーション) のテスト
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import os
+import sys
+import tempfile
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _write_store(path, n_days=30, races_per_day=6, size=8, seed=0):
+    """土日開催の疑似データで特徴量ストアを作る (x0 が着順と相関する)"""
+    from train import feature_store
+
+    rng = np.random.default_rng(seed)
+    days = pd.date_range('2025-01-04', periods=n_days * 4, freq='D')
+    days = days[days.dayofweek >= 5][:n_days]
+    rows = []
+    for d_i, day in enumerate(days):
+        for r in range(races_per_day):
+            ranks = rng.permutation(size) + 1
+            for rank in ranks:
+                rows.append({'race_id': str(2025 * 10**8 + d_i * 100 + r + 1), 'rank': rank, 'odds': float(rng.integers(2, 30)),
+                             'date': day, 'x0': -rank + rng.normal(0, 2), 'x1': rng.random()})
+    df = pd.DataFrame(rows)
+    feature_store._write_store(df, {}, ['x0', 'x1'], path)
+    return feature_store.FeatureStore(path)
+
+
+class TestWalkForward:
+    """週ごとの再学習・追加学習"""
+
+    def test_week_starts(self):
+        from train import walk_forward
+
+        dates = pd.to_datetime(['2025-01-04', '2025-01-05', '2025-01-11', '2025-01-19']).to_numpy()
+        weeks = walk_forward.week_starts(dates, '2025-01-05')
+        assert [str(w) for w in weeks] == ['2024-12-30', '2025-01-06', '2025-01-13']
+
+    def test_replay(self):
+        from train import walk_forward
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = _write_store(os.path.join(tmp, 'store'))
+            weeks = walk_forward.week_starts(store.date, '2025-02-01')
+            full = walk_forward.full_dataset(store)
+            assert os.path.exists(walk_forward._dataset_path(store))
+
+            res = walk_forward.replay(store, weeks, full, refit_every=2, refit_rounds=10, update_rounds=3)
+            assert res['mode'].tolist()[:4] == ['refit', 'update', 'refit', 'update']
+            assert res['trees'].tolist()[:2] == [10, 13]
+            # 再学習はその週より前のレースだけを使う
+            days = np.asarray(store.date).astype('datetime64[D]')
+            for week, mode, fit_rows in zip(weeks, res['mode'], res['fit_rows']):
+                if mode == 'refit':
+                    assert fit_rows == int((days < week).sum())
+            assert res['races'].sum() == len(np.unique(np.asarray(store.race_id)[days >= weeks[0]]))
+            # キャッシュした Dataset から再生しても同じ結果
+            again = walk_forward.replay(store, weeks, walk_forward.full_dataset(store), refit_every=2, refit_rounds=10, update_rounds=3)
+            np.testing.assert_allclose(res['roi'], again['roi'])
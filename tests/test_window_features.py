@@ -0,0 +1,74 @@
+"""
+train.window_features (lag-k / ローリング統計) のテスト
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import os
+import sys
+
+# プロジェクトルートを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _make_history(n=3000, n_horses=200, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'horse_id': rng.integers(0, n_horses, n).astype(str),
+        'date': pd.Timestamp('2020-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 1500, n)), 'D'),
+        'rank': rng.integers(1, 18, n).astype(float),
+        'speed_index': rng.normal(size=n),
+        'last_3f_time': rng.normal(35, 1, n)
+    })
+    df.loc[rng.random(n) < 0.05, 'speed_index'] = np.nan
+    return df
+
+
+class TestWindowFeatures:
+    """groupby().shift() / rolling() と同じ値になること"""
+
+    def test_matches_pandas_groupby(self):
+        from train import window_features
+
+        df = _make_history()
+        out = window_features.compute(df)
+        g = df.groupby('horse_id')
+
+        for src, name, default in window_features.WINDOW_SOURCES:
+            for k in range(1, window_features.MAX_LAG + 1):
+                expected = g[src].shift(k).fillna(default)
+                np.testing.assert_allclose(out[f'lag{k}_{name}'], expected)
+
+            rolling = g[src].shift(1).groupby(df['horse_id']).rolling(window_features.WINDOW, min_periods=1)
+            for stat, fill in [('mean', default), ('min', default), ('std', 0)]:
+                expected = getattr(rolling, stat)().reset_index(level=0, drop=True).reindex(df.index).fillna(fill)
+                np.testing.assert_allclose(out[f'{name}_{stat}{window_features.WINDOW}'], expected)
+
+        interval = (df['date'] - g['date'].shift(1)).dt.days.fillna(365)
+        np.testing.assert_allclose(out['interval'], interval)
+        assert list(out.index) == list(df.index)
+
+    def test_carried_tail_gives_same_result(self):
+        """前半の直近走 (tail) を付けて後半を計算しても、全体で計算した結果と同じになること"""
+        from train import window_features
+
+        df = _make_history(seed=1)
+        full = window_features.compute(df)
+
+        half = len(df) // 2
+        carried = window_features.tail(df.iloc[:half])
+        assert carried.groupby('horse_id').size().max() <= window_features.depth()
+
+        combined = pd.concat([carried, df.iloc[half:]], ignore_index=True)
+        second = window_features.compute(combined).iloc[len(carried):]
+        np.testing.assert_allclose(second.to_numpy(), full.iloc[half:].to_numpy())
+
+    def test_no_history_defaults(self):
+        """過去走が無い馬は lag 99/0、interval 365、std 0 になること"""
+        from train import window_features
+
+        out = window_features.compute(pd.DataFrame({'horse_id': ['a', 'b', None]}))
+        assert (out['lag1_rank'] == 99).all()
+        assert (out['lag5_speed_index'] == 0).all()
+        assert (out['rank_std5'] == 0).all()
+        assert (out['interval'] == 365).all()
@@ -0,0 +1,121 @@
+"""
+騎手・調教師・種牡馬・母父・(馬,芝ダ)・(馬,距離区分) ごとの累積 (出走数, 勝利数) の時点別インデックス。
+
+学習時の expanding window (preprocess.EXPANDING_RATES) は「(date, race_id, horse_id) の順で
+自分より前の行」の勝率なので、同じ順序の時刻キー (レース番号 * HORSE_SCALE + horse_id) を付けた
+出走記録をエンティティ・時刻順に並べ、勝利数の累積和と一緒に持っておく。
+任意の行の「時点 t での勝率」は
+    (エンティティ番号 * span + 時刻番号) の合成キーを searchsorted
+するだけで全行まとめて求まる。学習期間内の行は学習時と同じ値になり、学習期間より後の行
+(推論・評価) は最終時点の勝率 (従来の encoders.pkl の勝率マップ) と同じ値になる。
+
+成果物には numpy 配列の dict として保存する (artifacts['asof_stats'])。
+"""
+import numpy as np
+import pandas as pd
+
+DAY_SCALE = 10 ** 8 # レースキー = 日数 * DAY_SCALE + race_id の下8桁 (場・回・日・R)
+HORSE_SCALE = 2 ** 35 # 時刻キー = レース番号 * HORSE_SCALE + horse_id (10桁の数字)
+UNDATED_DAY = 99999 # 日付不明の行は最後 (学習時と同じ)
+
+def race_keys(dates, race_ids):
+    """(date, race_id) の順序を保つ int64 のレースキー"""
+    dates = pd.to_datetime(pd.Series(np.asarray(dates)), errors='coerce')
+    days = dates.to_numpy().astype('datetime64[D]').astype(np.int64)
+    days = np.where(dates.isna().to_numpy(), UNDATED_DAY, days)
+    race = pd.to_numeric(pd.Series(np.asarray(race_ids)), errors='coerce').fillna(0).astype('int64').to_numpy()
+    return days * DAY_SCALE + race % DAY_SCALE
+
+def horse_keys(horse_ids):
+    """
+    レース内の順番 (学習時の horse_id 昇順) を保つ整数。
+    horse_id は同じ桁数の数字なので数値の順と文字列の順が同じ。数字でない ID は 0 (レースの先頭) 扱い。
+    """
+    num = pd.to_numeric(pd.Series(np.asarray(horse_ids)), errors='coerce').fillna(0)
+    return num.clip(0, HORSE_SCALE - 1).astype('int64').to_numpy()
+
+def _time_keys(races, race_key, horse_key):
+    # インデックスに無いレースは horse_id を見ない (そのレースより前の出走だけを数える)
+    tick = np.searchsorted(races, race_key)
+    known = tick < len(races)
+    known[known] = races[tick[known]] == race_key[known]
+    return tick.astype(np.int64) * HORSE_SCALE + np.where(known, horse_key, 0)
+
+def entity_keys(df, columns):
+    """エンティティのキー文字列 (複合キーは '|' 区切り) と、キーが揃っている行のマスク"""
+    valid = df[columns].notna().all(axis=1).to_numpy()
+    keys = df[columns[0]].astype(str)
+    for col in columns[1:]:
+        keys = keys + '|' + df[col].astype(str)
+    return keys.to_numpy(dtype=str), valid
+
+def build(events, columns):
+    """
+    events: {name: [(keys, race_key, horse_key, is_win), ...]} (チャンクごとの出走記録)
+    columns: {name: グループキーの列名リスト}
+    """
+    merged = {}
+    for name, parts in events.items():
+        if parts:
+            merged[name] = [np.concatenate(v) for v in zip(*parts)]
+    races = np.unique(np.concatenate([r for _, r, _, _ in merged.values()])) if merged else np.zeros(0, np.int64)
+    for name, (keys, race_key, horse_key, win) in merged.items():
+        merged[name] = (keys, _time_keys(races, race_key, horse_key), win)
+    times = np.unique(np.concatenate([t for _, t, _ in merged.values()])) if merged else np.zeros(0, np.int64)
+
+    span = len(times) + 1
+    tables = {}
+    for name, (keys, t, win) in merged.items():
+        uniq, codes = np.unique(keys, return_inverse=True)
+        order = np.lexsort((t, codes))
+        codes, t, win = codes[order], t[order], win[order].astype(np.int64)
+        offsets = np.searchsorted(codes, np.arange(len(uniq) + 1))
+        # エンティティ内の勝利数の累積 (その出走を含む)
+        wins = np.cumsum(win)
+        wins -= np.repeat(wins[offsets[:-1]] - win[offsets[:-1]], np.diff(offsets))
+        tables[name] = {
+            'columns': list(columns[name]),
+            'keys': uniq,
+            'offsets': offsets.astype(np.int64),
+            # エンティティ順・時刻順に単調増加する合成キー
+            'composite': codes.astype(np.int64) * span + np.searchsorted(times, t),
+            'wins': wins.astype(np.int32)
+        }
+    return {'races': races, 'times': times, 'tables': tables}
+
+def rates(index, name, keys, race_key, horse_key, valid=None):
+    """各行のレース時点 (race_key, horse_key) より前の勝率 (出走なし・未知のエンティティは 0)"""
+    table = index['tables'].get(name)
+    if table is None or len(keys) == 0:
+        return np.zeros(len(keys))
+    span = len(index['times']) + 1
+    uniq = table['keys']
+    code = np.searchsorted(uniq, keys)
+    found = code < len(uniq)
+    found[found] = uniq[code[found]] == keys[found]
+    if valid is not None:
+        found &= valid
+    code = np.where(found, code, 0)
+
+    tick = np.searchsorted(index['times'], _time_keys(index['races'], race_key, horse_key), side='left')
+    pos = np.searchsorted(table['composite'], code * span + tick, side='left')
+    count = np.where(found, pos - table['offsets'][code], 0)
+    wins = np.where(count > 0, table['wins'][np.maximum(pos - 1, 0)], 0)
+    return np.where(count > 0, wins / np.maximum(count, 1), 0.0)
+
+def lookup(index, df, dates=None):
+    """
+    df の各行 (date, race_id, horse_id) の時点での全テーブルの勝率を DataFrame で返す。
+    キー列が無いテーブルは 0。dates を渡すと df['date'] の代わりに使う。
+    """
+    dates = df['date'] if dates is None else dates
+    race_key = race_keys(dates, df['race_id'] if 'race_id' in df.columns else np.zeros(len(df)))
+    horse_key = horse_keys(df['horse_id'])
+    out = pd.DataFrame(index=df.index)
+    for name, table in index['tables'].items():
+        if all(c in df.columns for c in table['columns']):
+            keys, valid = entity_keys(df, table['columns'])
+            out[name] = rates(index, name, keys, race_key, horse_key, valid)
+        else:
+            out[name] = 0.0
+    return out
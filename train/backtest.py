@@ -0,0 +1,316 @@
+"""
+ベクトル化したバックテストエンジン。
+
+レースごとにスコア順へ1回だけ並べ替え (lexsort: race_id, -score)、上位 k 頭の
+着順・オッズを (レース数 × k) の配列として取り出してから、全ての賭け式の
+的中・投資額・払戻をまとめて計算する。
+結果は evaluate.evaluate の従来のループ (simulate_loop) と一致する。
+"""
+import numpy as np
+import pandas as pd
+
+BET_AMOUNT = 100
+TOP_K = 3
+
+BETTING_TYPES = ['win', 'place', 'trifecta', 'box_trifecta', 'uma_ren', 'wide']
+
+def top_k(df, k=TOP_K, score_col='score'):
+    """
+    レースごとにスコア降順 (同点は行順) で上位 k 頭を取り出す。
+    戻り値は dict:
+        race_id  : (R,)   レースID
+        size     : (R,)   出走頭数
+        has_winner: (R,)  1着馬がいるか
+        rank / odds / score : (R, k) 上位 k 頭の値 (頭数が足りない所は NaN)
+        umaban   : (R, k) df に umaban 列がある場合のみ (払戻テーブルの参照用)
+    """
+    race_codes, race_ids = pd.factorize(df['race_id'])
+    valid = race_codes >= 0 # race_id 欠損行は除外 (groupby と同じ)
+    race_codes = race_codes[valid]
+    scores = pd.to_numeric(df[score_col], errors='coerce').to_numpy(dtype=np.float64)[valid]
+    ranks = pd.to_numeric(df['rank'], errors='coerce').to_numpy(dtype=np.float64)[valid]
+    odds = pd.to_numeric(df['odds'], errors='coerce').to_numpy(dtype=np.float64)[valid]
+    columns = [('rank', ranks), ('odds', odds), ('score', scores)]
+    if 'umaban' in df.columns:
+        columns.append(('umaban', pd.to_numeric(df['umaban'], errors='coerce').to_numpy(dtype=np.float64)[valid]))
+
+    n_races = len(race_ids)
+    # スコア降順、NaN は最後 (sort_values(ascending=False) と同じ)
+    neg = np.where(np.isnan(scores), np.inf, -scores)
+    order = np.lexsort((neg, race_codes))
+    sorted_codes = race_codes[order]
+
+    size = np.bincount(race_codes, minlength=n_races)
+    starts = np.zeros(n_races, dtype=np.int64)
+    starts[1:] = np.cumsum(size)[:-1]
+    pos = np.arange(len(order)) - starts[sorted_codes]
+
+    top = {
+        'race_id': np.asarray(race_ids),
+        'size': size,
+        'has_winner': np.bincount(race_codes, weights=(ranks == 1), minlength=n_races) > 0
+    }
+    in_top = pos < k
+    rows = order[in_top]
+    for name, values in columns:
+        mat = np.full((n_races, k), np.nan)
+        mat[sorted_codes[in_top], pos[in_top]] = values[rows]
+        top[name] = mat
+    return top
+
+def _hits_and_points(top, betting_type):
+    """賭け式ごとの的中 (R,) と点数 (R,)"""
+    r = top['rank']
+    if r.shape[1] < TOP_K: # top_k(k=1) などで列が足りない場合は欠損扱い
+        r = np.pad(r, ((0, 0), (0, TOP_K - r.shape[1])), constant_values=np.nan)
+    r1, r2, r3 = r[:, 0], r[:, 1], r[:, 2]
+    n = len(r1)
+    has2 = top['size'] >= 2
+    has3 = top['size'] >= 3
+    points = np.ones(n)
+
+    if betting_type == 'win':
+        # Single Win on Top 1
+        hit = r1 == 1
+    elif betting_type == 'place':
+        # Place bet on Top 1 (Rank 1-3)
+        hit = r1 <= 3
+    elif betting_type == 'trifecta':
+        # 3-Ren-Tan (Exact order 1-2-3)
+        hit = (r1 == 1) & (r2 == 2) & (r3 == 3)
+    elif betting_type == 'box_trifecta':
+        # 3-Ren-Tan Box (Any order of top 3 horses in top 3 ranks)
+        s = np.sort(r[:, :3], axis=1)
+        hit = has3 & (s[:, 0] == 1) & (s[:, 1] == 2) & (s[:, 2] == 3)
+        points = np.where(has3, 6, 1) # 6 combinations
+    elif betting_type == 'uma_ren':
+        # Uma-Ren (Top 2 in 1st/2nd any order)
+        hit = has2 & (((r1 == 1) & (r2 == 2)) | ((r1 == 2) & (r2 == 1)))
+    elif betting_type == 'wide':
+        # Wide (Top 2 both in Top 3)
+        hit = has2 & (r1 <= 3) & (r2 <= 3)
+    else:
+        raise ValueError(f"Unknown betting_type: {betting_type}")
+    return hit, points
+
+def simulate(top, betting_type='win', min_score=0.0, bet_amount=BET_AMOUNT):
+    """
+    top_k() の結果から1つの賭け式の成績を計算する。
+    1着馬のいないレースは除外し、上位1頭のスコアが min_score 未満のレースは見送る。
+    単勝以外は払戻オッズが無いため return は 0 (的中率のみ)。
+    """
+    score1 = top['score'][:, 0]
+    bet = top['has_winner'] & ~(score1 < min_score)
+    hit, points = _hits_and_points(top, betting_type)
+    hit &= bet
+
+    payout = np.zeros(len(hit))
+    if betting_type == 'win':
+        payout = np.where(hit, bet_amount * top['odds'][:, 0], 0)
+
+    bet_races = int(bet.sum())
+    hits = int(hit.sum())
+    total_bet = float((bet_amount * points)[bet].sum())
+    total_return = float(payout[hit].sum())
+    return {
+        'betting_type': betting_type,
+        'total_races': len(hit),
+        'bet_races': bet_races,
+        'hits': hits,
+        'hit_rate': hits / bet_races if bet_races > 0 else 0,
+        'roi': (total_return / total_bet) * 100 if total_bet > 0 else 0,
+        'total_return': total_return,
+        'total_bet': total_bet
+    }
+
+def sweep_order(top, groups=None, betting_type='win', bet_amount=BET_AMOUNT, payout_index=None):
+    """
+    threshold_sweep 用に、レースを (グループ, 上位1頭のスコア) の昇順に並べる (スコア欠損のレースは除く)。
+    戻り値は (keys, 並べ替え後のグループコード, スコア, {'hit', 'top3', 'return', 'cost'}) 。
+    payout_index (payouts.PayoutIndex) を渡すと、単勝以外は払戻テーブルの払戻で集計する
+    (payout_backtest.STRATEGIES の買い方。払戻データの無いレースと買い目の無いレースは除く)。
+    """
+    score = top['score'][:, 0]
+    rank = top['rank'][:, 0]
+    odds = top['odds'][:, 0]
+    if groups is None:
+        groups = np.zeros(len(score), dtype=np.int64)
+    codes, keys = pd.factorize(pd.Series(groups), sort=True)
+
+    ok = ~np.isnan(score) # スコア欠損は どの閾値でも買わない
+    if payout_index is not None and betting_type != 'win':
+        from . import payout_backtest
+        cost, ret = payout_backtest.race_returns(top, payout_index, *payout_backtest.STRATEGIES[betting_type], bet_amount)
+        ok &= payout_backtest.bet_mask(top, payout_index) & (cost > 0)
+        hit = ret > 0
+    else:
+        hit, points = _hits_and_points(top, betting_type)
+        cost = bet_amount * points
+        ret = np.where(hit, bet_amount * odds, 0.0) if betting_type == 'win' else np.zeros(len(score))
+    order = np.lexsort((score, codes))
+    order = order[ok[order]]
+    outcomes = {
+        'hit': hit[order],
+        'top3': rank[order] <= 3,
+        'return': ret[order],
+        'cost': cost[order]
+    }
+    return keys, codes[order], score[order], outcomes
+
+def threshold_sweep(top, thresholds, groups=None, bet_amount=BET_AMOUNT, betting_type='win', payout_index=None):
+    """
+    上位1頭のスコアが閾値以上のレースに betting_type で賭けた場合の成績を、
+    全閾値 × グループ (競馬場など) について一度に計算する。
+    グループごとにレースを上位1頭のスコア順に並べ、閾値の位置を searchsorted で求めて累積和から集計する。
+    groups は top['race_id'] と同じ長さのキー配列 (None なら全体で1グループ)。
+    hits_top3 は上位1頭が3着以内だったレース数。
+    単勝以外の return は payout_index (払戻テーブル) を渡したときだけ計算する (無ければ 0)。
+    戻り値は DataFrame: group, min_score, bets, hits, hits_top3, return, cost
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    keys, sorted_codes, sorted_score, outcomes = sweep_order(top, groups, betting_type, bet_amount, payout_index)
+    win, top3, ret, cost = (outcomes[k] for k in ('hit', 'top3', 'return', 'cost'))
+
+    # 後ろからの累積和 (スコア上位側) を先頭に 0 を足して持つ
+    def suffix(values):
+        return np.concatenate([np.cumsum(values[::-1])[::-1], [0]])
+
+    frames = []
+    for g, key in enumerate(keys):
+        start, stop = np.searchsorted(sorted_codes, [g, g + 1])
+        s = sorted_score[start:stop]
+        pos = np.searchsorted(s, thresholds, side='left') # s[pos:] >= 閾値
+        n_win, n_top3, total, spent = (suffix(v[start:stop]) for v in (win, top3, ret, cost))
+        bets = len(s) - pos
+        frames.append(pd.DataFrame({
+            'group': key,
+            'min_score': thresholds,
+            'bets': bets,
+            'hits': n_win[pos].astype(np.int64),
+            'hits_top3': n_top3[pos].astype(np.int64),
+            'return': total[pos],
+            'cost': np.rint(spent[pos]).astype(np.int64)
+        }))
+    if not frames:
+        return pd.DataFrame(columns=['group', 'min_score', 'bets', 'hits', 'hits_top3', 'return', 'cost'])
+    return pd.concat(frames, ignore_index=True)
+
+def backtest(df, betting_types=None, min_score=0.0, bet_amount=BET_AMOUNT, score_col='score'):
+    """全ての賭け式の成績を1回のソートで計算する。{betting_type: metrics}"""
+    top = top_k(df, TOP_K, score_col)
+    return {bt: simulate(top, bt, min_score, bet_amount) for bt in (betting_types or BETTING_TYPES)}
+
+def simulate_loop(df, betting_type='win', min_score=0.0, bet_amount=BET_AMOUNT):
+    """
+    従来の evaluate.evaluate のレースごとのループ (比較・ベンチマーク用)。
+    top2/top3 の存在チェックのみ `is not None` に修正している。
+    """
+    bet_races = 0
+    hits = 0
+    total_bet = 0
+    total_return = 0
+
+    grouped = df.groupby('race_id')
+    for rid, group in grouped:
+        if group.empty: continue
+        if not (group['rank'] == 1).any(): continue
+
+        group_sorted = group.sort_values('score', ascending=False, kind='mergesort')
+        top1 = group_sorted.iloc[0]
+        top2 = group_sorted.iloc[1] if len(group) >= 2 else None
+        top3 = group_sorted.iloc[2] if len(group) >= 3 else None
+
+        if top1['score'] < min_score:
+            continue
+        bet_races += 1
+
+        hit = False
+        payout = 0
+        cost = bet_amount
+
+        if betting_type == 'win':
+            if top1['rank'] == 1:
+                hit = True
+                payout = bet_amount * top1['odds']
+        elif betting_type == 'place':
+            if top1['rank'] <= 3:
+                hit = True
+        elif betting_type == 'trifecta':
+            if top1['rank'] == 1 and top2 is not None and top2['rank'] == 2 and top3 is not None and top3['rank'] == 3:
+                hit = True
+        elif betting_type == 'box_trifecta':
+            if top3 is not None:
+                if set([top1['rank'], top2['rank'], top3['rank']]) == {1, 2, 3}:
+                    hit = True
+                cost = bet_amount * 6
+        elif betting_type == 'uma_ren':
+            if top2 is not None and {top1['rank'], top2['rank']} == {1, 2}:
+                hit = True
+        elif betting_type == 'wide':
+            if top2 is not None and top1['rank'] <= 3 and top2['rank'] <= 3:
+                hit = True
+
+        if hit:
+            hits += 1
+            total_return += payout
+        total_bet += cost
+
+    return {
+        'betting_type': betting_type,
+        'total_races': len(grouped),
+        'bet_races': bet_races,
+        'hits': hits,
+        'hit_rate': hits / bet_races if bet_races > 0 else 0,
+        'roi': (total_return / total_bet) * 100 if total_bet > 0 else 0,
+        'total_return': total_return,
+        'total_bet': total_bet
+    }
+
+def synthetic_races(years=5, races_per_year=3456, seed=0):
+    """ベンチマーク用の疑似データ (年 × 開催 × 12R、1レース 8〜18頭)"""
+    rng = np.random.default_rng(seed)
+    n_races = years * races_per_year
+    sizes = rng.integers(8, 19, n_races)
+    race_ids = np.repeat([f"{2020 + i // races_per_year}{i % races_per_year:08d}" for i in range(n_races)], sizes)
+    # 着順は各レース内のランダムな順列 (一部は取消・除外で欠損)
+    ranks = np.concatenate([rng.permutation(s) + 1 for s in sizes]).astype(np.float64)
+    ranks[rng.random(len(ranks)) < 0.01] = np.nan
+    odds = np.round(rng.lognormal(2.5, 1.0, len(ranks)), 1)
+    win_prob = rng.dirichlet(np.ones(4), len(ranks))[:, 0]
+    return pd.DataFrame({
+        'race_id': race_ids,
+        'rank': ranks,
+        'odds': odds,
+        'score': win_prob ** 4 * odds
+    })
+
+def benchmark(years=5, min_score=0.4, betting_types=None):
+    """従来ループとベクトル版の速度を比較し、全賭け式で結果が一致することを確認する"""
+    import time
+    betting_types = betting_types or BETTING_TYPES
+    df = synthetic_races(years)
+    print(f"Benchmark: {years} years, {df['race_id'].nunique()} races, {len(df)} rows")
+
+    t0 = time.perf_counter()
+    fast = backtest(df, betting_types, min_score)
+    t_fast = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    slow = {bt: simulate_loop(df, bt, min_score) for bt in betting_types}
+    t_slow = time.perf_counter() - t0
+
+    for bt in betting_types:
+        mismatch = [k for k in slow[bt] if k != 'betting_type' and not np.isclose(slow[bt][k], fast[bt][k])]
+        status = 'OK' if not mismatch else f"MISMATCH {mismatch}"
+        print(f"  {bt:<13} bets={fast[bt]['bet_races']:>6} hits={fast[bt]['hits']:>6} roi={fast[bt]['roi']:>7.2f}% {status}")
+    print(f"Loop:       {t_slow:.2f}s ({len(betting_types)} betting types)")
+    print(f"Vectorized: {t_fast:.3f}s ({t_slow / max(t_fast, 1e-9):.0f}x)")
+    return t_slow, t_fast
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Backtest engine benchmark (loop vs vectorized)")
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--min_score", type=float, default=0.4)
+    args = parser.parse_args()
+    benchmark(args.years, args.min_score)
@@ -0,0 +1,82 @@
+"""
+閾値スイープの ROI・的中率のブートストラップ信頼区間。
+
+グループ (競馬場 / 全体) ごとにレースを復元抽出する。乱数のインデックス行列 (リサンプル数 × レース数) を
+bincount で「各レースが選ばれた回数」の重み行列にし、全リサンプルの集計をまとめて行う。
+各リサンプルに同じ閾値の戦略を当てはめるので、賭けたレース数のばらつきも区間に含まれる。
+1レースも賭けなかったリサンプルは ROI・的中率を NaN にして分位点から除く (0% として区間を下に引っ張らない)。
+全リサンプルで賭けが無い閾値の区間は NaN。
+レースは threshold_sweep と同じくスコア昇順に並べてあるので、全閾値の合計は
+重み付き値の後ろからの累積和を searchsorted の位置で引くだけで求まる (リサンプルの Python ループなし)。
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from . import backtest
+
+N_BOOT = 1000
+LEVEL = 0.95
+CHUNK_ELEMENTS = 4_000_000 # 重み行列を一度に作る要素数の上限 (メモリ用)
+
+CI_COLUMNS = ['roi_lo', 'roi_hi', 'hit_rate_lo', 'hit_rate_hi']
+
+def resample_counts(rng, n, n_boot):
+    """(n_boot, n): 各リサンプルで各レースが選ばれた回数 (インデックス行列を bincount)"""
+    idx = rng.integers(0, n, size=(n_boot, n))
+    idx += (np.arange(n_boot) * n)[:, None]
+    return np.bincount(idx.ravel(), minlength=n_boot * n).reshape(n_boot, n)
+
+def _suffix_sums(weights, values, pos):
+    """(B, len(pos)): 各リサンプルの pos 以降 (スコア上位側) の重み付き合計"""
+    total = np.cumsum((weights * values)[:, ::-1], axis=1)[:, ::-1]
+    total = np.concatenate([total, np.zeros((len(weights), 1))], axis=1)
+    return total[:, pos]
+
+def _ratio(num, den):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(den > 0, num / den * 100, np.nan)
+
+def sweep_intervals(top, thresholds, groups=None, betting_type='win', bet_amount=backtest.BET_AMOUNT,
+                    n_boot=N_BOOT, level=LEVEL, seed=0, payout_index=None):
+    """
+    backtest.threshold_sweep と同じ行順 (group, min_score) で ROI・的中率 (%) の信頼区間を返す。
+    戻り値は DataFrame: group, min_score, roi_lo, roi_hi, hit_rate_lo, hit_rate_hi
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    keys, sorted_codes, sorted_score, outcomes = backtest.sweep_order(top, groups, betting_type, bet_amount, payout_index)
+    hit = outcomes['hit'].astype(np.float64)
+    q = [(1 - level) / 2, 1 - (1 - level) / 2]
+    rng = np.random.default_rng(seed)
+
+    frames = []
+    for g, key in enumerate(keys):
+        start, stop = np.searchsorted(sorted_codes, [g, g + 1])
+        n = stop - start
+        pos = np.searchsorted(sorted_score[start:stop], thresholds, side='left')
+        roi = np.full((n_boot, len(thresholds)), np.nan)
+        hit_rate = np.full((n_boot, len(thresholds)), np.nan)
+        if n > 0:
+            ret, cost, win = (v[start:stop] for v in (outcomes['return'], outcomes['cost'], hit))
+            chunk = max(1, CHUNK_ELEMENTS // n)
+            for b in range(0, n_boot, chunk):
+                w = resample_counts(rng, n, min(chunk, n_boot - b))
+                bets = _suffix_sums(w, 1.0, pos)
+                roi[b:b + len(w)] = _ratio(_suffix_sums(w, ret, pos), _suffix_sums(w, cost, pos))
+                hit_rate[b:b + len(w)] = _ratio(_suffix_sums(w, win, pos), bets)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # All-NaN slice (賭けの無い閾値)
+            roi_q = np.nanquantile(roi, q, axis=0)
+            hit_q = np.nanquantile(hit_rate, q, axis=0)
+        frames.append(pd.DataFrame({
+            'group': key,
+            'min_score': thresholds,
+            'roi_lo': roi_q[0],
+            'roi_hi': roi_q[1],
+            'hit_rate_lo': hit_q[0],
+            'hit_rate_hi': hit_q[1]
+        }))
+    if not frames:
+        return pd.DataFrame(columns=['group', 'min_score'] + CI_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from . import settings
+from . import profiling
+
+# Dataset 構築 (ビニング) に影響するパラメータ。
+# キャッシュキーに含めるため、変更すると自動的に再構築される。
+DATASET_PARAMS = {
+    'max_bin': 255,
+    'min_data_in_bin': 3,
+    'bin_construct_sample_cnt': 200000,
+    'data_random_seed': 42, # 学習パラメータの seed=42 と揃える
+    'verbose': -1
+}
+
+def dataset_key(frames, features, target, params=None):
+    """
+    特徴量行列・特徴量リスト・ビニングパラメータから決定的なハッシュキーを作る。
+    frames: [train_df, valid_df] のように順序付きで渡す (race_id 順にソート済みであること)
+    """
+    import lightgbm as lgb
+    params = params if params is not None else DATASET_PARAMS
+    h = hashlib.sha1()
+    meta = {
+        'features': list(features),
+        'target': target,
+        'params': params,
+        'lightgbm': lgb.__version__
+    }
+    h.update(json.dumps(meta, sort_keys=True, default=str).encode('utf-8'))
+    
+    cols = list(features) + [target, 'race_id']
+    for frame in frames:
+        # 行数も混ぜておく (空フレーム同士の衝突防止)
+        h.update(str(len(frame)).encode('utf-8'))
+        hashed = pd.util.hash_pandas_object(frame[cols], index=False)
+        h.update(hashed.values.tobytes())
+    return h.hexdigest()[:20]
+
+def _save_binary(dataset, path):
+    """一時ファイルに書いてから置き換える (中断時に壊れたキャッシュを残さない)"""
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    dataset.save_binary(tmp_path)
+    os.replace(tmp_path, path)
+
+@profiling.profiled('dataset.build', rows=None)
+def build_datasets(train, valid, features, target, train_groups, valid_groups, use_cache=True, cache_dir=None):
+    """
+    学習・検証用の lgb.Dataset を返す。
+    同じ特徴量行列に対しては LightGBM バイナリ形式のキャッシュを再利用し、
+    pandas からの変換とビニングをスキップする。
+    """
+    import lightgbm as lgb
+    params = dict(DATASET_PARAMS)
+    
+    if not use_cache:
+        lgb_train = lgb.Dataset(train[features], train[target], group=train_groups, params=params)
+        lgb_eval = lgb.Dataset(valid[features], valid[target], group=valid_groups, reference=lgb_train, params=params)
+        return lgb_train, lgb_eval
+    
+    cache_dir = cache_dir or os.path.join(settings.CACHE_DIR, 'datasets')
+    key = dataset_key([train, valid], features, target, params)
+    key_dir = os.path.join(cache_dir, key)
+    train_path = os.path.join(key_dir, 'train.bin')
+    valid_path = os.path.join(key_dir, 'valid.bin')
+    
+    if os.path.exists(train_path) and os.path.exists(valid_path):
+        print(f"Loading cached binary Datasets ({key})...")
+        try:
+            lgb_train = lgb.Dataset(train_path, params=params)
+            lgb_eval = lgb.Dataset(valid_path, reference=lgb_train, params=params)
+            # 読み込みを確定させ、壊れていれば例外で再構築へ
+            lgb_train.construct()
+            lgb_eval.construct()
+            return lgb_train, lgb_eval
+        except Exception as e:
+            print(f"Cached Dataset unusable, rebuilding: {e}")
+    
+    print(f"Building binary Datasets ({key})...")
+    lgb_train = lgb.Dataset(train[features], train[target], group=train_groups, params=params, free_raw_data=False)
+    lgb_eval = lgb.Dataset(valid[features], valid[target], group=valid_groups, reference=lgb_train, params=params, free_raw_data=False)
+    lgb_train.construct()
+    lgb_eval.construct()
+    
+    try:
+        os.makedirs(key_dir, exist_ok=True)
+        _save_binary(lgb_train, train_path)
+        _save_binary(lgb_eval, valid_path)
+        print(f"Saved binary Datasets to {key_dir}")
+    except Exception as e:
+        print(f"Failed to save Dataset cache: {e}")
+    
+    return lgb_train, lgb_eval
@@ -1,12 +1,17 @@
 import pandas as pd
-import joblib
 import os
 import argparse
 from . import settings
-from . import preprocess
-from . import scraper_bulk
+from . import profiling
+from . import backtest
+from . import ranking_metrics
+from . import prediction_cache
+from . import payouts
+from . import payout_backtest
+from . import staking
+from . import results_db
 
-def evaluate(start_year, end_year, csv_file=None, min_score=None, power=None):
+def evaluate(start_year, end_year, csv_file=None, min_score=None, power=None, use_cache=True):
     print(f"--- Evaluaton Mode: {start_year}-{end_year} ---")
     
     # 1. Load Model & Artifacts
@@ -14,6 +19,7 @@ def evaluate(start_year, end_year, csv_file=None, min_score=None, power=None):
         print("Model not found. Run learn.train first.")
         return {}
 
+    import joblib
     print(f"Loading model from {settings.MODEL_PATH}...")
     model = joblib.load(settings.MODEL_PATH)
     encoder_path = os.path.join(settings.MODEL_DIR, 'encoders.pkl')
@@ -25,23 +31,10 @@ def evaluate(start_year, end_year, csv_file=None, min_score=None, power=None):
         print(f"Loading data from provided CSV: {csv_file}...")
         raw_df = pd.read_csv(csv_file)
     else:
-        # Check for individual year files first (common case)
-        dfs = []
-        full_range_found = True
-        for y in range(start_year, end_year + 1):
-            y_path = os.path.join(settings.RAW_DATA_DIR, f"results_{y}.csv")
-            if os.path.exists(y_path):
-                try:
-                    dfs.append(pd.read_csv(y_path))
-                except Exception as e:
-                    print(f"Error reading {y_path}: {e}")
-                    full_range_found = False
-            else:
-                full_range_found = False
-        
-        if full_range_found and dfs:
-            print(f"Loading data from individual files for {start_year}-{end_year}...")
-            raw_df = pd.concat(dfs, ignore_index=True)
+        # Individual year files (common case): results_YYYY.csv を取り込んだ結果DB (train/results_db.py) から読む
+        if set(range(start_year, end_year + 1)) <= results_db.years():
+            print(f"Loading data from the results DB for {start_year}-{end_year}...")
+            raw_df = results_db.load_results(start_year, end_year)
         else:
             # Fallback to looking for a combined file (rare)
             csv_path = os.path.join(settings.RAW_DATA_DIR, f"results_{start_year}_{end_year}.csv")
@@ -51,17 +44,11 @@ def evaluate(start_year, end_year, csv_file=None, min_score=None, power=None):
             else:
                 print(f"Data not completely found locally. Scraping {start_year}-{end_year}...")
                 # scraper_bulk does not return the df, it saves to files.
+                from . import scraper_bulk # requests / bs4 はスクレイプするときだけ読み込む
                 scraper_bulk.bulk_scrape(start_year, end_year)
                 
                 # Reload from files
-                dfs = []
-                for y in range(start_year, end_year + 1):
-                    y_path = os.path.join(settings.RAW_DATA_DIR, f"results_{y}.csv")
-                    if os.path.exists(y_path):
-                        dfs.append(pd.read_csv(y_path))
-                
-                if dfs:
-                    raw_df = pd.concat(dfs, ignore_index=True)
+                raw_df = results_db.load_results(start_year, end_year)
 
     if raw_df.empty:
         print("No data found.")
@@ -102,40 +89,37 @@ def evaluate(start_year, end_year, csv_file=None, min_score=None, power=None):
                 raw_df = raw_df[raw_df['race_no'].isin(target_races)]
                 print(f"  Rows after race_no filter: {len(raw_df)}")
 
-    # 3. Transform (NOT Fit)
-    print("Preprocessing (Transform mode)...")
-    df = preprocess.transform(raw_df, artifacts)
-    
-    # 4. Predict
-    features = [
-        'jockey_win_rate', 'trainer_win_rate', 'horse_id', 'jockey_id', 'trainer_id',
-        'waku', 'umaban', 'course_type', 'distance', 'weather', 'condition',
-        'lag1_rank', 'lag1_speed_index', 'interval', 'weight_diff'
-    ]
-    
-    if df.empty:
-        print("No data available for prediction after preprocessing.")
+    if raw_df.empty:
+        print("No data available for prediction after filtering.")
         return {}
+    # 学習時 (preprocess.load_data) と同じく血統 (sire_id, damsire_id) を付ける
+    from . import preprocess
+    raw_df = preprocess._merge_profiles(raw_df, preprocess._load_profiles()).reset_index(drop=True)
 
-    print("Predicting...")
-    # LightGBM Multiclass returns (N, 4) probability matrix
-    # Class 0 is Rank 1 (Winner)
-    pred_probs = model.predict(df[features])
-    
-    # Use Probability of Winning (Class 0) as base score
-    # Handle both 1D (binary) and 2D (multiclass) outputs just in case
-    if pred_probs.ndim > 1:
-        df['win_prob'] = pred_probs[:, 0]
-    else:
-        df['win_prob'] = pred_probs
+    # 3-4. Transform (NOT Fit) & Predict
+    # 予測キャッシュ (train/prediction_cache.py) に無いレースだけ推論する
+    features = model.feature_name() if hasattr(model, 'feature_name') else settings.FEATURES # 学習時の特徴量リストを優先
+    context = {
+        'first_race': str(raw_df['race_id'].astype(str).min()),
+        'places': config.get('target_places', []) if config else [],
+        'race_numbers': config.get('target_race_numbers', []) if config else [],
+        'race_range': None
+    }
+    # LightGBM Multiclass returns (N, 4) probability matrix -> Class 0 (Winner) の確率を使う
+    win_prob = prediction_cache.predict_cached(model, raw_df, artifacts, features, context=context, use_cache=use_cache)
+    df = pd.DataFrame({'win_prob': win_prob})
     
     # 5. Metrics (Ranking Accuracy)
     metrics = {}
     if 'rank' in raw_df.columns:
-        # Attach raw info for evaluation
+        # Attach raw info for evaluation (raw_df と同じ行順)
         df['race_id'] = raw_df['race_id']
         df['rank'] = pd.to_numeric(raw_df['rank'], errors='coerce')
         df['odds'] = pd.to_numeric(raw_df['odds'], errors='coerce').fillna(0)
+        if 'umaban' in raw_df.columns:
+            df['umaban'] = pd.to_numeric(raw_df['umaban'], errors='coerce')
+        if all(c in raw_df.columns for c in ['year', 'month', 'day']):
+            df['date'] = pd.to_datetime(raw_df[['year', 'month', 'day']], errors='coerce')
         
         # Calculate Expectation Score: (Win Prob)^power * Odds
         # Use provided power or default
@@ -143,12 +127,6 @@ def evaluate(start_year, end_year, csv_file=None, min_score=None, power=None):
         print(f"Using Score Power Exponent: {use_power}")
         df['score'] = (df['win_prob'] ** use_power) * df['odds']
         
-        # Metrics Initialization
-        total_races = 0
-        correct_top1 = 0
-        total_bet = 0
-        total_return = 0
-
         # Betting Strategy Logic
         betting_type = config.get('betting_type', 'win')
         
@@ -158,109 +136,55 @@ def evaluate(start_year, end_year, csv_file=None, min_score=None, power=None):
         
         print(f"Simulating Betting Strategy: {betting_type} (Min Score: {min_roi_score})")
         
-        # Counters for races we actually bet on
-        bet_races = 0
-        
-        grouped = df.groupby('race_id')
-        for rid, group in grouped:
-            if group.empty: continue
-            
-            # Skip if no rank=1 in group (anomaly)
-            if not (group['rank'] == 1).any(): continue
-            
-            # total_races += 1 # This was counting all valid races in data. Moving this meaning to bet_races or keep as denominator?
-            # Usually for strategy evaluation, we care about Hit Rate = Hits / Bets.
-            # So I will use bet_races as the denominator for stats.
-            
-            # Sort by Predicted Score Descending
-            # If multiple models/scores exist, ensure we use the main one.
-            # Here 'score' is from model.predict
-            group_sorted = group.sort_values('score', ascending=False)
-            
-            # Top predictions
-            top1 = group_sorted.iloc[0]
-            top2 = group_sorted.iloc[1] if len(group) >= 2 else None
-            top3 = group_sorted.iloc[2] if len(group) >= 3 else None
-            
-            # Filter by Min ROI Score (Check Top1)
-            if top1['score'] < min_roi_score:
-                continue
-            
-            bet_races += 1
-            
-            # Actual Ranks (Horse IDs or Umaban could be used, but we use rank column on the predicted rows)
-            # We need to know the actual rank of our predicted horses.
-            # group_sorted contains 'rank' column from raw_df
-            
-            hit = False
-            payout = 0
-            cost = 100 # Base cost
-            
-            if betting_type == 'win':
-                # Single Win on Top 1
-                if top1['rank'] == 1:
-                    hit = True
-                    payout = 100 * top1['odds']
-            
-            elif betting_type == 'place':
-                # Place bet on Top 1 (Rank 1-3)
-                if top1['rank'] <= 3:
-                    hit = True
-                    # Cannot calc payout without place odds
-                    
-            elif betting_type == 'trifecta':
-                # 3-Ren-Tan (Exact order 1-2-3)
-                if top1['rank'] == 1 and top2 and top2['rank'] == 2 and top3 and top3['rank'] == 3:
-                    hit = True
-                    
-            elif betting_type == 'box_trifecta':
-                # 3-Ren-Tan Box (Any order of top 3 horses in top 3 ranks)
-                if top1 and top2 and top3:
-                    ranks = [top1['rank'], top2['rank'], top3['rank']]
-                    if set(ranks) == {1, 2, 3}:
-                        hit = True
-                    cost = 600 # 6 combinations * 100
-                    
-            elif betting_type == 'uma_ren':
-                # Uma-Ren (Top 2 in 1st/2nd any order)
-                if top1 and top2:
-                    ranks = {top1['rank'], top2['rank']}
-                    if ranks == {1, 2}:
-                        hit = True
-                        
-            elif betting_type == 'wide':
-                # Wide (Top 2 both in Top 3)
-                if top1 and top2:
-                    if top1['rank'] <= 3 and top2['rank'] <= 3:
-                        hit = True
-            
-            if hit:
-                correct_top1 += 1 # Reusing variable as "Hits"
-                total_return += payout
-            
-            total_bet += cost
-            
-        acc = correct_top1 / bet_races if bet_races > 0 else 0
-        roi = (total_return / total_bet) * 100 if total_bet > 0 else 0
+        # レースごとの上位3頭を1回のソートで取り出し、ベクトル演算で集計する (train/backtest.py)
+        with profiling.stage('backtest', rows=len(df)):
+            result = backtest.simulate(backtest.top_k(df), 'win' if betting_type == 'kelly' else betting_type, min_roi_score)
+        # 分数 Kelly (softmax 確率 × オッズ) で資金を運用した場合 (train/staking.py)
+        with profiling.stage('backtest.kelly', rows=len(df)):
+            kelly = staking.kelly_backtest(df, min_score=min_roi_score)
+        if betting_type == 'kelly':
+            result.update(betting_type='kelly', bet_races=kelly['bets'], hits=kelly['hits'], roi=kelly['roi'],
+                          hit_rate=kelly['hits'] / kelly['bets'] if kelly['bets'] else 0,
+                          total_return=kelly['return'], total_bet=kelly['cost'])
+        # 払戻テーブル (payouts_{year}.csv) があれば全賭け式の払戻を計算する (train/payout_backtest.py)
+        strategy_results = None
+        payout_table = payouts.load_payouts(start_year, end_year)
+        if not payout_table.empty and 'umaban' in df.columns:
+            with profiling.stage('backtest.payouts', rows=len(df)):
+                top = backtest.top_k(df, payout_backtest.positions_needed(payout_backtest.STRATEGIES))
+                strategy_results = payout_backtest.evaluate_strategies(top, payouts.PayoutIndex(payout_table), min_score=min_roi_score)
+            if betting_type != 'win' and betting_type in strategy_results['strategy'].values:
+                row = strategy_results.set_index('strategy').loc[betting_type]
+                result.update(roi=row['roi'], total_return=row['return'], total_bet=row['cost'])
+
+        bet_races = result['bet_races']
+        hits = result['hits']
+        total_return = result['total_return']
+        total_bet = result['total_bet']
         
         print(f"\n--- Evaluation Result ({start_year}-{end_year}) ---")
         print(f"Strategy: {betting_type}")
-        print(f"Bet Races: {bet_races} (Skipped: {len(grouped) - bet_races})")
-        print(f"Hit Rate: {acc:.4f} ({correct_top1}/{bet_races})")
-        if betting_type == 'win':
-            print(f"ROI (Win Bet): {roi:.2f}% ({total_return:.0f}/{total_bet:.0f})")
+        print(f"Bet Races: {bet_races} (Skipped: {result['total_races'] - bet_races})")
+        print(f"Hit Rate: {result['hit_rate']:.4f} ({hits}/{bet_races})")
+        if betting_type in ('win', 'kelly'):
+            print(f"ROI (Win Bet): {result['roi']:.2f}% ({total_return:.0f}/{total_bet:.0f})")
+        elif strategy_results is not None and betting_type in strategy_results['strategy'].values:
+            print(f"ROI (Payouts): {result['roi']:.2f}% ({total_return:.0f}/{total_bet:.0f})")
         else:
-            print(f"ROI: Cannot calculate (Missing odds for {betting_type})")
+            print(f"ROI: Cannot calculate (Missing payouts for {betting_type})")
+        print(f"Kelly ({staking.KELLY_FRACTION:g} x Kelly, caps {staking.RACE_CAP:.0%}/race {staking.DAY_CAP:.0%}/day): "
+              f"ROI {kelly['roi']:.2f}% | Bankroll {staking.BANKROLL:,} -> {kelly['final_bankroll']:,.0f} "
+              f"(max drawdown {kelly['max_drawdown']:.1f}%, {kelly['bets']} races)")
+        if strategy_results is not None:
+            print(f"\n--- All Bet Types (payout tables, Min Score: {min_roi_score}) ---")
+            print(payout_backtest.format_results(strategy_results))
 
-        metrics = {
-            'betting_type': betting_type,
-            'total_races': len(grouped),
-            'bet_races': bet_races,
-            'hit_rate': acc,
-            'roi': roi,
-            'total_return': total_return,
-            'total_bet': total_bet
-        }
+        metrics = {k: v for k, v in result.items() if k != 'hits'}
+        
+        # Ranking Metrics (モデルの勝率順で評価)
+        ranking = ranking_metrics.ranking_metrics(df['race_id'].to_numpy(), df['win_prob'].to_numpy(), df['rank'].to_numpy())
+        print(f"Ranking ({ranking['races']} races): {ranking_metrics.format_metrics(ranking)}")
+        metrics.update({k: v for k, v in ranking.items() if k != 'races'})
 
     else:
         print("Rank column not found in raw data, cannot evaluate metrics.")
@@ -274,6 +198,7 @@ if __name__ == "__main__":
     parser.add_argument("--csv", type=str, help="Path to existing CSV file")
     parser.add_argument("--min_score", type=float, help="Override min_betting_roi_score")
     parser.add_argument("--power", type=float, default=settings.POWER_EXPONENT, help="Exponent for Win Prob")
+    parser.add_argument("--no_cache", action="store_true", help="予測キャッシュを使わずに全レースを推論する")
     args = parser.parse_args()
     
-    evaluate(args.start, args.end, csv_file=args.csv, min_score=args.min_score, power=args.power)
+    evaluate(args.start, args.end, csv_file=args.csv, min_score=args.min_score, power=args.power, use_cache=not args.no_cache)
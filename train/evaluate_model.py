@@ -3,9 +3,15 @@ import lightgbm as lgb
 import os
 import joblib
 import numpy as np
+import sys
 
 # Config
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # keiba/
+sys.path.append(BASE_DIR)
+
+from train import ranking_metrics
+from train import backtest
+
 DATA_PATH = os.path.join(BASE_DIR, 'train', 'data', 'raw', 'results_validation_patched.csv')
 MODEL_PATH = os.path.join(BASE_DIR, 'train', 'models', 'lgbm_ranker_v2.pkl')
 ENCODERS_PATH = os.path.join(BASE_DIR, 'train', 'models', 'encoders.pkl')
@@ -101,82 +107,25 @@ def evaluate():
     val_df['score'] = model.predict(X_val)
     
     # Calculate Metrics
-    total_races = 0
-    hits_1 = 0
-    hits_3 = 0
-    
-    total_cost = 0
-    total_return = 0
-    
+    # 全レース分をまとめて計算 (train/ranking_metrics.py)
     bet_amount = 100
+    metrics = ranking_metrics.ranking_metrics(val_df['race_id'].to_numpy(), val_df['score'].to_numpy(), val_df['rank'].to_numpy())
+    total_races = metrics['races']
     
-    # NDCG and MRR calculation
-    ndcg_at_1_list = []
-    ndcg_at_3_list = []
-    ndcg_at_5_list = []
-    mrr_list = []
-    
-    for race_id, group in val_df.groupby('race_id'):
-        total_races += 1
-        
-        # Sort by predicted score (descending - higher is better)
-        group = group.sort_values('score', ascending=False)
-        pred_winner = group.iloc[0]
-        
-        # Accuracy
-        if pred_winner['rank'] == 1:
-            hits_1 += 1
-            # Return
-            try:
-                # odds column might be object or float
-                odds_val = float(pred_winner['odds']) if pd.notnull(pred_winner['odds']) else 0.0
-                total_return += bet_amount * odds_val
-            except:
-                pass 
-            
-        if pred_winner['rank'] <= 3:
-            hits_3 += 1
-            
-        total_cost += bet_amount
-        
-        # Calculate NDCG (requires sklearn)
-        try:
-            from sklearn.metrics import ndcg_score
-            # Convert rank to relevance score (lower rank = higher relevance)
-            # For NDCG, relevance should be higher for better items
-            max_rank = group['rank'].max()
-            relevance = (max_rank - group['rank'] + 1).values
-            pred_scores = group['score'].values
-            
-            # NDCG requires 2D arrays
-            if len(relevance) > 0:
-                ndcg_1 = ndcg_score([relevance], [pred_scores], k=1)
-                ndcg_3 = ndcg_score([relevance], [pred_scores], k=3)
-                ndcg_5 = ndcg_score([relevance], [pred_scores], k=min(5, len(relevance)))
-                
-                ndcg_at_1_list.append(ndcg_1)
-                ndcg_at_3_list.append(ndcg_3)
-                ndcg_at_5_list.append(ndcg_5)
-        except ImportError:
-            pass  # Skip NDCG if sklearn not available
-        
-        # Calculate MRR (Mean Reciprocal Rank)
-        # Find the position of the actual winner in our prediction
-        actual_winner_id = group[group['rank'] == 1].index
-        if len(actual_winner_id) > 0:
-            winner_pos = group.index.get_loc(actual_winner_id[0]) + 1  # 1-indexed position
-            mrr_list.append(1.0 / winner_pos)
-        else:
-            mrr_list.append(0.0)
-            
-    acc_1 = hits_1 / total_races if total_races > 0 else 0
-    acc_3 = hits_3 / total_races if total_races > 0 else 0
+    # Return (予測1位の単勝)
+    top = backtest.top_k(val_df, k=1)
+    odds_1 = np.nan_to_num(top['odds'][:, 0])
+    total_return = float((bet_amount * odds_1)[top['rank'][:, 0] == 1].sum())
+    total_cost = bet_amount * total_races
+    
+    acc_1 = metrics['acc@1']
+    acc_3 = metrics['acc@3']
     roi = (total_return / total_cost) * 100 if total_cost > 0 else 0
     
-    mean_ndcg_1 = np.mean(ndcg_at_1_list) if ndcg_at_1_list else 0.0
-    mean_ndcg_3 = np.mean(ndcg_at_3_list) if ndcg_at_3_list else 0.0
-    mean_ndcg_5 = np.mean(ndcg_at_5_list) if ndcg_at_5_list else 0.0
-    mean_mrr = np.mean(mrr_list) if mrr_list else 0.0
+    mean_ndcg_1 = metrics['ndcg@1']
+    mean_ndcg_3 = metrics['ndcg@3']
+    mean_ndcg_5 = metrics['ndcg@5']
+    mean_mrr = metrics['mrr']
     
     print(f"\nResults (Validation Set - {total_races} races):")
     print(f"Accuracy (Hit Rate): {acc_1:.2%}")
@@ -187,6 +136,7 @@ def evaluate():
     print(f"NDCG@3: {mean_ndcg_3:.4f}")
     print(f"NDCG@5: {mean_ndcg_5:.4f}")
     print(f"MRR (Mean Reciprocal Rank): {mean_mrr:.4f}")
+    print(f"Hit@3 (Winner in Top 3 predictions): {metrics['hit@3']:.2%}")
 
 if __name__ == "__main__":
     evaluate()
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+from . import preprocess
+from . import window_features
+from . import asof_stats
+
+# ストアに保存する特徴量以外の列
+META_COLUMNS = ['race_id', 'rank', 'odds', 'date']
+
+# 特徴量の計算に使うコード (変わったらストアを作り直す)
+FEATURE_SOURCES = [preprocess.__file__, window_features.__file__, asof_stats.__file__]
+
+_digests = {} # (path, size, mtime_ns, ctime_ns) -> 内容の sha1
+
+def file_digest(path):
+    """
+    ファイル内容の sha1。actions/checkout で更新時刻が毎回変わっても同じ内容なら同じ値になる。
+    同じプロセス内ではファイルが変わっていなければ (サイズ・更新時刻・ctime) 読み直さない。
+    """
+    st = os.stat(path)
+    memo = (os.path.abspath(path), st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+    if memo not in _digests:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _digests[memo] = h.hexdigest()
+    return _digests[memo]
+
+def _file_fingerprint(path):
+    return [os.path.basename(path), file_digest(path)]
+
+def store_key(start_year, end_year, start_month=None, end_month=None, features=None):
+    """
+    生データファイルの指紋 (名前・内容のハッシュ)、期間、特徴量リスト、
+    特徴量のコード (FEATURE_SOURCES) のハッシュからキャッシュキーを作る。
+    """
+    features = features or settings.FEATURES
+    h = hashlib.sha1()
+    meta = {
+        'range': [start_year, end_year, start_month, end_month],
+        'features': list(features)
+    }
+    h.update(json.dumps(meta, sort_keys=True).encode('utf-8'))
+    
+    for y in range(start_year, end_year + 1):
+        path = os.path.join(settings.RAW_DATA_DIR, f"results_{y}.csv")
+        if os.path.exists(path):
+            h.update(json.dumps(_file_fingerprint(path)).encode('utf-8'))
+    profile_path = os.path.join(settings.RAW_DATA_DIR, "horse_profiles.csv")
+    if os.path.exists(profile_path):
+        h.update(json.dumps(_file_fingerprint(profile_path)).encode('utf-8'))
+    
+    # 特徴量ロジックが変わったら作り直す
+    for path in FEATURE_SOURCES:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:20]
+
+class FeatureStore:
+    """
+    前処理済み特徴量行列をディスク上の .npy (列ごと) として保持する。
+    np.load(mmap_mode='r') で開くため、複数プロセスで共有してもコピーされない。
+    行は race_id 順 (= 年順) に並んでいるので、年単位の分割は連続スライスになる。
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.features = self.meta['features']
+        self.X = np.load(os.path.join(path, 'X.npy'), mmap_mode='r')
+        self.race_id = np.load(os.path.join(path, 'race_id.npy'), mmap_mode='r')
+        self.rank = np.load(os.path.join(path, 'rank.npy'), mmap_mode='r')
+        self.odds = np.load(os.path.join(path, 'odds.npy'), mmap_mode='r')
+        self.date = np.load(os.path.join(path, 'date.npy'), mmap_mode='r')
+        self._artifacts = None
+    
+    def __len__(self):
+        return len(self.race_id)
+    
+    @property
+    def year(self):
+        # race_id: YYYY PP KK DD RR
+        return np.asarray(self.race_id) // 10**8
+    
+    @property
+    def artifacts(self):
+        if self._artifacts is None:
+            import joblib
+            self._artifacts = joblib.load(os.path.join(self.path, 'artifacts.pkl'))
+        return self._artifacts
+    
+    def year_slice(self, first_year, last_year):
+        """first_year..last_year の行範囲 (連続) を返す"""
+        years = self.year
+        start = int(np.searchsorted(years, first_year, side='left'))
+        stop = int(np.searchsorted(years, last_year, side='right'))
+        return slice(start, stop)
+    
+    def frame(self):
+        """train.train_model 向けの DataFrame (特徴量 + メタ列) を返す"""
+        df = pd.DataFrame(np.asarray(self.X), columns=self.features)
+        df['race_id'] = np.asarray(self.race_id).astype(str)
+        df['rank'] = np.asarray(self.rank)
+        df['odds'] = np.asarray(self.odds)
+        df['date'] = np.asarray(self.date)
+        return df
+
+def _write_store(df, artifacts, features, path):
+    tmp_path = path + '.tmp'
+    os.makedirs(tmp_path, exist_ok=True)
+    
+    # race_id 順 (年順) に安定ソート
+    df = df.assign(_rid=pd.to_numeric(df['race_id'], errors='coerce').fillna(0).astype('int64'))
+    df = df.sort_values('_rid', kind='mergesort').reset_index(drop=True)
+    
+    np.save(os.path.join(tmp_path, 'X.npy'), df[features].to_numpy(dtype=np.float64))
+    np.save(os.path.join(tmp_path, 'race_id.npy'), df['_rid'].to_numpy())
+    np.save(os.path.join(tmp_path, 'rank.npy'), pd.to_numeric(df['rank'], errors='coerce').fillna(99).to_numpy(dtype=np.float64))
+    np.save(os.path.join(tmp_path, 'odds.npy'), pd.to_numeric(df['odds'], errors='coerce').fillna(0).to_numpy(dtype=np.float64))
+    np.save(os.path.join(tmp_path, 'date.npy'), pd.to_datetime(df['date']).to_numpy(dtype='datetime64[ns]'))
+    import joblib
+    joblib.dump(artifacts, os.path.join(tmp_path, 'artifacts.pkl'))
+    with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'features': list(features), 'n_rows': len(df)}, f)
+    
+    _commit_store(tmp_path, path)
+
+def _commit_store(tmp_path, path):
+    if os.path.exists(path):
+        import shutil
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+def _clean_numeric(df):
+    # Clean numeric columns (train.py と同じ)
+    df['waku'] = pd.to_numeric(df['waku'], errors='coerce').fillna(0)
+    df['umaban'] = pd.to_numeric(df['umaban'], errors='coerce').fillna(0)
+    return df
+
+def _write_store_stream(chunks, state, features, path, block_rows=200000):
+    """
+    preprocess_stream のチャンクを順に .npy (open_memmap) へ書き込む。
+    行数は事前パス後の state.n_rows で確定している。
+    チャンクは日付順なので、最後に block_rows 行ずつ race_id 順へ並べ替える。
+    """
+    from numpy.lib.format import open_memmap
+    
+    tmp_path = path + '.tmp'
+    os.makedirs(tmp_path, exist_ok=True)
+    specs = {
+        'X': (np.float64, (len(features),)),
+        'race_id': (np.int64, ()),
+        'rank': (np.float64, ()),
+        'odds': (np.float64, ()),
+        'date': ('datetime64[ns]', ())
+    }
+    arrays = None
+    pos = 0
+    for df in chunks:
+        if arrays is None:
+            arrays = {
+                name: open_memmap(os.path.join(tmp_path, f'{name}.raw.npy'), mode='w+', dtype=dtype, shape=(state.n_rows,) + shape)
+                for name, (dtype, shape) in specs.items()
+            }
+        df = _clean_numeric(df)
+        end = pos + len(df)
+        arrays['X'][pos:end] = df[features].to_numpy(dtype=np.float64)
+        arrays['race_id'][pos:end] = pd.to_numeric(df['race_id'], errors='coerce').fillna(0).astype('int64').to_numpy()
+        arrays['rank'][pos:end] = pd.to_numeric(df['rank'], errors='coerce').fillna(99).to_numpy(dtype=np.float64)
+        arrays['odds'][pos:end] = pd.to_numeric(df['odds'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        arrays['date'][pos:end] = pd.to_datetime(df['date']).to_numpy(dtype='datetime64[ns]')
+        pos = end
+    
+    if arrays is None:
+        return False
+    
+    # race_id 順 (年順) に安定ソート (_write_store と同じ並び)
+    order = np.argsort(arrays['race_id'], kind='stable')
+    for name, (dtype, shape) in specs.items():
+        src = arrays[name]
+        dst = open_memmap(os.path.join(tmp_path, f'{name}.npy'), mode='w+', dtype=dtype, shape=src.shape)
+        for start in range(0, pos, block_rows):
+            dst[start:start + block_rows] = src[order[start:start + block_rows]]
+        dst.flush()
+        del dst
+    del arrays, src
+    for name in specs:
+        os.remove(os.path.join(tmp_path, f'{name}.raw.npy'))
+    
+    import joblib
+    joblib.dump(state.artifacts(), os.path.join(tmp_path, 'artifacts.pkl'))
+    with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'features': list(features), 'n_rows': pos}, f)
+    _commit_store(tmp_path, path)
+    return True
+
+def load_or_build(start_year, end_year, start_month=None, end_month=None, features=None, use_cache=True, stream=False):
+    """
+    キャッシュ済みの特徴量ストアを開く。無ければ load_data + preprocess で作成する。
+    stream=True の場合は preprocess_stream で年単位に処理し、全期間を一度にメモリへ載せない。
+    データが無い場合は None を返す。
+    """
+    features = features or settings.FEATURES
+    key = store_key(start_year, end_year, start_month, end_month, features)
+    path = os.path.join(settings.CACHE_DIR, 'features', key)
+    
+    if use_cache and os.path.exists(os.path.join(path, 'meta.json')):
+        print(f"Loading cached feature store ({key})...")
+        return FeatureStore(path)
+    
+    if stream:
+        state = preprocess.PreprocessState()
+        chunks = preprocess.preprocess_stream(start_year, end_year, start_month, end_month, state=state)
+        print(f"Writing feature store ({key}, streaming)...")
+        if not _write_store_stream(chunks, state, features, path):
+            print("No matching data found.")
+            return None
+        return FeatureStore(path)
+    
+    raw_df = preprocess.load_data(start_year=start_year, end_year=end_year, start_month=start_month, end_month=end_month)
+    if raw_df.empty:
+        return None
+    
+    df, artifacts = preprocess.preprocess(raw_df)
+    df = _clean_numeric(df)
+    
+    print(f"Writing feature store ({key}, {len(df)} rows)...")
+    _write_store(df, artifacts, features, path)
+    return FeatureStore(path)
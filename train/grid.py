@@ -0,0 +1,381 @@
+"""
+戦略グリッド (power × レース番号範囲 × 競馬場 × 閾値 × 賭け式) の並列評価。
+
+予測結果 (race_id, win_prob, rank, odds) は1回だけ計算して shared_memory に置き、
+プロセスプールの各ワーカーは DataFrame を pickle で受け取らずにそれを参照する。
+1タスク = (power, レース番号範囲) で、競馬場・閾値・賭け式は backtest.threshold_sweep でまとめて集計する。
+単勝以外の賭け式 (payout_backtest.STRATEGIES) の払戻は払戻テーブル (payouts_YYYY.csv、train/payouts.py) から引く。
+払戻データが無ければ単勝以外は評価しない (オッズが単勝しか無いので ROI が 0 になる)。
+賭け式 'kelly' は閾値を超えたレースに分数 Kelly で賭けた資金推移 (train/staking.py) を競馬場ごとに計算する。
+結果は完了順に1つの集計表 (CSV) へ追記していく。
+
+    python -m train.grid --start 2025 --end 2025 --power_min 2 --power_max 8 --race_windows 1-12,1-6,7-12,9-12
+    python -m train.grid --bet_types win,place,wide,trio_box5
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+from . import backtest
+from . import profiling
+from . import bootstrap
+from . import staking
+from . import payouts
+from . import payout_backtest
+
+# 共有メモリに置く列
+ARRAY_COLUMNS = {'race_id': np.int64, 'win_prob': np.float64, 'rank': np.float64, 'odds': np.float64, 'day': np.int64,
+                 'umaban': np.float64}
+
+RESULT_COLUMNS = [
+    'power', 'race_min', 'race_max', 'betting_type', 'place_code', 'min_score',
+    'bets', 'hits', 'hits_top3', 'hit_rate', 'place_rate', 'roi', 'return', 'cost'
+]
+KELLY_COLUMNS = ['final_bankroll', 'max_drawdown'] # 賭け式 'kelly' の行のみ
+
+def load_predictions(start_year, end_year, race_min=None, race_max=None, start_month=None, end_month=None, use_cache=True):
+    """
+    評価期間のデータを読み込み、evaluate_settings.yml の競馬場・レース番号と race_min/max で絞り込んで予測する。
+    戻り値は (race_id, place_code, win_prob, rank, odds, umaban, date を持つ DataFrame, artifacts)。データが無ければ (None, None)。
+    予測は prediction_cache 経由で、キャッシュに無いレースだけ推論する。
+    """
+    from . import preprocess
+    from . import prediction_cache
+    import joblib
+    import yaml
+
+    if not os.path.exists(settings.MODEL_PATH):
+        print("Model not found.")
+        return None, None
+
+    print("Loading Model...")
+    model = joblib.load(settings.MODEL_PATH)
+    artifacts = joblib.load(os.path.join(settings.MODEL_DIR, 'encoders.pkl'))
+
+    # Load Data
+    print("Loading Data...")
+    raw_df = preprocess.load_data(start_year=start_year, end_year=end_year, start_month=start_month, end_month=end_month)
+
+    if raw_df.empty:
+        print("No data found, skipping.")
+        return None, None
+
+    # Load Filters
+    yaml_path = os.path.join(os.path.dirname(__file__), 'evaluate_settings.yml')
+    config = {}
+    if os.path.exists(yaml_path):
+        with open(yaml_path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+
+    r_min = int(race_min) if race_min is not None else 1
+    r_max = int(race_max) if race_max is not None else 12
+
+    # Filter places & races
+    raw_df['race_id'] = raw_df['race_id'].astype(str)
+    raw_df['race_no'] = raw_df['race_id'].str[-2:].astype(int)
+
+    # 1. Config Filters (evaluate_settings.yml)
+    if config:
+        target_places = config.get('target_places', [])
+        if target_places:
+            print(f"Filtering places: {target_places}")
+            raw_df = raw_df[raw_df['race_id'].str[4:6].isin([str(p).zfill(2) for p in target_places])]
+
+        target_races = config.get('target_race_numbers', [])
+        if target_races:
+            print(f"Filtering race numbers from settings: {target_races}")
+            raw_df = raw_df[raw_df['race_no'].isin(target_races)]
+
+    # 2. CLI Range Filter (race_min/max)
+    if race_min is not None or race_max is not None:
+         print(f"Filtering race numbers by range: {r_min}-{r_max}")
+         raw_df = raw_df[(raw_df['race_no'] >= r_min) & (raw_df['race_no'] <= r_max)]
+
+    if raw_df.empty:
+        print("No data after filtering.")
+        return None, None
+
+    # Transform & Predict (キャッシュ済みのレースは推論しない)
+    raw_df = raw_df.reset_index(drop=True)
+    features = model.feature_name() if hasattr(model, 'feature_name') else settings.FEATURES # 学習時の特徴量リストを優先
+    context = {
+        'first_race': raw_df['race_id'].min(),
+        'places': config.get('target_places', []) if config else [],
+        'race_numbers': config.get('target_race_numbers', []) if config else [],
+        'race_range': [r_min, r_max] if race_min is not None or race_max is not None else None
+    }
+    win_prob = prediction_cache.predict_cached(model, raw_df, artifacts, features, context=context, use_cache=use_cache)
+
+    # Attach Metadata (raw_df と同じ行順)
+    df_base = pd.DataFrame({'win_prob': win_prob})
+    df_base['race_id'] = raw_df['race_id'].astype(str)
+    df_base['place_code'] = df_base['race_id'].str[4:6]
+    df_base['rank'] = pd.to_numeric(raw_df['rank'], errors='coerce')
+    df_base['odds'] = pd.to_numeric(raw_df['odds'], errors='coerce').fillna(0)
+    if 'umaban' in raw_df.columns:
+        df_base['umaban'] = pd.to_numeric(raw_df['umaban'], errors='coerce')
+    if all(c in raw_df.columns for c in ['year', 'month', 'day']):
+        df_base['date'] = pd.to_datetime(raw_df[['year', 'month', 'day']], errors='coerce')
+
+    # Pre-filtering for simulation
+    df_base = df_base[df_base['place_code'].notna()]
+    return df_base, artifacts
+
+def to_arrays(df):
+    """予測結果の DataFrame から共有する配列 (ARRAY_COLUMNS) を作る"""
+    return {
+        'race_id': pd.to_numeric(df['race_id'], errors='coerce').fillna(0).astype('int64').to_numpy(),
+        'win_prob': df['win_prob'].to_numpy(dtype=np.float64),
+        'rank': pd.to_numeric(df['rank'], errors='coerce').to_numpy(dtype=np.float64),
+        'odds': pd.to_numeric(df['odds'], errors='coerce').fillna(0).to_numpy(dtype=np.float64),
+        # 馬番 (払戻テーブルの参照用、無ければ NaN)
+        'umaban': (pd.to_numeric(df['umaban'], errors='coerce').to_numpy(dtype=np.float64)
+                   if 'umaban' in df.columns else np.full(len(df), np.nan)),
+        # 開催日 (1970-01-01 からの日数)。Kelly の1日の上限に使う
+        'day': (pd.to_datetime(df['date'], errors='coerce').to_numpy().astype('datetime64[D]').astype(np.int64)
+                if 'date' in df.columns else np.zeros(len(df), dtype=np.int64))
+    }
+
+class SharedArrays:
+    """
+    配列の dict を shared_memory に置く。spec() をワーカーに渡し、attach() で同じメモリを開く。
+    with ブロックを抜けると共有メモリを解放する。
+    """
+    def __init__(self, arrays):
+        self.blocks = {}
+        self.arrays = {}
+        for name, values in arrays.items():
+            values = np.ascontiguousarray(values)
+            shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            view = np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)
+            view[:] = values
+            self.blocks[name] = shm
+            self.arrays[name] = view
+
+    def spec(self):
+        return {name: (self.blocks[name].name, self.arrays[name].dtype.str, self.arrays[name].shape) for name in self.blocks}
+
+    def close(self):
+        self.arrays = {}
+        for shm in self.blocks.values():
+            shm.close()
+            shm.unlink()
+        self.blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+def attach(spec):
+    """spec() の共有メモリを開き、(配列の dict, SharedMemory のリスト) を返す"""
+    arrays, blocks = {}, []
+    for name, (shm_name, dtype, shape) in spec.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        blocks.append(shm)
+    return arrays, blocks
+
+def _add_rates(df):
+    bets = df['bets'].replace(0, np.nan)
+    df['hit_rate'] = (df['hits'] / bets * 100).fillna(0)
+    df['place_rate'] = (df['hits_top3'] / bets * 100).fillna(0)
+    df['roi'] = (df['return'] / df['cost'].replace(0, np.nan) * 100).fillna(0)
+    return df
+
+def evaluate_cell(arrays, power, race_min, race_max, betting_types, thresholds, by_place=True, n_boot=0,
+                  kelly_fraction=staking.KELLY_FRACTION, payout_index=None):
+    """
+    1つの (power, レース番号範囲) について、全賭け式 × 全閾値 × 競馬場 (+ 全体 'all') の成績表を返す。
+    race_id は YYYY PP KK DD RR の整数 (PP: 競馬場コード, RR: レース番号)。
+    n_boot > 0 なら各行に ROI・的中率のブートストラップ信頼区間 (bootstrap.CI_COLUMNS) を付ける。
+    全セルで同じ乱数列を使うので、power 間の比較ではリサンプルの揺れが揃う。
+    賭け式 'kelly' の return / cost は資金 staking.BANKROLL から分数 Kelly で賭けた金額 (信頼区間なし)。
+    単勝と 'kelly' 以外の賭け式は payout_index (payouts.PayoutIndex) の払戻で集計する (無ければ ValueError)。
+    """
+    paid = [bt for bt in betting_types if bt not in ('win', 'kelly')]
+    if paid and payout_index is None:
+        raise ValueError(f"Bet types {paid} need payout tables (payouts_YYYY.csv)")
+    race_id = arrays['race_id']
+    race_no = race_id % 100
+    mask = (race_no >= race_min) & (race_no <= race_max)
+    odds = arrays['odds'][mask]
+    df = pd.DataFrame({
+        'race_id': race_id[mask],
+        'rank': arrays['rank'][mask],
+        'odds': odds,
+        'score': (arrays['win_prob'][mask] ** power) * odds
+    })
+    k = backtest.TOP_K
+    if paid:
+        df['umaban'] = arrays['umaban'][mask]
+        k = max(k, payout_backtest.positions_needed({bt: payout_backtest.STRATEGIES[bt] for bt in paid}))
+    top = backtest.top_k(df, k)
+    places = pd.Series((top['race_id'] // 10**6) % 100).map('{:02d}'.format)
+    kelly = None
+    if 'kelly' in betting_types:
+        # 確率はレースごとの softmax、レースの並びは top_k と同じ (race_id の出現順)
+        codes, _ = pd.factorize(df['race_id'])
+        day = arrays['day'][mask] if 'day' in arrays else np.zeros(len(df), dtype=np.int64)
+        kelly = staking.race_table(df['race_id'].to_numpy(), day, staking.softmax_by_race(codes, arrays['win_prob'][mask]),
+                                   odds, df['rank'].to_numpy(), kelly_fraction)
+
+    def sweep(groups, bt):
+        if bt == 'kelly':
+            res = staking.threshold_sweep(kelly, top['score'][:, 0], thresholds, groups)
+            return res.reindex(columns=list(res.columns) + (bootstrap.CI_COLUMNS if n_boot else []))
+        res = backtest.threshold_sweep(top, thresholds, groups=groups, betting_type=bt, payout_index=payout_index)
+        if n_boot:
+            ci = bootstrap.sweep_intervals(top, thresholds, groups=groups, betting_type=bt, n_boot=n_boot,
+                                           payout_index=payout_index)
+            res = pd.concat([res, ci[bootstrap.CI_COLUMNS]], axis=1) # 同じ行順
+        return res
+
+    frames = []
+    for bt in betting_types:
+        if by_place:
+            frames.append(sweep(places, bt).assign(betting_type=bt))
+        frames.append(sweep(None, bt).assign(group='all', betting_type=bt))
+    result = pd.concat(frames, ignore_index=True).rename(columns={'group': 'place_code'})
+    result['power'] = power
+    result['race_min'] = race_min
+    result['race_max'] = race_max
+    extra = (bootstrap.CI_COLUMNS if n_boot else []) + (KELLY_COLUMNS if kelly is not None else [])
+    return _add_rates(result)[RESULT_COLUMNS + extra]
+
+# --- Worker side (共有メモリを開いたまま保持する) ---
+_ARRAYS = None
+_BLOCKS = []
+_PAYOUTS = None
+
+def _init_worker(spec, payout_index=None):
+    global _ARRAYS, _BLOCKS, _PAYOUTS
+    _ARRAYS, _BLOCKS = attach(spec)
+    _PAYOUTS = payout_index
+
+def _run_task(power, race_min, race_max, betting_types, thresholds, by_place, n_boot, kelly_fraction):
+    return evaluate_cell(_ARRAYS, power, race_min, race_max, betting_types, thresholds, by_place, n_boot, kelly_fraction,
+                         _PAYOUTS)
+
+def _stream(result, output, first):
+    """結果を output (CSV) へ追記する"""
+    if output:
+        result.to_csv(output, mode='w' if first else 'a', header=first, index=False)
+
+def run_grid(df, powers, race_windows=((1, 12),), betting_types=('win',), thresholds=None,
+             workers=None, output=None, by_place=True, n_boot=0, kelly_fraction=staking.KELLY_FRACTION, payout_table=None):
+    """
+    (power × race_windows) をタスクとしてプロセスプールで評価し、1つの DataFrame (RESULT_COLUMNS) を返す。
+    n_boot > 0 なら信頼区間の列 (bootstrap.CI_COLUMNS) も付ける。
+    betting_types に 'kelly' を含めると kelly_fraction の分数 Kelly の行 (KELLY_COLUMNS 付き) も評価する。
+    単勝以外の賭け式は payout_table (payouts.load_payouts の DataFrame) の払戻で評価し、払戻が無ければ除く。
+    output を指定すると、完了したタスクの結果から順に CSV へ書き出す。
+    workers=1 またはタスクが1つの場合はプロセスを起動せずに実行する。
+    """
+    if thresholds is None:
+        thresholds = np.round(np.arange(0, 1.05, 0.1), 6)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    betting_types = list(betting_types)
+    payout_index = None
+    if payout_table is not None and not payout_table.empty:
+        payout_index = payouts.PayoutIndex(payout_table)
+    skipped = [bt for bt in betting_types if bt not in ('win', 'kelly') and payout_index is None]
+    if skipped:
+        print(f"⚠️  No payout data: skipping bet types {skipped} (run train.scraper_bulk to collect payouts)")
+        betting_types = [bt for bt in betting_types if bt not in skipped]
+        if not betting_types:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+    arrays = to_arrays(df)
+    tasks = [(p, int(lo), int(hi)) for p in powers for lo, hi in race_windows]
+
+    cpu = os.cpu_count() or 1
+    workers = max(1, min(len(tasks), workers or cpu))
+    cells = len(tasks) * len(betting_types) * len(thresholds)
+    print(f"Grid: {len(powers)} powers x {len(race_windows)} race windows x {len(betting_types)} bet types "
+          f"x {len(thresholds)} thresholds ({cells} cells per place) | Workers: {workers}")
+
+    frames = []
+    started = time.time()
+    with profiling.stage('grid', rows=len(arrays['race_id'])):
+        if workers == 1:
+            for i, (power, lo, hi) in enumerate(tasks):
+                res = evaluate_cell(arrays, power, lo, hi, betting_types, thresholds, by_place, n_boot, kelly_fraction,
+                                    payout_index)
+                _stream(res, output, i == 0)
+                frames.append(res)
+        else:
+            ctx = multiprocessing.get_context('spawn')
+            with SharedArrays(arrays) as shared:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                         initializer=_init_worker, initargs=(shared.spec(), payout_index)) as pool:
+                    futures = [pool.submit(_run_task, power, lo, hi, betting_types, thresholds, by_place, n_boot, kelly_fraction)
+                               for power, lo, hi in tasks]
+                    for i, fut in enumerate(as_completed(futures)):
+                        res = fut.result()
+                        _stream(res, output, i == 0)
+                        frames.append(res)
+                        print(f"[{i + 1}/{len(tasks)}] power {res['power'].iloc[0]} / "
+                              f"races {res['race_min'].iloc[0]}-{res['race_max'].iloc[0]} done")
+
+    print(f"Grid finished in {time.time() - started:.1f}s")
+    if not frames:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    return pd.concat(frames, ignore_index=True).sort_values(
+        ['power', 'race_min', 'race_max', 'betting_type', 'min_score', 'place_code'], kind='mergesort'
+    ).reset_index(drop=True)
+
+def best_configs(results, min_bets=10, top_n=10):
+    """全競馬場合計 ('all') の行から、min_bets 以上賭けた ROI 上位の組み合わせを返す"""
+    total = results[(results['place_code'] == 'all') & (results['bets'] >= min_bets)]
+    return total.sort_values('roi', ascending=False).head(top_n)
+
+def parse_windows(text):
+    """'1-12,9-12' -> [(1, 12), (9, 12)]"""
+    windows = []
+    for part in text.split(','):
+        lo, _, hi = part.strip().partition('-')
+        windows.append((int(lo), int(hi or lo)))
+    return windows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel strategy grid evaluation")
+    parser.add_argument("--start", type=int, default=2025)
+    parser.add_argument("--end", type=int, default=2025)
+    parser.add_argument("--start_month", type=int, default=None, help="Start Month (1-12)")
+    parser.add_argument("--end_month", type=int, default=None, help="End Month (1-12)")
+    parser.add_argument("--power_min", type=int, default=settings.POWER_EXPONENT)
+    parser.add_argument("--power_max", type=int, default=None)
+    parser.add_argument("--race_windows", type=str, default="1-12", help="Race number windows, e.g. 1-12,9-12")
+    parser.add_argument("--bet_types", type=str, default="win",
+                        help=f"Comma separated: {','.join(list(payout_backtest.STRATEGIES) + ['kelly'])} (non-win types need payout tables)")
+    parser.add_argument("--kelly_fraction", type=float, default=staking.KELLY_FRACTION, help="Fraction of full Kelly for the 'kelly' bet type")
+    parser.add_argument("--score_step", type=float, default=0.1)
+    parser.add_argument("--score_max", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size (default: all cores)")
+    parser.add_argument("--output", type=str, default="grid_results.csv")
+    parser.add_argument("--bootstrap", type=int, default=0, help="Bootstrap resamples for ROI / hit rate CIs (0 = off)")
+    parser.add_argument("--no_cache", action="store_true", help="Ignore the prediction cache and re-run the model for all races")
+    args = parser.parse_args()
+
+    windows = parse_windows(args.race_windows)
+    df, _ = load_predictions(args.start, args.end, min(w[0] for w in windows), max(w[1] for w in windows),
+                             args.start_month, args.end_month, use_cache=not args.no_cache)
+    if df is not None:
+        power_max = args.power_max if args.power_max is not None else args.power_min
+        thresholds = np.round(np.arange(0, args.score_max + args.score_step / 2, args.score_step), 6)
+        results = run_grid(df, list(range(args.power_min, power_max + 1)), windows,
+                           [b.strip() for b in args.bet_types.split(',')], thresholds,
+                           workers=args.workers, output=args.output, n_boot=args.bootstrap, kelly_fraction=args.kelly_fraction,
+                           payout_table=payouts.load_payouts(args.start, args.end))
+        print("\nTop configurations (all places, >= 10 bets):")
+        print(best_configs(results).to_string(index=False))
+        print(f"\nSaved {args.output}")
@@ -0,0 +1,190 @@
+"""
+HTML レポートのコンパイル済みテンプレート (予測レポート・評価レポート共通)。
+
+テンプレートは str.format の書式で書き、作成時に1回だけ解析して
+「位置引数の書式文字列 + フィールドごとの (列名, 書式, エスケープの有無)」にしておく。
+    {name}     : HTML エスケープして埋め込む
+    {name!s}   : エスケープしない (組み立て済みの HTML)
+    {name:.1f} : 書式指定 ({p:.1%} なら 100 倍して %)。欠損値 (None / NaN) は na の文字列
+表は列の配列 (dict: 列名 -> 値のリスト、スカラーは全行に同じ値) を受け取り、列ごとにまとめて整形・
+エスケープしてから1行1回の format で出力先のファイルへ直接書く (DataFrame.iterrows も文字列の連結もしない)。
+列の配列は frame_columns(df) で DataFrame から1回で取り出せる。
+
+    ROW = Template('<tr><td>{name}</td><td>{win_prob:.1f}%</td></tr>\\n')
+    ROW.write_rows(f, {'name': names, 'win_prob': probs})
+
+速度比較: python -m train.html_render --races 500
+"""
+import html
+import string
+
+import numpy as np
+import pandas as pd
+
+def _is_na(value):
+    return value is None or value != value # NaN
+
+def _cell(value, spec, na):
+    return na if _is_na(value) else format(value, spec)
+
+def _escape_all(cells):
+    # 列全体を1つの文字列にしてまとめてエスケープする (区切りの \0 はエスケープされない)
+    if not cells:
+        return []
+    joined = '\0'.join(cells)
+    if joined.count('\0') != len(cells) - 1: # 値に \0 が含まれる
+        return list(map(html.escape, cells))
+    return html.escape(joined).split('\0')
+
+def frame_columns(df, names=None):
+    """DataFrame の列を Python の値のリストの dict にする (列ごとの取り出しより速い)"""
+    frame = df if names is None else df[names]
+    return dict(zip(frame.columns, frame.to_numpy(dtype=object).T.tolist())) if len(frame) else {c: [] for c in frame.columns}
+
+def first_only(n, value):
+    """先頭の行だけ value、残りは '' の列 (タブの active や1位の行のクラス)"""
+    return [value] + [''] * (n - 1) if n else []
+
+class Template:
+    def __init__(self, source, na='-'):
+        self.na = na
+        parts = []
+        self.fields = [] # (name, spec, escape)
+        for literal, name, spec, conversion in string.Formatter().parse(source):
+            parts.append(literal.replace('{', '{{').replace('}', '}}'))
+            if name is not None:
+                parts.append('{%d}' % len(self.fields))
+                self.fields.append((name, spec or '', conversion != 's'))
+        self._format = ''.join(parts).format
+
+    def _column(self, values, n, spec, escape):
+        # 1列分をまとめて文字列にする
+        if np.ndim(values) == 0:
+            return [self._column([values], 1, spec, escape)[0]] * n
+        na = self.na
+        if spec:
+            cells = [_cell(v, spec, na) for v in values]
+        else:
+            cells = [na if _is_na(v) else str(v) for v in values]
+        return _escape_all(cells) if escape else cells
+
+    def render(self, **values):
+        return ''.join(self.render_rows({k: [v] for k, v in values.items()}, 1))
+
+    def write(self, f, **values):
+        f.write(self.render(**values))
+
+    def render_rows(self, columns, n=None):
+        """列の配列から1行ずつの文字列を返す (イテレータ)"""
+        if n is None:
+            n = max((len(v) for v in columns.values() if np.ndim(v) > 0), default=1)
+        cols = [self._column(columns[name], n, spec, escape) for name, spec, escape in self.fields]
+        if not cols:
+            return iter([self._format()] * n)
+        return map(self._format, *cols)
+
+    def write_rows(self, f, columns, n=None):
+        f.writelines(self.render_rows(columns, n))
+
+_TH = Template('<th>{name}</th>')
+
+def write_frame(f, df, float_format='.2f', float_suffix='', index=False, na_rep='-', classes='table'):
+    """
+    DataFrame.to_html の代わりに表を f へ直接書く (浮動小数の列は float_format + float_suffix で整形)。
+    index=True なら先頭の列にインデックスを出す (インデックスは書式を付けない)。
+    """
+    frame = df.reset_index() if index else df
+    n_index = df.index.nlevels if index else 0
+    values = frame_columns(frame.set_axis(range(frame.shape[1]), axis=1))
+    columns = {}
+    for i, dtype in enumerate(frame.dtypes):
+        if i >= n_index and pd.api.types.is_float_dtype(dtype):
+            columns[f"c{i}"] = [na_rep if _is_na(v) else format(v, float_format) + float_suffix for v in values[i]]
+        else:
+            columns[f"c{i}"] = values[i]
+    names = ['' if col is None else col for col in frame.columns]
+    row = Template('<tr>' + ''.join(f"<td>{{c{i}}}</td>" for i in range(frame.shape[1])) + '</tr>\n', na=na_rep)
+    f.write(f'<table class="{html.escape(classes)}">\n<thead><tr>')
+    _TH.write_rows(f, {'name': names})
+    f.write('</tr></thead>\n<tbody>\n')
+    row.write_rows(f, columns, len(frame))
+    f.write('</tbody>\n</table>\n')
+
+# --- ベンチマーク (疑似データの1週間分のレース表) ---
+BENCH_ROW = Template('<tr class="{row_class}"><td>{symbol}</td><td>{umaban}</td><td>{name}</td><td>{jockey}</td>'
+                     '<td>{odds}</td><td>{win_prob:.1%}</td><td><strong>{score:.4f}</strong></td></tr>\n')
+BENCH_HEAD = Template('<div class="card"><div class="card-header">{title} | ID: {race_id}</div><table><tbody>\n')
+BENCH_SYMBOLS = ['🥇', '🥈', '🥉', '△', '☆']
+
+def synthetic_week(n_races=500, seed=0):
+    """ベンチマーク用の疑似レース ([(race_id, title, DataFrame)]、1レース 8〜18頭)"""
+    rng = np.random.default_rng(seed)
+    races = []
+    for i in range(n_races):
+        n = int(rng.integers(8, 19))
+        df = pd.DataFrame({
+            'umaban': rng.permutation(n) + 1,
+            'name': [f"ホース{i}-{j}" for j in range(n)],
+            'jockey': [f"騎手{j % 7}" for j in range(n)],
+            'odds': np.round(rng.lognormal(2.5, 1.0, n), 1),
+            'win_prob': rng.dirichlet(np.ones(n))
+        })
+        df['score'] = df['win_prob'] ** 4 * df['odds']
+        races.append((f"2026050101{i:04d}", f"{i % 12 + 1}R テスト", df.sort_values('score', ascending=False)))
+    return races
+
+def render_loop(f, races):
+    """従来の書き方 (iterrows + f-string の連結) のレース表"""
+    out = ""
+    for race_id, title, df in races:
+        out += f'<div class="card"><div class="card-header">{html.escape(title)} | ID: {race_id}</div><table><tbody>\n'
+        for i, (_, row) in enumerate(df.iterrows()):
+            symbol = BENCH_SYMBOLS[i] if i < len(BENCH_SYMBOLS) else ''
+            row_class = 'top-pick-row' if i == 0 else ''
+            out += (f'<tr class="{row_class}"><td>{symbol}</td><td>{row["umaban"]}</td><td>{html.escape(row["name"])}</td>'
+                    f'<td>{html.escape(row["jockey"])}</td><td>{row["odds"]}</td><td>{row["win_prob"] * 100:.1f}%</td>'
+                    f'<td><strong>{row["score"]:.4f}</strong></td></tr>\n')
+        out += '</tbody></table></div>\n'
+    f.write(out)
+
+def render_compiled(f, races):
+    """列の配列 + コンパイル済みテンプレートで同じ表を書く"""
+    for race_id, title, df in races:
+        n = len(df)
+        BENCH_HEAD.write(f, title=title, race_id=race_id)
+        BENCH_ROW.write_rows(f, {
+            'row_class': first_only(n, 'top-pick-row'),
+            'symbol': (BENCH_SYMBOLS + [''] * n)[:n],
+            **frame_columns(df)
+        }, n)
+        f.write('</tbody></table></div>\n')
+
+def benchmark(n_races=500):
+    """疑似データの n_races レースを従来の書き方とテンプレートで描画し、出力の一致と時間を比較する"""
+    import io
+    import time
+    races = synthetic_week(n_races)
+    print(f"Benchmark: {n_races} races, {sum(len(df) for _, _, df in races)} rows")
+
+    t0 = time.perf_counter()
+    slow = io.StringIO()
+    render_loop(slow, races)
+    t_slow = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    fast = io.StringIO()
+    render_compiled(fast, races)
+    t_fast = time.perf_counter() - t0
+
+    status = 'OK' if slow.getvalue() == fast.getvalue() else 'MISMATCH'
+    print(f"Output: {len(fast.getvalue()) / 1024:.0f} KiB ({status})")
+    print(f"iterrows + f-string: {t_slow:.3f}s")
+    print(f"Compiled template:   {t_fast:.3f}s ({t_slow / max(t_fast, 1e-9):.0f}x)")
+    return t_slow, t_fast
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Report rendering benchmark (iterrows vs compiled templates)")
+    parser.add_argument("--races", type=int, default=500)
+    args = parser.parse_args()
+    benchmark(args.races)
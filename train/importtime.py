@@ -0,0 +1,104 @@
+"""
+エントリーポイントの import 時間の予算と、python -X importtime による回帰ベンチマーク。
+
+重いモジュール (HEAVY: lightgbm, sklearn, matplotlib, requests, bs4, joblib) はそれを使う関数の中で
+import し、エントリーポイントを import しただけでは読み込まないようにしている (CLI の --help や
+常駐サーバーの起動、レポートだけの実行が速くなる)。各エントリーポイントを新しいインタプリタで
+`python -X importtime -c "import <module>"` して累積時間を測り、BUDGETS_MS と比べる。
+
+    python -m train.importtime              # 予算を超えたか重いモジュールを読み込んだら終了コード 1
+    python -m train.importtime --runs 5 --top 10
+"""
+import os
+import re
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# エントリーポイント -> import 時間の予算 (ms、pandas + numpy の読み込み込み)
+BUDGETS_MS = {
+    'train.train': 700,
+    'train.evaluate': 700,
+    'train.report.evaluate_html_generator': 700,
+    'app.report.predict_html_generator': 700,
+    'app.run_weekend': 700,
+    'app.server': 700,
+    'app.scheduler': 700,
+    'app.predictor': 100 # numpy / pandas は予測するときに読み込む
+}
+HEAVY = ['lightgbm', 'sklearn', 'matplotlib', 'requests', 'bs4', 'joblib']
+
+_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+def parse(stderr):
+    """-X importtime の出力を [(name, self_us, cumulative_us, depth)] にする"""
+    rows = []
+    for line in stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), (len(m.group(3)) - 1) // 2))
+    return rows
+
+def measure(module, runs=3):
+    """
+    新しいインタプリタで module を runs 回 import して
+    {'ms': 最小の累積時間, 'heavy': 読み込まれた HEAVY, 'top': [(パッケージ, ms)] (遅い順)} を返す。
+    top は module が読み込んだ最上位のモジュール・パッケージごとの累積時間 (入れ子で重複して数える)。
+    """
+    best = None
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                              capture_output=True, text=True, cwd=PROJECT_ROOT)
+        if proc.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+        rows = parse(proc.stderr)
+        end = next((i for i, (name, _, _, depth) in enumerate(rows) if name == module and depth == 0), None)
+        if end is None:
+            raise RuntimeError(f"no importtime line for {module}")
+        # module の行の直前の depth 0 の行 (インタプリタの起動時の import) より後が module が読み込んだもの
+        start = max([i + 1 for i, row in enumerate(rows[:end]) if row[3] == 0], default=0)
+        if best is None or rows[end][2] < best[0]:
+            best = (rows[end][2], rows[start:end])
+    total, rows = best
+    loaded = {name.split('.')[0] for name, _, _, _ in rows}
+    own = {module.split('.')[0], 'train', 'app'}
+    top = {}
+    for name, _, cum, _ in rows:
+        if '.' not in name and name not in own and not name.startswith('_'):
+            top[name] = max(top.get(name, 0), cum)
+    return {
+        'ms': total / 1000,
+        'heavy': [h for h in HEAVY if h in loaded],
+        'top': sorted(((name, us / 1000) for name, us in top.items()), key=lambda x: -x[1])
+    }
+
+def check(budgets=None, runs=3, top=5):
+    """全エントリーポイントを測って表を出す。予算超過・重いモジュールの読み込みのリストを返す"""
+    budgets = budgets or BUDGETS_MS
+    failures = []
+    print(f"{'module':<40} {'import':>9} {'budget':>8}")
+    for module, budget in budgets.items():
+        result = measure(module, runs)
+        status = 'OK'
+        if result['ms'] > budget:
+            status = 'OVER'
+            failures.append(f"{module}: {result['ms']:.0f}ms > {budget}ms")
+        if result['heavy']:
+            status = 'HEAVY'
+            failures.append(f"{module}: imports {', '.join(result['heavy'])}")
+        print(f"{module:<40} {result['ms']:7.0f}ms {budget:6d}ms  {status}")
+        if top:
+            print("    " + ", ".join(f"{name} {ms:.0f}ms" for name, ms in result['top'][:top]))
+    return failures
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Import-time budget check for the CLI entry points (python -X importtime)")
+    parser.add_argument("--runs", type=int, default=3, help="Imports per module (the fastest run is used)")
+    parser.add_argument("--top", type=int, default=5, help="Slowest top-level dependencies to show per module")
+    args = parser.parse_args()
+    failures = check(runs=args.runs, top=args.top)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,157 @@
+"""
+払戻テーブル (train/payouts.py) を使った全賭け式のバックテスト。
+
+買い目は「予測順位の位置」で書いたテンプレート (T 点 × 頭数) として1回だけ作り、
+上位 N 頭の馬番行列 (レース数 × N) に当てはめて (レース数 × T × 頭数) の馬番配列にする。
+払戻は PayoutIndex.lookup で全レース・全買い目を一度に引くので、レースごとの分岐はない。
+
+戦略は (bet_type, legs)。legs は着順ごとの予測順位 (0 始まり) のリスト:
+    [[0], [1]]                 1位 - 2位 (馬連なら1点)
+    [[0, 1, 2]]                上位3頭のボックス
+    [[0], [1, 2], [1, 2, 3, 4]] フォーメーション (1着: 1位 / 2着: 2,3位 / 3着: 2〜5位)
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from . import backtest
+from . import payouts
+
+BET_AMOUNT = backtest.BET_AMOUNT
+
+# evaluate_settings.yml の betting_type と同じ名前は backtest._hits_and_points と同じ買い方
+STRATEGIES = {
+    'win': ('win', [[0]]),
+    'place': ('place', [[0]]),
+    'uma_ren': ('uma_ren', [[0], [1]]),
+    'wide': ('wide', [[0], [1]]),
+    'trifecta': ('trifecta', [[0], [1], [2]]),
+    'box_trifecta': ('trifecta', [[0, 1, 2]]),
+    'uma_tan': ('uma_tan', [[0], [1]]),
+    'trio': ('trio', [[0], [1], [2]]),
+    'uma_ren_box3': ('uma_ren', [[0, 1, 2]]),
+    'wide_box3': ('wide', [[0, 1, 2]]),
+    'trio_box5': ('trio', [[0, 1, 2, 3, 4]]),
+    'uma_tan_1_23': ('uma_tan', [[0], [1, 2]]),
+    'trio_1_23_2345': ('trio', [[0], [1, 2], [1, 2, 3, 4]]),
+    'trifecta_1_23_2345': ('trifecta', [[0], [1, 2], [1, 2, 3, 4]])
+}
+
+RESULT_COLUMNS = ['strategy', 'bet_type', 'tickets', 'bet_races', 'hits', 'hit_rate', 'cost', 'return', 'roi']
+
+def tickets(bet_type, legs):
+    """
+    戦略の買い目テンプレート (T, 頭数) を予測順位の位置で返す。
+    legs が1つだけなら全着順に同じ候補を使う (ボックス)。同じ馬を含む組と、順不同の賭け式での重複は除く。
+    """
+    n_legs = payouts.LEGS[bet_type]
+    if len(legs) == 1:
+        legs = list(legs) * n_legs
+    if len(legs) != n_legs:
+        raise ValueError(f"{bet_type} needs {n_legs} legs, got {len(legs)}")
+    combos = []
+    seen = set()
+    for combo in itertools.product(*legs):
+        if len(set(combo)) < n_legs:
+            continue
+        key = combo if bet_type in payouts.ORDERED else tuple(sorted(combo))
+        if key in seen:
+            continue
+        seen.add(key)
+        combos.append(combo)
+    return np.array(combos, dtype=np.int64).reshape(-1, n_legs)
+
+def positions_needed(strategies):
+    """戦略に必要な予測上位の頭数 (top_k の k)"""
+    return max(max(max(leg) for leg in legs) for _, legs in strategies.values()) + 1
+
+def parse_strategy(text):
+    """
+    CLI 用: 'trifecta:1/23/2345' (フォーメーション) や 'trio:box5' を (bet_type, legs) にする。
+    予測順位は 1 始まりで書く。
+    """
+    bet_type, _, spec = text.partition(':')
+    if bet_type not in payouts.LEGS:
+        raise ValueError(f"Unknown bet_type: {bet_type}")
+    if spec.startswith('box'):
+        return bet_type, [list(range(int(spec[3:])))]
+    return bet_type, [[int(c) - 1 for c in leg] for leg in spec.split('/')]
+
+def race_returns(top, index, bet_type, legs, bet_amount=BET_AMOUNT):
+    """
+    全レースについて戦略の投資額 (R,) と払戻額 (R,) を返す。
+    top は umaban 付きの backtest.top_k() の結果。馬番の無い位置 (頭数不足) を含む買い目は買わない。
+    """
+    template = tickets(bet_type, legs)
+    umaban = top['umaban']
+    if umaban.shape[1] <= template.max():
+        umaban = np.pad(umaban, ((0, 0), (0, template.max() + 1 - umaban.shape[1])), constant_values=np.nan)
+    numbers = umaban[:, template] # (R, T, 頭数)
+    bought = ~np.isnan(numbers).any(axis=-1)
+    race_ids = pd.to_numeric(pd.Series(top['race_id']), errors='coerce').fillna(0).astype('int64').to_numpy()
+    pay = index.lookup(bet_type, race_ids, numbers)
+    cost = bought.sum(axis=1) * bet_amount
+    ret = np.where(bought, pay, 0).sum(axis=1) * bet_amount / 100
+    return cost.astype(np.float64), ret
+
+def bet_mask(top, index, min_score=0.0):
+    """賭けるレース: 1着馬がいて、払戻データがあり、上位1頭のスコアが min_score 以上"""
+    race_ids = pd.to_numeric(pd.Series(top['race_id']), errors='coerce').fillna(0).astype('int64').to_numpy()
+    return top['has_winner'] & index.has_race(race_ids) & ~(top['score'][:, 0] < min_score)
+
+def evaluate_strategies(top, index, strategies=None, min_score=0.0, bet_amount=BET_AMOUNT):
+    """全戦略の成績を DataFrame (RESULT_COLUMNS) で返す"""
+    strategies = strategies or STRATEGIES
+    bet = bet_mask(top, index, min_score)
+    rows = []
+    for name, (bet_type, legs) in strategies.items():
+        cost, ret = race_returns(top, index, bet_type, legs, bet_amount)
+        cost, ret = cost[bet], ret[bet]
+        bet_races = int((cost > 0).sum())
+        hits = int((ret > 0).sum())
+        total_cost = float(cost.sum())
+        total_return = float(ret.sum())
+        rows.append({
+            'strategy': name,
+            'bet_type': bet_type,
+            'tickets': len(tickets(bet_type, legs)),
+            'bet_races': bet_races,
+            'hits': hits,
+            'hit_rate': hits / bet_races if bet_races > 0 else 0,
+            'cost': total_cost,
+            'return': total_return,
+            'roi': total_return / total_cost * 100 if total_cost > 0 else 0
+        })
+    return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+
+def format_results(results):
+    lines = [f"{'Strategy':<20} {'Pts':>4} {'Races':>6} {'Hits':>6} {'Hit%':>7} {'ROI':>8}"]
+    for r in results.itertuples(index=False):
+        lines.append(f"{r.strategy:<20} {r.tickets:>4} {r.bet_races:>6} {r.hits:>6} {r.hit_rate * 100:>6.1f}% {r.roi:>7.1f}%")
+    return '\n'.join(lines)
+
+if __name__ == "__main__":
+    import argparse
+    from . import grid
+    from . import settings
+    parser = argparse.ArgumentParser(description="Backtest every bet type against scraped payout tables")
+    parser.add_argument("--start", type=int, default=2025)
+    parser.add_argument("--end", type=int, default=2025)
+    parser.add_argument("--power", type=float, default=settings.POWER_EXPONENT)
+    parser.add_argument("--min_score", type=float, default=0.0)
+    parser.add_argument("--strategy", action="append", help="Extra strategy, e.g. trifecta:1/23/2345 or trio:box5")
+    args = parser.parse_args()
+
+    table = payouts.load_payouts(args.start, args.end)
+    if table.empty:
+        print("No payout data found. Run train.scraper_bulk first.")
+    else:
+        df, _ = grid.load_predictions(args.start, args.end)
+        if df is not None:
+            strategies = dict(STRATEGIES)
+            for text in args.strategy or []:
+                strategies[text] = parse_strategy(text)
+            df['score'] = (df['win_prob'] ** args.power) * df['odds']
+            top = backtest.top_k(df, positions_needed(strategies))
+            print(format_results(evaluate_strategies(top, payouts.PayoutIndex(table), strategies, args.min_score)))
@@ -0,0 +1,169 @@
+"""
+払戻 (払戻金) テーブルの保存と参照。
+
+レース結果ページの払戻テーブル (table.pay_table_01) を1行1的中組み合わせで
+RAW_DATA_DIR/payouts_{year}.csv に保存する:
+    race_id, bet_type, combination, payout, popularity
+combination は馬番を '-' (順不同) または '>' (着順指定) でつないだ文字列、payout は100円あたりの払戻金。
+払戻テーブルが無かったレースは bet_type = 'none' の行だけを残し (取り直さないための印)、読み込み時に除く。
+
+バックテスト用には賭け式ごとに (race_id, 組み合わせキー) の整列済み int64 配列を作り、
+searchsorted で全レース・全買い目の払戻をまとめて引く (PayoutIndex)。
+"""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+
+# 払戻テーブルの見出し -> bet_type
+BET_TYPE_NAMES = {
+    '単勝': 'win',
+    '複勝': 'place',
+    '枠連': 'waku_ren',
+    '馬連': 'uma_ren',
+    'ワイド': 'wide',
+    '馬単': 'uma_tan',
+    '三連複': 'trio',
+    '3連複': 'trio',
+    '三連単': 'trifecta',
+    '3連単': 'trifecta'
+}
+# 賭け式ごとの頭数
+LEGS = {'win': 1, 'place': 1, 'waku_ren': 2, 'uma_ren': 2, 'wide': 2, 'uma_tan': 2, 'trio': 3, 'trifecta': 3}
+ORDERED = {'uma_tan', 'trifecta'} # 着順どおりに当てる賭け式
+
+COLUMNS = ['race_id', 'bet_type', 'combination', 'payout', 'popularity']
+NO_PAYOUT = 'none' # 払戻テーブルが無かったレースの印
+
+def no_payout_row(race_id):
+    """払戻テーブルが無かったレースの印の行"""
+    return {'race_id': race_id, 'bet_type': NO_PAYOUT, 'combination': '', 'payout': 0, 'popularity': ''}
+
+def payout_path(year):
+    return os.path.join(settings.RAW_DATA_DIR, f"payouts_{year}.csv")
+
+def combination_str(numbers, bet_type):
+    """馬番のリストを保存用の文字列にする (順不同の賭け式は昇順)"""
+    numbers = [int(n) for n in numbers]
+    if bet_type in ORDERED:
+        return '>'.join(str(n) for n in numbers)
+    return '-'.join(str(n) for n in sorted(numbers))
+
+def combo_keys(numbers, bet_type):
+    """
+    馬番の配列 (..., legs) を組み合わせキー (...,) にする。馬番は 1〜99。
+    順不同の賭け式は昇順に並べてからキーにする (3-7 と 7-3 は同じキー)。
+    """
+    numbers = np.asarray(numbers, dtype=np.int64)
+    if bet_type not in ORDERED:
+        numbers = np.sort(numbers, axis=-1)
+    legs = numbers.shape[-1]
+    weights = 100 ** np.arange(legs - 1, -1, -1, dtype=np.int64)
+    return (numbers * weights).sum(axis=-1)
+
+def parse_pay_table(soup, race_id):
+    """
+    結果ページの BeautifulSoup から払戻テーブルを読み、保存用の dict のリストを返す。
+    同着などで1つの賭け式に複数の的中がある場合は <br> 区切りで並んでいる。
+    """
+    rows = []
+    for tr in soup.select("table.pay_table_01 tr"):
+        th = tr.select_one("th")
+        tds = tr.select("td")
+        if th is None or len(tds) < 2:
+            continue
+        bet_type = BET_TYPE_NAMES.get(th.get_text(strip=True))
+        if bet_type is None:
+            continue
+        combos = tds[0].get_text("\n", strip=True).split("\n")
+        pays = tds[1].get_text("\n", strip=True).split("\n")
+        pops = tds[2].get_text("\n", strip=True).split("\n") if len(tds) > 2 else []
+        for i, (combo, pay) in enumerate(zip(combos, pays)):
+            numbers = re.findall(r'\d+', combo)
+            pay = pay.replace(',', '').replace('円', '').strip()
+            if len(numbers) != LEGS[bet_type] or not pay.isdigit():
+                continue
+            pop = pops[i].replace(',', '').strip() if i < len(pops) else ''
+            rows.append({
+                'race_id': race_id,
+                'bet_type': bet_type,
+                'combination': combination_str(numbers, bet_type),
+                'payout': int(pay),
+                'popularity': int(pop) if pop.isdigit() else None
+            })
+    return rows
+
+def save_payouts(rows, path):
+    """払戻の行を CSV に追記する"""
+    if not rows:
+        return
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_csv(path, mode='a', header=not os.path.exists(path), index=False, encoding='utf-8')
+    except Exception as e:
+        print(f"Error saving to {path}: {e}")
+
+def load_payouts(start_year, end_year):
+    """期間内の払戻を読み込む (ファイルが無ければ空の DataFrame)"""
+    dfs = []
+    for year in range(start_year, end_year + 1):
+        path = payout_path(year)
+        if os.path.exists(path):
+            dfs.append(pd.read_csv(path, dtype={'combination': str}))
+    if not dfs:
+        return pd.DataFrame(columns=COLUMNS)
+    df = pd.concat(dfs, ignore_index=True)
+    df = df[df['bet_type'] != NO_PAYOUT]
+    return df.drop_duplicates(['race_id', 'bet_type', 'combination'], keep='last').reset_index(drop=True)
+
+class PayoutIndex:
+    """
+    賭け式ごとに (race_id * 10^6 + 組み合わせキー) を昇順に並べた配列と払戻金を持つ。
+    lookup() は任意形状のキー配列の払戻を一度に返す (該当なしは 0)。
+    """
+    def __init__(self, payouts):
+        self.tables = {}
+        race_ids = pd.to_numeric(payouts['race_id'], errors='coerce').fillna(0).astype('int64').to_numpy()
+        self.race_ids = np.unique(race_ids)
+        for bet_type, rows in payouts.groupby('bet_type', sort=False).groups.items():
+            if bet_type not in LEGS:
+                continue
+            rows = payouts.index.get_indexer(rows)
+            parts = [re.findall(r'\d+', str(c)) for c in payouts['combination'].to_numpy()[rows]]
+            ok = np.array([len(p) == LEGS[bet_type] for p in parts], dtype=bool)
+            if not ok.any():
+                continue
+            rows = rows[ok]
+            numbers = np.array([p for p, k in zip(parts, ok) if k], dtype=np.int64)
+            keys = race_ids[rows] * 10**6 + combo_keys(numbers, bet_type)
+            order = np.argsort(keys, kind='stable')
+            self.tables[bet_type] = (keys[order], payouts['payout'].to_numpy(dtype=np.float64)[rows][order])
+
+    def has_race(self, race_ids):
+        """払戻データがあるレースか (R,)"""
+        race_ids = np.asarray(race_ids, dtype=np.int64)
+        if len(self.race_ids) == 0:
+            return np.zeros(len(race_ids), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.race_ids, race_ids), len(self.race_ids) - 1)
+        return self.race_ids[pos] == race_ids
+
+    def lookup(self, bet_type, race_ids, numbers):
+        """
+        race_ids (R,) と馬番 (R, T, legs) から払戻金 (R, T) を返す (100円あたり、外れは 0)。
+        """
+        numbers = np.asarray(numbers, dtype=np.float64) # 馬番欠損 (NaN) の買い目は外れ扱い
+        out = np.zeros(numbers.shape[:-1])
+        if bet_type not in self.tables:
+            return out
+        table_keys, table_pay = self.tables[bet_type]
+        ok = ~np.isnan(numbers).any(axis=-1)
+        race_ids = np.asarray(race_ids, dtype=np.int64).reshape((-1,) + (1,) * (out.ndim - 1))
+        keys = race_ids * 10**6 + combo_keys(np.nan_to_num(numbers), bet_type)
+        pos = np.minimum(np.searchsorted(table_keys, keys), len(table_keys) - 1)
+        found = ok & (table_keys[pos] == keys)
+        out[found] = table_pay[pos[found]]
+        return out
@@ -0,0 +1,167 @@
+"""
+モデル出力 (生スコア) の永続キャッシュ。
+
+キーは (モデル指紋, race_id, horse_id)。モデル指紋はモデル・encoders.pkl の内容、特徴量のコード
+(preprocess.py, window_features.py, asof_stats.py)、生データ (results_YYYY.csv, horse_profiles.csv) の内容と、
+特徴量に影響する入力条件 (context: 期間の開始・競馬場/レース番号の絞り込みなど) から作る。
+transform() の過去走特徴量は読み込んだ範囲内で計算されるため、context が同じ場合だけスコアを再利用する。
+
+保存形式は列ごとの配列 (race_id int64 / horse_id str / score float64) を part ファイル (.npz) として追記し、
+part が増えたら1ファイルにまとめ直す。
+
+    scores = prediction_cache.predict_cached(model, raw_df, artifacts, features, context={...})
+"""
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+from . import profiling
+
+MAX_PARTS = 16 # これを超えたら1ファイルにまとめる
+
+def _hash_file(h, path):
+    if path and os.path.exists(path):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+
+def raw_files(years=None):
+    """RAW_DATA_DIR の results_YYYY.csv (years を渡すとその年だけ) と horse_profiles.csv"""
+    files = sorted(glob.glob(os.path.join(settings.RAW_DATA_DIR, 'results_*.csv')))
+    if years is not None:
+        years = {str(y) for y in years}
+        files = [f for f in files if os.path.basename(f)[len('results_'):-len('.csv')] in years]
+    profile_path = os.path.join(settings.RAW_DATA_DIR, 'horse_profiles.csv')
+    return files + ([profile_path] if os.path.exists(profile_path) else [])
+
+def model_fingerprint(model_path=None, encoder_path=None, context=None, raw=None, sources=()):
+    """
+    モデル・encoders・特徴量のコード (feature_store.FEATURE_SOURCES + sources)・生データ raw
+    (ファイルのリスト、None なら raw_files() の全ファイル) の内容と context からキャッシュの名前空間を作る
+    """
+    from .feature_store import FEATURE_SOURCES, file_digest
+
+    model_path = model_path or settings.MODEL_PATH
+    encoder_path = encoder_path or os.path.join(settings.MODEL_DIR, 'encoders.pkl')
+    h = hashlib.sha1()
+    _hash_file(h, model_path)
+    _hash_file(h, encoder_path)
+    for path in list(FEATURE_SOURCES) + list(sources):
+        _hash_file(h, path)
+    for path in raw_files() if raw is None else raw:
+        h.update(json.dumps([os.path.basename(path), file_digest(path)]).encode('utf-8'))
+    h.update(json.dumps(context or {}, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()[:20]
+
+def _keys(race_ids, horse_ids):
+    race_ids = pd.to_numeric(pd.Series(race_ids), errors='coerce').fillna(0).astype('int64').to_numpy()
+    horse_ids = pd.Series(horse_ids).astype(str).to_numpy(dtype=str)
+    return race_ids, horse_ids
+
+class PredictionCache:
+    """1つのモデル指紋に対応するスコアの保存先 (CACHE_DIR/predictions/<key>/)"""
+    def __init__(self, key, root=None):
+        self.key = key
+        self.path = os.path.join(root or os.path.join(settings.CACHE_DIR, 'predictions'), key)
+        self._frame = None
+
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.path, 'part-*.npz')))
+
+    def frame(self):
+        """キャッシュ済みの全行 (race_id, horse_id, score)"""
+        if self._frame is None:
+            frames = []
+            for part in self._parts():
+                with np.load(part) as data:
+                    frames.append(pd.DataFrame({k: data[k] for k in ('race_id', 'horse_id', 'score')}))
+            if frames:
+                self._frame = pd.concat(frames, ignore_index=True).drop_duplicates(['race_id', 'horse_id'], keep='last')
+            else:
+                self._frame = pd.DataFrame({
+                    'race_id': np.zeros(0, dtype=np.int64),
+                    'horse_id': np.zeros(0, dtype=str),
+                    'score': np.zeros(0)
+                })
+        return self._frame
+
+    def lookup(self, race_ids, horse_ids):
+        """各行のキャッシュ済みスコア (無い行は NaN)"""
+        race_ids, horse_ids = _keys(race_ids, horse_ids)
+        query = pd.DataFrame({'race_id': race_ids, 'horse_id': horse_ids})
+        return query.merge(self.frame(), on=['race_id', 'horse_id'], how='left')['score'].to_numpy(dtype=np.float64, copy=True)
+
+    def append(self, race_ids, horse_ids, scores):
+        race_ids, horse_ids = _keys(race_ids, horse_ids)
+        if len(race_ids) == 0:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        parts = self._parts()
+        n = int(os.path.basename(parts[-1])[5:-4]) + 1 if parts else 0
+        tmp = os.path.join(self.path, f'part-{n:06d}.tmp.npz')
+        np.savez(tmp, race_id=race_ids, horse_id=horse_ids, score=np.asarray(scores, dtype=np.float64))
+        os.replace(tmp, os.path.join(self.path, f'part-{n:06d}.npz'))
+        self._frame = None
+        if len(parts) + 1 > MAX_PARTS:
+            self.compact()
+
+    def compact(self):
+        """part ファイルを1つにまとめる"""
+        parts = self._parts()
+        if len(parts) <= 1:
+            return
+        df = self.frame()
+        n = int(os.path.basename(parts[-1])[5:-4]) + 1
+        tmp = os.path.join(self.path, f'part-{n:06d}.tmp.npz')
+        np.savez(tmp, race_id=df['race_id'].to_numpy(), horse_id=df['horse_id'].to_numpy(dtype=str), score=df['score'].to_numpy())
+        os.replace(tmp, os.path.join(self.path, f'part-{n:06d}.npz'))
+        for part in parts:
+            os.remove(part)
+
+def predict_cached(model, raw_df, artifacts, features, context=None, use_cache=True, model_path=None, encoder_path=None):
+    """
+    raw_df の各行 (位置順) のモデル出力を返す。キャッシュに無いレースだけ推論してキャッシュに追記する。
+    transform() は過去走特徴量のために raw_df 全体に対して行うが、全レースがキャッシュ済みなら transform も省略する。
+    多クラス出力の場合は列0 (1着) のスコアを使う。
+    """
+    from . import preprocess
+
+    raw_df = raw_df.reset_index(drop=True)
+    cache = None
+    scores = np.full(len(raw_df), np.nan)
+    if use_cache and 'horse_id' in raw_df.columns:
+        # raw_df に含まれる年の生データだけを指紋に入れる (別の年のファイルの更新ではキャッシュを捨てない)
+        years = raw_df['race_id'].astype(str).str[:4].unique()
+        cache = PredictionCache(model_fingerprint(model_path, encoder_path, context, raw=raw_files(years)))
+        scores = cache.lookup(raw_df['race_id'], raw_df['horse_id'])
+
+    missing = np.isnan(scores)
+    if cache is not None:
+        n_races = raw_df['race_id'].nunique()
+        n_missing = raw_df.loc[missing, 'race_id'].nunique()
+        print(f"Prediction cache ({cache.key}): {n_races - n_missing}/{n_races} races cached")
+    if not missing.any():
+        return scores
+
+    # キャッシュに無い馬が1頭でもいるレースはレース全体を推論し直す
+    missing_races = raw_df.loc[missing, 'race_id'].unique()
+    rows = np.flatnonzero(raw_df['race_id'].isin(missing_races).to_numpy())
+
+    print("Preprocessing (Transform mode)...")
+    df = preprocess.transform(raw_df.copy(), artifacts)
+    df = df.loc[rows] # transform の index は raw_df の行位置
+    print(f"Predicting {len(missing_races)} races...")
+    with profiling.stage('predict.model', rows=len(df)):
+        pred = model.predict(df[features])
+    if pred.ndim > 1:
+        pred = pred[:, 0]
+    scores[rows] = pred
+
+    if cache is not None:
+        cache.append(raw_df['race_id'].to_numpy()[rows], raw_df['horse_id'].to_numpy()[rows], pred)
+    return scores
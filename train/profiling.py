@@ -0,0 +1,316 @@
+"""
+ステージ単位の計測 (wall / CPU / 行数 / ピークメモリ)。
+
+環境変数 KEIBA_PROFILE に出力ディレクトリを指定すると有効になり、
+プロセス終了時に JSON / CSV のタイミングレポートを書き出す。
+
+    KEIBA_PROFILE=profiles python -m train.train
+    KEIBA_PROFILE=profiles KEIBA_PROFILE_CPROFILE=1 python -m app.run_weekend
+
+- KEIBA_PROFILE_CPROFILE=1 : cProfile のダンプ (.prof) も保存する
+- KEIBA_PROFILE_MEMORY=0   : tracemalloc によるピークメモリ計測を無効化する (オーバーヘッド削減)
+
+無効時の stage() / profiled() はほぼ何もしない。
+2つのレポートの比較: python -m train.profiling compare old.json new.json
+"""
+import atexit
+import csv
+import functools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+_enabled = False
+_memory = False
+_output_dir = None
+_profiler = None
+_records = []
+_lock = threading.Lock()
+_local = threading.local()
+_run_started = None
+
+REPORT_FIELDS = ['stage', 'parent', 'depth', 'wall_s', 'cpu_s', 'rows', 'peak_mb', 'rss_max_mb', 'error']
+
+def is_enabled():
+    return _enabled
+
+def enable(output_dir='profiles', memory=True, cprofile=False):
+    """計測を有効化し、終了時にレポートを output_dir へ書き出す"""
+    global _enabled, _memory, _output_dir, _profiler, _run_started
+    if _enabled:
+        return
+    _enabled = True
+    _output_dir = output_dir
+    _run_started = time.time()
+    if memory:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _memory = True
+    if cprofile:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    atexit.register(write_report)
+
+def disable():
+    """計測を止める (終了時のレポート出力も取り消す)"""
+    global _enabled, _memory, _profiler
+    if not _enabled:
+        return
+    atexit.unregister(write_report)
+    if _memory:
+        import tracemalloc
+        tracemalloc.stop()
+    if _profiler is not None:
+        _profiler.disable()
+    _enabled = False
+    _memory = False
+    _profiler = None
+
+def enable_from_env():
+    output_dir = os.environ.get('KEIBA_PROFILE')
+    if output_dir:
+        enable(
+            output_dir,
+            memory=os.environ.get('KEIBA_PROFILE_MEMORY', '1') != '0',
+            cprofile=os.environ.get('KEIBA_PROFILE_CPROFILE', '0') == '1'
+        )
+
+def reset():
+    """記録済みのステージを破棄する (テスト用)"""
+    with _lock:
+        _records.clear()
+
+def records():
+    with _lock:
+        return list(_records)
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+def _rss_max_mb():
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux: KB, macOS: bytes
+        return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+    except ImportError:
+        return None
+
+def _count_rows(obj):
+    """DataFrame / ndarray / list (タプルの場合は先頭要素) の行数"""
+    if isinstance(obj, tuple) and obj:
+        obj = obj[0]
+    if obj is None or isinstance(obj, (str, bytes, dict)):
+        return None
+    try:
+        return len(obj)
+    except TypeError:
+        return None
+
+class _Stage:
+    """
+    1ステージの計測。with 文で使うか、start() / stop() で明示的に区切る。
+    rows はブロック内で `st.rows = len(df)` のように後から設定できる。
+    """
+    __slots__ = ('name', 'rows', 'peak', 'parent', 'depth', 'wall0', 'cpu0')
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.peak = 0
+
+    def __enter__(self):
+        if not _enabled:
+            return self
+        stack = _stack()
+        if _memory:
+            import tracemalloc
+            # 親ステージのピークを退避してからリセット
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.parent = stack[-1].name if stack else None
+        self.depth = len(stack)
+        stack.append(self)
+        self.wall0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not _enabled:
+            return False
+        wall = time.perf_counter() - self.wall0
+        cpu = time.process_time() - self.cpu0
+        stack = _stack()
+        if self in stack:
+            stack.remove(self)
+        peak_mb = None
+        if _memory:
+            import tracemalloc
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            peak_mb = self.peak / (1024 * 1024)
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+        with _lock:
+            _records.append({
+                'stage': self.name,
+                'parent': self.parent,
+                'depth': self.depth,
+                'wall_s': round(wall, 6),
+                'cpu_s': round(cpu, 6),
+                'rows': self.rows,
+                'peak_mb': round(peak_mb, 3) if peak_mb is not None else None,
+                'rss_max_mb': _rss_max_mb(),
+                'error': exc_type.__name__ if exc_type else None
+            })
+        return False
+
+    def stop(self):
+        self.__exit__(None, None, None)
+
+def stage(name, rows=None):
+    """with ブロックを1ステージとして計測する"""
+    return _Stage(name, rows)
+
+def start(name, rows=None):
+    """with で囲みにくい区間用。戻り値の stop() で終了する"""
+    return _Stage(name, rows).__enter__()
+
+def profiled(name=None, rows=_count_rows):
+    """
+    関数全体を1ステージとして計測するデコレータ。
+    rows は戻り値から行数を求める関数 (既定: DataFrame 等の len)。
+    """
+    def decorator(func):
+        stage_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with stage(stage_name) as st:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    st.rows = rows(result)
+                return result
+        return wrapper
+    return decorator
+
+def summarize(recs=None):
+    """ステージ名ごとの集計 (回数・合計/最大時間・合計行数・最大ピーク)"""
+    summary = {}
+    for r in (recs if recs is not None else records()):
+        s = summary.setdefault(r['stage'], {
+            'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'max_wall_s': 0.0, 'rows': 0, 'peak_mb': None
+        })
+        s['calls'] += 1
+        s['wall_s'] += r['wall_s']
+        s['cpu_s'] += r['cpu_s']
+        s['max_wall_s'] = max(s['max_wall_s'], r['wall_s'])
+        if r['rows']:
+            s['rows'] += r['rows']
+        if r['peak_mb'] is not None:
+            s['peak_mb'] = max(s['peak_mb'] or 0.0, r['peak_mb'])
+    for s in summary.values():
+        s['wall_s'] = round(s['wall_s'], 6)
+        s['cpu_s'] = round(s['cpu_s'], 6)
+    return summary
+
+def _git_commit():
+    if os.environ.get('GITHUB_SHA'):
+        return os.environ['GITHUB_SHA']
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+def write_report(output_dir=None, run_name=None):
+    """
+    JSON (メタ情報 + 集計 + 全ステージ) と CSV (全ステージ) を書き出す。
+    cProfile が有効なら .prof も保存する。書き出したファイルのベースパスを返す。
+    """
+    global _profiler
+    output_dir = output_dir or _output_dir or 'profiles'
+    recs = records()
+    if not recs and _profiler is None:
+        return None
+
+    os.makedirs(output_dir, exist_ok=True)
+    run_name = run_name or os.path.splitext(os.path.basename(sys.argv[0] or 'run'))[0]
+    if run_name == '__main__':
+        run_name = 'run'
+    base = os.path.join(output_dir, f"profile_{run_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+    report = {
+        'run': run_name,
+        'argv': sys.argv,
+        'commit': _git_commit(),
+        'started_at': datetime.fromtimestamp(_run_started).isoformat() if _run_started else None,
+        'python': sys.version.split()[0],
+        'summary': summarize(recs),
+        'stages': recs
+    }
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    with open(base + '.csv', 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(recs)
+
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(base + '.prof')
+        _profiler = None
+
+    print(f"Profile report saved to {base}.json")
+    return base
+
+def compare(old_path, new_path, threshold=0.2):
+    """2つの JSON レポートのステージ別合計 wall 時間を比較し、threshold 以上遅くなったステージを返す"""
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)['summary']
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)['summary']
+
+    regressions = []
+    print(f"{'stage':<50} {'old_s':>10} {'new_s':>10} {'change':>8}")
+    for name in sorted(set(old) | set(new)):
+        o = old.get(name, {}).get('wall_s')
+        n = new.get(name, {}).get('wall_s')
+        if o is None or n is None:
+            print(f"{name:<50} {o if o is not None else '-':>10} {n if n is not None else '-':>10} {'':>8}")
+            continue
+        change = (n - o) / o if o > 0 else 0.0
+        mark = ' !' if change >= threshold else ''
+        print(f"{name:<50} {o:>10.3f} {n:>10.3f} {change:>+7.1%}{mark}")
+        if change >= threshold:
+            regressions.append(name)
+    return regressions
+
+enable_from_env()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Profile report tools")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_cmp = sub.add_parser('compare', help="Compare two JSON profile reports")
+    p_cmp.add_argument('old')
+    p_cmp.add_argument('new')
+    p_cmp.add_argument('--threshold', type=float, default=0.2, help="Relative slowdown flagged as regression")
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        regressions = compare(args.old, args.new, args.threshold)
+        if regressions:
+            print(f"\nRegressions (>= {args.threshold:.0%}): {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,133 @@
+"""
+レース単位のランキング指標 (NDCG@k, MRR, hit@k, acc@k) を全レース分まとめて計算する。
+
+入力はフラットな配列 (race_id, score, rank)。レースごとにスコア降順へ1回だけ並べ替え (lexsort)、
+グループの先頭位置 (offsets) を使って全レースの指標を配列演算で求める。
+
+- relevance = レース内の最大着順 - 着順 + 1 (1着が最大。着順欠損は 0)
+- NDCG@k  : sklearn.metrics.ndcg_score と同じ定義 (線形ゲイン、同点スコアはゲインを平均)
+- MRR     : 1着馬の予測順位の逆数 (1着馬がいないレースは 0)
+- hit@k   : 1着馬が予測上位 k 頭に入っている
+- acc@k   : 予測1位の馬が k 着以内
+"""
+import numpy as np
+import pandas as pd
+
+DEFAULT_KS = (1, 3, 5)
+
+def group_offsets(codes):
+    """ソート済みのグループコード列から、各グループの開始位置 (末尾に全長を付けた配列) を返す"""
+    n = len(codes)
+    if n == 0:
+        return np.zeros(1, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+    return np.append(starts, n)
+
+def _relevance(codes, ranks, n_groups):
+    ranks = np.asarray(ranks, dtype=np.float64)
+    ok = ~np.isnan(ranks)
+    max_rank = np.full(n_groups, -np.inf)
+    np.maximum.at(max_rank, codes[ok], ranks[ok])
+    return np.where(ok, max_rank[codes] - ranks + 1, 0.0)
+
+def _discount_table(max_size, k):
+    """cum[p] = 先頭 p 位置分 (k 位まで) の割引 1/log2(i+2) の合計"""
+    disc = 1.0 / np.log2(np.arange(max_size) + 2)
+    disc[k:] = 0
+    return np.concatenate(([0.0], np.cumsum(disc)))
+
+def race_metrics(race_ids, scores, ranks, ks=DEFAULT_KS):
+    """レースごとの指標を DataFrame (race_id 順、1行1レース) で返す"""
+    race_ids = np.asarray(race_ids)
+    scores = np.asarray(scores, dtype=np.float64)
+    ranks = np.asarray(ranks, dtype=np.float64)
+    codes, uniques = pd.factorize(race_ids, sort=True)
+    if (codes < 0).any(): # race_id 欠損行は除外
+        keep = codes >= 0
+        codes, scores, ranks = codes[keep], scores[keep], ranks[keep]
+    n_groups = len(uniques)
+
+    # レース内をスコア降順 (NaN は最後、同点は行順) に並べる
+    neg = np.where(np.isnan(scores), np.inf, -scores)
+    order = np.lexsort((neg, codes))
+    codes_s = codes[order]
+    offsets = group_offsets(codes_s)
+    sizes = np.diff(offsets)
+    pos = np.arange(len(order)) - offsets[:-1][codes_s] if len(order) else np.zeros(0, dtype=np.int64)
+
+    rel = _relevance(codes, ranks, n_groups)
+    rel_s = rel[order]
+    rank_s = ranks[order]
+    neg_s = neg[order]
+
+    # 同点スコアのまとまり (tie group)
+    new_tie = np.ones(len(order), dtype=bool)
+    new_tie[1:] = (codes_s[1:] != codes_s[:-1]) | (neg_s[1:] != neg_s[:-1])
+    tie_id = np.cumsum(new_tie) - 1
+    n_ties = int(tie_id[-1]) + 1 if len(order) else 0
+    tie_size = np.bincount(tie_id, minlength=n_ties)
+    tie_gain = np.bincount(tie_id, weights=rel_s, minlength=n_ties) / np.maximum(tie_size, 1)
+    tie_start = pos[new_tie]
+    tie_code = codes_s[new_tie]
+
+    # 理想順 (relevance 降順)
+    ideal_order = np.lexsort((-rel, codes))
+    ideal_rel = rel[ideal_order]
+    max_size = int(sizes.max()) if n_groups else 0
+
+    out = {'race_id': np.asarray(uniques), 'size': sizes}
+    for k in ks:
+        cum = _discount_table(max_size, k)
+        dcg = np.bincount(tie_code, weights=tie_gain * (cum[tie_start + tie_size] - cum[tie_start]), minlength=n_groups)
+        idcg = np.bincount(codes_s, weights=ideal_rel * (cum[pos + 1] - cum[pos]), minlength=n_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[f'ndcg@{k}'] = np.where(idcg > 0, dcg / idcg, 0.0)
+
+    # 1着馬の予測順位 (同着は上位の方)
+    winner_pos = np.full(n_groups, np.iinfo(np.int64).max)
+    is_win = rank_s == 1
+    np.minimum.at(winner_pos, codes_s[is_win], pos[is_win])
+    has_winner = winner_pos < np.iinfo(np.int64).max
+    out['mrr'] = np.where(has_winner, 1.0 / (np.where(has_winner, winner_pos, 0) + 1), 0.0)
+
+    top1_rank = np.full(n_groups, np.nan)
+    top1_rank[codes_s[pos == 0]] = rank_s[pos == 0]
+    for k in ks:
+        out[f'hit@{k}'] = has_winner & (winner_pos < k)
+        out[f'acc@{k}'] = top1_rank <= k
+    return pd.DataFrame(out)
+
+def ranking_metrics(race_ids, scores, ranks, ks=DEFAULT_KS):
+    """全レース平均の指標を dict で返す ({'races', 'ndcg@k', 'mrr', 'hit@k', 'acc@k'})"""
+    per_race = race_metrics(race_ids, scores, ranks, ks)
+    result = {'races': len(per_race)}
+    for col in per_race.columns:
+        if col in ('race_id', 'size'):
+            continue
+        result[col] = float(per_race[col].mean()) if len(per_race) else 0.0
+    return result
+
+def format_metrics(metrics, ks=DEFAULT_KS):
+    """1行表示用の文字列"""
+    parts = [f"NDCG@{k}={metrics[f'ndcg@{k}']:.4f}" for k in ks]
+    parts.append(f"MRR={metrics['mrr']:.4f}")
+    parts += [f"Hit@{k}={metrics[f'hit@{k}']:.3f}" for k in ks]
+    return ' '.join(parts)
+
+def log_callback(X_valid, race_ids, ranks, period=50, ks=DEFAULT_KS):
+    """
+    LightGBM の学習中に period ラウンドごとに検証データのレース単位指標を表示するコールバック。
+    (LightGBM の ndcg は label=rank をそのまま relevance に使うため、着順の向きを揃えた指標を別に出す)
+    計算結果は callback.history に (iteration, metrics) で残る。
+    """
+    def _callback(env):
+        iteration = env.iteration + 1
+        if period <= 0 or (iteration % period != 0 and iteration != env.end_iteration):
+            return
+        scores = env.model.predict(X_valid, num_iteration=iteration)
+        metrics = ranking_metrics(race_ids, scores, ranks, ks)
+        _callback.history.append((iteration, metrics))
+        print(f"[{iteration}]\tvalid race metrics: {format_metrics(metrics, ks)}")
+    _callback.history = []
+    _callback.order = 30 # log_evaluation (order=10) の後
+    return _callback
@@ -4,7 +4,6 @@ import numpy as np
 import os
 import argparse
 import sys
-import matplotlib.pyplot as plt
 import base64
 from io import BytesIO
 
@@ -13,8 +12,12 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(
 
 from train import evaluate
 from train import settings
+from train import profiling
+from train import grid
+from train import bootstrap
+from train import html_render
 
-def generate_report(start_year, end_year, output_file="evaluate.html", power_min=None, power_max=None, race_min=None, race_max=None, start_month=None, end_month=None):
+def generate_report(start_year, end_year, output_file="evaluate.html", power_min=None, power_max=None, race_min=None, race_max=None, start_month=None, end_month=None, score_step=0.1, score_max=1.0, workers=None, use_cache=True, n_boot=bootstrap.N_BOOT):
     if start_month and end_month:
         print(f"Generating Evaluation Report for {start_year}/{start_month}-{end_year}/{end_month}...")
     else:
@@ -38,155 +41,35 @@ def generate_report(start_year, end_year, output_file="evaluate.html", power_min
     print(f"Evaluating Power Exponents: {power_values}")
     print(f"Evaluating Race Numbers: {r_min} to {r_max}")
     
-    min_scores = [round(x * 0.1, 1) for x in range(0, 11)] # 0.0 to 1.0
+    # 閾値 0.0 〜 score_max を score_step 刻みで評価 (0.01 刻みなどの細かいグリッドも1パスで集計できる)
+    min_scores = np.round(np.arange(0, score_max + score_step / 2, score_step), 6).tolist()
     
     # Store results for all powers
     # Structure: {power: summary_df}
     all_power_results = {}
 
-    # 1. Load Data & Model (Once)
-    from train import scraper_bulk, preprocess
-    import joblib
-    
-    if not os.path.exists(settings.MODEL_PATH):
-        print("Model not found.")
-        return
-
-    print("Loading Model...")
-    model = joblib.load(settings.MODEL_PATH)
-    artifacts = joblib.load(os.path.join(settings.MODEL_DIR, 'encoders.pkl'))
-    
-    # Load Data
-    print("Loading Data...")
-    raw_df = preprocess.load_data(start_year=start_year, end_year=end_year, start_month=start_month, end_month=end_month)
-    
-    if raw_df.empty:
-        print("No data found, skipping.")
-        return
-
-    # Load Filters
-    import yaml
-    yaml_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'evaluate_settings.yml')
-    config = {}
-    if os.path.exists(yaml_path):
-        with open(yaml_path, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
-
-
-
-    # Filter places & races
-    if not raw_df.empty:
-        raw_df['race_id'] = raw_df['race_id'].astype(str)
-        raw_df['race_no'] = raw_df['race_id'].str[-2:].astype(int)
-        
-        # 1. Config Filters (evaluate_settings.yml)
-        if config:
-            target_places = config.get('target_places', [])
-            if target_places:
-                print(f"Filtering places: {target_places}")
-                raw_df = raw_df[raw_df['race_id'].str[4:6].isin([str(p).zfill(2) for p in target_places])]
-            
-            target_races = config.get('target_race_numbers', [])
-            if target_races:
-                print(f"Filtering race numbers from settings: {target_races}")
-                raw_df = raw_df[raw_df['race_no'].isin(target_races)]
-        
-        # 2. CLI Range Filter (race_min/max)
-        if race_min is not None or race_max is not None:
-             print(f"Filtering race numbers by range: {r_min}-{r_max}")
-             raw_df = raw_df[(raw_df['race_no'] >= r_min) & (raw_df['race_no'] <= r_max)]
-             
-    if raw_df.empty:
-        print("No data after filtering.")
+    # 1. Load Data, Model & Predict (Once)
+    df_base, artifacts = grid.load_predictions(start_year, end_year, race_min, race_max, start_month, end_month, use_cache=use_cache)
+    if df_base is None:
         return
-    
-    # Transform
-    print("Transforming...")
-    df_base = preprocess.transform(raw_df, artifacts)
-    
-    # Features
-    features = [
-        'jockey_win_rate', 'trainer_win_rate', 'horse_id', 'jockey_id', 'trainer_id',
-        'waku', 'umaban', 'course_type', 'distance', 'weather', 'condition',
-        'lag1_rank', 'lag1_speed_index', 'lag1_last_3f', 'interval', 'weight_diff',
-        'sire_id', 'damsire_id', 'running_style',
-        'sire_win_rate', 'damsire_win_rate',
-        'course_type_win_rate', 'dist_cat_win_rate',
-        'front_runner_count', 'pace_ratio'
-    ]
-    
-    print("Predicting...")
-    pred_probs = model.predict(df_base[features])
-    if pred_probs.ndim > 1:
-        df_base['win_prob'] = pred_probs[:, 0]
-    else:
-        df_base['win_prob'] = pred_probs
-        
-    # Attach Metadata
-    df_base['race_id'] = raw_df['race_id'].astype(str)
-    df_base['place_code'] = df_base['race_id'].str[4:6]
-    df_base['rank'] = pd.to_numeric(raw_df['rank'], errors='coerce')
-    df_base['odds'] = pd.to_numeric(raw_df['odds'], errors='coerce').fillna(0)
-    
-    # Pre-filtering for simulation
-    df_base = df_base[df_base['place_code'].notna()]
-    unique_places = sorted(df_base['place_code'].unique().astype(str))
 
-    # --- Power Loop ---
+    # --- Power Grid ---
+    # power ごとに上位1頭を1回だけ抽出し、全閾値 × 全競馬場をまとめて集計する (train/grid.py)
+    # 複数の power はプロセスプールで並列に評価する
+    # 各セルにはレースのブートストラップによる ROI・的中率の 95% 信頼区間を付ける (train/bootstrap.py)
+    results = grid.run_grid(df_base, power_values, [(r_min, r_max)], ['win'], min_scores, workers=workers, n_boot=n_boot)
+    ci_cols = bootstrap.CI_COLUMNS if n_boot else []
+    # 全競馬場合計の信頼区間 (Overall / Best Configuration 用)
+    overall_ci = {p: res.set_index('min_score')[ci_cols] for p, res in results[results['place_code'] == 'all'].groupby('power')}
+    results = results[results['place_code'] != 'all']
     for exponent in power_values:
-        print(f"--- Simulating for Power: {exponent} ---")
-        
-        # Use a copy to calculate score
-        df = df_base.copy()
-        df['score'] = (df['win_prob'] ** exponent) * df['odds']
-        
-        summary_data = [] # For this exponent
-        
-        for score_thresh in min_scores:
-            # Group by Place
-            for p_code in unique_places:
-                place_name = place_map.get(p_code, f"Place {p_code}")
-                place_df = df[df['place_code'] == p_code]
-                
-                # Get Top 1 per race
-                place_df_sorted = place_df.sort_values(['race_id', 'score'], ascending=[True, False])
-                top1_df = place_df_sorted.groupby('race_id').head(1)
-                
-                # Filter by threshold
-                bet_df = top1_df[top1_df['score'] >= score_thresh]
-                
-                bets = len(bet_df)
-                if bets > 0:
-                    cost = bets * 100
-                    hits_df = bet_df[bet_df['rank'] == 1]
-                    hits = len(hits_df)
-                    place_df_hits = bet_df[bet_df['rank'] <= 3]
-                    hits_top3 = len(place_df_hits)
-                    return_amt = (hits_df['odds'] * 100).sum()
-                    
-                    roi = return_amt / cost * 100
-                    hit_rate = hits / bets * 100
-                    place_rate = hits_top3 / bets * 100
-                else:
-                    bets, hits, hits_top3, return_amt, cost = 0, 0, 0, 0, 0
-                    roi, hit_rate, place_rate = 0, 0, 0
-                
-                summary_data.append({
-                    'min_score': score_thresh,
-                    'place_code': p_code,
-                    'place_name': place_name,
-                    'bets': bets,
-                    'hits': hits,
-                    'hits_top3': hits_top3,
-                    'hit_rate': hit_rate,
-                    'place_rate': place_rate,
-                    'roi': roi,
-                    'return': return_amt,
-                    'cost': cost
-                })
-        
+        res = results[results['power'] == exponent].copy()
+        res['place_name'] = res['place_code'].map(lambda p_code: place_map.get(p_code, f"Place {p_code}"))
         # Store summary for this power
-        all_power_results[exponent] = pd.DataFrame(summary_data)
+        all_power_results[exponent] = res[[
+            'min_score', 'place_code', 'place_name', 'bets', 'hits', 'hits_top3',
+            'hit_rate', 'place_rate', 'roi', 'return', 'cost'
+        ] + ci_cols].reset_index(drop=True)
 
     # C. Generate Report
     # 期間表示用の文字列を構築
@@ -197,7 +80,9 @@ def generate_report(start_year, end_year, output_file="evaluate.html", power_min
         eval_period = f"{start_year} - {end_year}"
         title_period = f"{start_year}-{end_year}"
     
-    html_content = f"""
+    # 表は train/html_render.py で出力ファイルへ直接書く (レポート全体の文字列は作らない)
+    with profiling.stage('report.render'), open(output_file, "w", encoding='utf-8') as f:
+        f.write(f"""
     <!DOCTYPE html>
     <html>
     <head>
@@ -218,101 +103,110 @@ def generate_report(start_year, end_year, output_file="evaluate.html", power_min
         <p><strong>Evaluation Period:</strong> {eval_period}</p>
         <p><strong>Powers Tested:</strong> {power_values}</p>
         <p><strong>Generated:</strong> {pd.Timestamp.now()}</p>
-    """
+    """)
     
-    # 1. Comparative Chart: ROI vs Score (For all powers)
-    # Aggregating All Places
-    html_content += "<h2>ROI Comparison by Power Exponent</h2>"
+        # 1. Comparative Chart: ROI vs Score (For all powers)
+        # Aggregating All Places
+        f.write("<h2>ROI Comparison by Power Exponent</h2>")
     
-    plt.figure(figsize=(10, 6))
+        import matplotlib.pyplot as plt # グラフを描くときだけ読み込む (import を軽くする)
+        plt.figure(figsize=(10, 6))
     
-    best_configs = []
+        best_configs = []
     
-    for pow_val, res_df in all_power_results.items():
-        # Aggregate across all places
-        agg = res_df.groupby('min_score').agg({'bets': 'sum', 'cost': 'sum', 'return': 'sum'}).reset_index()
-        agg['roi'] = (agg['return'] / agg['cost'] * 100).fillna(0)
+        for pow_val, res_df in all_power_results.items():
+            # Aggregate across all places
+            agg = res_df.groupby('min_score').agg({'bets': 'sum', 'cost': 'sum', 'return': 'sum'}).reset_index()
+            agg['roi'] = (agg['return'] / agg['cost'] * 100).fillna(0)
+            if ci_cols and pow_val in overall_ci:
+                agg = agg.join(overall_ci[pow_val], on='min_score')
         
-        plt.plot(agg['min_score'], agg['roi'], marker='o', label=f'Power {pow_val}')
+            plt.plot(agg['min_score'], agg['roi'], marker='o', label=f'Power {pow_val}')
         
-        # Find best ROI (with min bets > 10 to avoid noise?)
-        valid_agg = agg[agg['bets'] >= 10]
-        if not valid_agg.empty:
-            best_row = valid_agg.loc[valid_agg['roi'].idxmax()]
-            best_configs.append({
-                'Power': pow_val,
-                'Best ROI': best_row['roi'],
-                'At Score': best_row['min_score'],
-                'Bets': best_row['bets']
-            })
+            # Find best ROI (with min bets > 10 to avoid noise?)
+            valid_agg = agg[agg['bets'] >= 10]
+            if not valid_agg.empty:
+                best_row = valid_agg.loc[valid_agg['roi'].idxmax()]
+                best = {
+                    'Power': pow_val,
+                    'Best ROI': best_row['roi'],
+                    'At Score': best_row['min_score'],
+                    'Bets': best_row['bets']
+                }
+                if 'roi_lo' in agg.columns:
+                    best['ROI 95% CI'] = f"{best_row['roi_lo']:.1f} - {best_row['roi_hi']:.1f}"
+                best_configs.append(best)
             
-    plt.axhline(100, color='red', linestyle='--', label='Break Even')
-    plt.title("ROI vs Min Score Threshold (All Courses)")
-    plt.xlabel("Min Score")
-    plt.ylabel("ROI (%)")
-    plt.grid(True)
-    plt.legend()
-    
-    buf = BytesIO()
-    plt.savefig(buf, format='png')
-    plt.close()
-    data_uri = base64.b64encode(buf.getvalue()).decode('utf-8')
-    html_content += f'<div class="chart"><img src="data:image/png;base64,{data_uri}" style="max-width:100%"></div>'
+        plt.axhline(100, color='red', linestyle='--', label='Break Even')
+        plt.title("ROI vs Min Score Threshold (All Courses)")
+        plt.xlabel("Min Score")
+        plt.ylabel("ROI (%)")
+        plt.grid(True)
+        plt.legend()
+    
+        buf = BytesIO()
+        plt.savefig(buf, format='png')
+        plt.close()
+        data_uri = base64.b64encode(buf.getvalue()).decode('utf-8')
+        f.write(f'<div class="chart"><img src="data:image/png;base64,{data_uri}" style="max-width:100%"></div>')
     
-    # 1b. Feature Importance Chart (NEW)
-    if 'feature_importance' in artifacts:
-        html_content += "<h2>Feature Importance (Gain)</h2>"
-        fi_df = pd.DataFrame(artifacts['feature_importance'])
+        # 1b. Feature Importance Chart (NEW)
+        if 'feature_importance' in artifacts:
+            f.write("<h2>Feature Importance (Gain)</h2>")
+            fi_df = pd.DataFrame(artifacts['feature_importance'])
         
-        plt.figure(figsize=(10, 8))
-        # Plot top 20
-        top_fi = fi_df.head(20).sort_values('importance', ascending=True)
-        plt.barh(top_fi['feature'], top_fi['importance'], color='skyblue')
-        plt.title("LightGBM Feature Importance (Gain)")
-        plt.xlabel("Total Gain")
-        plt.tight_layout()
+            plt.figure(figsize=(10, 8))
+            # Plot top 20
+            top_fi = fi_df.head(20).sort_values('importance', ascending=True)
+            plt.barh(top_fi['feature'], top_fi['importance'], color='skyblue')
+            plt.title("LightGBM Feature Importance (Gain)")
+            plt.xlabel("Total Gain")
+            plt.tight_layout()
         
-        buf_fi = BytesIO()
-        plt.savefig(buf_fi, format='png')
-        plt.close()
-        fi_uri = base64.b64encode(buf_fi.getvalue()).decode('utf-8')
-        html_content += f'<div class="chart"><img src="data:image/png;base64,{fi_uri}" style="max-width:100%"></div>'
-    else:
-        html_content += "<h2>Feature Importance</h2><p>Feature importance data not found in artifacts. Re-train the model to generate this data.</p>"
-    
-    # 2. Best Configuration Table
-    html_content += "<h2>Best Configuration Summary (Min 10 bets)</h2>"
-    if best_configs:
-        best_df = pd.DataFrame(best_configs).sort_values('Best ROI', ascending=False)
-        html_content += best_df.to_html(classes='table', float_format="%.2f", index=False)
-    else:
-        html_content += "<p>No configurations with >10 bets found.</p>"
-
-    # 3. Detailed Tables per Power
-    for pow_val, res_df in all_power_results.items():
-        html_content += f"<h2>Detailed Metrics (Power = {pow_val})</h2>"
+            buf_fi = BytesIO()
+            plt.savefig(buf_fi, format='png')
+            plt.close()
+            fi_uri = base64.b64encode(buf_fi.getvalue()).decode('utf-8')
+            f.write(f'<div class="chart"><img src="data:image/png;base64,{fi_uri}" style="max-width:100%"></div>')
+        else:
+            f.write("<h2>Feature Importance</h2><p>Feature importance data not found in artifacts. Re-train the model to generate this data.</p>")
+    
+        # 2. Best Configuration Table
+        f.write("<h2>Best Configuration Summary (Min 10 bets)</h2>")
+        if best_configs:
+            best_df = pd.DataFrame(best_configs).sort_values('Best ROI', ascending=False)
+            html_render.write_frame(f, best_df, float_format='.2f')
+        else:
+            f.write("<p>No configurations with >10 bets found.</p>")
+
+        # 3. Detailed Tables per Power
+        for pow_val, res_df in all_power_results.items():
+            f.write(f"<h2>Detailed Metrics (Power = {pow_val})</h2>")
         
-        # Overall by score
-        agg = res_df.groupby('min_score').agg({
-            'bets': 'sum', 'hits': 'sum', 'cost': 'sum', 'return': 'sum', 'hits_top3': 'sum'
-        }).reset_index()
-        agg['roi'] = (agg['return'] / agg['cost'] * 100).fillna(0)
-        agg['hit_rate'] = (agg['hits'] / agg['bets'] * 100).fillna(0)
-        agg['place_rate'] = (agg['hits_top3'] / agg['bets'] * 100).fillna(0)
+            # Overall by score
+            agg = res_df.groupby('min_score').agg({
+                'bets': 'sum', 'hits': 'sum', 'cost': 'sum', 'return': 'sum', 'hits_top3': 'sum'
+            }).reset_index()
+            agg['roi'] = (agg['return'] / agg['cost'] * 100).fillna(0)
+            agg['hit_rate'] = (agg['hits'] / agg['bets'] * 100).fillna(0)
+            agg['place_rate'] = (agg['hits_top3'] / agg['bets'] * 100).fillna(0)
+            if ci_cols and pow_val in overall_ci:
+                agg = agg.join(overall_ci[pow_val], on='min_score')
         
-        cols = ['min_score', 'bets', 'hit_rate', 'place_rate', 'roi', 'return']
-        html_content += f"<h3>Overall by Threshold</h3>"
-        html_content += agg[cols].to_html(classes='table', float_format="%.2f", index=False)
+            cols = ['min_score', 'bets', 'hit_rate', 'place_rate', 'roi', 'return'] + ci_cols
+            f.write(f"<h3>Overall by Threshold</h3>")
+            html_render.write_frame(f, agg[cols], float_format='.2f')
         
-        # By Place
-        html_content += f"<h3>ROI by Racecourse</h3>"
-        pivot_roi = res_df.pivot(index='min_score', columns='place_name', values='roi')
-        html_content += pivot_roi.to_html(classes='table', float_format="%.1f%%", na_rep="-")
-
-    html_content += "</body></html>"
-    
-    with open(output_file, "w", encoding='utf-8') as f:
-        f.write(html_content)
+            # By Place
+            f.write(f"<h3>ROI by Racecourse</h3>")
+            pivot_roi = res_df.pivot(index='min_score', columns='place_name', values='roi')
+            html_render.write_frame(f, pivot_roi, float_format='.1f', float_suffix='%', index=True)
+            if 'roi_lo' in res_df.columns:
+                f.write(f"<h3>ROI 95% CI Lower Bound by Racecourse</h3>")
+                pivot_lo = res_df.pivot(index='min_score', columns='place_name', values='roi_lo')
+                html_render.write_frame(f, pivot_lo, float_format='.1f', float_suffix='%', index=True)
+
+        f.write("</body></html>")
         
     print(f"Report saved to {output_file}")
 
@@ -327,7 +221,12 @@ if __name__ == "__main__":
     parser.add_argument("--race_max", type=int, default=None, help="Max Race No")
     parser.add_argument("--start_month", type=int, default=None, help="Start Month (1-12)")
     parser.add_argument("--end_month", type=int, default=None, help="End Month (1-12)")
+    parser.add_argument("--score_step", type=float, default=0.1, help="Min score threshold step (e.g. 0.01)")
+    parser.add_argument("--score_max", type=float, default=1.0, help="Max min score threshold")
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size for the power grid (default: all cores)")
+    parser.add_argument("--no_cache", action="store_true", help="Ignore the prediction cache and re-run the model for all races")
+    parser.add_argument("--bootstrap", type=int, default=bootstrap.N_BOOT, help="Bootstrap resamples for ROI / hit rate CIs (0 = off)")
     args = parser.parse_args()
     
-    generate_report(args.start, args.end, args.output, args.power_min, args.power_max, args.race_min, args.race_max, args.start_month, args.end_month)
+    generate_report(args.start, args.end, args.output, args.power_min, args.power_max, args.race_min, args.race_max, args.start_month, args.end_month, args.score_step, args.score_max, args.workers, not args.no_cache, args.bootstrap)
 
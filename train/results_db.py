@@ -0,0 +1,286 @@
+"""
+レース結果と馬のプロフィールの組み込みデータベース (SQLite)。
+
+results_YYYY.csv と horse_profiles.csv はそのまま正本 (スクレイパーは CSV に追記する) で、
+CACHE_DIR/results.sqlite はそれを取り込んだ索引付きのコピー。sync() は前回の取り込みから
+内容が変わったファイルだけ取り込み直す (サイズ・更新時刻が同じなら読まない。checkout や
+キャッシュの復元で更新時刻だけ変わったときは内容のハッシュを比べる)。「騎手 X の 2023 年の全レース」
+「馬 Y の直近5走」のような問い合わせを、全 CSV を pandas に読み込まずに索引で答える。
+
+    results  CSV の列 + race_date (YYYY-MM-DD) + source (取り込み元のファイル)
+             索引: horse_id, jockey_id, trainer_id (それぞれ + race_date), race_date,
+                   (course_type, distance), race_id
+    horses   horse_profiles.csv (horse_id が主キー)
+    sources  取り込んだファイルの指紋 (サイズ, 更新時刻, 内容の sha1) と列
+
+    python -m train.results_db                         # 取り込みと件数の表示
+    python -m train.results_db --jockey 01170 --start 2023-01-01 --end 2023-12-31
+    python -m train.results_db --horse 2019105219 --limit 5
+"""
+import json
+import os
+import sqlite3
+import pandas as pd
+from . import settings
+
+SCHEMA_VERSION = 2 # スキーマを変えたら上げる (古い DB は作り直す)
+ID_COLUMNS = ['race_id', 'horse_id', 'jockey_id', 'trainer_id']
+# scraper_bulk._save_buffer の列 (+ レガシーの date)。数値の列は NUMERIC (数値にならない値は文字列のまま)
+RESULT_COLUMNS = {
+    'race_id': 'TEXT', 'course_type': 'TEXT', 'distance': 'NUMERIC', 'weather': 'TEXT', 'condition': 'TEXT',
+    'year': 'NUMERIC', 'month': 'NUMERIC', 'day': 'NUMERIC', 'date': 'TEXT',
+    'rank': 'NUMERIC', 'waku': 'NUMERIC', 'umaban': 'NUMERIC', 'horse_name': 'TEXT', 'horse_id': 'TEXT',
+    'jockey': 'TEXT', 'jockey_id': 'TEXT', 'trainer': 'TEXT', 'trainer_id': 'TEXT',
+    'horse_weight': 'NUMERIC', 'weight_diff': 'NUMERIC', 'time': 'TEXT',
+    'passing': 'TEXT', 'last_3f': 'NUMERIC', 'odds': 'NUMERIC', 'popularity': 'NUMERIC'
+}
+PROFILE_COLUMNS = ['horse_id', 'horse_name', 'sire_id', 'sire_name', 'damsire_id', 'damsire_name']
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS results (
+    {', '.join(f'"{c}" {t}' for c, t in RESULT_COLUMNS.items())},
+    race_date TEXT,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_horse ON results (horse_id, race_date);
+CREATE INDEX IF NOT EXISTS results_jockey ON results (jockey_id, race_date);
+CREATE INDEX IF NOT EXISTS results_trainer ON results (trainer_id, race_date);
+CREATE INDEX IF NOT EXISTS results_date ON results (race_date);
+CREATE INDEX IF NOT EXISTS results_course ON results (course_type, distance);
+CREATE INDEX IF NOT EXISTS results_race ON results (race_id);
+CREATE INDEX IF NOT EXISTS results_source ON results (source);
+CREATE TABLE IF NOT EXISTS horses (
+    {', '.join(f'{c} TEXT' + (' PRIMARY KEY' if c == 'horse_id' else '') for c in PROFILE_COLUMNS)}
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY, kind TEXT, year INTEGER, size INTEGER, mtime_ns INTEGER, digest TEXT,
+    columns TEXT, rows INTEGER
+);
+"""
+
+def db_path():
+    return os.path.join(settings.CACHE_DIR, 'results.sqlite')
+
+def connect(path=None):
+    """スキーマを作ったうえで接続を返す"""
+    path = path or db_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=60)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        conn.executescript("DROP TABLE IF EXISTS results; DROP TABLE IF EXISTS horses; DROP TABLE IF EXISTS sources;"
+                           f"{_SCHEMA} PRAGMA user_version = {SCHEMA_VERSION};")
+    else:
+        conn.executescript(_SCHEMA)
+    return conn
+
+def _file_year(path):
+    """results_2024.csv -> 2024 (年が無いファイル名は 0)"""
+    try:
+        return int(os.path.basename(path).replace('results_', '').replace('.csv', ''))
+    except ValueError:
+        return 0
+
+def race_dates(df):
+    """
+    CSV の行の日付 (YYYY-MM-DD の文字列、無ければ None)。
+    新フォーマットは year, month, day、レガシーは date (2024年1月5日)、整数の date は race_id から。
+    """
+    if all(c in df.columns for c in ['year', 'month', 'day']):
+        dates = pd.to_datetime(df[['year', 'month', 'day']], errors='coerce')
+    elif 'date' in df.columns and df['date'].dtype in ('int64', 'int32'):
+        rid = df['race_id'].astype(str)
+        dates = pd.to_datetime(rid.str[0:4] + '-' + rid.str[6:8] + '-' + rid.str[8:10], errors='coerce')
+    elif 'date' in df.columns:
+        dates = pd.to_datetime(df['date'], format='%Y年%m月%d日', errors='coerce')
+    else:
+        return pd.Series(None, index=df.index, dtype=object)
+    return dates.dt.strftime('%Y-%m-%d').astype(object).where(dates.notna(), None)
+
+def _rows(df, columns):
+    values = df[columns].astype(object)
+    return values.where(values.notna(), None).values.tolist()
+
+def _import_results(conn, path, fingerprint):
+    df = pd.read_csv(path, dtype={c: str for c in ID_COLUMNS})
+    columns = [c for c in RESULT_COLUMNS if c in df.columns]
+    df['race_date'] = race_dates(df)
+    df['source'] = path
+    insert = columns + ['race_date', 'source']
+    conn.execute("DELETE FROM results WHERE source = ?", (path,))
+    conn.executemany(f"INSERT INTO results ({_quote(insert)}) "
+                     f"VALUES ({', '.join('?' * len(insert))})", _rows(df, insert))
+    conn.execute("INSERT OR REPLACE INTO sources VALUES (?, 'results', ?, ?, ?, ?, ?, ?)",
+                 (path, _file_year(path), *fingerprint, json.dumps(columns), len(df)))
+    return len(df)
+
+def _import_profiles(conn, path, fingerprint):
+    df = pd.read_csv(path, dtype=str)
+    df['horse_id'] = df['horse_id'].str.strip().str.replace(r'\.0$', '', regex=True)
+    df = df.dropna(subset=['horse_id']).drop_duplicates('horse_id', keep='last')
+    columns = [c for c in PROFILE_COLUMNS if c in df.columns]
+    conn.execute("DELETE FROM horses")
+    conn.executemany(f"INSERT INTO horses ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                     _rows(df, columns))
+    conn.execute("INSERT OR REPLACE INTO sources VALUES (?, 'profiles', NULL, ?, ?, ?, ?, ?)",
+                 (path, *fingerprint, json.dumps(columns), len(df)))
+    return len(df)
+
+def sync(conn=None, raw_dir=None):
+    """
+    raw_dir (既定は RAW_DATA_DIR) の results_*.csv と horse_profiles.csv のうち、前回から変わった
+    ファイルだけ取り込み直す。raw_dir に無いファイルの行は消す (DB は常に raw_dir の写し)。
+    取り込んだファイルの数を返す。
+    """
+    from .feature_store import file_digest
+    raw_dir = os.path.abspath(raw_dir or settings.RAW_DATA_DIR)
+    conn = conn or connect()
+    files = {}
+    if os.path.isdir(raw_dir):
+        for name in sorted(os.listdir(raw_dir)):
+            if name.startswith('results_') and name.endswith('.csv'):
+                files[os.path.join(raw_dir, name)] = _import_results
+            elif name == 'horse_profiles.csv':
+                files[os.path.join(raw_dir, name)] = _import_profiles
+    known = {row[0]: row[1:] for row in conn.execute("SELECT path, kind, size, mtime_ns, digest FROM sources")}
+    imported = 0
+    with conn:
+        for path in set(known) - set(files):
+            conn.execute("DELETE FROM results WHERE source = ?", (path,))
+            conn.execute("DELETE FROM sources WHERE path = ?", (path,))
+            if known[path][0] == 'profiles':
+                conn.execute("DELETE FROM horses")
+        for path, import_file in files.items():
+            st = os.stat(path)
+            kind, size, mtime_ns, digest = known.get(path, (None,) * 4)
+            if (size, mtime_ns) == (st.st_size, st.st_mtime_ns):
+                continue
+            fingerprint = (st.st_size, st.st_mtime_ns, file_digest(path))
+            if (size, digest) == (st.st_size, fingerprint[2]):
+                # 更新時刻だけ変わった (checkout、キャッシュの復元)
+                conn.execute("UPDATE sources SET mtime_ns = ? WHERE path = ?", (st.st_mtime_ns, path))
+                continue
+            try:
+                rows = import_file(conn, path, fingerprint)
+                print(f"Imported {os.path.basename(path)} into the results DB ({rows} rows)")
+                imported += 1
+            except Exception as e:
+                conn.execute("DELETE FROM sources WHERE path = ?", (path,)) # 次の sync でもう一度取り込む
+                print(f"Skipping {path}: {e}")
+    return imported
+
+def open_synced(conn=None):
+    """sync 済みの接続 (conn を渡せばそれを sync して返す)"""
+    conn = conn or connect()
+    sync(conn)
+    return conn
+
+def query(sql, params=(), conn=None):
+    """SQL の結果を DataFrame で返す (conn が無ければ sync してから)"""
+    cur = (conn or open_synced()).execute(sql, params)
+    return pd.DataFrame(cur.fetchall(), columns=[d[0] for d in cur.description])
+
+def _quote(columns):
+    return ', '.join(f'"{c}"' for c in columns)
+
+def _result_sources(conn, start_year=None, end_year=None):
+    rows = conn.execute("SELECT path, year, columns FROM sources WHERE kind = 'results' ORDER BY year, path")
+    return [(path, year, json.loads(columns)) for path, year, columns in rows
+            if start_year is None or end_year is None or start_year <= year <= end_year]
+
+def digests(conn=None):
+    """取り込み済みの results_YYYY.csv の {ファイル名: 内容の sha1}"""
+    rows = (conn or open_synced()).execute("SELECT path, digest FROM sources WHERE kind = 'results'")
+    return {os.path.basename(path): digest for path, digest in rows}
+
+def years(conn=None):
+    """取り込み済みの results_YYYY.csv の年"""
+    return {year for _, year, _ in _result_sources(conn or open_synced())}
+
+def load_results(start_year=None, end_year=None, conn=None):
+    """
+    results_{start_year..end_year}.csv を年順に連結したのと同じ行・列の DataFrame
+    (ID の列は preprocess.load_data と同じく文字列)
+    """
+    conn = conn or open_synced()
+    sources = _result_sources(conn, start_year, end_year)
+    if not sources:
+        return pd.DataFrame()
+    columns = [c for c in RESULT_COLUMNS if any(c in cols for _, _, cols in sources)]
+    df = pd.concat([query(f"SELECT {_quote(columns)} FROM results WHERE source = ? ORDER BY rowid", (path,), conn)
+                    for path, _, _ in sources], ignore_index=True)
+    # 数値にならない値 ('中止', '---') を含む列は、read_csv と同じく全部文字列にする
+    for col in columns:
+        if RESULT_COLUMNS[col] == 'NUMERIC' and df[col].dtype == object and df[col].map(type).eq(str).any():
+            df[col] = df[col].map(lambda v: v if v is None or isinstance(v, str) else str(v))
+    return df
+
+def history_frame(conn=None):
+    """HistoryLoader 用: 日付のある全行の (horse_id, rank, time, race_id, last_3f, course_type, distance, date)"""
+    df = query("SELECT horse_id, rank, time, race_id, last_3f, course_type, distance, race_date AS date "
+               "FROM results WHERE race_date IS NOT NULL ORDER BY race_date, rowid", (), conn)
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+def runs(horse_id=None, jockey_id=None, trainer_id=None, start=None, end=None, course_type=None, distance=None,
+         limit=None, conn=None):
+    """
+    条件に合う出走 (結果の行) を日付の新しい順で返す。start / end は 'YYYY-MM-DD' (end を含む)。
+    例: runs(jockey_id='01170', start='2023-01-01', end='2023-12-31'), runs(horse_id=..., limit=5)
+    """
+    where, params = [], []
+    for col, value in [('horse_id', horse_id), ('jockey_id', jockey_id), ('trainer_id', trainer_id),
+                       ('course_type', course_type), ('distance', distance)]:
+        if value is not None:
+            where.append(f"{col} = ?")
+            params.append(value)
+    if start is not None:
+        where.append("race_date >= ?")
+        params.append(start)
+    if end is not None:
+        where.append("race_date <= ?")
+        params.append(end)
+    sql = f"SELECT {_quote(RESULT_COLUMNS)}, race_date FROM results"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY race_date DESC, rowid DESC"
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    return query(sql, tuple(params), conn)
+
+def race_ids(year=None, conn=None):
+    """取り込み済みのレース ID (year を渡すと results_{year}.csv の分だけ)"""
+    conn = conn or open_synced()
+    if year is None:
+        rows = conn.execute("SELECT DISTINCT race_id FROM results")
+    else:
+        rows = conn.execute("SELECT DISTINCT race_id FROM results WHERE source IN "
+                            "(SELECT path FROM sources WHERE kind = 'results' AND year = ?)", (year,))
+    return {r[0] for r in rows if r[0] is not None}
+
+def horse_ids(conn=None):
+    """結果に出てくる horse_id"""
+    conn = conn or open_synced()
+    return {r[0] for r in conn.execute("SELECT DISTINCT horse_id FROM results") if r[0] is not None}
+
+def profile_ids(conn=None):
+    """horse_profiles.csv にある horse_id"""
+    conn = conn or open_synced()
+    return {r[0] for r in conn.execute("SELECT horse_id FROM horses")}
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Import results/profile CSVs into the SQLite results DB and query it")
+    parser.add_argument("--horse", default=None, help="horse_id")
+    parser.add_argument("--jockey", default=None, help="jockey_id")
+    parser.add_argument("--trainer", default=None, help="trainer_id")
+    parser.add_argument("--start", default=None, help="YYYY-MM-DD")
+    parser.add_argument("--end", default=None, help="YYYY-MM-DD")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    conn = open_synced()
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ['results', 'horses']}
+    print(f"{db_path()}: {counts['results']} results, {counts['horses']} horse profiles, years {sorted(years(conn))}")
+    if args.horse or args.jockey or args.trainer:
+        df = runs(args.horse, args.jockey, args.trainer, args.start, args.end, limit=args.limit, conn=conn)
+        print(df[['race_date', 'race_id', 'horse_name', 'jockey', 'rank', 'odds']].to_string(index=False))
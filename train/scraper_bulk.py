@@ -6,6 +6,9 @@ import os
 import random
 from tqdm import tqdm
 from . import settings
+from . import profiling
+from . import payouts as payout_store
+from . import results_db
 import re
 
 def fetch_html(url):
@@ -15,7 +18,8 @@ def fetch_html(url):
     }
     try:
         time.sleep(1 + random.random()) # Be polite
-        response = requests.get(url, headers=headers, timeout=10)
+        with profiling.stage('http.fetch'):
+            response = requests.get(url, headers=headers, timeout=10)
         response.encoding = response.apparent_encoding
         return response.text
     except Exception as e:
@@ -81,15 +85,19 @@ def get_race_ids(year, month):
                     
     return sorted(list(set(race_ids)))
 
-def scrape_race_data(race_id):
+def scrape_race_data(race_id, payouts=None):
     """
     Scrapes result data for a specific race ID from db.netkeiba.com.
+    payouts にリストを渡すと、同じページの払戻テーブルの行を追加する (train/payouts.py)。
+    払戻テーブルが無いページでは印の行 (payouts.NO_PAYOUT) を1行追加する。
     """
     url = f"https://db.netkeiba.com/race/{race_id}/"
     html = fetch_html(url)
     if not html: return None
     
     soup = BeautifulSoup(html, "lxml")
+    if payouts is not None:
+        payouts.extend(payout_store.parse_pay_table(soup, race_id) or [payout_store.no_payout_row(race_id)])
     
     # Parse Race Info (Metadata)
     # usually in div.data_intro > dl.racedata > h1 (Title) and p (Details) or similar structure depending on race/shutuba
@@ -236,10 +244,11 @@ def scrape_race_data(race_id):
             
     return results
 
-def bulk_scrape(year_start, year_end, month_start=1, month_end=12, force=False):
+def bulk_scrape(year_start, year_end, month_start=1, month_end=12, force=False, backfill_payouts=False):
     """
     指定された範囲のデータをスクレイピングするメイン関数。
     データ損失を防ぐために増分保存します。
+    backfill_payouts=True のときは、結果はあるが払戻が未取得のレースの結果ページも取り直す。
     """
     for year in range(year_start, year_end + 1):
         save_path = os.path.join(settings.RAW_DATA_DIR, f"results_{year}.csv")
@@ -248,9 +257,8 @@ def bulk_scrape(year_start, year_end, month_start=1, month_end=12, force=False):
         # Check for existing data
         if not force and os.path.exists(save_path):
             try:
-                # Only read race_ids to save memory/time
-                df_existing = pd.read_csv(save_path, usecols=['race_id'])
-                existing_rids = set(df_existing['race_id'].astype(str))
+                # 結果DB の race_id の索引から (変わった CSV だけ取り込み直す)
+                existing_rids = results_db.race_ids(year)
                 print(f"File {save_path} exists. Found {len(existing_rids)} existing races.")
             except Exception as e:
                 print(f"Error reading existing file {save_path}: {e}")
@@ -262,8 +270,23 @@ def bulk_scrape(year_start, year_end, month_start=1, month_end=12, force=False):
             except:
                 pass
 
+        # 払戻テーブル (payouts_{year}.csv)
+        pay_path = payout_store.payout_path(year)
+        existing_pay_rids = set()
+        if not force and os.path.exists(pay_path):
+            try:
+                existing_pay_rids = set(pd.read_csv(pay_path, usecols=['race_id'])['race_id'].astype(str))
+            except Exception as e:
+                print(f"Error reading existing file {pay_path}: {e}")
+        elif force and os.path.exists(pay_path):
+            try:
+                os.remove(pay_path)
+            except:
+                pass
+
         # Prepare for incremental write
         buffer = []
+        pay_buffer = []
         BUFFER_SIZE = 50
         
         for month in range(month_start, month_end + 1):
@@ -272,26 +295,40 @@ def bulk_scrape(year_start, year_end, month_start=1, month_end=12, force=False):
             
             # Filter out existing
             new_rids = [rid for rid in rids if rid not in existing_rids]
-            print(f"Found {len(rids)} races ({len(new_rids)} new).")
+            # 結果はあるが払戻が未取得のレース (払戻の保存を始める前に取得した分) は、指定したときだけ払戻を取り直す
+            pay_rids = []
+            if backfill_payouts:
+                pay_rids = [rid for rid in rids if rid in existing_rids and rid not in existing_pay_rids]
+            print(f"Found {len(rids)} races ({len(new_rids)} new, {len(pay_rids)} payouts to backfill).")
             
-            if not new_rids:
+            if not new_rids and not pay_rids:
                 continue
 
-            for rid in tqdm(new_rids):
-                data = scrape_race_data(rid)
-                if data:
+            for rid in tqdm(new_rids + pay_rids):
+                pay_rows = []
+                data = scrape_race_data(rid, payouts=pay_rows)
+                if data and rid not in existing_rids:
                     buffer.extend(data)
                     existing_rids.add(rid) # Add to tracked IDs
+                if pay_rows:
+                    pay_buffer.extend(pay_rows)
+                    existing_pay_rids.add(rid)
                 
                 # Incremental Save
                 if len(buffer) >= BUFFER_SIZE:
                     _save_buffer(buffer, save_path)
                     buffer = [] # Clear buffer
+                if len(pay_buffer) >= BUFFER_SIZE:
+                    payout_store.save_payouts(pay_buffer, pay_path)
+                    pay_buffer = []
             
             # Save remaining in buffer at end of month
             if buffer:
                 _save_buffer(buffer, save_path)
                 buffer = []
+            if pay_buffer:
+                payout_store.save_payouts(pay_buffer, pay_path)
+                pay_buffer = []
 
 def _save_buffer(data, path):
     if not data: return
@@ -336,7 +373,9 @@ if __name__ == "__main__":
     parser.add_argument("--month_start", type=int, default=1, help="Start month")
     parser.add_argument("--month_end", type=int, default=12, help="End month")
     parser.add_argument("--force", action="store_true", help="Force overwrite existing data")
+    parser.add_argument("--backfill_payouts", action="store_true",
+                        help="Re-fetch result pages of scraped races that have no payout rows yet")
     args = parser.parse_args()
     
     print(f"Starting scrape from {args.start}-{args.month_start} to {args.end}-{args.month_end} (Force: {args.force})...")
-    bulk_scrape(args.start, args.end, args.month_start, args.month_end, args.force)
+    bulk_scrape(args.start, args.end, args.month_start, args.month_end, args.force, args.backfill_payouts)
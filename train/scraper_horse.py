@@ -6,6 +6,8 @@ import os
 import random
 from tqdm import tqdm
 from . import settings
+from . import profiling
+from . import results_db
 
 def fetch_html(url):
     """Fetches HTML with retry logic and exponential backoff."""
@@ -16,7 +18,8 @@ def fetch_html(url):
     for attempt in range(max_retries):
         try:
             time.sleep(1 + attempt * 2)  # Exponential backoff: 1s, 3s, 5s
-            response = requests.get(url, headers=headers, timeout=10)
+            with profiling.stage('http.fetch'):
+                response = requests.get(url, headers=headers, timeout=10)
             response.encoding = response.apparent_encoding
             if response.status_code == 200:
                 return response.text
@@ -114,9 +117,8 @@ def scrape_missing_horses(input_path=None, output_path=None, target_db_path=None
             print(f"エラー: 入力ファイルが見つかりません: {full_input_path}")
             return
     else:
-        scan_files = [f for f in os.listdir(settings.RAW_DATA_DIR) if f.startswith('results_') and f.endswith('.csv')]
-        for f in scan_files:
-            files_to_scan.append(os.path.join(settings.RAW_DATA_DIR, f))
+        # 全 results_*.csv の馬IDは結果DB の索引から
+        all_horse_ids.update(normalize_id(h) for h in results_db.horse_ids())
     
     for path in files_to_scan:
         try:
@@ -132,7 +134,9 @@ def scrape_missing_horses(input_path=None, output_path=None, target_db_path=None
     
     # 2. 既存プロファイルの読み込み
     existing_ids = set()
-    if os.path.exists(target_db_path):
+    if os.path.abspath(target_db_path) == os.path.abspath(os.path.join(settings.RAW_DATA_DIR, "horse_profiles.csv")):
+        existing_ids = results_db.profile_ids()
+    elif os.path.exists(target_db_path):
         try:
             # 【重要】dtype=str を指定
             df_prof = pd.read_csv(target_db_path, dtype={'horse_id': str})
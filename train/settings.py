@@ -7,10 +7,30 @@ DATA_DIR = os.path.join(BASE_DIR, 'data')
 RAW_DATA_DIR = os.path.join(DATA_DIR, 'raw')
 MODEL_DIR = os.path.join(BASE_DIR, 'models') # train/models
 MODEL_PATH = os.path.join(MODEL_DIR, 'lgbm_ranker_v2.pkl')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache') # 再生成可能なキャッシュ (Git管理外)
 
 # Feature Engineering Settings
 CATEGORY_COLS = ['jockey_id', 'horse_id', 'trainer_id', 'course_type', 'weather', 'condition', 'sire_id', 'damsire_id', 'running_style']
 NUM_CLASSES = 1 # Ranker output is 1D score (previously 4 for classification)
 
+# Model Features (学習・評価・推論で共通)
+FEATURES = [
+    'jockey_win_rate', 'trainer_win_rate', 'horse_id', 'jockey_id', 'trainer_id',
+    'waku', 'umaban', 'course_type', 'distance', 'weather', 'condition',
+    'lag1_rank', 'lag1_speed_index', 'lag1_last_3f', 'interval', 'weight_diff',
+    'sire_id', 'damsire_id', 'running_style',
+    'sire_win_rate', 'damsire_win_rate',
+    'course_type_win_rate', 'dist_cat_win_rate',
+    'front_runner_count', 'pace_ratio',
+    # 過去走ウィンドウ (train/window_features.py): lag2..5 と直近5走の mean/min/std
+    'lag2_rank', 'lag2_speed_index', 'lag2_last_3f',
+    'lag3_rank', 'lag3_speed_index', 'lag3_last_3f',
+    'lag4_rank', 'lag4_speed_index', 'lag4_last_3f',
+    'lag5_rank', 'lag5_speed_index', 'lag5_last_3f',
+    'rank_mean5', 'rank_min5', 'rank_std5',
+    'speed_index_mean5', 'speed_index_min5', 'speed_index_std5',
+    'last_3f_mean5', 'last_3f_min5', 'last_3f_std5'
+]
+
 # Prediction Settings
 POWER_EXPONENT = 4 # Default exponent for Score = P^n * Odds
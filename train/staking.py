@@ -0,0 +1,171 @@
+"""
+予測確率とオッズからの分数 Kelly 配分と、資金・1日の上限付きの資金推移シミュレーション。
+
+1レースの単勝は排反なので、全頭まとめた同時 Kelly 配分を使う。期待値 p*o の降順に馬を足していき
+    R(S) = (1 - Σ_S p) / (1 - Σ_S 1/o)
+より p_k * o_k が大きい間だけ集合 S に入れると、賭け金 (資金に対する割合) は f_i = p_i - R(S) / o_i になる。
+レースごとの並べ替えは lexsort 1回、集合の判定と合計は区間ごとの累積和で行うので全レースを一度に計算する。
+
+賭け金はその日の開始時点の資金に対する割合で、
+    1レースの合計が RACE_CAP を超えたらそのレースを縮小、1日の合計が DAY_CAP を超えたらその日の全レースを縮小
+する。1日の損益率が資金に依存しないので、資金推移は日ごとの (1 + 損益率) の累積積で求まる。
+"""
+import numpy as np
+import pandas as pd
+
+from . import backtest
+
+KELLY_FRACTION = 0.25
+RACE_CAP = 0.05 # 1レースに賭ける資金の上限 (割合)
+DAY_CAP = 0.20 # 1日に賭ける資金の上限 (割合)
+BANKROLL = 100000
+
+SWEEP_COLUMNS = ['group', 'min_score', 'bets', 'hits', 'hits_top3', 'return', 'cost', 'final_bankroll', 'max_drawdown']
+
+def _segment_cumsum(codes, values, starts):
+    # codes でソート済みの配列の、区間 (レース) ごとの累積和
+    total = np.cumsum(values)
+    return total - (total - values)[starts][codes]
+
+def softmax_by_race(race_codes, scores):
+    """レースごとの softmax (predictor.predict と同じ確率)"""
+    scores = np.asarray(scores, dtype=np.float64)
+    n_races = int(race_codes.max()) + 1 if len(race_codes) else 0
+    top = np.full(n_races, -np.inf)
+    np.maximum.at(top, race_codes, scores)
+    e = np.exp(scores - top[race_codes])
+    return e / np.bincount(race_codes, weights=e, minlength=n_races)[race_codes]
+
+def kelly_stakes(race_codes, prob, odds):
+    """
+    各馬の単勝への Kelly 賭け金 (資金に対する割合、分数を掛ける前)。
+    race_codes は 0..R-1 のレース番号。確率・オッズが無効な馬と期待値 1 以下のレースには賭けない。
+    """
+    prob = np.asarray(prob, dtype=np.float64)
+    odds = np.asarray(odds, dtype=np.float64)
+    valid = (odds > 1) & (prob > 0) & np.isfinite(prob) & np.isfinite(odds)
+    p = np.where(valid, prob, 0.0)
+    inv = np.where(valid, 1 / np.where(valid, odds, 1), 0.0)
+    ev = np.where(valid, p * np.where(valid, odds, 0), 0.0)
+
+    order = np.lexsort((-ev, race_codes))
+    codes, p, inv, ev, valid = race_codes[order], p[order], inv[order], ev[order], valid[order]
+    n_races = int(codes.max()) + 1 if len(codes) else 0
+    starts = np.searchsorted(codes, np.arange(n_races))
+
+    # 自分より期待値の高い馬だけの集合の R
+    prev_p = _segment_cumsum(codes, p, starts) - p
+    prev_inv = _segment_cumsum(codes, inv, starts) - inv
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_prev = np.where(prev_inv < 1, (1 - prev_p) / (1 - prev_inv), np.inf)
+    # 条件を満たさない馬が出たらそのレースはそこで打ち切り
+    failed = _segment_cumsum(codes, (~(valid & (ev > r_prev))).astype(np.int64), starts)
+    chosen = failed == 0
+
+    set_p = np.bincount(codes, weights=p * chosen, minlength=n_races)
+    set_inv = np.bincount(codes, weights=inv * chosen, minlength=n_races)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.where(set_inv < 1, (1 - set_p) / (1 - set_inv), np.inf)
+    stakes = np.where(chosen & np.isfinite(r[codes]), np.maximum(p - r[codes] * inv, 0.0), 0.0)
+    out = np.empty_like(stakes)
+    out[order] = stakes
+    return out
+
+def stake_fractions(race_codes, prob, odds, fraction=KELLY_FRACTION, race_cap=RACE_CAP):
+    """分数 Kelly の賭け金 (資金に対する割合)。1レースの合計は race_cap まで縮小する"""
+    stakes = fraction * kelly_stakes(race_codes, prob, odds)
+    total = np.bincount(race_codes, weights=stakes)
+    scale = np.where(total > race_cap, race_cap / np.where(total > 0, total, 1), 1.0)
+    return stakes * scale[race_codes]
+
+def race_table(race_ids, days, prob, odds, rank, fraction=KELLY_FRACTION, race_cap=RACE_CAP):
+    """
+    レースごとの賭け金と払戻 (資金に対する割合) の表。行はレース (pd.factorize(race_ids) の順)。
+    戻り値は dict: race_id, day, stake, payout, has_winner, hit (賭けた馬が1着), top3 (賭けた馬が3着以内)
+    """
+    codes, uniques = pd.factorize(pd.Series(race_ids))
+    n_races = len(uniques)
+    rank = np.asarray(rank, dtype=np.float64)
+    odds = np.asarray(odds, dtype=np.float64)
+    stakes = stake_fractions(codes, prob, odds, fraction, race_cap)
+
+    staked = stakes > 0
+    first = np.zeros(n_races, dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(codes))[::-1] # レースの先頭行
+    return {
+        'race_id': np.asarray(uniques),
+        'day': np.asarray(days)[first] if len(codes) else np.zeros(0, dtype=np.int64),
+        'stake': np.bincount(codes, weights=stakes, minlength=n_races),
+        'payout': np.bincount(codes, weights=np.where(staked & (rank == 1), stakes * odds, 0.0), minlength=n_races),
+        'has_winner': np.bincount(codes, weights=rank == 1, minlength=n_races) > 0,
+        'hit': np.bincount(codes, weights=staked & (rank == 1), minlength=n_races) > 0,
+        'top3': np.bincount(codes, weights=staked & (rank <= 3), minlength=n_races) > 0
+    }
+
+def simulate(table, mask=None, day_cap=DAY_CAP, bankroll=BANKROLL):
+    """
+    race_table() のうち mask のレースに賭けた場合の資金推移 (1着馬のいないレースは除く)。
+    戻り値は dict: bets, hits, hits_top3, cost, return, roi, final_bankroll, max_drawdown, days
+    """
+    mask = np.ones(len(table['stake']), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+    bet = mask & table['has_winner'] & (table['stake'] > 0)
+    day_codes, day_keys = pd.factorize(pd.Series(table['day'][bet]), sort=True)
+    n_days = len(day_keys)
+    stake = np.bincount(day_codes, weights=table['stake'][bet], minlength=n_days)
+    payout = np.bincount(day_codes, weights=table['payout'][bet], minlength=n_days)
+    scale = np.where(stake > day_cap, day_cap / np.where(stake > 0, stake, 1), 1.0)
+
+    # その日の開始時点の資金 (前日までの (1 + 損益率) の累積積)
+    growth = np.cumprod(1 + scale * (payout - stake))
+    start = bankroll * np.concatenate([[1.0], growth[:-1]])
+    path = np.concatenate([[bankroll], bankroll * growth])
+    cost = float((start * scale * stake).sum())
+    ret = float((start * scale * payout).sum())
+    return {
+        'bets': int(bet.sum()),
+        'hits': int((bet & table['hit']).sum()),
+        'hits_top3': int((bet & table['top3']).sum()),
+        'cost': cost,
+        'return': ret,
+        'roi': ret / cost * 100 if cost > 0 else 0,
+        'final_bankroll': float(path[-1]),
+        'max_drawdown': float((1 - path / np.maximum.accumulate(path)).max()) * 100,
+        'days': n_days
+    }
+
+def threshold_sweep(table, top_score, thresholds, groups=None, day_cap=DAY_CAP, bankroll=BANKROLL):
+    """
+    上位1頭のスコア (top_score, レース順) が閾値以上のレースだけで Kelly 配分した場合の成績を、
+    全閾値 × グループ (競馬場など) について返す。グループごとに別の資金で運用する。
+    戻り値は DataFrame (SWEEP_COLUMNS)
+    """
+    if groups is None:
+        groups = np.zeros(len(top_score), dtype=np.int64)
+    codes, keys = pd.factorize(pd.Series(groups), sort=True)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(keys) + 1))
+    rows = []
+    for g, key in enumerate(keys):
+        rows_g = order[bounds[g]:bounds[g + 1]]
+        sub = {k: v[rows_g] for k, v in table.items()}
+        for t in np.asarray(thresholds, dtype=np.float64):
+            r = simulate(sub, top_score[rows_g] >= t, day_cap, bankroll)
+            rows.append({'group': key, 'min_score': t, **{k: r[k] for k in SWEEP_COLUMNS[2:]}})
+    return pd.DataFrame(rows, columns=SWEEP_COLUMNS)
+
+def kelly_backtest(df, fraction=KELLY_FRACTION, race_cap=RACE_CAP, day_cap=DAY_CAP, bankroll=BANKROLL,
+                   min_score=0.0, prob_col='win_prob'):
+    """
+    予測結果 (race_id, date, win_prob, odds, rank, score) の DataFrame から1つの設定の資金推移を計算する。
+    確率は prob_col のレースごとの softmax。score 列があれば上位1頭が min_score 未満のレースは見送る。
+    """
+    codes, _ = pd.factorize(df['race_id'])
+    prob = softmax_by_race(codes, df[prob_col].to_numpy(dtype=np.float64))
+    days = pd.to_datetime(df['date'], errors='coerce') if 'date' in df.columns else pd.Series(pd.NaT, index=df.index)
+    table = race_table(df['race_id'].to_numpy(), days.to_numpy().astype('datetime64[D]').astype(np.int64), prob,
+                       pd.to_numeric(df['odds'], errors='coerce').to_numpy(dtype=np.float64),
+                       pd.to_numeric(df['rank'], errors='coerce').to_numpy(dtype=np.float64), fraction, race_cap)
+    mask = None
+    if 'score' in df.columns:
+        mask = ~(backtest.top_k(df, 1)['score'][:, 0] < min_score)
+    return simulate(table, mask, day_cap, bankroll)
@@ -1,45 +1,39 @@
-import lightgbm as lgb
 import pandas as pd
-import joblib
 import os
 from . import settings
 from . import preprocess
+from . import feature_store
+from . import dataset_cache
+from . import profiling
+from . import ranking_metrics
 
 import argparse
 
-def train_model(start_year, end_year, start_month=None, end_month=None):
+def train_model(start_year, end_year, start_month=None, end_month=None, use_cache=True, stream=False):
+    import joblib
+    import lightgbm as lgb
+    
     if start_month and end_month:
         print(f"--- Training Mode: {start_year}/{start_month}-{end_year}/{end_month} ---")
     else:
         print(f"--- Training Mode: {start_year}-{end_year} ---")
     
-    # 1. Load Data
-    raw_df = preprocess.load_data(start_year=start_year, end_year=end_year, start_month=start_month, end_month=end_month)
-    if raw_df.empty:
+    # 1-2. Load Data & Preprocess
+    # 前処理済み特徴量は feature_store にキャッシュされ、生データが変わらなければ再利用される
+    with profiling.stage('train.feature_store') as st:
+        store = feature_store.load_or_build(start_year, end_year, start_month, end_month, use_cache=use_cache, stream=stream)
+        st.rows = len(store) if store is not None else 0
+    if store is None:
         print("No training data found.")
         return
-
-    # 2. Preprocess
-    # Now returns df AND artifacts (encoders, maps)
-    df, artifacts = preprocess.preprocess(raw_df)
-    
-    # Clean numeric columns (just in case)
-    df['waku'] = pd.to_numeric(df['waku'], errors='coerce').fillna(0)
-    df['umaban'] = pd.to_numeric(df['umaban'], errors='coerce').fillna(0)
+    df = store.frame()
+    artifacts = dict(store.artifacts)
 
     # Split
     train, valid, _ = preprocess.split_data(df)
     
     # 3. Train with LambdaRank
-    features = [
-        'jockey_win_rate', 'trainer_win_rate', 'horse_id', 'jockey_id', 'trainer_id',
-        'waku', 'umaban', 'course_type', 'distance', 'weather', 'condition',
-        'lag1_rank', 'lag1_speed_index', 'lag1_last_3f', 'interval', 'weight_diff',
-        'sire_id', 'damsire_id', 'running_style',
-        'sire_win_rate', 'damsire_win_rate',
-        'course_type_win_rate', 'dist_cat_win_rate',
-        'front_runner_count', 'pace_ratio'
-    ]
+    features = settings.FEATURES
     target = 'rank'  # Changed from 'rank_class' to 'rank' for LambdaRank
     
     print(f"Features: {features}")
@@ -61,8 +55,10 @@ def train_model(start_year, end_year, start_month=None, end_month=None):
     assert sum(train_groups) == len(train), "Train group parameter mismatch!"
     assert sum(valid_groups) == len(valid), "Valid group parameter mismatch!"
     
-    lgb_train = lgb.Dataset(train[features], train[target], group=train_groups)
-    lgb_eval = lgb.Dataset(valid[features], valid[target], group=valid_groups, reference=lgb_train)
+    # Binary Dataset cache (特徴量行列が同じならビニングをスキップ)
+    lgb_train, lgb_eval = dataset_cache.build_datasets(
+        train, valid, features, target, train_groups, valid_groups, use_cache=use_cache
+    )
     
     params = {
         'objective': 'lambdarank',
@@ -75,17 +71,28 @@ def train_model(start_year, end_year, start_month=None, end_month=None):
         'seed': 42
     }
     
+    # 検証データのレース単位指標 (NDCG / MRR / Hit@k)。ストアの着順欠損 (99) は除外扱い
+    valid_race_ids = valid['race_id'].to_numpy()
+    valid_ranks = valid['rank'].where(valid['rank'] < 99).to_numpy(dtype=float)
+    
     print("Starting LambdaRank training...")
-    model = lgb.train(
-        params,
-        lgb_train,
-        valid_sets=[lgb_train, lgb_eval],
-        num_boost_round=1000, # Increased rounds
-        callbacks=[
-            lgb.early_stopping(stopping_rounds=20),
-            lgb.log_evaluation(50)
-        ]
+    with profiling.stage('train.fit', rows=len(train)):
+        model = lgb.train(
+            params,
+            lgb_train,
+            valid_sets=[lgb_train, lgb_eval],
+            num_boost_round=1000, # Increased rounds
+            callbacks=[
+                lgb.early_stopping(stopping_rounds=20),
+                lgb.log_evaluation(50),
+                ranking_metrics.log_callback(valid[features], valid_race_ids, valid_ranks, period=50)
+            ]
+        )
+    
+    valid_metrics = ranking_metrics.ranking_metrics(
+        valid_race_ids, model.predict(valid[features], num_iteration=model.best_iteration), valid_ranks
     )
+    print(f"Validation ({valid_metrics['races']} races): {ranking_metrics.format_metrics(valid_metrics)}")
     
     # Save Model
     os.makedirs(settings.MODEL_DIR, exist_ok=True)
@@ -103,6 +110,7 @@ def train_model(start_year, end_year, start_month=None, end_month=None):
     
     # Save Encoders & Importance to Artifacts
     artifacts['feature_importance'] = feature_importance.to_dict('records')
+    artifacts['validation_metrics'] = valid_metrics
     
     encoder_path = os.path.join(settings.MODEL_DIR, 'encoders.pkl')
     joblib.dump(artifacts, encoder_path)
@@ -115,6 +123,8 @@ if __name__ == "__main__":
     parser.add_argument("--end", type=int, default=2024)
     parser.add_argument("--start_month", type=int, default=None)
     parser.add_argument("--end_month", type=int, default=None)
+    parser.add_argument("--no_cache", action="store_true", help="Disable feature store / binary Dataset cache")
+    parser.add_argument("--stream", action="store_true", help="Preprocess year by year (out-of-core) when building the feature store")
     args = parser.parse_args()
     
-    train_model(args.start, args.end, args.start_month, args.end_month)
+    train_model(args.start, args.end, args.start_month, args.end_month, use_cache=not args.no_cache, stream=args.stream)
@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import random
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from . import settings
+from . import feature_store
+
+# train.train_model と同じ LambdaRank の基本パラメータ
+BASE_PARAMS = {
+    'objective': 'lambdarank',
+    'metric': 'ndcg',
+    'ndcg_eval_at': [1, 3, 5],
+    'boosting_type': 'gbdt',
+    'learning_rate': 0.05,
+    'num_leaves': 31,
+    'verbose': -1,
+    'seed': 42
+}
+
+# 探索空間 (ビニングに影響するパラメータは含めない)
+SEARCH_SPACE = {
+    'learning_rate': [0.02, 0.03, 0.05, 0.1],
+    'num_leaves': [15, 31, 63, 127],
+    'min_data_in_leaf': [10, 20, 50, 100],
+    'feature_fraction': [0.6, 0.8, 1.0],
+    'bagging_fraction': [0.7, 0.9, 1.0],
+    'bagging_freq': [0, 1],
+    'lambda_l2': [0.0, 1.0, 10.0]
+}
+
+NUM_BOOST_ROUND = 1000
+EARLY_STOPPING_ROUNDS = 20
+
+def sample_configs(n_configs, seed=42):
+    """先頭は現行パラメータ、残りは探索空間からの重複なしランダムサンプル"""
+    rng = random.Random(seed)
+    configs = [{}]
+    seen = {json.dumps({}, sort_keys=True)}
+    max_tries = n_configs * 50
+    while len(configs) < n_configs and max_tries > 0:
+        max_tries -= 1
+        cfg = {k: rng.choice(v) for k, v in SEARCH_SPACE.items()}
+        key = json.dumps(cfg, sort_keys=True)
+        if key in seen:
+            continue
+        seen.add(key)
+        configs.append(cfg)
+    return configs
+
+def make_folds(store, min_train_years=1, n_folds=None):
+    """
+    Walk-forward の fold を作る: 年 <= Y で学習し、Y+1 で検証。
+    ストアは race_id (= 年) 順なので、各 fold は連続スライスになる。
+    """
+    years = sorted(set(np.unique(store.year).tolist()))
+    folds = []
+    for i in range(min_train_years - 1, len(years) - 1):
+        train_last, valid_year = years[i], years[i + 1]
+        train_slice = store.year_slice(years[0], train_last)
+        valid_slice = store.year_slice(valid_year, valid_year)
+        if train_slice.stop > train_slice.start and valid_slice.stop > valid_slice.start:
+            folds.append((train_slice.start, train_slice.stop, valid_slice.start, valid_slice.stop, valid_year))
+    if n_folds:
+        folds = folds[-n_folds:]
+    return folds
+
+def _group_sizes(race_ids):
+    """race_id 順に並んだ配列からレースごとの頭数 (出現順) を返す"""
+    boundaries = np.flatnonzero(np.diff(race_ids)) + 1
+    return np.diff(np.concatenate(([0], boundaries, [len(race_ids)])))
+
+def top1_win_stats(race_ids, scores, ranks, odds, bet_amount=100):
+    """各レースのスコア1位に単勝を買った場合の (bets, hits, return) を返す"""
+    if len(race_ids) == 0:
+        return 0, 0, 0.0
+    order = np.lexsort((-scores, race_ids))
+    sorted_races = race_ids[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_races[1:] != sorted_races[:-1]
+    top = order[first]
+    wins = ranks[top] == 1
+    return len(top), int(wins.sum()), float((odds[top][wins] * bet_amount).sum())
+
+# --- Worker side (各プロセスでストアを mmap で開く) ---
+_STORE = None
+_NUM_THREADS = 1
+
+def _init_worker(store_path, num_threads):
+    global _STORE, _NUM_THREADS
+    _STORE = feature_store.FeatureStore(store_path)
+    _NUM_THREADS = num_threads
+
+def _run_task(config_id, config, fold):
+    import lightgbm as lgb
+    
+    t_start, t_stop, v_start, v_stop, valid_year = fold
+    store = _STORE
+    started = time.time()
+    
+    # mmap のスライスはコピーされず、LightGBM への変換時に初めて読まれる
+    X_train, X_valid = store.X[t_start:t_stop], store.X[v_start:v_stop]
+    y_train, y_valid = store.rank[t_start:t_stop], store.rank[v_start:v_stop]
+    rid_valid = np.asarray(store.race_id[v_start:v_stop])
+    
+    params = {**BASE_PARAMS, **config, 'num_threads': _NUM_THREADS}
+    lgb_train = lgb.Dataset(X_train, y_train, group=_group_sizes(np.asarray(store.race_id[t_start:t_stop])),
+                            params={'verbose': -1, 'feature_pre_filter': False})
+    lgb_valid = lgb.Dataset(X_valid, y_valid, group=_group_sizes(rid_valid), reference=lgb_train)
+    
+    model = lgb.train(
+        params,
+        lgb_train,
+        valid_sets=[lgb_valid],
+        valid_names=['valid'],
+        num_boost_round=NUM_BOOST_ROUND,
+        callbacks=[lgb.early_stopping(stopping_rounds=EARLY_STOPPING_ROUNDS, verbose=False)]
+    )
+    
+    scores = model.predict(X_valid, num_iteration=model.best_iteration)
+    bets, hits, ret = top1_win_stats(rid_valid, scores, np.asarray(y_valid), np.asarray(store.odds[v_start:v_stop]))
+    
+    result = {
+        'config_id': config_id,
+        'valid_year': valid_year,
+        'train_rows': t_stop - t_start,
+        'valid_rows': v_stop - v_start,
+        'best_iteration': model.best_iteration,
+        'bets': bets,
+        'hit_rate': hits / bets if bets else 0.0,
+        'roi': ret / (bets * 100) * 100 if bets else 0.0,
+        'seconds': time.time() - started,
+        'params': json.dumps(config, sort_keys=True)
+    }
+    for k in BASE_PARAMS['ndcg_eval_at']:
+        result[f'ndcg@{k}'] = model.best_score['valid'].get(f'ndcg@{k}', np.nan)
+    return result
+
+def split_cores(n_tasks, workers=None):
+    """コア数をプロセス数と LightGBM スレッド数に分配する"""
+    cpu = os.cpu_count() or 1
+    if workers is None:
+        workers = min(n_tasks, cpu)
+    workers = max(1, workers)
+    threads = max(1, cpu // workers)
+    return workers, threads
+
+def run_search(start_year, end_year, n_configs=50, n_folds=None, min_train_years=1, workers=None, seed=42, use_cache=True):
+    """
+    特徴量ストアを1回だけ作成 (またはキャッシュから取得) し、
+    (パラメータ × fold) をプロセスプールで並列に学習・評価する。
+    """
+    store = feature_store.load_or_build(start_year, end_year, use_cache=use_cache)
+    if store is None:
+        print("No training data found.")
+        return pd.DataFrame()
+    
+    folds = make_folds(store, min_train_years=min_train_years, n_folds=n_folds)
+    if not folds:
+        print("Not enough years for walk-forward folds (need at least 2).")
+        return pd.DataFrame()
+    
+    configs = sample_configs(n_configs, seed=seed)
+    tasks = [(cid, cfg, fold) for cid, cfg in enumerate(configs) for fold in folds]
+    workers, threads = split_cores(len(tasks), workers)
+    print(f"Folds: {[f[4] for f in folds]} | Configs: {len(configs)} | Tasks: {len(tasks)}")
+    print(f"Workers: {workers} x LightGBM threads: {threads}")
+    
+    results = []
+    started = time.time()
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker, initargs=(store.path, threads)) as pool:
+        futures = [pool.submit(_run_task, *task) for task in tasks]
+        for i, fut in enumerate(as_completed(futures), 1):
+            res = fut.result()
+            results.append(res)
+            print(f"[{i}/{len(tasks)}] config {res['config_id']} / {res['valid_year']}: "
+                  f"NDCG@1={res['ndcg@1']:.4f} ROI={res['roi']:.1f}% ({res['seconds']:.1f}s)")
+    
+    print(f"Search finished in {time.time() - started:.1f}s")
+    return pd.DataFrame(results).sort_values(['config_id', 'valid_year']).reset_index(drop=True)
+
+def summarize(fold_df, sort_by='roi'):
+    """パラメータセットごとに fold 平均・標準偏差を集計する"""
+    metric_cols = [c for c in fold_df.columns if c.startswith('ndcg@')] + ['hit_rate', 'roi', 'best_iteration']
+    summary = fold_df.groupby(['config_id', 'params'])[metric_cols].agg(['mean', 'std'])
+    summary.columns = [f"{m}_{s}" for m, s in summary.columns]
+    summary = summary.reset_index().sort_values(f'{sort_by}_mean', ascending=False)
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Walk-forward CV & hyperparameter search")
+    parser.add_argument("--start", type=int, default=2016)
+    parser.add_argument("--end", type=int, default=2025)
+    parser.add_argument("--n_configs", type=int, default=50, help="Number of parameter sets")
+    parser.add_argument("--n_folds", type=int, default=None, help="Use only the last N folds")
+    parser.add_argument("--min_train_years", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size (default: auto)")
+    parser.add_argument("--sort_by", type=str, default="roi", help="roi / hit_rate / ndcg@1 / ndcg@3 / ndcg@5")
+    parser.add_argument("--output", type=str, default="tune_results.csv", help="Per-fold results CSV")
+    parser.add_argument("--no_cache", action="store_true", help="Rebuild the feature store")
+    args = parser.parse_args()
+    
+    fold_df = run_search(args.start, args.end, n_configs=args.n_configs, n_folds=args.n_folds,
+                         min_train_years=args.min_train_years, workers=args.workers, use_cache=not args.no_cache)
+    if not fold_df.empty:
+        fold_df.to_csv(args.output, index=False)
+        summary = summarize(fold_df, sort_by=args.sort_by)
+        summary_path = os.path.splitext(args.output)[0] + "_summary.csv"
+        summary.to_csv(summary_path, index=False)
+        print("\nTop parameter sets:")
+        print(summary.head(10).to_string(index=False))
+        print(f"\nSaved {args.output} and {summary_path}")
@@ -0,0 +1,192 @@
+"""
+シーズンを週ごとに再生する walk-forward シミュレーション。
+
+各週の開始時点より前のレースだけで学習したモデルでその週のレースを予測し、
+スコア1位の単勝 ROI を週ごと・累積で集計する。モデルの更新は
+    - refit  : その時点までの全履歴で学習し直す (refit_every 週ごと)
+    - update : 前の週のレースだけを追加学習する (init_model で update_rounds 本の木を足す)
+のどちらか。特徴量は feature_store (mmap) を使い、ストア全行の lgb.Dataset を1回だけ作って
+バイナリで保存しておく。各週の学習データはそのサブセット (subset) なのでビニングをやり直さない。
+ビン境界はストア全体の特徴量分布から決まる (ラベルは使わない)。
+"""
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from . import feature_store
+from . import dataset_cache
+from . import backtest
+from . import tune
+
+REFIT_ROUNDS = 300 # 再生中は検証データを取らないので木の本数は固定
+UPDATE_ROUNDS = 20
+REFIT_EVERY = 4
+
+def week_starts(dates, season_start, season_end=None):
+    """season_start..season_end にレースがある週の月曜日 (datetime64[D]) の配列"""
+    days = np.asarray(dates).astype('datetime64[D]')
+    lo = np.datetime64(pd.Timestamp(season_start).date())
+    hi = np.datetime64(pd.Timestamp(season_end).date()) if season_end is not None else days.max()
+    days = np.unique(days[(days >= lo) & (days <= hi)])
+    # 1970-01-01 は木曜日 -> (日数 + 3) % 7 が月曜始まりの曜日
+    monday = days - ((days.astype(np.int64) + 3) % 7).astype('timedelta64[D]')
+    return np.unique(monday)
+
+def _dataset_path(store):
+    import lightgbm as lgb
+    h = hashlib.sha1(json.dumps(dataset_cache.DATASET_PARAMS, sort_keys=True).encode('utf-8'))
+    h.update(lgb.__version__.encode('utf-8'))
+    return os.path.join(store.path, f"dataset_{h.hexdigest()[:12]}.bin")
+
+def full_dataset(store, use_cache=True):
+    """ストア全行 (race_id 順) の lgb.Dataset。ストアのディレクトリにバイナリでキャッシュする"""
+    import lightgbm as lgb
+    params = dict(dataset_cache.DATASET_PARAMS)
+    path = _dataset_path(store)
+    if use_cache and os.path.exists(path):
+        print(f"Loading cached binary Dataset ({os.path.basename(path)})...")
+        try:
+            dataset = lgb.Dataset(path, params=params)
+            dataset.construct()
+            return dataset
+        except Exception as e:
+            print(f"Cached Dataset unusable, rebuilding: {e}")
+
+    print(f"Building binary Dataset ({len(store)} rows)...")
+    rid = np.asarray(store.race_id)
+    dataset = lgb.Dataset(np.asarray(store.X), np.asarray(store.rank), group=tune._group_sizes(rid),
+                          params=params, free_raw_data=False)
+    dataset.construct()
+    if use_cache:
+        try:
+            dataset_cache._save_binary(dataset, path)
+        except Exception as e:
+            print(f"Failed to save Dataset cache: {e}")
+    return dataset
+
+def _subset(full, race_ids, rows):
+    # サブセットにはクエリ情報が引き継がれないので頭数を付け直す
+    subset = full.subset(rows)
+    subset.set_group(tune._group_sizes(race_ids[rows]))
+    return subset
+
+def replay(store, weeks, full=None, refit_every=REFIT_EVERY, refit_rounds=REFIT_ROUNDS, update_rounds=UPDATE_ROUNDS,
+           train_years=None, params=None, bet_amount=backtest.BET_AMOUNT):
+    """
+    weeks (各週の月曜日) を順に再生し、週ごとの成績の DataFrame を返す。
+    refit_every 週ごと (0 なら最初の週だけ) に全履歴で学習し直し、それ以外の週は前の週のレースで追加学習する。
+    train_years を指定すると再学習に使う履歴を直近 train_years 年に限る。
+    """
+    import lightgbm as lgb
+    params = {**tune.BASE_PARAMS, **(params or {})}
+    full = full if full is not None else full_dataset(store)
+    days = np.asarray(store.date).astype('datetime64[D]')
+    race_ids = np.asarray(store.race_id)
+    ranks = np.asarray(store.rank)
+    odds = np.asarray(store.odds)
+    week = np.timedelta64(7, 'D')
+
+    booster = None
+    rows = []
+    cum_return = cum_cost = 0.0
+    for i, start in enumerate(weeks):
+        started = time.time()
+        test = np.flatnonzero((days >= start) & (days < start + week))
+        if len(test) == 0:
+            continue
+
+        if booster is None or (refit_every and i % refit_every == 0):
+            mask = days < start
+            if train_years:
+                mask &= days >= start - np.timedelta64(int(train_years * 365), 'D')
+            fit_rows = np.flatnonzero(mask)
+            if len(fit_rows) == 0:
+                continue
+            booster = lgb.train(params, _subset(full, race_ids, fit_rows), num_boost_round=refit_rounds,
+                                keep_training_booster=True)
+            mode = 'refit'
+        else:
+            # 前回の学習以降に結果が出たレース (前の週) を追加学習
+            fit_rows = np.flatnonzero((days >= weeks[i - 1]) & (days < start))
+            if len(fit_rows):
+                new = lgb.Dataset(np.asarray(store.X[fit_rows]), ranks[fit_rows],
+                                  group=tune._group_sizes(race_ids[fit_rows]), reference=full,
+                                  params=dict(dataset_cache.DATASET_PARAMS))
+                booster = lgb.train(params, new, num_boost_round=update_rounds, init_model=booster,
+                                    keep_training_booster=True)
+            mode = 'update'
+
+        scores = booster.predict(np.asarray(store.X[test]))
+        top = backtest.top_k(pd.DataFrame({
+            'race_id': race_ids[test],
+            'rank': np.where(ranks[test] >= 99, np.nan, ranks[test]), # ストアの着順欠損は 99
+            'odds': odds[test],
+            'score': scores
+        }))
+        result = backtest.simulate(top, 'win', -np.inf, bet_amount)
+        cum_return += result['total_return']
+        cum_cost += result['total_bet']
+        rows.append({
+            'week': pd.Timestamp(start).date(),
+            'mode': mode,
+            'fit_rows': len(fit_rows),
+            'trees': booster.num_trees(),
+            'races': result['total_races'],
+            'bets': result['bet_races'],
+            'hits': result['hits'],
+            'return': result['total_return'],
+            'cost': result['total_bet'],
+            'roi': result['roi'],
+            'cum_roi': cum_return / cum_cost * 100 if cum_cost else 0.0,
+            'seconds': time.time() - started
+        })
+        r = rows[-1]
+        print(f"{r['week']} [{mode:<6}] races={r['races']:>4} hits={r['hits']:>3} "
+              f"ROI={r['roi']:>6.1f}% cum={r['cum_roi']:>6.1f}% ({r['seconds']:.1f}s)")
+    return pd.DataFrame(rows)
+
+def simulate(start_year, end_year, season_start, season_end=None, refit_every=REFIT_EVERY, refit_rounds=REFIT_ROUNDS,
+             update_rounds=UPDATE_ROUNDS, train_years=None, use_cache=True):
+    """start_year..end_year の特徴量ストア (キャッシュ) を使い、season_start..season_end を週ごとに再生する"""
+    store = feature_store.load_or_build(start_year, end_year, use_cache=use_cache)
+    if store is None:
+        print("No data found.")
+        return pd.DataFrame()
+    weeks = week_starts(store.date, season_start, season_end)
+    if len(weeks) == 0:
+        print(f"No races between {season_start} and {season_end or 'the end of the data'}.")
+        return pd.DataFrame()
+    print(f"Walk-forward: {len(weeks)} weeks from {weeks[0]} | refit every {refit_every or '-'} weeks, "
+          f"{refit_rounds} rounds (update: {update_rounds} rounds)")
+    full = full_dataset(store, use_cache=use_cache)
+    started = time.time()
+    result = replay(store, weeks, full, refit_every, refit_rounds, update_rounds, train_years)
+    print(f"Replay finished in {time.time() - started:.1f}s")
+    return result
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Week-by-week walk-forward season simulation")
+    parser.add_argument("--start", type=int, default=2016, help="First year of history")
+    parser.add_argument("--end", type=int, default=2025, help="Last year (the season)")
+    parser.add_argument("--season_start", type=str, default=None, help="First day to replay (default: Jan 1 of --end)")
+    parser.add_argument("--season_end", type=str, default=None)
+    parser.add_argument("--refit_every", type=int, default=REFIT_EVERY, help="Full refit every N weeks (1 = every week, 0 = only once)")
+    parser.add_argument("--refit_rounds", type=int, default=REFIT_ROUNDS)
+    parser.add_argument("--update_rounds", type=int, default=UPDATE_ROUNDS, help="Trees added by weekly incremental updates")
+    parser.add_argument("--train_years", type=float, default=None, help="Limit refits to the last N years")
+    parser.add_argument("--output", type=str, default="walk_forward.csv")
+    parser.add_argument("--no_cache", action="store_true", help="Rebuild the feature store and Dataset")
+    args = parser.parse_args()
+
+    weekly = simulate(args.start, args.end, args.season_start or f"{args.end}-01-01", args.season_end,
+                      args.refit_every, args.refit_rounds, args.update_rounds, args.train_years, use_cache=not args.no_cache)
+    if not weekly.empty:
+        weekly.to_csv(args.output, index=False)
+        total_cost = weekly['cost'].sum()
+        print(f"\nSeason ROI: {weekly['return'].sum() / total_cost * 100 if total_cost else 0:.2f}% "
+              f"({weekly['hits'].sum()}/{weekly['bets'].sum()} hits) | Saved {args.output}")
@@ -0,0 +1,110 @@
+"""
+過去走のウィンドウ特徴量 (lag-k と直近 N 走のローリング統計)。
+
+馬ごとに1回だけ安定ソートし、lag 行列 (行数 × N) を作って全特徴量を計算する。
+計算量は O(行数 × N) で、学習 (preprocess / transform) と推論 (HistoryLoader) の両方で使う。
+"""
+import numpy as np
+import pandas as pd
+
+MAX_LAG = 5 # lag1 .. lag5
+WINDOW = 5  # 直近5走のローリング統計
+
+# (元の列, 特徴量名の接頭辞, 欠損時の値)
+WINDOW_SOURCES = [
+    ('rank', 'rank', 99), # 99 = 出走歴なし
+    ('speed_index', 'speed_index', 0),
+    ('last_3f_time', 'last_3f', 0)
+]
+ROLLING_STATS = ['mean', 'min', 'std']
+
+# 計算に必要な列 (チャンク間で持ち越す列)
+HISTORY_COLUMNS = [src for src, _, _ in WINDOW_SOURCES] + ['date']
+
+def lag_columns(max_lag=MAX_LAG):
+    return [f'lag{k}_{name}' for k in range(1, max_lag + 1) for _, name, _ in WINDOW_SOURCES]
+
+def rolling_columns(window=WINDOW):
+    return [f'{name}_{stat}{window}' for _, name, _ in WINDOW_SOURCES for stat in ROLLING_STATS]
+
+def feature_columns(max_lag=MAX_LAG, window=WINDOW):
+    """compute() が返す列 (interval を含む)"""
+    return lag_columns(max_lag) + ['interval'] + rolling_columns(window)
+
+def depth(max_lag=MAX_LAG, window=WINDOW):
+    """1頭あたり保持が必要な過去走の数"""
+    return max(max_lag, window)
+
+def _group_positions(codes):
+    """codes (馬ごとに連続・時系列順) の各行がグループ内で何番目か。codes < 0 は常に0"""
+    n = len(codes)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    idx = np.arange(n)
+    is_start = np.ones(n, dtype=bool)
+    is_start[1:] = codes[1:] != codes[:-1]
+    is_start |= codes < 0
+    start = np.maximum.accumulate(np.where(is_start, idx, 0))
+    return idx - start
+
+def compute(df, group_col='horse_id', max_lag=MAX_LAG, window=WINDOW):
+    """
+    df は時系列順に並んでいること (同じ馬の行が古い順)。
+    各行について「その行より前の出走」から lag-k・interval・直近 window 走の mean/min/std を計算し、
+    df と同じ index の DataFrame で返す。馬IDが欠損している行は出走歴なし扱い。
+    """
+    n = len(df)
+    codes = pd.factorize(df[group_col])[0]
+    # 馬ごとにまとめる (安定ソートなので馬の中では時系列順のまま)
+    order = np.argsort(codes, kind='stable')
+    pos = _group_positions(codes[order])
+    k_max = depth(max_lag, window)
+
+    # lag 行列の参照先: i 行目の k 走前は i - k (同じ馬の範囲内のみ)
+    ks = np.arange(1, k_max + 1)
+    src_idx = np.arange(n)[:, None] - ks[None, :]
+    valid = ks[None, :] <= pos[:, None]
+    src_idx = np.where(valid, src_idx, 0)
+
+    out = {}
+    for src, name, default in WINDOW_SOURCES:
+        if src in df.columns:
+            values = pd.to_numeric(df[src], errors='coerce').to_numpy(dtype=np.float64)[order]
+        else:
+            values = np.full(n, np.nan)
+        lags = np.where(valid, values[src_idx], np.nan) if n else np.empty((0, k_max))
+
+        for k in range(1, max_lag + 1):
+            out[f'lag{k}_{name}'] = np.where(np.isnan(lags[:, k - 1]), default, lags[:, k - 1])
+
+        # 直近 window 走 (欠損値は除外)
+        win = lags[:, :window]
+        ok = ~np.isnan(win)
+        cnt = ok.sum(axis=1)
+        total = np.where(ok, win, 0).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / cnt
+            sq = np.where(ok, (win - mean[:, None]) ** 2, 0).sum(axis=1)
+            std = np.sqrt(sq / (cnt - 1))
+        out[f'{name}_mean{window}'] = np.where(cnt > 0, mean, default)
+        out[f'{name}_min{window}'] = np.where(cnt > 0, np.where(ok, win, np.inf).min(axis=1) if n else 0, default)
+        out[f'{name}_std{window}'] = np.where(cnt > 1, std, 0)
+
+    # Interval (Days since last race)
+    if 'date' in df.columns and n:
+        dates = pd.to_datetime(df['date']).to_numpy(dtype='datetime64[ns]')[order]
+        prev = np.where(pos > 0, dates[np.maximum(np.arange(n) - 1, 0)], np.datetime64('NaT'))
+        days = (dates - prev) / np.timedelta64(1, 'D')
+        out['interval'] = np.where(np.isnan(days), 365, np.floor(days)) # Default 1 year
+    else:
+        out['interval'] = np.full(n, 365.0)
+
+    # 元の行順に戻す
+    inverse = np.empty(n, dtype=np.int64)
+    inverse[order] = np.arange(n)
+    return pd.DataFrame({c: out[c][inverse] for c in feature_columns(max_lag, window)}, index=df.index)
+
+def tail(df, group_col='horse_id', max_lag=MAX_LAG, window=WINDOW):
+    """馬ごとに直近 depth 走だけを残す (チャンク間・推論時の持ち越し用)"""
+    keep = [group_col] + [c for c in HISTORY_COLUMNS if c in df.columns]
+    return df[keep].groupby(group_col, sort=False).tail(depth(max_lag, window))